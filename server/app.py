@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import uuid
 from datetime import datetime
@@ -17,23 +18,64 @@ load_environment()
 
 from service.mood_service import MoodService
 from service.event_service import EventService
-from dao.database import Database
+from dao.database import get_database
+from dao.write_queue import get_write_queue
+from dao.retention import start_janitor
+from dao.search_index import SearchIndex
+from dao.user_export import EXPORT_FORMATS, has_user_data, ndjson_stream, tar_stream
 from service.analysis_report_service import AnalysisReportService
-from service.chat_langgraph_optimized import optimized_chat  # 使用LangGraph优化版
+from service.chat_langgraph_optimized import chat_service, optimized_chat  # 使用LangGraph优化版
 from utils.chat_logger import chat_logger
+from utils import json_codec
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify 响应和请求体解析使用 utils.json_codec（orjson 等）
+
+    default 沿用 Flask 的默认处理，datetime 仍按 HTTP-date 格式输出
+    """
+
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(
+            obj,
+            pretty=bool(kwargs.get("indent")),
+            sort_keys=kwargs.get("sort_keys", self.sort_keys),
+            default=kwargs.get("default", self.default),
+        )
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
 
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 CORS(app)  # 允许跨域请求
 
 # 获取环境变量配置
 PORT = int(os.environ.get("PORT", 5000))
 HOST = os.environ.get("HOST", "0.0.0.0")
 DEBUG = os.environ.get("FLASK_ENV", "production") == "development"
+# 对话时从数据库读取的最近历史消息条数，默认 0 表示全部（与缓存容量无关）
+CHAT_HISTORY_LIMIT = int(os.environ.get("CHAT_HISTORY_LIMIT", "0"))
 
 # 初始化数据库和聊天服务
-db = Database()
+db = get_database()
+# 聊天持久化走写后台化队列：请求只负责入队，由后台线程合并写入
+write_queue = get_write_queue(db)
 event_service = EventService()
-analysis_service = AnalysisReportService()
+analysis_service = AnalysisReportService(db)
+# 消息全文检索：按用户建立的内存倒排索引，随新消息增量更新
+search_index = SearchIndex(db, int(os.environ.get("SEARCH_INDEX_MAX_USERS", "128")))
+
+
+def on_records_expired(entity, user_id):
+    """保留策略删除了记录：失效进程内的长期记忆索引（不支持变更流的后端需要）"""
+    if entity == "crisis_memory":
+        chat_service.memory_index.invalidate(user_id)
+
+
+# 按 RETENTION_RULES 在低优先级后台线程中清理过期数据（未配置时不启动）
+retention_janitor = start_janitor(db, on_records_expired)
 
 
 def async_event_extraction(session_id, user_id, db, event_service):
@@ -45,6 +87,17 @@ def async_event_extraction(session_id, user_id, db, event_service):
             db.save_events(session_id, events)
 
 
+def maybe_trigger_event_extraction(session_id, user_id):
+    """消息写入完成后检查用户消息数量，每3条消息进行一次事件提取"""
+    user_message_count = db.get_user_message_count(session_id)
+    if user_message_count > 0 and user_message_count % 3 == 0:
+        print(f"触发事件提取：会话 {session_id} 已有 {user_message_count} 条用户消息")
+        Thread(
+            target=async_event_extraction,
+            args=(session_id, user_id, db, event_service),
+        ).start()
+
+
 @app.route("/api/chat", methods=["POST"])
 def chat():
     """处理聊天请求，获取AI回复"""
@@ -67,8 +120,11 @@ def chat():
         history = data.get("history", [])
 
         # 如果没有提供历史记录，但提供了session_id，则从数据库获取
-        if not history and session_id and db.session_exists(session_id):
-            history = db.get_chat_history(session_id)
+        if not history and session_id:
+            # 先等待该会话尚在队列中的写入完成，保证读到上一轮的消息
+            write_queue.wait_for(session_id, timeout=2)
+            if db.session_exists(session_id):
+                history = db.get_chat_history(session_id, CHAT_HISTORY_LIMIT or None)
 
         # 记录用户请求日志
         chat_logger.log_chat_request(user_id, session_id, message, timestamp)
@@ -87,10 +143,16 @@ def chat():
         message_id = f"msg_{uuid.uuid4().hex[:8]}"
         response_time = datetime.now().isoformat()
 
-        # 保存对话记录到数据库
-        db.save_message(session_id, user_id, "user", message, timestamp)
-        db.save_message(
-            session_id, user_id, "agent", response["response"], response_time
+        # 保存对话记录到数据库（两条消息在同一批次中合并写入）
+        saved = write_queue.submit_batch(
+            [
+                ("save_message", (session_id, user_id, "user", message, timestamp), {}),
+                (
+                    "save_message",
+                    (session_id, user_id, "agent", response["response"], response_time),
+                    {},
+                ),
+            ]
         )
 
         # 记录AI回复日志
@@ -104,16 +166,10 @@ def chat():
             response_time,
         )
 
-        # 检查用户消息数量，每3条消息进行一次事件提取
-        user_message_count = db.get_user_message_count(session_id)
-        if user_message_count > 0 and user_message_count % 3 == 0:
-            print(
-                f"触发事件提取：会话 {session_id} 已有 {user_message_count} 条用户消息"
-            )
-            Thread(
-                target=async_event_extraction,
-                args=(session_id, user_id, db, event_service),
-            ).start()
+        # 消息写入完成后检查用户消息数量，每3条消息进行一次事件提取
+        saved.add_done_callback(
+            lambda _: maybe_trigger_event_extraction(session_id, user_id)
+        )
 
         # 构建基础响应
         response_data = {
@@ -171,6 +227,7 @@ def get_history():
             return jsonify({"error_code": 400, "error_message": "缺少必要参数"}), 400
 
         # 从数据库获取历史记录
+        write_queue.wait_for(session_id, timeout=2)
         history = db.get_chat_history(session_id)
 
         # 返回历史记录
@@ -184,6 +241,114 @@ def get_history():
         )
 
 
+@app.route("/api/chat/search", methods=["GET"])
+def search_history():
+    """检索用户的历史对话"""
+    try:
+        user_id = request.args.get("user_id")
+        query = request.args.get("q", "").strip()
+        session_id = request.args.get("session_id")
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+
+        if not user_id or not query:
+            return jsonify({"error_code": 400, "error_message": "缺少必要参数"}), 400
+
+        # 检索的是已写入存储的消息（写队列合并窗口内的消息稍后即可检索到）
+        result = search_index.search(
+            user_id, query, offset=offset, limit=limit, session_id=session_id or None
+        )
+
+        return jsonify(
+            {
+                "user_id": user_id,
+                "query": query,
+                "total": result["total"],
+                "offset": offset,
+                "limit": limit,
+                "hits": result["hits"],
+            }
+        )
+
+    except ValueError:
+        return jsonify({"error_code": 400, "error_message": "参数格式错误"}), 400
+    except Exception as e:
+        print(f"Error in search endpoint: {str(e)}")
+        return (
+            jsonify({"error_code": 500, "error_message": f"服务器内部错误: {str(e)}"}),
+            500,
+        )
+
+
+@app.route("/api/users/<user_id>/export", methods=["GET"])
+def export_user_data(user_id):
+    """流式导出用户的全部数据（NDJSON 或 tar.gz）"""
+    try:
+        export_format = request.args.get("format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error_code": 400, "error_message": "不支持的导出格式"}), 400
+
+        write_queue.wait_for(user_id, timeout=2)
+        if not has_user_data(db, user_id):
+            return (
+                jsonify({"error_code": 404, "error_message": f"用户 {user_id} 没有数据"}),
+                404,
+            )
+
+        # 边读边输出，不在内存中生成完整的导出文件
+        if export_format == "tar":
+            return app.response_class(
+                tar_stream(db, user_id),
+                mimetype="application/gzip",
+                headers={
+                    "Content-Disposition": f'attachment; filename="user_data_{user_id}.tar.gz"'
+                },
+            )
+        return app.response_class(
+            ndjson_stream(db, user_id),
+            mimetype="application/x-ndjson",
+            headers={
+                "Content-Disposition": f'attachment; filename="user_data_{user_id}.ndjson"'
+            },
+        )
+
+    except Exception as e:
+        print(f"Error in user export endpoint: {str(e)}")
+        return (
+            jsonify({"error_code": 500, "error_message": f"服务器内部错误: {str(e)}"}),
+            500,
+        )
+
+
+@app.route("/api/users/<user_id>", methods=["DELETE"])
+def purge_user_data(user_id):
+    """删除用户的全部数据"""
+    try:
+        # 先等待该用户尚在写队列中的写入完成，避免删除后又被写入
+        write_queue.wait_for(user_id, timeout=2)
+        for session_id in db.get_sessions(user_id):
+            write_queue.wait_for(session_id, timeout=2)
+
+        result = db.delete_user(user_id)
+        # 进程内按用户缓存的检索索引
+        search_index.invalidate(user_id)
+        chat_service.memory_index.invalidate(user_id)
+        print(f"Purged user {user_id}: {result}")
+
+        return jsonify({"success": True, "user_id": user_id, **result})
+
+    except ValueError as e:
+        return jsonify({"error_code": 400, "error_message": str(e)}), 400
+    except NotImplementedError as e:
+        return jsonify({"error_code": 501, "error_message": str(e)}), 501
+    except Exception as e:
+        print(f"Error in user purge endpoint: {str(e)}")
+        return (
+            jsonify({"error_code": 500, "error_message": f"服务器内部错误: {str(e)}"}),
+            500,
+        )
+
+
 @app.route("/api/mood", methods=["POST"])
 def analyze_mood():
     """Analyze mood of messages and provide mood intensity, category, thinking, and scene."""
@@ -256,6 +421,7 @@ def save_mood_data():
         session_id = data["session_id"]
         mood_data = data["mood_data"]
 
+        write_queue.wait_for(session_id, timeout=2)
         db.save_mood_data(user_id, session_id, mood_data)
 
         return (
@@ -290,6 +456,7 @@ def extract_events():
         )
 
         # 校验会话是否存在
+        write_queue.wait_for(session_id, timeout=2)
         if not db.session_exists(session_id):
             return (
                 jsonify(
@@ -335,12 +502,20 @@ def get_events():
     try:
         session_id = request.args.get("session_id")
         limit = request.args.get("limit")
+        # 可选过滤：since 为ISO时间，types 为逗号分隔的事件类型
+        since = request.args.get("since")
+        types = request.args.get("types")
 
         if not session_id:
             return jsonify({"error_code": 400, "error_message": "缺少必要参数"}), 400
 
         # 从数据库获取事件列表
-        events = db.get_events(session_id, int(limit) if limit else None)
+        events = db.get_events(
+            session_id,
+            int(limit) if limit else None,
+            since=since or None,
+            types=[t for t in types.split(",") if t] if types else None,
+        )
 
         return jsonify(
             {
@@ -607,29 +782,16 @@ def get_user_analysis_summary():
         # 收集基本统计数据
         total_events = 0
         total_patterns = 0
-        emotions = db.get_emotion_history(user_id, limit=50)
-
-        # 过滤时间范围内的情绪数据
-        recent_emotions = [
-            emotion
-            for emotion in emotions
-            if datetime.fromisoformat(emotion.get("timestamp", "1900-01-01"))
-            >= cutoff_date
-        ]
-
-        # 统计事件和模式
-        for session_id in session_ids:
-            events = db.get_events(session_id)
-            filtered_events = [
-                event
-                for event in events
-                if datetime.fromisoformat(event.get("time", "1900-01-01"))
-                >= cutoff_date
-            ]
-            total_events += len(filtered_events)
+        # 时间范围内最近的情绪数据（存储层按时间索引二分查找，无需逐条解析时间）
+        recent_emotions = db.get_emotion_history(user_id, limit=50, start=cutoff_date)
 
-            pattern = db.get_pattern_analysis(session_id)
-            if pattern:
+        # 统计事件和模式：与报告生成一样按 created_at 在存储层过滤时间范围
+        bundle = db.bulk_load(
+            user_id, session_ids, kinds=("events", "pattern"), since=cutoff_date
+        )
+        for session in bundle.iter_sessions():
+            total_events += len(session.events)
+            if session.pattern:
                 total_patterns += 1
 
         # 计算情绪统计
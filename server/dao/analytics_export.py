@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+列式分析数据导出
+
+把消息、事件、情绪评分、情绪分析和模式分析导出为按用户分区的列式文件，
+供 DuckDB / Polars / pyarrow 等向量化引擎在本地查询，不接触线上存储：
+
+    <out>/<表>/user_id=<用户ID>/<文件>
+
+- 格式：安装了 pyarrow 时为 Parquet（时间为 UTC 毫秒时间戳，情绪类别等为字典编码的分类列），
+  否则为 gzip 压缩的 CSV（时间为 epoch 秒），可用 ANALYTICS_EXPORT_FORMAT 指定；
+  每个表目录下的 _schema.json 记录列名和类型
+- 增量：消息和情绪评分只追加，每次只导出新增的记录（新的分片文件）；事件、情绪分析和
+  模式分析可以被修改，按会话比较内容摘要，有变化时重写该会话的文件。源存储带有落盘的
+  变更流（CHANGE_FEED_PERSIST=1）时只检查变更流中出现过的会话
+- 导出状态保存在 <out>/_export_state.json，每个用户导出完成后更新，中断后重新运行即可继续
+"""
+
+import os
+import io
+import csv
+import gzip
+import time
+import hashlib
+
+from dao.atomic_file import AtomicFileWriter
+from dao.time_range import to_epoch
+from utils import json_codec
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ("parquet", "csv")
+
+STATE_FILE = "_export_state.json"
+
+# 表结构：(列名, 类型)。user_id 是分区键，不写入文件
+# 类型：string / category（分类） / int64 / float64 / epoch（时间）/ json（嵌套数据序列化为字符串）
+SCHEMAS = {
+    "messages": (
+        ("session_id", "string"),
+        ("seq", "int64"),
+        ("role", "category"),
+        ("content", "string"),
+        ("ts", "epoch"),
+    ),
+    "events": (
+        ("session_id", "string"),
+        ("event_id", "string"),
+        ("primary_type", "category"),
+        ("sub_type", "category"),
+        ("status", "category"),
+        ("title", "string"),
+        ("content", "string"),
+        ("ts", "epoch"),
+        ("updated_ts", "epoch"),
+    ),
+    "emotions": (
+        ("session_id", "string"),
+        ("seq", "int64"),
+        ("emotion_score", "float64"),
+        ("emotion_category", "category"),
+        ("ts", "epoch"),
+    ),
+    "moods": (
+        ("session_id", "string"),
+        ("mood_id", "string"),
+        ("mood_category", "category"),
+        ("mood_intensity", "float64"),
+        ("scene", "string"),
+        ("thinking", "string"),
+        ("ts", "epoch"),
+    ),
+    "patterns": (
+        ("session_id", "string"),
+        ("pattern_summary", "string"),
+        ("ts", "epoch"),
+        ("data", "json"),
+    ),
+}
+
+
+def _choose_format():
+    preferred = os.environ.get("ANALYTICS_EXPORT_FORMAT", "").lower()
+    if preferred == "csv" or pyarrow is None:
+        return "csv"
+    return "parquet"
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _message_rows(session_id, start, messages):
+    return [
+        (session_id, start + i, m.get("role"), m.get("content"), to_epoch(m.get("timestamp")))
+        for i, m in enumerate(messages)
+    ]
+
+
+def _emotion_rows(start, records):
+    return [
+        (
+            r.get("session_id"),
+            start + i,
+            _number(r.get("emotion_score")),
+            r.get("emotion_category"),
+            to_epoch(r.get("timestamp")),
+        )
+        for i, r in enumerate(records)
+    ]
+
+
+def _event_rows(session_id, events):
+    return [
+        (
+            session_id,
+            e.get("id"),
+            e.get("primaryType"),
+            e.get("subType"),
+            e.get("status"),
+            e.get("title"),
+            e.get("content"),
+            to_epoch(e.get("created_at")),
+            to_epoch(e.get("updateTime")),
+        )
+        for e in events
+    ]
+
+
+def _mood_rows(session_id, moods):
+    return [
+        (
+            session_id,
+            m.get("id"),
+            m.get("moodCategory"),
+            _number(m.get("moodIntensity")),
+            m.get("scene"),
+            m.get("thinking"),
+            to_epoch(m.get("created_at")),
+        )
+        for m in moods
+    ]
+
+
+def _pattern_rows(session_id, pattern):
+    if not pattern:
+        return []
+    summary = pattern.get("pattern_summary")
+    if not isinstance(summary, str) and summary is not None:
+        summary = json_codec.dumps(summary)
+    return [(session_id, summary, to_epoch(pattern.get("saved_at")), pattern)]
+
+
+def _digest(data):
+    return hashlib.sha1(json_codec.dumps_bytes(data, sort_keys=True)).hexdigest()
+
+
+class _CsvSink:
+    """gzip 压缩的 CSV"""
+
+    extension = ".csv.gz"
+
+    def encode(self, table, rows):
+        columns = SCHEMAS[table]
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow([name for name, _ in columns])
+        for row in rows:
+            writer.writerow([
+                "" if value is None
+                else json_codec.dumps(value) if kind == "json"
+                else value
+                for value, (_, kind) in zip(row, columns)
+            ])
+        return gzip.compress(text.getvalue().encode("utf-8"), compresslevel=6)
+
+
+class _ParquetSink:
+    """Parquet（pyarrow）"""
+
+    extension = ".parquet"
+
+    def encode(self, table, rows):
+        columns = SCHEMAS[table]
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+        arrays = []
+        for (name, kind), column in zip(columns, values):
+            column = list(column)
+            if kind == "category":
+                array = pyarrow.array(column, pyarrow.string()).dictionary_encode()
+            elif kind == "epoch":
+                array = pyarrow.array(
+                    [None if v is None else int(v * 1000) for v in column],
+                    pyarrow.timestamp("ms", tz="UTC"),
+                )
+            elif kind == "json":
+                array = pyarrow.array(
+                    [None if v is None else json_codec.dumps(v) for v in column], pyarrow.string()
+                )
+            else:
+                array = pyarrow.array(column, getattr(pyarrow, kind)())
+            arrays.append(array)
+
+        buffer = pyarrow.BufferOutputStream()
+        pyarrow.parquet.write_table(
+            pyarrow.table(arrays, names=[name for name, _ in columns]),
+            buffer,
+            compression="zstd",
+        )
+        return buffer.getvalue().to_pybytes()
+
+
+class AnalyticsExporter:
+    """把存储后端的数据增量导出为列式文件"""
+
+    def __init__(self, database, out_dir, export_format=None, log=print):
+        """初始化导出器
+
+        Args:
+            database: 源存储后端（StorageBackend），只读
+            out_dir: 导出目录
+            export_format: parquet / csv，默认自动选择
+            log: 进度输出函数
+        """
+        self.db = database
+        self.out_dir = out_dir
+        self.format = export_format or _choose_format()
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown export format: {self.format}")
+        if self.format == "parquet" and pyarrow is None:
+            raise RuntimeError("pyarrow is required for parquet export")
+        self.sink = _ParquetSink() if self.format == "parquet" else _CsvSink()
+        self.log = log
+        self.files = AtomicFileWriter(keep_backup=False)
+        self.state_path = os.path.join(out_dir, STATE_FILE)
+        self.state = self._load_state()
+
+    # ---- 导出状态 ----
+
+    def _load_state(self):
+        empty = {"format": self.format, "feed_version": None, "sessions": {}, "users": {}}
+        try:
+            with open(self.state_path, "rb") as f:
+                state = json_codec.loads(f.read())
+        except FileNotFoundError:
+            return empty
+        if state.get("format") != self.format:
+            # 换了格式：旧文件保留，全部重新导出
+            self.log(f"[export] format changed to {self.format}, exporting everything again")
+            return empty
+        return state
+
+    def _save_state(self):
+        self.files.write_json(self.state_path, self.state)
+
+    # ---- 导出 ----
+
+    def run(self):
+        """执行一次增量导出
+
+        Returns:
+            dict: 统计信息 {"users", "files_written", "files_removed", "rows", "bytes", "elapsed_s"}
+        """
+        started = time.perf_counter()
+        stats = {"users": 0, "files_written": 0, "files_removed": 0, "rows": 0, "bytes": 0}
+        for table, columns in SCHEMAS.items():
+            os.makedirs(os.path.join(self.out_dir, table), exist_ok=True)
+            self.files.write_json(
+                os.path.join(self.out_dir, table, "_schema.json"),
+                {
+                    "format": self.format,
+                    "partitioning": ["user_id"],
+                    "columns": [{"name": name, "type": kind} for name, kind in columns],
+                },
+            )
+
+        feed_version, changed = self._changed_sessions()
+        sessions = self.db.get_sessions()
+        by_user = {}
+        for session_id, meta in sessions.items():
+            by_user.setdefault(meta.get("user_id"), []).append(session_id)
+        # 已经不存在的会话：删除导出的文件
+        for session_id in set(self.state["sessions"]) - set(sessions):
+            entry = self.state["sessions"].pop(session_id)
+            self._remove_session_files(entry.get("user_id"), session_id, stats)
+        users = set(by_user) | set(self.state["users"])
+
+        for user_id in sorted(u for u in users if u is not None):
+            before = stats["files_written"] + stats["files_removed"]
+            for session_id in by_user.get(user_id, []):
+                self._export_session(
+                    user_id, session_id, changed is None or session_id in changed, stats
+                )
+            self._export_emotions(user_id, stats)
+            if stats["files_written"] + stats["files_removed"] > before:
+                stats["users"] += 1
+                self._save_state()
+
+        self.state["feed_version"] = feed_version
+        self._save_state()
+        stats["elapsed_s"] = round(time.perf_counter() - started, 3)
+        return stats
+
+    def _changed_sessions(self):
+        """根据落盘的变更流找出上次导出后可能修改过事件 / 情绪分析 / 模式分析的会话
+
+        Returns:
+            (当前版本号, 会话ID集合)；无法确定时集合为 None，表示检查全部会话
+        """
+        changes = getattr(self.db, "changes", None)
+        if changes is None or changes.log is None:
+            return None, None
+        version = changes.version
+        last = self.state.get("feed_version")
+        if last is None or last > version:
+            return version, None
+        since = changes.changes_since(last)
+        if since and since[0]["version"] != last + 1:
+            # 变更流已被压缩，缺少上次导出之后的部分记录
+            return version, None
+        return version, {
+            c["key"] for c in since if c["entity"] in ("events", "moods", "pattern", "sessions")
+        }
+
+    def _partition(self, table, user_id):
+        return os.path.join(self.out_dir, table, f"user_id={user_id}")
+
+    def _write(self, table, user_id, name, rows, stats):
+        payload = self.sink.encode(table, rows)
+        directory = self._partition(table, user_id)
+        os.makedirs(directory, exist_ok=True)
+        self.files.write_bytes(os.path.join(directory, name + self.sink.extension), payload)
+        stats["files_written"] += 1
+        stats["rows"] += len(rows)
+        stats["bytes"] += len(payload)
+
+    def _remove(self, table, user_id, match, stats):
+        """删除分区中文件名（去掉扩展名）满足 match 的文件"""
+        directory = self._partition(table, user_id)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.endswith(self.sink.extension) and match(name[: -len(self.sink.extension)]):
+                os.remove(os.path.join(directory, name))
+                stats["files_removed"] += 1
+
+    def _remove_session_files(self, user_id, session_id, stats):
+        if user_id is None:
+            return
+        self._remove("messages", user_id, lambda n: n.rsplit(".", 1)[0] == session_id, stats)
+        for table in ("events", "moods", "patterns"):
+            self._remove(table, user_id, lambda n: n == session_id, stats)
+
+    def _export_session(self, user_id, session_id, check_documents, stats):
+        entry = self.state["sessions"].setdefault(session_id, {"user_id": user_id, "messages": 0})
+
+        # 消息：只导出新增的部分，条数变少（被清理）时重新导出全部
+        def message_count():
+            return sum(self.db.get_message_counts(session_id).values())
+
+        total = message_count()
+        exported = entry["messages"]
+        if total < exported:
+            self._remove("messages", user_id, lambda n: n.rsplit(".", 1)[0] == session_id, stats)
+            entry["messages"] = exported = 0
+        if total > exported:
+            messages = self.db.get_chat_history(session_id, total - exported)
+            # 读取期间又有新消息时尾部已经移动，留到下次导出
+            if message_count() == total:
+                self._write(
+                    "messages", user_id, f"{session_id}.{exported:012d}",
+                    _message_rows(session_id, exported, messages), stats,
+                )
+                entry["messages"] = total
+
+        if not check_documents and "events" in entry:
+            return
+        for table, data, to_rows in (
+            ("events", self.db.get_events(session_id), _event_rows),
+            ("moods", self.db.get_mood_analysis(session_id), _mood_rows),
+            ("patterns", self.db.get_pattern_analysis(session_id), _pattern_rows),
+        ):
+            digest = _digest(data) if data else None
+            if entry.get(table) == digest and table in entry:
+                continue
+            if data:
+                self._write(table, user_id, session_id, to_rows(session_id, data), stats)
+            else:
+                self._remove(table, user_id, lambda n: n == session_id, stats)
+            entry[table] = digest
+
+    def _export_emotions(self, user_id, stats):
+        entry = self.state["users"].setdefault(user_id, {"emotions": 0})
+        total = self.db.get_emotion_count(user_id)
+        exported = entry["emotions"]
+        if total < exported:
+            self._remove("emotions", user_id, lambda n: True, stats)
+            entry["emotions"] = exported = 0
+        if total > exported:
+            records = self.db.get_emotion_history(user_id, total - exported)
+            # 读取期间又有新记录时尾部已经移动，留到下次导出
+            if self.db.get_emotion_count(user_id) == total:
+                self._write(
+                    "emotions", user_id, f"part-{exported:012d}",
+                    _emotion_rows(exported, records), stats,
+                )
+                entry["emotions"] = total
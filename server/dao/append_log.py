@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+追加写的记录日志
+
+每个 key（会话ID、用户ID等）的记录保存为一行一条的 JSONL 文件（<key>.jsonl），
+旁边维护一个偏移量索引文件（<key>.idx），其中按顺序存放每条记录
+在 JSONL 文件中的起始字节偏移（8字节无符号整数，小端）。
+
+- 追加记录只需在两个文件末尾各写一次，成本为 O(1)
+- 读取最近 N 条记录时，只读取索引末尾的 N 个偏移，再从第一个偏移处 seek 读取
+- 旧版 <key>.json 数组文件在首次访问时自动转换
+
+指定 time_field 时还维护时间索引（<key>.tidx）：与偏移索引一一对应的
+8字节浮点数（epoch 秒）。时间按追加顺序单调不减（晚到的旧时间按前一条记录计），
+按时间范围读取时二分查找起止位置，只读取并解析范围内的记录，成本为 O(log n + k)。
+
+写后台化队列追加的记录带有写操作标记（OP_FIELD），重放意图日志时据此跳过
+已经写入的操作；读取记录时去掉该字段。
+
+消息（messages/）、情绪评分（emotions/，带时间索引）和长期记忆（memories/）都使用该格式。
+"""
+
+import os
+import mmap
+import struct
+import threading
+from bisect import bisect_left
+
+from dao.atomic_file import BACKUP_SUFFIX
+from dao.time_range import to_epoch
+from utils import json_codec
+
+_OFFSET = struct.Struct("<Q")
+_TIME = struct.Struct("<d")
+
+# 记录中的写操作标记字段（见 dao.write_queue）
+OP_FIELD = "_op_id"
+
+
+class _TimeKeys:
+    """时间索引文件的只读序列视图（mmap），供 bisect 使用"""
+
+    def __init__(self, buffer, count):
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        return _TIME.unpack_from(self._buffer, index * _TIME.size)[0]
+
+
+class AppendLog:
+    """基于 JSONL + 偏移索引的追加写存储"""
+
+    def __init__(self, log_dir, time_field=None):
+        """初始化记录日志
+
+        Args:
+            log_dir: 日志文件所在目录
+            time_field: 记录中的时间字段，指定后维护时间索引并支持 read_range
+        """
+        self.log_dir = log_dir
+        self.time_field = time_field
+        # 本进程内已校验过索引的会话
+        self._verified = set()
+        self._prepare_lock = threading.Lock()
+
+    def log_path(self, key):
+        """获取消息日志文件路径"""
+        return os.path.join(self.log_dir, f"{key}.jsonl")
+
+    def index_path(self, key):
+        """获取偏移索引文件路径"""
+        return os.path.join(self.log_dir, f"{key}.idx")
+
+    def time_index_path(self, key):
+        """获取时间索引文件路径"""
+        return os.path.join(self.log_dir, f"{key}.tidx")
+
+    def legacy_path(self, key):
+        """获取旧版 JSON 数组文件路径"""
+        return os.path.join(self.log_dir, f"{key}.json")
+
+    def exists(self, key):
+        """key 是否有记录"""
+        self._prepare(key)
+        return os.path.exists(self.log_path(key))
+
+    def append(self, key, record, fsync=False):
+        """追加一条记录
+
+        Args:
+            key: 会话ID / 用户ID
+            record: 记录字典
+            fsync: 是否在写入后立即 fsync
+        """
+        self.append_many(key, [record], fsync)
+
+    def append_many(self, key, records, fsync=False, markers=None):
+        """一次性追加多条记录（日志和索引各只写一次）
+
+        Args:
+            key: 会话ID / 用户ID
+            records: 记录列表
+            fsync: 是否在写入后立即 fsync
+            markers: 与 records 一一对应的写操作标记，随记录写入（None 表示不标记）
+        """
+        if not records:
+            return
+        self._prepare(key)
+
+        if markers:
+            records = [
+                dict(record, **{OP_FIELD: marker}) if marker else record
+                for record, marker in zip(records, markers)
+            ]
+        lines = [
+            json_codec.dumps_bytes(record) + b"\n"
+            for record in records
+        ]
+        with open(self.log_path(key), "ab") as f:
+            offset = f.tell()
+            f.write(b"".join(lines))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        offsets = []
+        for line in lines:
+            offsets.append(_OFFSET.pack(offset))
+            offset += len(line)
+        with open(self.index_path(key), "ab") as f:
+            f.write(b"".join(offsets))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        if self.time_field:
+            with open(self.time_index_path(key), "ab") as f:
+                f.write(self._time_keys(records, self._last_time(key)))
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def count(self, key):
+        """获取记录总数"""
+        self._prepare(key)
+        try:
+            return os.path.getsize(self.index_path(key)) // _OFFSET.size
+        except FileNotFoundError:
+            return 0
+
+    def read(self, key, limit=None):
+        """读取记录
+
+        Args:
+            key: 会话ID / 用户ID
+            limit: 最多返回最近的多少条，None表示全部
+
+        Returns:
+            list: 按写入顺序排列的记录列表
+        """
+        self._prepare(key)
+        log_file = self.log_path(key)
+        if not os.path.exists(log_file):
+            return []
+
+        start = 0
+        if limit is not None and limit > 0:
+            start = self._tail_offset(key, limit)
+
+        with open(log_file, "rb") as f:
+            f.seek(start)
+            data = f.read()
+
+        records = self._decode_lines(data)
+        if limit is not None and limit > 0:
+            records = records[-limit:]
+        return records
+
+    def read_range(self, key, start=None, end=None, limit=None):
+        """按时间范围读取记录（需要 time_field），start <= 时间 < end
+
+        Args:
+            key: 会话ID / 用户ID
+            start: 起始时间（datetime / ISO 字符串 / epoch 秒），None表示不限
+            end: 结束时间（不含），None表示不限
+            limit: 最多返回范围内最近的多少条
+
+        Returns:
+            list: 按写入顺序排列的记录列表
+        """
+        self._prepare(key)
+        start = to_epoch(start)
+        end = to_epoch(end)
+        try:
+            index_size = os.path.getsize(self.index_path(key))
+            time_size = os.path.getsize(self.time_index_path(key))
+        except FileNotFoundError:
+            return []
+        total = min(index_size // _OFFSET.size, time_size // _TIME.size)
+        if total == 0:
+            return []
+
+        with open(self.time_index_path(key), "rb") as f, mmap.mmap(
+            f.fileno(), total * _TIME.size, access=mmap.ACCESS_READ
+        ) as buffer:
+            keys = _TimeKeys(buffer, total)
+            lo = bisect_left(keys, start) if start is not None else 0
+            hi = bisect_left(keys, end) if end is not None else total
+        if limit is not None and limit > 0:
+            lo = max(lo, hi - limit)
+        if lo >= hi:
+            return []
+
+        with open(self.index_path(key), "rb") as f:
+            f.seek(lo * _OFFSET.size)
+            first = _OFFSET.unpack(f.read(_OFFSET.size))[0]
+            last = None
+            if hi < total:
+                f.seek(hi * _OFFSET.size)
+                last = _OFFSET.unpack(f.read(_OFFSET.size))[0]
+
+        with open(self.log_path(key), "rb") as f:
+            f.seek(first)
+            data = f.read(last - first) if last is not None else f.read()
+
+        records = self._decode_lines(data)[: hi - lo]
+        if start is not None:
+            # 时间索引单调不减，乱序写入的旧记录需要按自身时间再过滤一次
+            records = [
+                r for r in records
+                if (to_epoch(r.get(self.time_field)) or 0.0) >= start
+            ]
+        return records
+
+    def read_at(self, key, offsets):
+        """按字节偏移读取指定的若干条记录（只解析这些行）
+
+        Args:
+            key: 会话ID / 用户ID
+            offsets: 记录起始偏移列表
+
+        Returns:
+            list: 与 offsets 顺序一致的记录列表，无法解析的行为 None
+        """
+        if not offsets:
+            return []
+        records = []
+        with open(self.log_path(key), "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                try:
+                    record = json_codec.loads(f.readline())
+                except ValueError:
+                    records.append(None)
+                    continue
+                record.pop(OP_FIELD, None)
+                records.append(record)
+        return records
+
+    def find_markers(self, key, markers):
+        """查找已经随记录写入 key 日志的写操作标记
+
+        Args:
+            key: 会话ID / 用户ID
+            markers: 待查找的标记
+
+        Returns:
+            set: markers 中已经写入的标记
+        """
+        wanted = set(markers)
+        found = set()
+        if not wanted:
+            return found
+        self._prepare(key)
+        try:
+            with open(self.log_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return found
+
+        field = json_codec.dumps_bytes(OP_FIELD)
+        for raw in data.split(b"\n"):
+            # 只解析带标记的行
+            if field not in raw:
+                continue
+            try:
+                marker = json_codec.loads(raw).get(OP_FIELD)
+            except (ValueError, AttributeError):
+                continue
+            if marker in wanted:
+                found.add(marker)
+        return found
+
+    def write_all(self, key, records):
+        """用给定的记录整体替换 key 的日志（先写临时文件再原子替换）
+
+        三个文件无法一起原子替换，因此先删除旧索引，再替换日志，最后放入新索引：
+        任何时刻崩溃，索引要么与日志一致，要么缺失（打开时按日志重建），
+        不会出现新索引配旧日志或旧索引配新日志。
+
+        Args:
+            key: 会话ID / 用户ID
+            records: 记录列表
+        """
+        log_tmp = self.log_path(key) + ".tmp"
+        index_tmp = self.index_path(key) + ".tmp"
+        time_tmp = self.time_index_path(key) + ".tmp"
+        offsets = []
+        with open(log_tmp, "wb") as f:
+            for record in records:
+                offsets.append(f.tell())
+                f.write(json_codec.dumps_bytes(record) + b"\n")
+        with open(index_tmp, "wb") as f:
+            f.write(b"".join(_OFFSET.pack(o) for o in offsets))
+        if self.time_field:
+            with open(time_tmp, "wb") as f:
+                f.write(self._time_keys(records))
+
+        for path in (self.index_path(key), self.time_index_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        os.replace(log_tmp, self.log_path(key))
+        os.replace(index_tmp, self.index_path(key))
+        if self.time_field:
+            os.replace(time_tmp, self.time_index_path(key))
+        self._verified.add(key)
+
+    def remove(self, key):
+        """删除 key 的日志及索引（包括尚未转换的旧版文件）
+
+        Returns:
+            int: 删除的文件的字节数
+        """
+        removed = 0
+        legacy_file = self.legacy_path(key)
+        for path in (
+            self.log_path(key),
+            self.index_path(key),
+            self.time_index_path(key),
+            legacy_file,
+            legacy_file + BACKUP_SUFFIX,
+        ):
+            try:
+                removed += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._verified.discard(key)
+        return removed
+
+    def _time_keys(self, records, previous=0.0):
+        """生成记录的时间索引项（单调不减）"""
+        keys = []
+        for record in records:
+            value = to_epoch(record.get(self.time_field))
+            previous = value if value is not None and value > previous else previous
+            keys.append(_TIME.pack(previous))
+        return b"".join(keys)
+
+    def _last_time(self, key):
+        """时间索引中最后一条记录的时间"""
+        try:
+            with open(self.time_index_path(key), "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell() // _TIME.size * _TIME.size
+                if size == 0:
+                    return 0.0
+                f.seek(size - _TIME.size)
+                return _TIME.unpack(f.read(_TIME.size))[0]
+        except FileNotFoundError:
+            return 0.0
+
+    def _tail_offset(self, key, limit):
+        """从索引中读取倒数第 limit 条记录的起始偏移"""
+        index_file = self.index_path(key)
+        try:
+            with open(index_file, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                total = size // _OFFSET.size
+                if total <= limit:
+                    return 0
+                f.seek((total - limit) * _OFFSET.size)
+                return _OFFSET.unpack(f.read(_OFFSET.size))[0]
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _decode_lines(data):
+        records = []
+        for raw in data.split(b"\n"):
+            if not raw.strip():
+                continue
+            try:
+                record = json_codec.loads(raw)
+            except ValueError:
+                # 崩溃时可能残留写了一半的最后一行，直接跳过
+                continue
+            record.pop(OP_FIELD, None)
+            records.append(record)
+        return records
+
+    def _prepare(self, key):
+        """首次访问 key 时转换旧版文件并校验索引"""
+        if key in self._verified:
+            return
+
+        with self._prepare_lock:
+            if key not in self._verified:
+                self._prepare_locked(key)
+
+    def _prepare_locked(self, key):
+        log_file = self.log_path(key)
+        legacy_file = self.legacy_path(key)
+
+        if not os.path.exists(log_file) and os.path.exists(legacy_file):
+            self._convert_legacy(key)
+        elif os.path.exists(log_file) and not self._index_is_valid(key):
+            self._rebuild_index(key)
+
+        if self.time_field and os.path.exists(log_file) and not self._time_index_is_valid(key):
+            self._rebuild_time_index(key)
+
+        self._verified.add(key)
+
+    def _time_index_is_valid(self, key):
+        """时间索引与偏移索引的条数是否一致"""
+        try:
+            time_size = os.path.getsize(self.time_index_path(key))
+        except FileNotFoundError:
+            return False
+        index_size = os.path.getsize(self.index_path(key))
+        return time_size // _TIME.size == index_size // _OFFSET.size and not time_size % _TIME.size
+
+    def _rebuild_time_index(self, key):
+        """扫描日志重建时间索引（旧数据首次访问时执行一次）"""
+        with open(self.log_path(key), "rb") as f:
+            records = self._decode_lines(f.read())
+        tmp_file = self.time_index_path(key) + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(self._time_keys(records))
+        os.replace(tmp_file, self.time_index_path(key))
+
+    def _index_is_valid(self, key):
+        """检查索引末尾的偏移是否正好对应日志的最后一行"""
+        log_file = self.log_path(key)
+        index_file = self.index_path(key)
+        log_size = os.path.getsize(log_file)
+
+        if not os.path.exists(index_file):
+            return log_size == 0
+        index_size = os.path.getsize(index_file)
+        if index_size % _OFFSET.size:
+            return False
+        if index_size == 0:
+            return log_size == 0
+
+        with open(index_file, "rb") as f:
+            f.seek(index_size - _OFFSET.size)
+            last_offset = _OFFSET.unpack(f.read(_OFFSET.size))[0]
+        if last_offset >= log_size:
+            return False
+
+        with open(log_file, "rb") as f:
+            f.seek(last_offset)
+            tail = f.read()
+        return tail.endswith(b"\n") and tail.count(b"\n") == 1
+
+    def _rebuild_index(self, key):
+        """扫描日志重建偏移索引，并截掉未写完的最后一行"""
+        log_file = self.log_path(key)
+        offsets = []
+        valid_end = 0
+        with open(log_file, "rb") as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                offsets.append(offset)
+                valid_end = f.tell()
+
+        if valid_end != os.path.getsize(log_file):
+            with open(log_file, "r+b") as f:
+                f.truncate(valid_end)
+
+        tmp_file = self.index_path(key) + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(b"".join(_OFFSET.pack(o) for o in offsets))
+        os.replace(tmp_file, self.index_path(key))
+
+    def _convert_legacy(self, key):
+        """将旧版 JSON 数组文件转换为 JSONL 日志"""
+        legacy_file = self.legacy_path(key)
+        with open(legacy_file, "rb") as f:
+            records = json_codec.loads(f.read())
+
+        self.write_all(key, records)
+        os.remove(legacy_file)
+        if os.path.exists(legacy_file + BACKUP_SUFFIX):
+            os.remove(legacy_file + BACKUP_SUFFIX)
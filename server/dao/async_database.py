@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库的 asyncio 接口
+
+AsyncDatabase 包装 Database / SQLiteDatabase，其所有公开方法都可以直接 await：
+
+    adb = AsyncDatabase(get_database())
+    profile = await adb.get_user_profile(user_id)
+    data = await adb.gather(
+        profile=("get_user_profile", user_id),
+        memory=("get_long_term_memory", user_id, 5),
+    )
+
+存储层的文件读写和 SQLite 调用本身是阻塞的（标准库没有真正的异步文件 I/O，
+aiofiles / aiosqlite 内部同样是线程），因此调用在一个专用的有界线程池中执行：
+- 同时执行的存储调用不超过 max_concurrency（DB_ASYNC_CONCURRENCY，默认 8）
+- 超出的调用在队列中等待而不是超时失败，等待期间不占用事件循环
+- 单个调用出错时 gather 只让对应的键返回默认值，不影响其他键
+
+同步代码通过 run 执行协程：协程交给一个常驻的事件循环线程执行，调用线程阻塞等待结果。
+不必每次新建事件循环，调用线程自身是否有运行中的事件循环也不影响（在该事件循环线程
+内部调用 run 会死锁，此时抛出 RuntimeError）。
+"""
+
+import os
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncDatabase:
+    """数据库的 asyncio 外观，所有公开方法均为协程"""
+
+    def __init__(self, database, max_concurrency=None):
+        """初始化异步数据库接口
+
+        Args:
+            database: Database 或 SQLiteDatabase 实例
+            max_concurrency: 同时执行的存储调用数上限，默认读取 DB_ASYNC_CONCURRENCY
+        """
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get("DB_ASYNC_CONCURRENCY", "8"))
+
+        self.db = database
+        self.max_concurrency = max(1, max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="async-db"
+        )
+        self._methods = {}
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self._closed = False
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        method = self._methods.get(name)
+        if method is None:
+            target = getattr(self.db, name)
+            if not callable(target):
+                return target
+
+            @functools.wraps(target)
+            async def method(*args, **kwargs):
+                return await self.call(target, *args, **kwargs)
+
+            self._methods[name] = method
+        return method
+
+    async def call(self, func, *args, **kwargs):
+        """在存储线程池中执行阻塞调用并等待结果
+
+        Args:
+            func: 数据库方法（或方法名）
+
+        Returns:
+            方法的返回值
+        """
+        if isinstance(func, str):
+            func = getattr(self.db, func)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def gather(self, defaults=None, **calls):
+        """并发执行多个数据库调用
+
+        Args:
+            defaults: 调用失败时各键的默认值
+            **calls: 键 -> (方法名, 参数...)
+
+        Returns:
+            dict: 键 -> 返回值（失败的调用为默认值）
+        """
+        defaults = defaults or {}
+        keys = list(calls)
+        results = await asyncio.gather(
+            *(self.call(*calls[key]) for key in keys), return_exceptions=True
+        )
+
+        data = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                print(f"Error getting {key}: {result}")
+                result = defaults.get(key)
+            data[key] = result
+        return data
+
+    def run(self, coro, timeout=None):
+        """在同步代码中执行协程（交给常驻的事件循环线程），阻塞等待结果
+
+        Args:
+            coro: 协程对象
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        Returns:
+            协程的返回值
+
+        Raises:
+            RuntimeError: 在事件循环线程内部调用，或已经 close
+        """
+        try:
+            loop = self._get_loop()
+            if threading.current_thread() is self._loop_thread:
+                raise RuntimeError("AsyncDatabase.run called from its own event loop thread")
+        except RuntimeError:
+            coro.close()
+            raise
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def _get_loop(self):
+        """获取（首次调用时启动）常驻的事件循环"""
+        if self._loop is not None:
+            return self._loop
+        with self._loop_lock:
+            if self._loop is None:
+                if self._closed:
+                    raise RuntimeError("AsyncDatabase is closed")
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="async-db-loop", daemon=True
+                )
+                thread.start()
+                self._loop_thread = thread
+                self._loop = loop
+        return self._loop
+
+    def close(self):
+        """关闭存储线程池（等待已提交的调用完成），再停止事件循环线程
+
+        事件循环中尚未结束的协程最多再等待 5 秒，之后被取消。
+        """
+        with self._loop_lock:
+            self._closed = True
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        self._executor.shutdown(wait=True)
+        if loop is None:
+            return
+
+        async def drain():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=5)
+                for task in pending:
+                    task.cancel()
+
+        asyncio.run_coroutine_threadsafe(drain(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+_shared_async = {}
+_shared_async_lock = threading.Lock()
+
+
+def get_async_database(database):
+    """获取包装某个数据库实例的共享 AsyncDatabase
+
+    Args:
+        database: Database 或 SQLiteDatabase 实例
+
+    Returns:
+        AsyncDatabase: 同一数据库实例共享同一个异步接口和线程池
+    """
+    with _shared_async_lock:
+        adb = _shared_async.get(id(database))
+        if adb is None or adb.db is not database:
+            adb = AsyncDatabase(database)
+            _shared_async[id(database)] = adb
+        return adb
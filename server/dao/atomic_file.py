@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+崩溃安全的 JSON 文件读写
+
+所有整文件重写都走“写临时文件 -> os.replace 原子替换”的路径，读者要么看到旧文件，
+要么看到新文件，不会读到写了一半的 JSON。替换前把当前文件硬链接为 `<文件>.bak`，
+保留上一代完好的数据；读取时发现文件损坏会自动从 `.bak` 恢复。
+
+fsync 策略（DB_FSYNC）：
+- none: 不主动 fsync（默认）
+- batch: 记录写过的文件和目录，每隔 DB_FSYNC_INTERVAL_MS 毫秒统一 fsync 一次
+- always: 每次写入都 fsync 文件，并在替换后 fsync 所在目录
+"""
+
+import os
+import time
+import atexit
+import threading
+
+from utils import json_codec
+
+FSYNC_POLICIES = ("none", "batch", "always")
+
+BACKUP_SUFFIX = ".bak"
+TMP_SUFFIX = ".tmp"
+
+
+def fsync_dir(directory):
+    """fsync 目录，使其中的创建 / 重命名操作落盘"""
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # 部分平台 / 文件系统不支持对目录 fsync
+        pass
+    finally:
+        os.close(fd)
+
+
+def remove_tree(directory):
+    """删除目录及其中的全部文件
+
+    Returns:
+        int: 删除的文件的字节数
+    """
+    removed = 0
+    for root, dirs, files in os.walk(directory, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                removed += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        for name in dirs:
+            os.rmdir(os.path.join(root, name))
+    if os.path.isdir(directory):
+        os.rmdir(directory)
+    return removed
+
+
+class AtomicFileWriter:
+    """原子写入 + 上一代备份 + 可配置 fsync 的文件写入器"""
+
+    def __init__(self, fsync_policy="none", batch_interval=1.0, keep_backup=True):
+        """初始化文件写入器
+
+        Args:
+            fsync_policy: fsync 策略，none / batch / always
+            batch_interval: batch 策略下两次 fsync 之间的最长间隔（秒）
+            keep_backup: 替换前是否保留上一代文件（.bak）
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+
+        self.fsync_policy = fsync_policy
+        self.batch_interval = batch_interval
+        self.keep_backup = keep_backup
+
+        self._lock = threading.Lock()
+        self._pending_files = set()
+        self._pending_dirs = set()
+        self._last_sync = time.monotonic()
+        self.stats = {"writes": 0, "syncs": 0, "recovered": 0, "quarantined": 0}
+
+        if fsync_policy == "batch":
+            atexit.register(self.sync)
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量 DB_FSYNC / DB_FSYNC_INTERVAL_MS 创建写入器"""
+        return cls(
+            fsync_policy=os.environ.get("DB_FSYNC", "none").lower(),
+            batch_interval=float(os.environ.get("DB_FSYNC_INTERVAL_MS", "1000")) / 1000,
+        )
+
+    def write_json(self, path, data, fsync=None):
+        """原子地把 data 以紧凑的 JSON 格式写入 path
+
+        Args:
+            path: 目标文件路径
+            data: 可序列化为 JSON 的数据
+            fsync: 为 True 时无论策略如何都立即 fsync 文件和目录
+        """
+        payload = json_codec.dumps_bytes(data)
+        self.write_bytes(path, payload, fsync)
+
+    def write_bytes(self, path, payload, fsync=None):
+        """原子地把 payload 写入 path（临时文件 + os.replace）
+
+        Args:
+            path: 目标文件路径
+            payload: 文件内容（bytes）
+            fsync: 为 True 时无论策略如何都立即 fsync 文件和目录
+        """
+        sync_now = fsync or self.fsync_policy == "always"
+        directory = os.path.dirname(path)
+
+        # 临时文件名带上进程和线程标识，多个写者不会互相覆盖
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(payload)
+                if sync_now:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            if self.keep_backup and os.path.exists(path):
+                self._link_backup(path)
+            os.replace(tmp_file, path)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+        with self._lock:
+            self.stats["writes"] += 1
+
+        if sync_now:
+            fsync_dir(directory)
+        elif self.fsync_policy == "batch":
+            with self._lock:
+                self._pending_files.add(path)
+                self._pending_dirs.add(directory)
+                due = time.monotonic() - self._last_sync >= self.batch_interval
+            if due:
+                self.sync()
+
+    def _link_backup(self, path):
+        """把当前文件保存为上一代备份（硬链接，不复制数据）"""
+        backup = path + BACKUP_SUFFIX
+        link_tmp = f"{backup}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        try:
+            os.link(path, link_tmp)
+            os.replace(link_tmp, backup)
+        except OSError:
+            # 不支持硬链接的文件系统上退化为复制
+            with open(path, "rb") as src, open(link_tmp, "wb") as dst:
+                dst.write(src.read())
+            os.replace(link_tmp, backup)
+
+    def sync(self):
+        """fsync batch 策略下积累的文件和目录"""
+        with self._lock:
+            files, self._pending_files = self._pending_files, set()
+            dirs, self._pending_dirs = self._pending_dirs, set()
+            self._last_sync = time.monotonic()
+            if files or dirs:
+                self.stats["syncs"] += 1
+
+        for path in files:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for directory in dirs:
+            fsync_dir(directory)
+
+    def read_json(self, path, default=None):
+        """读取 JSON 文件，文件损坏时从上一代备份恢复
+
+        Args:
+            path: 文件路径
+            default: 文件不存在（或主文件与备份都损坏）时的返回值
+
+        Returns:
+            解析后的数据
+        """
+        try:
+            with open(path, "rb") as f:
+                return json_codec.loads(f.read())
+        except FileNotFoundError:
+            return default
+        except ValueError:
+            pass
+
+        data = self.recover_file(path)
+        return default if data is None else data
+
+    def recover_file(self, path):
+        """用 .bak 替换损坏的文件；备份也不可用时把损坏文件隔离为 .corrupt
+
+        Returns:
+            恢复出的数据，无法恢复时返回 None
+        """
+        with self._lock:
+            # 其他线程可能已经完成了恢复
+            try:
+                with open(path, "rb") as f:
+                    return json_codec.loads(f.read())
+            except FileNotFoundError:
+                return None
+            except ValueError:
+                pass
+
+            backup = path + BACKUP_SUFFIX
+            try:
+                with open(backup, "rb") as f:
+                    payload = f.read()
+                data = json_codec.loads(payload)
+            except (OSError, ValueError):
+                quarantine = f"{path}.corrupt-{int(time.time())}"
+                os.replace(path, quarantine)
+                self.stats["quarantined"] += 1
+                print(f"Warning: {path} is corrupt and has no usable backup, moved to {quarantine}")
+                return None
+
+            tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+            with open(tmp_file, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, path)
+            fsync_dir(os.path.dirname(path))
+            self.stats["recovered"] += 1
+            print(f"Recovered {path} from last good generation")
+            return data
+
+    def verify_tree(self, root, stale_tmp_age=60.0, recursive=True):
+        """检查目录下的 JSON 文件，损坏的从上一代恢复，并清理残留的临时文件
+
+        Args:
+            root: 数据目录
+            stale_tmp_age: 超过该时间（秒）的临时文件视为崩溃残留
+            recursive: 是否检查子目录，False 时只检查 root 下的全局文件
+
+        Returns:
+            dict: 检查结果统计
+        """
+        result = {"checked": 0, "recovered": 0, "quarantined": 0, "tmp_removed": 0}
+        now = time.time()
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            if recursive:
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            else:
+                dirnames[:] = []
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+
+                if filename.endswith(TMP_SUFFIX):
+                    # 还在写的临时文件（其他进程）不要删
+                    try:
+                        if now - os.path.getmtime(path) >= stale_tmp_age:
+                            os.remove(path)
+                            result["tmp_removed"] += 1
+                    except OSError:
+                        pass
+                    continue
+
+                if not filename.endswith(".json"):
+                    continue
+
+                result["checked"] += 1
+                try:
+                    with open(path, "rb") as f:
+                        json_codec.loads(f.read())
+                    continue
+                except (OSError, ValueError):
+                    pass
+
+                if self.recover_file(path) is None:
+                    result["quarantined"] += 1
+                else:
+                    result["recovered"] += 1
+
+        return result
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量读取（Database.bulk_load）返回的数据包
+
+一次调用取回一个用户在多个会话中的各类数据，供分析报告等需要“全量数据”的流程直接使用。
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+# 按会话存储的数据种类
+SESSION_KINDS = (
+    "chat_history",
+    "message_count",
+    "events",
+    "moods",
+    "pattern",
+    "inquiry",
+    "inquiry_history",
+    "plan",
+)
+
+# 按用户存储的数据种类
+USER_KINDS = ("profile", "long_term_memory", "emotions")
+
+KINDS = SESSION_KINDS + USER_KINDS
+
+
+def normalize_kinds(kinds):
+    """校验并规范化 kinds 参数，None 表示全部种类
+
+    Raises:
+        ValueError: 包含未知的数据种类
+    """
+    if kinds is None:
+        return set(KINDS)
+    if isinstance(kinds, str):
+        kinds = [kinds]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise ValueError(f"Unknown data kinds: {sorted(unknown)}")
+    return set(kinds)
+
+
+@dataclass
+class SessionBundle:
+    """单个会话的数据"""
+
+    session_id: str
+    chat_history: List[Dict[str, Any]] = field(default_factory=list)
+    message_count: int = 0
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    moods: List[Dict[str, Any]] = field(default_factory=list)
+    pattern: Dict[str, Any] = field(default_factory=dict)
+    inquiry: Dict[str, Any] = field(default_factory=dict)
+    inquiry_history: List[Dict[str, Any]] = field(default_factory=list)
+    plan: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class UserDataBundle:
+    """一个用户的批量数据，sessions 按请求的会话顺序排列"""
+
+    user_id: str
+    sessions: Dict[str, SessionBundle] = field(default_factory=dict)
+    profile: Dict[str, Any] = field(default_factory=dict)
+    long_term_memory: List[Dict[str, Any]] = field(default_factory=list)
+    emotions: List[Dict[str, Any]] = field(default_factory=list)
+
+    def iter_sessions(self):
+        """按会话顺序遍历 SessionBundle"""
+        return iter(self.sessions.values())
+
+    def collect(self, kind):
+        """把所有会话中某一种列表数据按会话顺序拼接起来
+
+        Args:
+            kind: 列表类型的数据种类，如 "events" / "moods"
+
+        Returns:
+            list: 拼接后的列表
+        """
+        items = []
+        for session in self.sessions.values():
+            items.extend(getattr(session, kind))
+        return items
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据变更流（change data capture）
+
+Database 的每次写操作都会发布一条变更记录，派生数据（统计、缓存、搜索索引等）
+订阅变更后增量更新，而不必轮询或重新扫描数据文件：
+
+    {
+        "version": 12,              # 全局单调递增的版本号
+        "entity": "events",         # 数据种类（与 bulk_load 的 kinds 一致，另有 sessions / reports）
+        "op": "insert",             # insert / update / delete
+        "key": "session_1",         # 存储键：会话ID 或 用户ID
+        "user_id": "user_1",        # 数据所属用户
+        "id": "evt_xxx",            # 单条记录的ID（更新、删除单条记录时）
+        "count": 3,                 # 一次写入的记录条数（批量追加时）
+        "time": 1760000000.0        # 变更时间（epoch 秒）
+    }
+
+- 进程内：subscribe(callback) 注册回调，回调按 version 顺序同步执行；changes_since(version) 拉取变更
+- 落盘（CHANGE_FEED_PERSIST=1）：变更追加到 changes/feed.jsonl，多个工作进程共享同一个版本号序列，
+  其他进程写入的变更在 poll() 时读入并分发给本进程的订阅者。publish 把变更放入进程内队列，
+  跨进程文件锁空闲时直接写入，被其他进程持有时不等待，由后台线程批量分配版本号并追加
+  （每批只取一次文件锁），写操作不会在持有会话 / 用户锁时等待其他进程；
+  poll() / data_version() / changes_since() 先写入本进程排队的变更
+- 用户数据版本：data_version(user_id) 为该用户最近一次变更的 version，单调递增，可直接用于缓存失效；
+  不落盘时版本号只在进程内有效（进程重启后进程内缓存也一并失效）
+
+回调只能做轻量的内存更新，不能再调用数据库（进程内模式下在写操作持有的锁内执行，
+落盘模式下在写入日志的线程中执行）；耗时的处理应放入订阅者自己的队列或线程中。
+"""
+
+import os
+import time
+import atexit
+import threading
+from collections import deque
+
+from dao.append_log import AppendLog
+from dao.locks import FileLock
+
+_FEED_KEY = "feed"
+
+
+class ChangeFeed:
+    """数据变更流"""
+
+    def __init__(self, feed_dir=None, retain=1024, max_records=100000):
+        """初始化变更流
+
+        Args:
+            feed_dir: 落盘目录，None表示只在进程内发布
+            retain: 进程内保留最近多少条变更供 changes_since 读取
+            max_records: 落盘日志超过该条数时只保留最近的一半
+        """
+        self.feed_dir = feed_dir
+        self.max_records = max_records
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._recent = deque(maxlen=retain)
+        self._versions = {}
+        self._version = 0
+        self._stat = None
+        self.stats = {"published": 0, "received": 0, "callback_errors": 0, "batches": 0}
+        # 落盘模式下等待写入日志的变更
+        self._pending = deque()
+        self._pending_cond = threading.Condition(threading.Lock())
+
+        self.log = None
+        if feed_dir:
+            os.makedirs(feed_dir, exist_ok=True)
+            # version 单调递增，借用时间索引按 version 二分查找
+            self.log = AppendLog(feed_dir, time_field="version")
+            self._file_lock = FileLock(os.path.join(feed_dir, "feed.lock"))
+            # 其他进程可能正在追加，首次读取（含索引校验）也要持有文件锁
+            with self._file_lock.exclusive():
+                last = self.log.read(_FEED_KEY, 1)
+                self._version = last[0]["version"] if last else 0
+                self._stat = self._log_stat()
+            self._writer = threading.Thread(
+                target=self._run_writer, name="change-feed", daemon=True
+            )
+            self._writer.start()
+            atexit.register(self.flush)
+
+    def subscribe(self, callback, entities=None):
+        """订阅变更
+
+        Args:
+            callback: callback(change)，按 version 顺序调用
+            entities: 只接收这些数据种类的变更，None表示全部
+
+        Returns:
+            callback，可传给 unsubscribe
+        """
+        entities = {entities} if isinstance(entities, str) else entities
+        with self._lock:
+            self._subscribers.append((callback, set(entities) if entities else None))
+        return callback
+
+    def unsubscribe(self, callback):
+        """取消订阅"""
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] is not callback]
+
+    def publish(self, entity, op, key, user_id=None, record_id=None, count=None):
+        """发布一条变更（出错时只打印日志，不影响写操作）
+
+        Args:
+            entity: 数据种类
+            op: insert / update / delete
+            key: 存储键（会话ID 或 用户ID）
+            user_id: 数据所属用户
+            record_id: 单条记录的ID
+            count: 写入的记录条数
+
+        Returns:
+            dict: 变更记录，失败时返回 None；落盘模式下 version 在写入日志时才分配
+        """
+        try:
+            change = {"entity": entity, "op": op, "key": key, "user_id": user_id}
+            if record_id is not None:
+                change["id"] = record_id
+            if count is not None:
+                change["count"] = count
+            change["time"] = time.time()
+
+            if self.log is not None:
+                with self._pending_cond:
+                    self._pending.append(change)
+                    self.stats["published"] += 1
+                # 调用方通常持有会话 / 用户的写锁：文件锁空闲时直接写入，否则交给后台线程
+                if not self._write_pending(blocking=False):
+                    with self._pending_cond:
+                        self._pending_cond.notify()
+                return change
+
+            with self._lock:
+                change["version"] = self._version + 1
+                self._apply_locked(change)
+                self.stats["published"] += 1
+            return change
+
+        except Exception as e:
+            print(f"Error publishing change: {str(e)}")
+            return None
+
+    def flush(self):
+        """把本进程排队的变更写入日志（未落盘时无操作）
+
+        Returns:
+            int: 写入的变更条数
+        """
+        return self._write_pending(blocking=True)
+
+    def _write_pending(self, blocking):
+        """分配版本号并追加排队的变更；blocking 为 False 时锁被占用就直接返回 0"""
+        if self.log is None or not self._pending:
+            return 0
+        if not self._lock.acquire(blocking=blocking):
+            return 0
+        try:
+            if blocking:
+                self._file_lock.acquire_exclusive()
+            elif not self._file_lock.try_acquire_exclusive():
+                return 0
+            try:
+                with self._pending_cond:
+                    batch = list(self._pending)
+                    self._pending.clear()
+                if not batch:
+                    return 0
+                self._poll_locked()
+                for version, change in enumerate(batch, self._version + 1):
+                    change["version"] = version
+                self.log.append_many(_FEED_KEY, batch)
+                for change in batch:
+                    self._apply_locked(change)
+                self._stat = self._log_stat()
+                if self.log.count(_FEED_KEY) > self.max_records:
+                    self._compact_locked()
+                self.stats["batches"] += 1
+                return len(batch)
+            finally:
+                self._file_lock.release_exclusive()
+        except Exception as e:
+            print(f"Error writing change feed: {str(e)}")
+            return 0
+        finally:
+            self._lock.release()
+
+    def _run_writer(self):
+        while True:
+            with self._pending_cond:
+                while not self._pending:
+                    self._pending_cond.wait()
+            # 等待期间到达的变更在同一批中写入；出错时稍后重试
+            if not self.flush():
+                time.sleep(0.05)
+
+    def poll(self):
+        """读入其他进程写入的变更并分发给订阅者（未落盘时无操作）
+
+        Returns:
+            int: 读入的变更条数
+        """
+        if self.log is None:
+            return 0
+        # 先写入本进程排队的变更，保证读到自己的写入
+        self.flush()
+        if self._log_stat() == self._stat:
+            return 0
+        try:
+            with self._lock, self._file_lock.exclusive():
+                return self._poll_locked()
+        except Exception as e:
+            print(f"Error polling change feed: {str(e)}")
+            return 0
+
+    def changes_since(self, version, limit=None):
+        """获取 version 之后的变更（按 version 正序）
+
+        未落盘时只能返回进程内保留的最近 retain 条变更。
+
+        Args:
+            version: 已处理到的版本号
+            limit: 最多返回的条数
+
+        Returns:
+            list: 变更记录列表
+        """
+        if self.log is not None:
+            self.poll()
+            with self._lock, self._file_lock.exclusive():
+                changes = self.log.read_range(_FEED_KEY, version + 1)
+        else:
+            with self._lock:
+                changes = [dict(c) for c in self._recent if c["version"] > version]
+        return changes[:limit] if limit else changes
+
+    @property
+    def version(self):
+        """当前的全局版本号"""
+        self.poll()
+        return self._version
+
+    def data_version(self, user_id):
+        """用户数据的版本号（该用户最近一次变更的 version，没有变更时为 0）"""
+        self.poll()
+        return self._versions.get(user_id, 0)
+
+    def _apply_locked(self, change):
+        """更新版本号并分发给订阅者"""
+        self._version = change["version"]
+        if change.get("user_id") is not None:
+            self._versions[change["user_id"]] = change["version"]
+        self._recent.append(change)
+
+        for callback, entities in self._subscribers:
+            if entities is not None and change["entity"] not in entities:
+                continue
+            try:
+                callback(dict(change))
+            except Exception as e:
+                self.stats["callback_errors"] += 1
+                print(f"Error in change subscriber: {str(e)}")
+
+    def _poll_locked(self):
+        changes = self.log.read_range(_FEED_KEY, self._version + 1)
+        for change in changes:
+            self._apply_locked(change)
+        self.stats["received"] += len(changes)
+        self._stat = self._log_stat()
+        return len(changes)
+
+    def _compact_locked(self):
+        """只保留最近一半的变更记录"""
+        keep = self.log.read(_FEED_KEY, self.max_records // 2)
+        self.log.write_all(_FEED_KEY, keep)
+        self._stat = self._log_stat()
+
+    def _log_stat(self):
+        try:
+            st = os.stat(self.log.time_index_path(_FEED_KEY))
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
@@ -2,13 +2,74 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
 import time
+import inspect
 import threading
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from dao.append_log import AppendLog
+from dao.atomic_file import BACKUP_SUFFIX, AtomicFileWriter
+from dao.bundle import (
+    SESSION_KINDS,
+    SessionBundle,
+    UserDataBundle,
+    normalize_kinds,
+)
+from dao.change_feed import ChangeFeed
+from dao.event_store import EventStore
+from dao.report_store import ReportStore
+from dao.locks import FileLock, StripedRWLock
+from dao.message_cache import RecentMessageCache
+from dao.retention import expired_positions, record_time
+from dao.session_archive import SessionArchive
+from dao.session_index import SessionIndex
+from dao.storage import StorageBackend, backend_names, get_backend_factory, register_backend
+from dao.time_range import time_window
+
+
+# 每个会话一个 JSON 文件的数据：(数据种类, 目录名)
+_SESSION_DOCUMENTS = (
+    ("pattern", "patterns"),
+    ("inquiry", "inquiry_results"),
+    ("plan", "plans"),
+)
+
+
+def _tail(items, limit):
+    if limit is not None and limit > 0:
+        return items[-limit:]
+    return items
+
+
+def _filter_events(events, limit=None, since=None, types=None):
+    """按创建时间、类型和数量过滤事件列表（与 EventStore.query 的语义一致）"""
+    if isinstance(since, datetime):
+        since = since.isoformat()
+    if since is not None:
+        events = [e for e in events if (e.get("created_at") or "") >= since]
+    if types:
+        types = {types} if isinstance(types, str) else set(types)
+        events = [
+            e for e in events
+            if e.get("primaryType") in types or e.get("subType") in types
+        ]
+    return _tail(events, limit)
+
+
+def _remove_files(paths):
+    """删除存在的文件，返回删除的字节数"""
+    removed = 0
+    for path in paths:
+        try:
+            removed += os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return removed
 
 
-class Database:
+class Database(StorageBackend):
     """简单的基于文件的数据库实现，用于存储聊天历史记录和事件"""
 
     def __init__(self, data_dir="data"):
@@ -21,30 +82,330 @@ class Database:
         self.sessions_file = os.path.join(data_dir, "sessions.json")
         self.messages_dir = os.path.join(data_dir, "messages")
         self.events_dir = os.path.join(data_dir, "events")
-        self.lock = threading.Lock()
+        # 按用户分片的数据：情绪评分、长期记忆、用户画像
+        self.emotions_dir = os.path.join(data_dir, "emotions")
+        self.memories_dir = os.path.join(data_dir, "memories")
+        self.profiles_dir = os.path.join(data_dir, "profiles")
+        self.reports_dir = os.path.join(data_dir, "analysis_reports")
+        self.archive_dir = os.path.join(data_dir, "archive")
+        self.changes_dir = os.path.join(data_dir, "changes")
+        self.lock_dir = os.path.join(data_dir, ".locks")
+
+        # 按 session_id / user_id / 文件分片的读写锁，不同会话互不阻塞；
+        # 每个分片同时持有 fcntl 文件锁，多个工作进程可以共享同一数据目录
+        self.locks = StripedRWLock(lock_dir=self.lock_dir)
 
         # 确保目录存在
         os.makedirs(self.data_dir, exist_ok=True)
         os.makedirs(self.messages_dir, exist_ok=True)
         os.makedirs(self.events_dir, exist_ok=True)
+        os.makedirs(self.emotions_dir, exist_ok=True)
+        os.makedirs(self.memories_dir, exist_ok=True)
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        os.makedirs(self.reports_dir, exist_ok=True)
+
+        # 所有整文件重写都是“临时文件 + 原子替换”，并保留上一代备份
+        self.files = AtomicFileWriter.from_env()
+        # 启动时默认只检查数据目录下的全局文件；会话 / 用户文件在读取时按需从 .bak 恢复，
+        # 全量检查由 verify_data.py 执行
+        verify = os.environ.get("DB_VERIFY_ON_START", "quick").lower()
+        if verify not in ("0", "off", "none"):
+            self.verify_files(full=verify == "full")
+
+        # 消息、情绪评分和长期记忆都以追加写的 JSONL 日志保存
+        self.message_log = AppendLog(self.messages_dir)
+        self.emotion_log = AppendLog(self.emotions_dir, time_field="timestamp")
+        self.memory_log = AppendLog(self.memories_dir)
+        # 活跃会话最近的消息常驻内存，按会话 LRU 淘汰
+        self.recent = RecentMessageCache(
+            int(os.environ.get("HISTORY_CACHE_MESSAGES", "64")),
+            int(float(os.environ.get("HISTORY_CACHE_MB", "64")) * 1024 * 1024),
+        )
+        # 事件按事件ID建立内存索引，更新和删除只追加记录
+        self.events = EventStore(self.events_dir)
+        # 分析报告：每个用户一个报告头索引，正文压缩保存
+        self.reports = ReportStore(self.reports_dir, self.files)
+        # 长时间不活动的会话归档为按用户分段的压缩文件
+        self.archive = SessionArchive(self.archive_dir)
+        # 每次写操作发布一条变更记录（CHANGE_FEED_PERSIST=1 时同时追加到 changes/ 供其他进程读取）
+        self.changes = ChangeFeed(
+            self.changes_dir if os.environ.get("CHANGE_FEED_PERSIST", "0") == "1" else None
+        )
+        # bulk_load 的并行读取线程池，首次使用时创建
+        self._io_pool = None
+        self._io_pool_lock = threading.Lock()
+
+        # 将旧版全局文件拆分到每个用户自己的文件中
+        self._migrate_global_user_files()
+
+        # 会话索引常驻内存，启动时只加载一次
+        self.sessions = SessionIndex(
+            self.sessions_file,
+            lock_file=os.path.join(self.lock_dir, "sessions.lock"),
+            writer=self.files,
+        )
+
+        # 后台定期归档空闲会话（ARCHIVE_IDLE_DAYS 为 0 时关闭）
+        idle_days = float(os.environ.get("ARCHIVE_IDLE_DAYS", "0"))
+        if idle_days > 0:
+            self._start_archiver(
+                idle_days, float(os.environ.get("ARCHIVE_INTERVAL_S", "3600"))
+            )
+
+    def flush(self):
+        """将内存中尚未落盘的会话元数据和排队的变更写入磁盘，并完成积压的 fsync"""
+        self.sessions.flush()
+        self.changes.flush()
+        self.files.sync()
+
+    def _publish_session_change(self, entity, op, session_id, record_id=None, count=None):
+        """发布会话数据的变更（在会话写锁内调用，保证变更顺序与写入顺序一致）"""
+        self.changes.publish(
+            entity,
+            op,
+            session_id,
+            self.sessions.field(session_id, "user_id", sync=False),
+            record_id,
+            count,
+        )
+
+    def verify_files(self, full=True):
+        """检查数据文件：损坏的 JSON 文件从上一代备份恢复，清理崩溃残留的临时文件
 
-        # 初始化会话文件
-        if not os.path.exists(self.sessions_file):
-            with open(self.sessions_file, "w", encoding="utf-8") as f:
-                json.dump({}, f)
+        Args:
+            full: 是否检查整个数据目录，False 时只检查数据目录下的全局文件
 
-    def _get_message_file(self, session_id):
-        """获取消息存储文件的路径"""
-        return os.path.join(self.messages_dir, f"{session_id}.json")
+        Returns:
+            dict: 检查结果统计
+        """
+        with FileLock(os.path.join(self.lock_dir, "recovery.lock")).exclusive():
+            result = self.files.verify_tree(self.data_dir, recursive=full)
+        if result["recovered"] or result["quarantined"] or result["tmp_removed"]:
+            print(f"Verified data files in {self.data_dir}: {result}")
+        return result
 
-    def _get_events_file(self, session_id):
-        """获取事件存储文件的路径"""
-        return os.path.join(self.events_dir, f"{session_id}.json")
+    def lock_stats(self):
+        """获取锁等待/持有时间统计，用于观察锁竞争情况
+
+        Returns:
+            dict: {"read": {...}, "write": {...}}，时间单位为秒
+        """
+        return self.locks.stats.snapshot()
 
     def _get_mood_file(self, session_id):
         """获取情绪分析数据存储文件的路径"""
         return os.path.join(self.messages_dir, f"{session_id}_mood.json")
 
+    def _get_profile_file(self, user_id):
+        """获取用户画像存储文件的路径"""
+        return os.path.join(self.profiles_dir, f"{user_id}.json")
+
+    def _migrate_global_user_files(self):
+        """在线迁移：把 emotion_scores.json / long_term_memory.json / user_profiles.json
+        中的数据拆分到每个用户的分片文件，完成后将旧文件重命名为 *.migrated；
+        旧版 analysis_reports/<user_id>_<时间戳>.json 报告迁移到按用户索引的报告存储
+
+        多个进程同时启动时由文件锁保证只有一个进程执行迁移。
+        """
+        legacy_logs = [
+            (os.path.join(self.data_dir, "emotion_scores.json"), self.emotion_log),
+            (os.path.join(self.data_dir, "long_term_memory.json"), self.memory_log),
+        ]
+        profiles_file = os.path.join(self.data_dir, "user_profiles.json")
+
+        pending = [path for path, _ in legacy_logs if os.path.exists(path)]
+        if os.path.exists(profiles_file):
+            pending.append(profiles_file)
+        if self.reports.has_legacy():
+            pending.append(self.reports_dir)
+        if not pending:
+            return
+
+        with FileLock(os.path.join(self.lock_dir, "migration.lock")).exclusive():
+            for legacy_file, log in legacy_logs:
+                if not os.path.exists(legacy_file):
+                    continue
+                records_by_user = self.files.read_json(legacy_file, {})
+                for user_id, records in records_by_user.items():
+                    # 已经存在分片说明该用户此前已迁移完成
+                    if not os.path.exists(log.log_path(user_id)):
+                        log.write_all(user_id, records)
+                os.replace(legacy_file, legacy_file + ".migrated")
+                print(f"Migrated {legacy_file} into per-user shards")
+
+            if os.path.exists(profiles_file):
+                profiles = self.files.read_json(profiles_file, {})
+                for user_id, profile in profiles.items():
+                    profile_file = self._get_profile_file(user_id)
+                    if os.path.exists(profile_file):
+                        continue
+                    self.files.write_json(profile_file, profile)
+                os.replace(profiles_file, profiles_file + ".migrated")
+                print(f"Migrated {profiles_file} into per-user shards")
+
+            self.reports.migrate_legacy()
+
+    def apply_batch(self, operations, fsync=False, op_ids=None):
+        """批量执行写操作（写入合并 / group commit）
+
+        同一会话的消息、同一用户的情绪评分和长期记忆各合并为一次追加写，
+        同一用户的多次画像更新合并为一次文件重写；其余操作按提交顺序逐个执行。
+        合并的追加写先于其余操作执行，保证新会话在保存事件等操作之前已经存在。
+
+        Args:
+            operations: [(方法名, args, kwargs), ...]，按提交顺序排列
+            fsync: 是否对本批次写入的每个文件 fsync 一次
+            op_ids: 与 operations 一一对应的写操作ID，追加写的记录带上该标记，
+                    供 applied_operations 判断操作是否已经写入
+
+        Returns:
+            list: 与 operations 一一对应的异常，成功的操作为 None；
+                  合并写入失败时同一组的操作都记为该异常
+        """
+        errors = [None] * len(operations)
+        op_ids = op_ids or [None] * len(operations)
+        # 分组键 -> (合并的数据, 操作下标)，消息按会话分组并带上 user_id
+        messages = {}
+        emotions = {}
+        memories = {}
+        profiles = {}
+        others = []
+        now = datetime.now()
+
+        for i, (name, args, kwargs) in enumerate(operations):
+            try:
+                bound = inspect.signature(getattr(self, name)).bind(*args, **kwargs)
+                bound.apply_defaults()
+                params = bound.arguments
+            except Exception as e:
+                print(f"Error binding batched operation {name}: {str(e)}")
+                errors[i] = e
+                continue
+
+            if name == "save_message":
+                _, records, indices = messages.setdefault(
+                    params["session_id"], (params["user_id"], [], [])
+                )
+                records.append(
+                    {
+                        "role": params["role"],
+                        "content": params["content"],
+                        "timestamp": params["timestamp"] or now.isoformat(),
+                    }
+                )
+                indices.append(i)
+            elif name == "save_emotion_score":
+                records, indices = emotions.setdefault(params["user_id"], ([], []))
+                indices.append(i)
+                records.append(
+                    {
+                        "session_id": params["session_id"],
+                        "emotion_score": params["emotion_score"],
+                        "emotion_category": params["emotion_category"],
+                        "timestamp": now.isoformat(),
+                    }
+                )
+            elif name == "save_long_term_memory":
+                records, indices = memories.setdefault(params["user_id"], ([], []))
+                indices.append(i)
+                records.append(
+                    {
+                        "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+                        "content": params["memory_content"],
+                    }
+                )
+            elif name == "save_user_profile":
+                profile_data, indices = profiles.setdefault(params["user_id"], ({}, []))
+                indices.append(i)
+                profile_data.update(params["profile_data"])
+            else:
+                others.append((i, name, args, kwargs))
+
+        for session_id, (user_id, session_messages, indices) in messages.items():
+            try:
+                self._append_messages(
+                    session_id, user_id, session_messages, fsync,
+                    [op_ids[i] for i in indices],
+                )
+            except Exception as e:
+                print(f"Error saving batched messages: {str(e)}")
+                for i in indices:
+                    errors[i] = e
+
+        for entity, log, grouped in (
+            ("emotions", self.emotion_log, emotions),
+            ("long_term_memory", self.memory_log, memories),
+        ):
+            for user_id, (records, indices) in grouped.items():
+                try:
+                    with self.locks.write(user_id):
+                        log.append_many(
+                            user_id, records, fsync, [op_ids[i] for i in indices]
+                        )
+                        self.changes.publish(
+                            entity, "insert", user_id, user_id, count=len(records)
+                        )
+                except Exception as e:
+                    print(f"Error saving batched user records: {str(e)}")
+                    for i in indices:
+                        errors[i] = e
+
+        for user_id, (profile_data, indices) in profiles.items():
+            try:
+                self._update_profile(user_id, profile_data, fsync)
+            except Exception as e:
+                print(f"Error saving batched user profile: {str(e)}")
+                for i in indices:
+                    errors[i] = e
+
+        for i, name, args, kwargs in others:
+            try:
+                getattr(self, name)(*args, **kwargs)
+            except Exception as e:
+                print(f"Error in batched operation {name}: {str(e)}")
+                errors[i] = e
+
+        return errors
+
+    def applied_operations(self, operations, op_ids):
+        """找出已经写入的写操作（用于重放意图日志时跳过）
+
+        消息、情绪评分和长期记忆的追加写带有写操作ID标记，据此判断；
+        其余操作（画像合并更新等）无法判断，视为未写入。
+
+        Args:
+            operations: [(方法名, args, kwargs), ...]
+            op_ids: 与 operations 一一对应的写操作ID
+
+        Returns:
+            set: 已经写入的写操作ID
+        """
+        logs = {
+            "save_message": ("session_id", self.message_log),
+            "save_emotion_score": ("user_id", self.emotion_log),
+            "save_long_term_memory": ("user_id", self.memory_log),
+        }
+        # (日志, 键) -> 该日志中待查找的写操作ID
+        wanted = {}
+        for (name, args, kwargs), op_id in zip(operations, op_ids):
+            if name not in logs:
+                continue
+            param, log = logs[name]
+            try:
+                key = inspect.signature(getattr(self, name)).bind(*args, **kwargs).arguments[param]
+            except Exception:
+                continue
+            wanted.setdefault((id(log), key), (log, set()))[1].add(op_id)
+
+        applied = set()
+        for (_, key), (log, markers) in wanted.items():
+            try:
+                with self.locks.read(key):
+                    applied |= log.find_markers(key, markers)
+            except Exception as e:
+                print(f"Error checking applied operations: {str(e)}")
+        return applied
+
     def session_exists(self, session_id):
         """检查会话是否存在
 
@@ -55,10 +416,7 @@ class Database:
             bool: 会话是否存在
         """
         try:
-            with self.lock:
-                with open(self.sessions_file, "r", encoding="utf-8") as f:
-                    sessions = json.load(f)
-                return session_id in sessions
+            return self.sessions.exists(session_id)
         except Exception as e:
             print(f"Error checking session existence: {str(e)}")
             return False
@@ -78,41 +436,38 @@ class Database:
                 timestamp = datetime.now().isoformat()
 
             message = {"role": role, "content": content, "timestamp": timestamp}
-
-            with self.lock:
-                # 确保会话存在
-                with open(self.sessions_file, "r", encoding="utf-8") as f:
-                    sessions = json.load(f)
-
-                if session_id not in sessions:
-                    sessions[session_id] = {
-                        "user_id": user_id,
-                        "created_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat(),
-                    }
-                else:
-                    sessions[session_id]["updated_at"] = datetime.now().isoformat()
-
-                with open(self.sessions_file, "w", encoding="utf-8") as f:
-                    json.dump(sessions, f, ensure_ascii=False, indent=2)
-
-                # 保存消息
-                message_file = self._get_message_file(session_id)
-
-                if os.path.exists(message_file):
-                    with open(message_file, "r", encoding="utf-8") as f:
-                        messages = json.load(f)
-                else:
-                    messages = []
-
-                messages.append(message)
-
-                with open(message_file, "w", encoding="utf-8") as f:
-                    json.dump(messages, f, ensure_ascii=False, indent=2)
+            self._append_messages(session_id, user_id, [message])
 
         except Exception as e:
             print(f"Error saving message: {str(e)}")
 
+    def _append_messages(self, session_id, user_id, messages, fsync=False, markers=None):
+        """追加一组消息到会话日志（一次加锁、一次写入）"""
+        counts = {}
+        for message in messages:
+            name = f"messages.{message.get('role')}"
+            counts[name] = counts.get(name, 0) + 1
+
+        with self.locks.write(session_id):
+            self._restore_archived_locked(session_id)
+            created = not self.sessions.exists(session_id)
+            # 确保会话存在（新会话立即落盘，updated_at 和计数器延迟批量落盘）
+            self.sessions.touch(
+                session_id, user_id, datetime.now().isoformat(), counts
+            )
+
+            # 保存消息（追加写，不重写整个文件）
+            self.message_log.append_many(session_id, messages, fsync, markers)
+            self.recent.append(
+                session_id, messages, self.message_log.count(session_id)
+            )
+
+            if created:
+                self.changes.publish("sessions", "insert", session_id, user_id)
+            self.changes.publish(
+                "chat_history", "insert", session_id, user_id, count=len(messages)
+            )
+
     def get_chat_history(self, session_id, limit=None):
         """获取聊天历史记录
 
@@ -124,19 +479,21 @@ class Database:
             list: 消息列表
         """
         try:
-            message_file = self._get_message_file(session_id)
-
-            if not os.path.exists(message_file):
-                return []
-
-            with self.lock:
-                with open(message_file, "r", encoding="utf-8") as f:
-                    messages = json.load(f)
-
-            if limit is not None and limit > 0:
-                messages = messages[-limit:]
-
-            return messages
+            with self.locks.read(session_id):
+                # 缓存与日志的条数一致且覆盖所需范围时不读取日志
+                total = self.message_log.count(session_id)
+                messages = self.recent.get(session_id, limit, total)
+                if messages is not None:
+                    return messages
+
+                archived = self._archived_session(session_id)
+                if archived is not None:
+                    return _tail(archived["messages"], limit)
+                # 通过偏移索引直接定位到最近 limit 条记录
+                messages = self.message_log.read(session_id, limit)
+                if messages:
+                    self.recent.fill(session_id, messages, total)
+                return messages
 
         except Exception as e:
             print(f"Error getting chat history: {str(e)}")
@@ -152,17 +509,7 @@ class Database:
             dict: 会话列表
         """
         try:
-            with self.lock:
-                with open(self.sessions_file, "r", encoding="utf-8") as f:
-                    sessions = json.load(f)
-
-            if user_id is not None:
-                return {
-                    sid: data
-                    for sid, data in sessions.items()
-                    if data.get("user_id") == user_id
-                }
-            return sessions
+            return self.sessions.get_sessions(user_id)
 
         except Exception as e:
             print(f"Error getting sessions: {str(e)}")
@@ -176,23 +523,12 @@ class Database:
             events: 事件列表
         """
         try:
-            with self.lock:
+            with self.locks.write(session_id):
                 # 确保会话存在
-                with open(self.sessions_file, "r", encoding="utf-8") as f:
-                    sessions = json.load(f)
-
-                if session_id not in sessions:
+                if not self.sessions.exists(session_id):
                     print(f"Warning: Session {session_id} does not exist")
                     return
-
-                # 保存事件
-                events_file = self._get_events_file(session_id)
-
-                if os.path.exists(events_file):
-                    with open(events_file, "r", encoding="utf-8") as f:
-                        existing_events = json.load(f)
-                else:
-                    existing_events = []
+                self._restore_archived_locked(session_id)
 
                 # 添加新事件
                 for event in events:
@@ -204,38 +540,35 @@ class Database:
                             f"evt_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
                         )
                     event["created_at"] = datetime.now().isoformat()
-                    existing_events.append(event)
 
-                with open(events_file, "w", encoding="utf-8") as f:
-                    json.dump(existing_events, f, ensure_ascii=False, indent=2)
+                # 追加到事件日志，不重写已有事件
+                self.events.append(session_id, events)
+                self.sessions.set_counts(session_id, self._event_counts_locked(session_id))
+                self._publish_session_change(
+                    "events", "insert", session_id, count=len(events)
+                )
 
         except Exception as e:
             print(f"Error saving events: {str(e)}")
 
-    def get_events(self, session_id, limit=None):
+    def get_events(self, session_id, limit=None, since=None, types=None):
         """获取事件列表
 
         Args:
             session_id: 会话ID
             limit: 最大事件数量，None表示获取全部
+            since: 只返回该时间（datetime 或 ISO 字符串）之后创建的事件
+            types: 只返回 primaryType / subType 属于其中的事件
 
         Returns:
             list: 事件列表
         """
         try:
-            events_file = self._get_events_file(session_id)
-
-            if not os.path.exists(events_file):
-                return []
-
-            with self.lock:
-                with open(events_file, "r", encoding="utf-8") as f:
-                    events = json.load(f)
-
-            if limit is not None and limit > 0:
-                events = events[-limit:]
-
-            return events
+            with self.locks.read(session_id):
+                archived = self._archived_session(session_id)
+                if archived is not None:
+                    return _filter_events(archived["events"], limit, since, types)
+                return self.events.query(session_id, limit, since, types)
 
         except Exception as e:
             print(f"Error getting events: {str(e)}")
@@ -253,31 +586,16 @@ class Database:
             bool: 更新是否成功
         """
         try:
-            events_file = self._get_events_file(session_id)
-
-            if not os.path.exists(events_file):
-                return False
-
-            with self.lock:
-                with open(events_file, "r", encoding="utf-8") as f:
-                    events = json.load(f)
-
-                # 查找并更新事件
-                updated = False
-                for event in events:
-                    if event.get("id") == event_id:
-                        # 更新字段
-                        for key, value in update_data.items():
-                            event[key] = value
-                        # 更新时间戳
-                        event["updateTime"] = datetime.now().isoformat()
-                        updated = True
-                        break
+            # 更新时间戳
+            update_data = dict(update_data, updateTime=datetime.now().isoformat())
 
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                # 只追加一条更新记录
+                updated = self.events.update(session_id, event_id, update_data)
                 if updated:
-                    with open(events_file, "w", encoding="utf-8") as f:
-                        json.dump(events, f, ensure_ascii=False, indent=2)
-
+                    self.sessions.set_counts(session_id, self._event_counts_locked(session_id))
+                    self._publish_session_change("events", "update", session_id, event_id)
                 return updated
 
         except Exception as e:
@@ -292,20 +610,12 @@ class Database:
             event_id: 事件ID
         """
         try:
-            events_file = self._get_events_file(session_id)
-
-            if not os.path.exists(events_file):
-                return
-
-            with self.lock:
-                with open(events_file, "r", encoding="utf-8") as f:
-                    events = json.load(f)
-
-                # 过滤掉要删除的事件
-                events = [event for event in events if event["id"] != event_id]
-
-                with open(events_file, "w", encoding="utf-8") as f:
-                    json.dump(events, f, ensure_ascii=False, indent=2)
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                # 只追加一条删除记录
+                if self.events.delete(session_id, event_id):
+                    self.sessions.set_counts(session_id, self._event_counts_locked(session_id))
+                    self._publish_session_change("events", "delete", session_id, event_id)
 
         except Exception as e:
             print(f"Error deleting event: {str(e)}")
@@ -320,23 +630,118 @@ class Database:
             int: 用户消息数量
         """
         try:
-            message_file = self._get_message_file(session_id)
+            return self.get_message_counts(session_id).get("user", 0)
+
+        except Exception as e:
+            print(f"Error getting user message count: {str(e)}")
+            return 0
 
-            if not os.path.exists(message_file):
-                return 0
+    def get_message_counts(self, session_id):
+        """获取会话中各角色的消息数量（读取维护好的计数器，O(1)）
 
-            with self.lock:
-                with open(message_file, "r", encoding="utf-8") as f:
-                    messages = json.load(f)
+        计数器与消息日志的总条数不一致时（旧数据、崩溃、多进程并发写入），
+        在写锁下重新统计一次并校正计数器。
 
-            # 只计算用户消息
-            user_message_count = sum(1 for msg in messages if msg.get("role") == "user")
-            return user_message_count
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 角色 -> 消息数量
+        """
+        try:
+            with self.locks.read(session_id):
+                by_role = self._stored_message_counts_locked(session_id)
+            if by_role is not None:
+                return by_role
+
+            with self.locks.write(session_id):
+                # 等待写锁期间可能已被其他线程校正
+                by_role = self._stored_message_counts_locked(session_id)
+                if by_role is not None:
+                    return by_role
+                by_role = self._count_messages_locked(session_id)
+                self.sessions.set_counts(
+                    session_id,
+                    {f"messages.{role}": value for role, value in by_role.items()},
+                )
+                return by_role
 
         except Exception as e:
-            print(f"Error getting user message count: {str(e)}")
+            print(f"Error getting message counts: {str(e)}")
+            return {}
+
+    def _stored_message_counts_locked(self, session_id):
+        """读取消息计数器，与消息日志不一致时返回 None，调用方需持有会话锁"""
+        counts = self.sessions.get_counts(session_id)
+        by_role = {
+            name[len("messages."):]: value
+            for name, value in counts.items()
+            if name.startswith("messages.")
+        }
+        if sum(by_role.values()) == self.message_log.count(session_id):
+            return by_role
+        if by_role and self.sessions.field(session_id, "archived_at"):
+            # 归档时已写入准确的计数器
+            return by_role
+        return None
+
+    def _count_messages_locked(self, session_id):
+        """扫描消息日志统计各角色的消息数量（不写回计数器），调用方需持有会话锁"""
+        by_role = {}
+        for message in self.message_log.read(session_id):
+            role = message.get("role")
+            by_role[role] = by_role.get(role, 0) + 1
+        return by_role
+
+    def get_event_count(self, session_id):
+        """获取会话的事件数量（读取维护好的计数器，O(1)）
+
+        计数器记录了统计时事件日志的字节数，与日志当前大小不一致时（旧数据、
+        崩溃前未刷新的计数器、多进程并发写入），在写锁下重新统计一次并校正计数器。
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            int: 事件数量
+        """
+        try:
+            with self.locks.read(session_id):
+                count = self._stored_event_count_locked(session_id)
+            if count is not None:
+                return count
+
+            with self.locks.write(session_id):
+                # 等待写锁期间可能已被其他线程校正
+                count = self._stored_event_count_locked(session_id)
+                if count is not None:
+                    return count
+                counts = self._event_counts_locked(session_id)
+                self.sessions.set_counts(session_id, counts)
+                return counts["events"]
+
+        except Exception as e:
+            print(f"Error getting event count: {str(e)}")
             return 0
 
+    def _stored_event_count_locked(self, session_id):
+        """读取事件计数器，与事件日志不一致时返回 None，调用方需持有会话锁"""
+        counts = self.sessions.get_counts(session_id)
+        if "events" in counts:
+            if counts.get("events.log_size") == self.events.log_size(session_id):
+                return counts["events"]
+            if self.sessions.field(session_id, "archived_at"):
+                # 归档时已写入准确的计数器
+                return counts["events"]
+        return None
+
+    def _event_counts_locked(self, session_id):
+        """重新统计的事件计数器及对应的日志大小，调用方需持有会话锁"""
+        return {
+            "events": self.events.count(session_id),
+            "events.log_size": self.events.log_size(session_id),
+        }
+
     def save_mood_data(self, user_id, session_id, mood_data):
         """保存情绪分析数据
         Args:
@@ -344,22 +749,16 @@ class Database:
             mood_data: 情绪分析数据（dict 或 list）
         """
         try:
-            with self.lock:
+            with self.locks.write(session_id):
                 # 确保会话存在
-                with open(self.sessions_file, "r", encoding="utf-8") as f:
-                    sessions = json.load(f)
-
-                if session_id not in sessions:
+                if not self.sessions.exists(session_id):
                     print(f"Warning: Session {session_id} does not exist")
                     return
+                self._restore_archived_locked(session_id)
 
                 mood_file = self._get_mood_file(session_id)
 
-                if os.path.exists(mood_file):
-                    with open(mood_file, "r", encoding="utf-8") as f:
-                        existing_moods = json.load(f)
-                else:
-                    existing_moods = []
+                existing_moods = self.files.read_json(mood_file, [])
 
                 # mood_data 可以是单个 dict 或 list
                 if isinstance(mood_data, dict):
@@ -370,30 +769,40 @@ class Database:
                         mood["created_at"] = datetime.now().isoformat()
                         existing_moods.append(mood)
 
-                with open(mood_file, "w", encoding="utf-8") as f:
-                    json.dump(existing_moods, f, ensure_ascii=False, indent=2)
+                self.files.write_json(mood_file, existing_moods)
+                self._publish_session_change(
+                    "moods",
+                    "insert",
+                    session_id,
+                    count=len(mood_data) if isinstance(mood_data, list) else 1,
+                )
 
         except Exception as e:
             print(f"Error saving mood analysis: {str(e)}")
 
-    def get_mood_analysis(self, session_id, limit=None):
+    def get_mood_analysis(self, session_id, limit=None, start=None, end=None):
         """获取情绪分析数据
         Args:
             session_id: 会话ID
             limit: 最大数量，None表示获取全部
+            start: 按 created_at 过滤的起始时间（datetime / ISO 字符串 / epoch 秒）
+            end: 结束时间（不含）
         Returns:
             list: 情绪分析数据列表
         """
         try:
             mood_file = self._get_mood_file(session_id)
 
-            if not os.path.exists(mood_file):
-                return []
-
-            with self.lock:
-                with open(mood_file, "r", encoding="utf-8") as f:
-                    moods = json.load(f)
+            with self.locks.read(session_id):
+                archived = self._archived_session(session_id)
+                if archived is not None:
+                    moods = archived["moods"]
+                elif not os.path.exists(mood_file):
+                    return []
+                else:
+                    moods = self.files.read_json(mood_file, [])
 
+            moods = time_window(moods, "created_at", start, end)
             if limit is not None and limit > 0:
                 moods = moods[-limit:]
 
@@ -415,12 +824,12 @@ class Database:
         try:
             mood_file = self._get_mood_file(session_id)
 
-            if not os.path.exists(mood_file):
-                return False
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                if not os.path.exists(mood_file):
+                    return False
 
-            with self.lock:
-                with open(mood_file, "r", encoding="utf-8") as f:
-                    moods = json.load(f)
+                moods = self.files.read_json(mood_file, [])
 
                 updated = False
                 for mood in moods:
@@ -432,8 +841,8 @@ class Database:
                         break
 
                 if updated:
-                    with open(mood_file, "w", encoding="utf-8") as f:
-                        json.dump(moods, f, ensure_ascii=False, indent=2)
+                    self.files.write_json(mood_file, moods)
+                    self._publish_session_change("moods", "update", session_id, mood_id)
 
                 return updated
 
@@ -450,46 +859,21 @@ class Database:
         try:
             mood_file = self._get_mood_file(session_id)
 
-            if not os.path.exists(mood_file):
-                return
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                if not os.path.exists(mood_file):
+                    return
 
-            with self.lock:
-                with open(mood_file, "r", encoding="utf-8") as f:
-                    moods = json.load(f)
+                moods = self.files.read_json(mood_file, [])
 
                 moods = [mood for mood in moods if mood.get("id") != mood_id]
 
-                with open(mood_file, "w", encoding="utf-8") as f:
-                    json.dump(moods, f, ensure_ascii=False, indent=2)
+                self.files.write_json(mood_file, moods)
+                self._publish_session_change("moods", "delete", session_id, mood_id)
 
         except Exception as e:
             print(f"Error deleting mood analysis: {str(e)}")
 
-    def get_user_profile(self, user_id):
-        """获取用户画像数据
-
-        Args:
-            user_id: 用户ID
-
-        Returns:
-            dict: 用户画像数据
-        """
-        try:
-            profiles_file = os.path.join(self.data_dir, "user_profiles.json")
-
-            if not os.path.exists(profiles_file):
-                return {}
-
-            with self.lock:
-                with open(profiles_file, "r", encoding="utf-8") as f:
-                    profiles = json.load(f)
-
-            return profiles.get(user_id, {})
-
-        except Exception as e:
-            print(f"Error getting user profile: {str(e)}")
-            return {}
-
     def save_long_term_memory(self, user_id, memory_content):
         """保存长期记忆
 
@@ -498,29 +882,15 @@ class Database:
             memory_content: 记忆内容
         """
         try:
-            memory_file = os.path.join(self.data_dir, "long_term_memory.json")
+            memory_entry = {
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "content": memory_content,
+            }
 
-            with self.lock:
-                # 读取现有长期记忆
-                if os.path.exists(memory_file):
-                    with open(memory_file, "r", encoding="utf-8") as f:
-                        memories = json.load(f)
-                else:
-                    memories = {}
-
-                # 添加新记忆
-                if user_id not in memories:
-                    memories[user_id] = []
-
-                memory_entry = {
-                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "content": memory_content,
-                }
-                memories[user_id].append(memory_entry)
-
-                # 保存长期记忆
-                with open(memory_file, "w", encoding="utf-8") as f:
-                    json.dump(memories, f, ensure_ascii=False, indent=2)
+            with self.locks.write(user_id):
+                # 追加到该用户自己的记忆日志
+                self.memory_log.append(user_id, memory_entry)
+                self.changes.publish("long_term_memory", "insert", user_id, user_id)
 
         except Exception as e:
             print(f"Error saving long term memory: {str(e)}")
@@ -536,25 +906,29 @@ class Database:
             list: 长期记忆列表
         """
         try:
-            memory_file = os.path.join(self.data_dir, "long_term_memory.json")
+            with self.locks.read(user_id):
+                return self.memory_log.read(user_id, limit)
 
-            if not os.path.exists(memory_file):
-                return []
-
-            with self.lock:
-                with open(memory_file, "r", encoding="utf-8") as f:
-                    memories = json.load(f)
+        except Exception as e:
+            print(f"Error getting long term memory: {str(e)}")
+            return []
 
-            user_memories = memories.get(user_id, [])
+    def get_long_term_memory_count(self, user_id):
+        """获取用户长期记忆的数量（由日志偏移索引的大小得到，O(1)）
 
-            if limit is not None and limit > 0:
-                user_memories = user_memories[-limit:]
+        Args:
+            user_id: 用户ID
 
-            return user_memories
+        Returns:
+            int: 长期记忆数量
+        """
+        try:
+            with self.locks.read(user_id):
+                return self.memory_log.count(user_id)
 
         except Exception as e:
-            print(f"Error getting long term memory: {str(e)}")
-            return []
+            print(f"Error getting long term memory count: {str(e)}")
+            return 0
 
     def save_emotion_score(
         self, user_id, session_id, emotion_score, emotion_category=None
@@ -568,61 +942,57 @@ class Database:
             emotion_category: 情绪类别（可选）
         """
         try:
-            emotions_file = os.path.join(self.data_dir, "emotion_scores.json")
-
-            with self.lock:
-                # 读取现有情绪数据
-                if os.path.exists(emotions_file):
-                    with open(emotions_file, "r", encoding="utf-8") as f:
-                        emotions = json.load(f)
-                else:
-                    emotions = {}
-
-                # 添加情绪数据
-                if user_id not in emotions:
-                    emotions[user_id] = []
-
+            with self.locks.write(user_id):
+                # 在锁内取时间，保证日志按时间正序（时间索引依赖这一点）
                 emotion_entry = {
                     "session_id": session_id,
                     "emotion_score": emotion_score,
                     "emotion_category": emotion_category,
                     "timestamp": datetime.now().isoformat(),
                 }
-                emotions[user_id].append(emotion_entry)
-
-                # 保存情绪数据
-                with open(emotions_file, "w", encoding="utf-8") as f:
-                    json.dump(emotions, f, ensure_ascii=False, indent=2)
+                # 追加到该用户自己的情绪日志
+                self.emotion_log.append(user_id, emotion_entry)
+                self.changes.publish("emotions", "insert", user_id, user_id)
 
         except Exception as e:
             print(f"Error saving emotion score: {str(e)}")
 
-    def get_emotion_history(self, user_id, limit=None):
-        """获取用户情绪历史
+    def get_emotion_count(self, user_id):
+        """获取用户情绪评分记录的数量（由日志偏移索引的大小得到，O(1)）
 
         Args:
             user_id: 用户ID
-            limit: 获取的数量限制
 
         Returns:
-            list: 情绪历史列表
+            int: 情绪评分记录数量
         """
         try:
-            emotions_file = os.path.join(self.data_dir, "emotion_scores.json")
+            with self.locks.read(user_id):
+                return self.emotion_log.count(user_id)
 
-            if not os.path.exists(emotions_file):
-                return []
+        except Exception as e:
+            print(f"Error getting emotion count: {str(e)}")
+            return 0
 
-            with self.lock:
-                with open(emotions_file, "r", encoding="utf-8") as f:
-                    emotions = json.load(f)
+    def get_emotion_history(self, user_id, limit=None, start=None, end=None):
+        """获取用户情绪历史
 
-            user_emotions = emotions.get(user_id, [])
+        指定 start / end 时通过时间索引二分查找范围，只读取范围内的记录。
 
-            if limit is not None and limit > 0:
-                user_emotions = user_emotions[-limit:]
+        Args:
+            user_id: 用户ID
+            limit: 获取的数量限制（范围内最近的 limit 条）
+            start: 起始时间（datetime / ISO 字符串 / epoch 秒），包含
+            end: 结束时间，不包含
 
-            return user_emotions
+        Returns:
+            list: 情绪历史列表（按时间正序）
+        """
+        try:
+            with self.locks.read(user_id):
+                if start is None and end is None:
+                    return self.emotion_log.read(user_id, limit)
+                return self.emotion_log.read_range(user_id, start, end, limit)
 
         except Exception as e:
             print(f"Error getting emotion history: {str(e)}")
@@ -641,9 +1011,10 @@ class Database:
 
             plan_file = os.path.join(plans_dir, f"{session_id}.json")
 
-            with self.lock:
-                with open(plan_file, "w", encoding="utf-8") as f:
-                    json.dump(plan_data, f, ensure_ascii=False, indent=2)
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                self.files.write_json(plan_file, plan_data)
+                self._publish_session_change("plan", "update", session_id)
 
         except Exception as e:
             print(f"Error saving session plan: {str(e)}")
@@ -661,12 +1032,11 @@ class Database:
             plans_dir = os.path.join(self.data_dir, "plans")
             plan_file = os.path.join(plans_dir, f"{session_id}.json")
 
-            if not os.path.exists(plan_file):
-                return {}
-
-            with self.lock:
-                with open(plan_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
+            with self.locks.read(session_id):
+                archived = self._archived_session(session_id)
+                if archived is not None:
+                    return archived["plan"] or {}
+                return self.files.read_json(plan_file, {})
 
         except Exception as e:
             print(f"Error getting session plan: {str(e)}")
@@ -680,28 +1050,25 @@ class Database:
             profile_data: 用户画像数据字典
         """
         try:
-            profiles_file = os.path.join(self.data_dir, "user_profiles.json")
+            self._update_profile(user_id, profile_data)
 
-            with self.lock:
-                # 读取现有用户画像
-                if os.path.exists(profiles_file):
-                    with open(profiles_file, "r", encoding="utf-8") as f:
-                        profiles = json.load(f)
-                else:
-                    profiles = {}
+        except Exception as e:
+            print(f"Error saving user profile: {str(e)}")
 
-                # 更新用户画像
-                if user_id not in profiles:
-                    profiles[user_id] = {}
-                profiles[user_id].update(profile_data)
-                profiles[user_id]["updated_at"] = datetime.now().isoformat()
+    def _update_profile(self, user_id, profile_data, fsync=False):
+        """合并更新用户画像，只重写该用户自己的画像文件"""
+        profile_file = self._get_profile_file(user_id)
 
-                # 保存用户画像
-                with open(profiles_file, "w", encoding="utf-8") as f:
-                    json.dump(profiles, f, ensure_ascii=False, indent=2)
+        with self.locks.write(user_id):
+            # 读取该用户现有画像
+            profile = self.files.read_json(profile_file, {})
 
-        except Exception as e:
-            print(f"Error saving user profile: {str(e)}")
+            # 更新用户画像
+            profile.update(profile_data)
+            profile["updated_at"] = datetime.now().isoformat()
+
+            self.files.write_json(profile_file, profile, fsync=fsync)
+            self.changes.publish("profile", "update", user_id, user_id)
 
     def get_user_profile(self, user_id):
         """获取用户画像数据
@@ -713,16 +1080,13 @@ class Database:
             dict: 用户画像数据
         """
         try:
-            profiles_file = os.path.join(self.data_dir, "user_profiles.json")
+            profile_file = self._get_profile_file(user_id)
 
-            if not os.path.exists(profiles_file):
+            if not os.path.exists(profile_file):
                 return {}
 
-            with self.lock:
-                with open(profiles_file, "r", encoding="utf-8") as f:
-                    profiles = json.load(f)
-
-            return profiles.get(user_id, {})
+            with self.locks.read(user_id):
+                return self.files.read_json(profile_file, {})
 
         except Exception as e:
             print(f"Error getting user profile: {str(e)}")
@@ -744,9 +1108,10 @@ class Database:
             # 添加时间戳
             inquiry_data["saved_at"] = datetime.now().isoformat()
 
-            with self.lock:
-                with open(inquiry_file, "w", encoding="utf-8") as f:
-                    json.dump(inquiry_data, f, ensure_ascii=False, indent=2)
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                self.files.write_json(inquiry_file, inquiry_data)
+                self._publish_session_change("inquiry", "update", session_id)
 
         except Exception as e:
             print(f"Error saving inquiry result: {str(e)}")
@@ -764,12 +1129,11 @@ class Database:
             inquiry_dir = os.path.join(self.data_dir, "inquiry_results")
             inquiry_file = os.path.join(inquiry_dir, f"{session_id}.json")
 
-            if not os.path.exists(inquiry_file):
-                return {}
-
-            with self.lock:
-                with open(inquiry_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
+            with self.locks.read(session_id):
+                archived = self._archived_session(session_id)
+                if archived is not None:
+                    return archived["inquiry"] or {}
+                return self.files.read_json(inquiry_file, {})
 
         except Exception as e:
             print(f"Error getting inquiry result: {str(e)}")
@@ -791,9 +1155,10 @@ class Database:
             # 添加时间戳
             pattern_data["saved_at"] = datetime.now().isoformat()
 
-            with self.lock:
-                with open(pattern_file, "w", encoding="utf-8") as f:
-                    json.dump(pattern_data, f, ensure_ascii=False, indent=2)
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                self.files.write_json(pattern_file, pattern_data)
+                self._publish_session_change("pattern", "update", session_id)
 
         except Exception as e:
             print(f"Error saving pattern analysis: {str(e)}")
@@ -811,12 +1176,11 @@ class Database:
             patterns_dir = os.path.join(self.data_dir, "patterns")
             pattern_file = os.path.join(patterns_dir, f"{session_id}.json")
 
-            if not os.path.exists(pattern_file):
-                return {}
-
-            with self.lock:
-                with open(pattern_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
+            with self.locks.read(session_id):
+                archived = self._archived_session(session_id)
+                if archived is not None:
+                    return archived["pattern"] or {}
+                return self.files.read_json(pattern_file, {})
 
         except Exception as e:
             print(f"Error getting pattern analysis: {str(e)}")
@@ -838,20 +1202,17 @@ class Database:
             # 添加时间戳
             inquiry_data["timestamp"] = datetime.now().isoformat()
 
-            with self.lock:
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
                 # 读取现有历史记录
-                if os.path.exists(inquiry_file):
-                    with open(inquiry_file, "r", encoding="utf-8") as f:
-                        inquiry_history = json.load(f)
-                else:
-                    inquiry_history = []
+                inquiry_history = self.files.read_json(inquiry_file, [])
 
                 # 添加新的询问记录
                 inquiry_history.append(inquiry_data)
 
                 # 保存更新后的历史记录
-                with open(inquiry_file, "w", encoding="utf-8") as f:
-                    json.dump(inquiry_history, f, ensure_ascii=False, indent=2)
+                self.files.write_json(inquiry_file, inquiry_history)
+                self._publish_session_change("inquiry_history", "insert", session_id)
 
         except Exception as e:
             print(f"Error saving inquiry history: {str(e)}")
@@ -870,12 +1231,12 @@ class Database:
             inquiry_dir = os.path.join(self.data_dir, "inquiry_history")
             inquiry_file = os.path.join(inquiry_dir, f"{session_id}.json")
 
-            if not os.path.exists(inquiry_file):
-                return []
-
-            with self.lock:
-                with open(inquiry_file, "r", encoding="utf-8") as f:
-                    inquiry_history = json.load(f)
+            with self.locks.read(session_id):
+                archived = self._archived_session(session_id)
+                if archived is not None:
+                    inquiry_history = archived["inquiry_history"]
+                else:
+                    inquiry_history = self.files.read_json(inquiry_file, [])
 
             if limit is not None and limit > 0:
                 inquiry_history = inquiry_history[-limit:]
@@ -892,21 +1253,19 @@ class Database:
         Args:
             user_id: 用户ID
             report_data: 分析报告数据
+
+        Returns:
+            str: 报告ID
         """
         try:
-            reports_dir = os.path.join(self.data_dir, "analysis_reports")
-            os.makedirs(reports_dir, exist_ok=True)
-
-            # 使用时间戳作为文件名的一部分
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            report_file = os.path.join(reports_dir, f"{user_id}_{timestamp}.json")
-
             # 添加保存时间戳
             report_data["saved_at"] = datetime.now().isoformat()
 
-            with self.lock:
-                with open(report_file, "w", encoding="utf-8") as f:
-                    json.dump(report_data, f, ensure_ascii=False, indent=2)
+            with self.locks.write(user_id):
+                # 正文压缩保存，报告头追加到该用户的报告索引
+                report_id = self.reports.save(user_id, report_data)["id"]
+                self.changes.publish("reports", "insert", user_id, user_id, report_id)
+                return report_id
 
         except Exception as e:
             print(f"Error saving analysis report: {str(e)}")
@@ -921,78 +1280,647 @@ class Database:
             dict: 最新的分析报告数据
         """
         try:
-            reports_dir = os.path.join(self.data_dir, "analysis_reports")
-            
-            if not os.path.exists(reports_dir):
-                return {}
+            with self.locks.read(user_id):
+                # 报告索引的最后一行就是最新报告
+                header = self.reports.latest(user_id)
+                if header is None:
+                    return {}
+                return self.reports.load(user_id, header["id"]) or {}
 
-            # 获取用户的所有报告文件
-            user_reports = []
-            for filename in os.listdir(reports_dir):
-                if filename.startswith(f"{user_id}_") and filename.endswith(".json"):
-                    user_reports.append(filename)
+        except Exception as e:
+            print(f"Error getting latest analysis report: {str(e)}")
+            return {}
 
-            if not user_reports:
-                return {}
+    def get_analysis_reports_history(self, user_id, limit=None):
+        """获取用户的分析报告历史（只返回报告头，正文通过 get_analysis_report 按需加载）
 
-            # 按时间戳排序，获取最新的
-            user_reports.sort(reverse=True)
-            latest_report_file = os.path.join(reports_dir, user_reports[0])
+        Args:
+            user_id: 用户ID
+            limit: 获取的报告数量限制
 
-            with self.lock:
-                with open(latest_report_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
+        Returns:
+            list: 报告头列表（最新的在前），包含 id、generated_at、size、period、metrics 等
+        """
+        try:
+            with self.locks.read(user_id):
+                return self.reports.headers(user_id, limit)
 
         except Exception as e:
-            print(f"Error getting latest analysis report: {str(e)}")
+            print(f"Error getting analysis reports history: {str(e)}")
+            return []
+
+    def get_analysis_report(self, user_id, report_id):
+        """按报告ID获取完整的分析报告
+
+        Args:
+            user_id: 用户ID
+            report_id: 报告ID
+
+        Returns:
+            dict: 分析报告数据，不存在时为空字典
+        """
+        try:
+            with self.locks.read(user_id):
+                return self.reports.load(user_id, report_id) or {}
+
+        except Exception as e:
+            print(f"Error getting analysis report: {str(e)}")
             return {}
 
-    def get_analysis_reports_history(self, user_id, limit=None):
-        """获取用户的分析报告历史
+    def bulk_load(self, user_id, session_ids=None, kinds=None, since=None, limits=None):
+        """一次性批量读取用户在多个会话中的数据
+
+        每个会话只加一次读锁，在线程池中并行读取；消息数量来自计数器，
+        事件按 since 在索引上过滤，只解析需要的记录。
 
         Args:
             user_id: 用户ID
-            limit: 获取的报告数量限制
+            session_ids: 会话ID列表，None表示该用户的全部会话
+            kinds: 需要的数据种类（见 dao.bundle.KINDS），None表示全部
+            since: 只返回该时间之后创建的事件、情绪分析和情绪评分（datetime 或 ISO 字符串）
+            limits: 各数据种类的数量限制，如 {"chat_history": 100, "events": 50}
 
         Returns:
-            list: 分析报告历史列表
+            UserDataBundle: 批量数据
         """
+        kinds = normalize_kinds(kinds)
+        limits = limits or {}
+        if isinstance(since, datetime):
+            since = since.isoformat()
+
+        bundle = UserDataBundle(user_id=user_id)
         try:
-            reports_dir = os.path.join(self.data_dir, "analysis_reports")
-            
-            if not os.path.exists(reports_dir):
-                return []
+            if session_ids is None:
+                session_ids = self.sessions.session_ids(user_id)
+
+            session_kinds = kinds.intersection(SESSION_KINDS)
+            if session_kinds and session_ids:
+                results = self._get_io_pool().map(
+                    lambda session_id: self._load_session_bundle(
+                        session_id, session_kinds, since, limits
+                    ),
+                    session_ids,
+                )
+                bundle.sessions = {result.session_id: result for result in results}
+
+            with self.locks.read(user_id):
+                if "profile" in kinds:
+                    bundle.profile = self.files.read_json(
+                        self._get_profile_file(user_id), {}
+                    )
+                if "long_term_memory" in kinds:
+                    bundle.long_term_memory = self.memory_log.read(
+                        user_id, limits.get("long_term_memory")
+                    )
+                if "emotions" in kinds:
+                    limit = limits.get("emotions")
+                    if since is None:
+                        bundle.emotions = self.emotion_log.read(user_id, limit)
+                    else:
+                        bundle.emotions = self.emotion_log.read_range(
+                            user_id, since, None, limit
+                        )
+
+        except Exception as e:
+            print(f"Error bulk loading data: {str(e)}")
 
-            # 获取用户的所有报告文件
-            user_reports = []
-            for filename in os.listdir(reports_dir):
-                if filename.startswith(f"{user_id}_") and filename.endswith(".json"):
-                    user_reports.append(filename)
+        return bundle
 
-            if not user_reports:
-                return []
+    def import_sessions(self, items):
+        """导入会话数据（数据迁移使用）
 
-            # 按时间戳排序（最新的在前）
-            user_reports.sort(reverse=True)
+        data 中出现的每种数据都整体替换目标中已有的数据（空列表 / None 表示删除），
+        原始的时间戳和ID保持不变，因此同一批数据可以重复导入。
 
-            if limit is not None and limit > 0:
-                user_reports = user_reports[:limit]
+        Args:
+            items: [(session_id, meta, data), ...]
+                meta: {"user_id", "created_at", "updated_at"}
+                data: {"chat_history", "events", "moods", "inquiry_history",
+                       "pattern", "inquiry", "plan"} 中的任意几项
+        """
+        for session_id, meta, data in items:
+            with self.locks.write(session_id):
+                self._restore_archived_locked(session_id)
+                created = not self.sessions.exists(session_id)
+                self.sessions.touch(session_id, meta.get("user_id"), meta.get("created_at"))
+
+                fields = {
+                    "user_id": meta.get("user_id"),
+                    "created_at": meta.get("created_at"),
+                    "updated_at": meta.get("updated_at") or meta.get("created_at"),
+                }
+                counts = self.sessions.get_counts(session_id)
+                if "chat_history" in data:
+                    self.recent.discard(session_id)
+                    messages = data["chat_history"]
+                    if messages:
+                        self.message_log.write_all(session_id, messages)
+                    else:
+                        self.message_log.remove(session_id)
+                    counts = {k: v for k, v in counts.items() if not k.startswith("messages.")}
+                    for message in messages:
+                        name = f"messages.{message.get('role')}"
+                        counts[name] = counts.get(name, 0) + 1
+                if "events" in data:
+                    if data["events"]:
+                        self.events.replace(session_id, data["events"])
+                    else:
+                        self.events.remove(session_id)
+                    counts.update(self._event_counts_locked(session_id))
+                fields["counts"] = counts
+                self.sessions.set_fields(session_id, fields)
+
+                if "moods" in data:
+                    self._replace_session_file(
+                        self._get_mood_file(session_id), data["moods"] or None
+                    )
+                if "inquiry_history" in data:
+                    self._replace_session_file(
+                        self._get_session_doc_file("inquiry_history", session_id),
+                        data["inquiry_history"] or None,
+                    )
+                for kind, dirname in _SESSION_DOCUMENTS:
+                    if kind in data:
+                        self._replace_session_file(
+                            self._get_session_doc_file(dirname, session_id), data[kind]
+                        )
+
+                self.changes.publish(
+                    "sessions", "insert" if created else "update", session_id, meta.get("user_id")
+                )
+
+    def import_users(self, items):
+        """导入用户数据（数据迁移使用），语义同 import_sessions
+
+        Args:
+            items: [(user_id, data), ...]
+                data: {"profile", "long_term_memory", "emotions", "reports"} 中的任意几项，
+                reports 为 [(报告ID, 报告正文), ...]
+        """
+        for user_id, data in items:
+            with self.locks.write(user_id):
+                for kind, log in (
+                    ("long_term_memory", self.memory_log),
+                    ("emotions", self.emotion_log),
+                ):
+                    if kind in data:
+                        if data[kind]:
+                            log.write_all(user_id, data[kind])
+                        else:
+                            log.remove(user_id)
+                if "profile" in data:
+                    self._replace_session_file(
+                        self._get_profile_file(user_id), data["profile"] or None
+                    )
+                if "reports" in data:
+                    self.reports.replace(user_id, data["reports"])
+
+                for kind in data:
+                    self.changes.publish(kind, "update", user_id, user_id)
+
+    def delete_user(self, user_id):
+        """删除用户的全部数据
+
+        先从会话索引中一次性移除用户的全部会话（之后读接口不再返回这些会话），
+        再逐个会话在该会话的写锁内删除文件，最后在用户写锁内删除用户级数据；
+        每次只持有一个会话 / 用户的锁，不阻塞其他会话的读写。
+        用到的只有用户 -> 会话索引和按会话 / 用户分片的文件，耗时与该用户的数据量成正比。
 
-            # 读取报告数据
-            reports = []
-            for filename in user_reports:
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            dict: {"sessions": 删除的会话数, "bytes_reclaimed": 释放的字节数, "elapsed_s": 耗时（秒）}
+        """
+        # 用户ID会拼接为目录名（报告正文、归档段文件），不能包含路径
+        if not user_id or user_id in (".", "..") or os.path.basename(user_id) != user_id:
+            raise ValueError(f"Invalid user_id: {user_id!r}")
+
+        started = time.perf_counter()
+        result = {"sessions": 0, "bytes_reclaimed": 0}
+
+        session_ids = self.sessions.session_ids(user_id)
+        self.sessions.remove_many(session_ids)
+        for session_id in session_ids:
+            with self.locks.write(session_id):
+                self.recent.discard(session_id)
+                result["bytes_reclaimed"] += self.message_log.remove(session_id)
+                result["bytes_reclaimed"] += self.events.remove(session_id)
+                result["bytes_reclaimed"] += _remove_files(self._session_files(session_id))
+                self.changes.publish("sessions", "delete", session_id, user_id)
+            result["sessions"] += 1
+
+        with self.locks.write(user_id):
+            # 已归档会话的数据在用户的归档段文件中
+            result["bytes_reclaimed"] += self.archive.remove_user(user_id)
+            profile_file = self._get_profile_file(user_id)
+            for entity, removed in (
+                ("emotions", self.emotion_log.remove(user_id)),
+                ("long_term_memory", self.memory_log.remove(user_id)),
+                ("profile", _remove_files([profile_file, profile_file + BACKUP_SUFFIX])),
+                ("reports", self.reports.remove_user(user_id)),
+            ):
+                result["bytes_reclaimed"] += removed
+                self.changes.publish(entity, "delete", user_id, user_id)
+
+        result["elapsed_s"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def expire_records(self, entity, key, before=None, keep=None, match=None):
+        """按保留规则删除一个会话 / 用户的旧记录
+
+        Args:
+            entity: inquiry_history（key 为会话ID）、plan（会话ID，整体删除）、
+                    reports（用户ID）或 long_term_memory（用户ID）
+            key: 会话ID / 用户ID
+            before: 删除该时间（epoch 秒）之前的记录
+            keep: 只保留最近的 keep 条
+            match: 只处理满足条件的记录 callable(record) -> bool，None表示全部
+
+        Returns:
+            dict: {"expired": 删除的记录数, "bytes_freed": 释放的字节数,
+                   "oldest": 保留的（满足 match 的）记录中最早的时间，没有时为 None}
+        """
+        result = {"expired": 0, "bytes_freed": 0, "oldest": None}
+
+        if entity in ("inquiry_history", "plan"):
+            with self.locks.write(key):
+                # 已归档的会话不处理，避免为了清理把会话恢复为常规文件
+                if self.sessions.field(key, "archived_at"):
+                    return result
+                if entity == "plan":
+                    path = self._get_session_doc_file("plans", key)
+                    result["bytes_freed"] = _remove_files([path, path + BACKUP_SUFFIX])
+                    if result["bytes_freed"]:
+                        result["expired"] = 1
+                        self._publish_session_change("plan", "delete", key)
+                    return result
+
+                path = self._get_session_doc_file("inquiry_history", key)
+                history = self.files.read_json(path, [])
+                expired, result["oldest"] = expired_positions(
+                    history, record_time(entity), before, keep, match
+                )
+                if expired:
+                    size = os.path.getsize(path)
+                    remaining = [r for i, r in enumerate(history) if i not in expired]
+                    if remaining:
+                        self.files.write_json(path, remaining)
+                        result["bytes_freed"] = size - os.path.getsize(path)
+                    else:
+                        result["bytes_freed"] = _remove_files([path, path + BACKUP_SUFFIX])
+                    result["expired"] = len(expired)
+                    self._publish_session_change(
+                        entity, "delete", key, count=len(expired)
+                    )
+                return result
+
+        if entity not in ("reports", "long_term_memory"):
+            raise ValueError(f"Unsupported retention entity: {entity}")
+
+        with self.locks.write(key):
+            if entity == "reports":
+                headers = self.reports.headers(key)
+                headers.reverse()
+                expired, result["oldest"] = expired_positions(
+                    headers, record_time(entity), before, keep, match
+                )
+                if expired:
+                    result["bytes_freed"] = self.reports.remove_reports(
+                        key, [headers[i]["id"] for i in expired]
+                    )
+            else:
+                memories = self.memory_log.read(key)
+                expired, result["oldest"] = expired_positions(
+                    memories, record_time(entity), before, keep, match
+                )
+                if expired:
+                    remaining = [m for i, m in enumerate(memories) if i not in expired]
+                    size = os.path.getsize(self.memory_log.log_path(key))
+                    if remaining:
+                        # 整体重写（临时文件 + 原子替换），读者不会看到中间状态
+                        self.memory_log.write_all(key, remaining)
+                        result["bytes_freed"] = size - os.path.getsize(
+                            self.memory_log.log_path(key)
+                        )
+                    else:
+                        result["bytes_freed"] = self.memory_log.remove(key)
+
+            if expired:
+                result["expired"] = len(expired)
+                self.changes.publish(entity, "delete", key, key, count=len(expired))
+        return result
+
+    def _replace_session_file(self, path, data):
+        """整体写入或删除（data 为 None 时）单个 JSON 文件"""
+        if data is None:
+            for stale in (path, path + BACKUP_SUFFIX):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.files.write_json(path, data)
+
+    def _get_io_pool(self):
+        """批量读取使用的线程池（首次使用时创建）"""
+        if self._io_pool is None:
+            with self._io_pool_lock:
+                if self._io_pool is None:
+                    self._io_pool = ThreadPoolExecutor(
+                        max_workers=8, thread_name_prefix="bulk-load"
+                    )
+        return self._io_pool
+
+    def _get_session_doc_file(self, dirname, session_id):
+        """获取按会话保存的单个JSON文件路径（plans / patterns / inquiry_* 目录）"""
+        return os.path.join(self.data_dir, dirname, f"{session_id}.json")
+
+    def _load_session_bundle(self, session_id, kinds, since, limits):
+        """在一次读锁内读取单个会话需要的全部数据"""
+        result = SessionBundle(session_id=session_id)
+        try:
+            with self.locks.read(session_id):
+                archived = self._archived_session(session_id)
+
+                if "chat_history" in kinds:
+                    if archived is not None:
+                        result.chat_history = _tail(
+                            archived["messages"], limits.get("chat_history")
+                        )
+                    else:
+                        result.chat_history = self.message_log.read(
+                            session_id, limits.get("chat_history")
+                        )
+                if "message_count" in kinds:
+                    # 只持有读锁：计数器过期时重新统计但不写回
+                    by_role = self._stored_message_counts_locked(session_id)
+                    if by_role is None:
+                        by_role = self._count_messages_locked(session_id)
+                    result.message_count = by_role.get("user", 0)
+                if "events" in kinds:
+                    if archived is not None:
+                        result.events = _filter_events(
+                            archived["events"], limits.get("events"), since
+                        )
+                    else:
+                        result.events = self.events.query(
+                            session_id, limits.get("events"), since
+                        )
+                if "moods" in kinds:
+                    if archived is not None:
+                        moods = archived["moods"]
+                    else:
+                        moods = self.files.read_json(self._get_mood_file(session_id), [])
+                    if since is not None:
+                        moods = time_window(moods, "created_at", since)
+                    result.moods = _tail(moods, limits.get("moods"))
+                if "inquiry_history" in kinds:
+                    if archived is not None:
+                        history = archived["inquiry_history"]
+                    else:
+                        history = self.files.read_json(
+                            self._get_session_doc_file("inquiry_history", session_id), []
+                        )
+                    result.inquiry_history = _tail(history, limits.get("inquiry_history"))
+                for kind, dirname in _SESSION_DOCUMENTS:
+                    if kind not in kinds:
+                        continue
+                    if archived is not None:
+                        setattr(result, kind, archived[kind] or {})
+                    else:
+                        setattr(
+                            result,
+                            kind,
+                            self.files.read_json(
+                                self._get_session_doc_file(dirname, session_id), {}
+                            ),
+                        )
+
+        except Exception as e:
+            print(f"Error loading session {session_id}: {str(e)}")
+
+        return result
+
+    def _archived_session(self, session_id):
+        """已归档会话的数据（调用方需持有会话锁），会话未归档时返回 None"""
+        if not self.sessions.field(session_id, "archived_at", sync=False):
+            # 未归档的会话一定有消息日志；日志不存在时才需要确认其他进程是否已将其归档
+            if os.path.exists(self.message_log.log_path(session_id)):
+                return None
+            if not self.sessions.field(session_id, "archived_at"):
+                return None
+        user_id = self.sessions.field(session_id, "user_id")
+        return self.archive.load(user_id, session_id)
+
+    def _session_files(self, session_id):
+        """会话的全部常规数据文件（含索引和上一代备份）"""
+        paths = [
+            self.message_log.log_path(session_id),
+            self.message_log.index_path(session_id),
+            self.events.log.log_path(session_id),
+            self.events.log.index_path(session_id),
+            self._get_mood_file(session_id),
+            self._get_session_doc_file("inquiry_history", session_id),
+        ]
+        paths.extend(
+            self._get_session_doc_file(dirname, session_id)
+            for _, dirname in _SESSION_DOCUMENTS
+        )
+        paths.extend([path + BACKUP_SUFFIX for path in paths if path.endswith(".json")])
+        return paths
+
+    def archive_session(self, session_id):
+        """把一个会话的全部数据归档到用户的压缩段文件，并删除其常规文件
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 归档统计（删除的文件数、归档前后字节数），会话不存在或已归档时返回 None
+        """
+        with self.locks.write(session_id):
+            user_id = self.sessions.field(session_id, "user_id")
+            if user_id is None or self.sessions.field(session_id, "archived_at"):
+                return None
+
+            data = {
+                "session_id": session_id,
+                "user_id": user_id,
+                "messages": self.message_log.read(session_id),
+                "events": self.events.query(session_id),
+                "moods": self.files.read_json(self._get_mood_file(session_id), []),
+                "inquiry_history": self.files.read_json(
+                    self._get_session_doc_file("inquiry_history", session_id), []
+                ),
+            }
+            for kind, dirname in _SESSION_DOCUMENTS:
+                data[kind] = self.files.read_json(
+                    self._get_session_doc_file(dirname, session_id)
+                )
+
+            paths = [path for path in self._session_files(session_id) if os.path.exists(path)]
+            bytes_before = sum(os.path.getsize(path) for path in paths)
+
+            # 先落盘归档，再标记会话，最后删除常规文件；任一步崩溃都不会丢数据
+            entry = self.archive.put(user_id, session_id, data)
+
+            counts = {"events": len(data["events"])}
+            for message in data["messages"]:
+                name = f"messages.{message.get('role')}"
+                counts[name] = counts.get(name, 0) + 1
+            self.sessions.set_counts(session_id, counts)
+            self.sessions.set_fields(session_id, {"archived_at": entry["archived_at"]})
+
+            self.message_log.remove(session_id)
+            self.recent.discard(session_id)
+            self.events.remove(session_id)
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+            return {
+                "files_removed": len(paths),
+                "bytes_before": bytes_before,
+                "bytes_after": entry["size"],
+            }
+
+    def _restore_archived_locked(self, session_id):
+        """会话已归档时把数据恢复为常规文件（调用方需持有会话写锁）"""
+        if not self.sessions.field(session_id, "archived_at"):
+            return
+
+        user_id = self.sessions.field(session_id, "user_id")
+        data = self.archive.load(user_id, session_id)
+        if data is not None:
+            if data["messages"]:
+                self.message_log.write_all(session_id, data["messages"])
+            if data["events"]:
+                self.events.replace(session_id, data["events"])
+            if data["moods"]:
+                self.files.write_json(self._get_mood_file(session_id), data["moods"])
+            if data["inquiry_history"]:
+                self._write_session_document(
+                    "inquiry_history", session_id, data["inquiry_history"]
+                )
+            for kind, dirname in _SESSION_DOCUMENTS:
+                if data[kind] is not None:
+                    self._write_session_document(dirname, session_id, data[kind])
+
+        self.sessions.set_fields(session_id, {"archived_at": None})
+        self.archive.drop(user_id, session_id)
+
+    def _write_session_document(self, dirname, session_id, data):
+        path = self._get_session_doc_file(dirname, session_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.files.write_json(path, data)
+
+    def archive_idle_sessions(self, idle_days=30, limit=None):
+        """归档超过 idle_days 天没有更新的会话
+
+        Args:
+            idle_days: 空闲天数
+            limit: 本次最多归档的会话数，None表示不限
+
+        Returns:
+            dict: 归档统计
+        """
+        cutoff = (datetime.now() - timedelta(days=idle_days)).isoformat()
+        result = {"archived": 0, "files_removed": 0, "bytes_before": 0, "bytes_after": 0}
+
+        # 多个进程同时运行归档时只有一个在工作
+        with FileLock(os.path.join(self.lock_dir, "archive.lock")).exclusive():
+            for session_id, meta in self.sessions.get_sessions().items():
+                if limit is not None and result["archived"] >= limit:
+                    break
+                if meta.get("archived_at") or (meta.get("updated_at") or "") >= cutoff:
+                    continue
                 try:
-                    report_file = os.path.join(reports_dir, filename)
-                    with self.lock:
-                        with open(report_file, "r", encoding="utf-8") as f:
-                            report_data = json.load(f)
-                            reports.append(report_data)
+                    stats = self.archive_session(session_id)
                 except Exception as e:
-                    print(f"Error reading report file {filename}: {str(e)}")
+                    print(f"Error archiving session {session_id}: {str(e)}")
                     continue
+                if stats is None:
+                    continue
+                result["archived"] += 1
+                for key, value in stats.items():
+                    result[key] += value
 
-            return reports
+        if result["archived"]:
+            print(f"Archived {result['archived']} idle sessions: {result}")
+        return result
 
-        except Exception as e:
-            print(f"Error getting analysis reports history: {str(e)}")
-            return []
+    def _start_archiver(self, idle_days, interval):
+        """启动定期归档空闲会话的后台线程"""
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.archive_idle_sessions(idle_days)
+                except Exception as e:
+                    print(f"Error archiving idle sessions: {str(e)}")
+
+        threading.Thread(target=run, name="session-archiver", daemon=True).start()
+
+
+_shared_databases = {}
+_shared_databases_lock = threading.Lock()
+
+
+def get_database(data_dir="data"):
+    """获取进程内共享的数据库实例
+
+    同一数据目录在一个进程内只创建一个实例，所有服务共用同一套锁和内存索引。
+
+    Args:
+        data_dir: 数据存储目录
+
+    Returns:
+        数据库实例
+    """
+    key = os.path.abspath(data_dir)
+    db = _shared_databases.get(key)
+    if db is None:
+        with _shared_databases_lock:
+            db = _shared_databases.get(key)
+            if db is None:
+                db = create_database(data_dir)
+                _shared_databases[key] = db
+    return db
+
+
+def _create_sqlite_database(data_dir):
+    from dao.sqlite_database import SQLiteDatabase
+
+    return SQLiteDatabase(data_dir, os.environ.get("SQLITE_DB_FILE") or None)
+
+
+def _create_memory_database(data_dir):
+    from dao.memory_database import MemoryDatabase
+
+    return MemoryDatabase(data_dir)
+
+
+register_backend("file", Database)
+register_backend("sqlite", _create_sqlite_database)
+register_backend("memory", _create_memory_database)
+
+
+def create_database(data_dir="data"):
+    """根据环境变量 DB_BACKEND 创建数据库实例
+
+    Args:
+        data_dir: 数据存储目录
+
+    Returns:
+        StorageBackend: 数据库实例（file 为默认后端）
+    """
+    backend = os.environ.get("DB_BACKEND", "file").lower()
+    factory = get_backend_factory(backend)
+    if factory is None:
+        print(
+            f"Warning: Unknown DB_BACKEND {backend!r} (available: {', '.join(backend_names())}), "
+            "falling back to file"
+        )
+        factory = Database
+    return factory(data_dir)
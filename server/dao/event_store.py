@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按事件ID索引的事件存储
+
+每个会话的事件保存在追加写的 JSONL 日志中（events/<session_id>.jsonl），记录有三种：
+- 事件本身（新增）：{"id": ..., "primaryType": ..., ...}
+- 更新：{"_op": "update", "id": ..., "data": {...}}
+- 删除（墓碑）：{"_op": "delete", "id": ...}
+
+内存中为每个会话维护 event_id -> (记录偏移列表, created_at, 类型) 的索引：
+- 更新 / 删除只追加一行，成本为 O(1)，不再读写整个文件
+- 按时间、类型查询时先在索引上过滤，只解析命中事件所在的行
+- 废弃记录（被覆盖的更新、墓碑）超过存活事件数时重写日志（压缩）
+- 每个会话的索引有自己的锁，不同会话的索引更新和磁盘读取互不阻塞；
+  全局锁只保护索引缓存本身（LRU）
+
+旧版 events/<session_id>.json 数组文件在首次访问时自动转换。
+多个进程共享数据目录时，通过日志文件的 inode 和大小发现其他进程的写入。
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from dao.append_log import AppendLog
+from utils import json_codec
+
+_UPDATE = "update"
+_DELETE = "delete"
+
+
+class _SessionEvents:
+    """单个会话的事件索引"""
+
+    __slots__ = ("lock", "inode", "pos", "events", "garbage")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """清空索引（日志被重写或删除时）"""
+        self.inode = None
+        self.pos = 0
+        # event_id -> [偏移列表, created_at, 类型集合]，按新增顺序排列
+        self.events = OrderedDict()
+        # 日志中除每个存活事件的最新状态外的多余记录数
+        self.garbage = 0
+
+
+def _event_types(event):
+    return frozenset(
+        value for value in (event.get("primaryType"), event.get("subType")) if value
+    )
+
+
+class EventStore:
+    """按事件ID索引的追加写事件存储"""
+
+    def __init__(self, log_dir, compact_min=64, max_sessions=1024):
+        """初始化事件存储
+
+        Args:
+            log_dir: 事件日志目录
+            compact_min: 废弃记录至少达到多少条才压缩
+            max_sessions: 内存中最多缓存多少个会话的索引
+        """
+        self.log = AppendLog(log_dir)
+        self.compact_min = compact_min
+        self.max_sessions = max_sessions
+
+        # 只保护 _cache；会话索引的读写由各自的 entry.lock 保护
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def _entry(self, session_id):
+        """从缓存获取（或创建）会话索引"""
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is None:
+                entry = _SessionEvents()
+                self._cache[session_id] = entry
+                while len(self._cache) > self.max_sessions:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(session_id)
+            return entry
+
+    @contextmanager
+    def _session(self, session_id):
+        """持有会话索引的锁，并读入日志中尚未索引的新记录"""
+        entry = self._entry(session_id)
+        with entry.lock:
+            self._refresh(session_id, entry)
+            yield entry
+
+    def _refresh(self, session_id, entry):
+        """读入日志中尚未索引的新记录（调用方需持有 entry.lock）"""
+        self.log.exists(session_id)
+        try:
+            st = os.stat(self.log.log_path(session_id))
+        except FileNotFoundError:
+            entry.reset()
+            return
+
+        # 日志被压缩（其他进程重写）时重新建立索引
+        if st.st_ino != entry.inode or st.st_size < entry.pos:
+            entry.reset()
+            entry.inode = st.st_ino
+        if st.st_size > entry.pos:
+            self._scan(session_id, entry)
+
+    def _scan(self, session_id, entry):
+        """从上次读到的位置开始解析日志，更新索引"""
+        with open(self.log.log_path(session_id), "rb") as f:
+            f.seek(entry.pos)
+            data = f.read()
+
+        # 只处理完整的行，写了一半的行留到下次
+        end = data.rfind(b"\n") + 1
+        offset = entry.pos
+        for line in data[:end].split(b"\n")[:-1]:
+            line_offset = offset
+            offset += len(line) + 1
+            try:
+                record = json_codec.loads(line)
+            except ValueError:
+                entry.garbage += 1
+                continue
+
+            op = record.get("_op")
+            event_id = record.get("id")
+            current = entry.events.get(event_id)
+
+            if op == _UPDATE:
+                if current is None:
+                    entry.garbage += 1
+                    continue
+                current[0].append(line_offset)
+                entry.garbage += 1
+                changes = record.get("data") or {}
+                if "created_at" in changes:
+                    current[1] = changes["created_at"]
+                if "primaryType" in changes or "subType" in changes:
+                    current[2] = None
+            elif op == _DELETE:
+                entry.garbage += 1
+                if current is not None:
+                    entry.garbage += 1
+                    del entry.events[event_id]
+            else:
+                if event_id is None:
+                    event_id = f"@{line_offset}"
+                if current is not None:
+                    entry.garbage += 1
+                    del entry.events[event_id]
+                entry.events[event_id] = [
+                    [line_offset],
+                    record.get("created_at"),
+                    _event_types(record),
+                ]
+        entry.pos += end
+
+    def _materialize(self, session_id, items):
+        """读取并合并事件的原始记录与其后的更新
+
+        Args:
+            items: [(event_id, 索引项), ...]
+
+        Returns:
+            list: 事件列表
+        """
+        offsets = [offset for _, meta in items for offset in meta[0]]
+        records = iter(self.log.read_at(session_id, offsets))
+
+        events = []
+        for _, meta in items:
+            event = next(records)
+            for _ in meta[0][1:]:
+                update = next(records)
+                if event is not None and update is not None:
+                    event.update(update.get("data") or {})
+            if event is None:
+                continue
+            if meta[2] is None:
+                meta[2] = _event_types(event)
+            events.append(event)
+        return events
+
+    def append(self, session_id, events):
+        """追加新事件
+
+        Args:
+            session_id: 会话ID
+            events: 事件列表（需已带有 id 和 created_at）
+        """
+        with self._session(session_id) as entry:
+            self.log.append_many(session_id, events)
+            self._refresh(session_id, entry)
+
+    def query(self, session_id, limit=None, since=None, types=None):
+        """查询事件
+
+        Args:
+            session_id: 会话ID
+            limit: 最多返回最近的多少条，None表示全部
+            since: 只返回 created_at 不早于该时间的事件（datetime 或 ISO 字符串）
+            types: 只返回 primaryType 或 subType 属于该集合的事件
+
+        Returns:
+            list: 按新增顺序排列的事件列表
+        """
+        if isinstance(since, datetime):
+            since = since.isoformat()
+        if isinstance(types, str):
+            types = {types}
+
+        with self._session(session_id) as entry:
+            items = list(entry.events.items())
+
+            if since is not None:
+                items = [item for item in items if (item[1][1] or "") >= since]
+
+            if types:
+                types = set(types)
+                # 类型被更新过的事件需要解析一次才能确定类型
+                unknown = [item for item in items if item[1][2] is None]
+                if unknown:
+                    self._materialize(session_id, unknown)
+                items = [item for item in items if item[1][2] & types]
+
+            if limit is not None and limit > 0:
+                items = items[-limit:]
+
+            return self._materialize(session_id, items)
+
+    def get(self, session_id, event_id):
+        """获取单个事件，不存在时返回 None"""
+        with self._session(session_id) as entry:
+            meta = entry.events.get(event_id)
+            if meta is None:
+                return None
+            events = self._materialize(session_id, [(event_id, meta)])
+            return events[0] if events else None
+
+    def update(self, session_id, event_id, update_data):
+        """追加一条更新记录
+
+        Returns:
+            bool: 事件是否存在
+        """
+        with self._session(session_id) as entry:
+            if event_id not in entry.events:
+                return False
+            self.log.append(
+                session_id, {"_op": _UPDATE, "id": event_id, "data": update_data}
+            )
+            self._refresh(session_id, entry)
+            self._maybe_compact(session_id, entry)
+            return True
+
+    def delete(self, session_id, event_id):
+        """追加一条删除记录（墓碑）
+
+        Returns:
+            bool: 事件是否存在
+        """
+        with self._session(session_id) as entry:
+            if event_id not in entry.events:
+                return False
+            self.log.append(session_id, {"_op": _DELETE, "id": event_id})
+            self._refresh(session_id, entry)
+            self._maybe_compact(session_id, entry)
+            return True
+
+    def count(self, session_id):
+        """会话中存活的事件数量"""
+        with self._session(session_id) as entry:
+            return len(entry.events)
+
+    def log_size(self, session_id):
+        """会话事件日志的字节数（一次 stat），日志不存在时为 0"""
+        try:
+            return os.path.getsize(self.log.log_path(session_id))
+        except FileNotFoundError:
+            return 0
+
+    def _maybe_compact(self, session_id, entry):
+        if entry.garbage >= max(self.compact_min, len(entry.events)):
+            self._compact_locked(session_id, entry)
+
+    def compact(self, session_id):
+        """用存活事件的最新版本重写日志，丢弃更新记录和墓碑"""
+        with self._session(session_id) as entry:
+            self._compact_locked(session_id, entry)
+
+    def _compact_locked(self, session_id, entry):
+        events = self._materialize(session_id, list(entry.events.items()))
+        self.log.write_all(session_id, events)
+        entry.reset()
+
+    def replace(self, session_id, events):
+        """用给定的事件列表整体替换会话的日志（用于从归档恢复）"""
+        entry = self._entry(session_id)
+        with entry.lock:
+            self.log.write_all(session_id, events)
+            entry.reset()
+
+    def remove(self, session_id):
+        """删除会话的事件日志，返回删除的字节数"""
+        entry = self._entry(session_id)
+        with entry.lock:
+            entry.reset()
+            removed = self.log.remove(session_id)
+        with self._lock:
+            self._cache.pop(session_id, None)
+        return removed
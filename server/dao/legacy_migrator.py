@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+旧版 data/ 目录到新存储后端的流式迁移
+
+旧版目录结构：
+    sessions.json                     # {session_id: {"user_id", "created_at", "updated_at"}}
+    messages/<session_id>.json        # 消息数组
+    messages/<session_id>_mood.json   # 情绪分析数组
+    events/<session_id>.json          # 事件数组
+    plans/ inquiry_results/ patterns/ inquiry_history/<session_id>.json
+    emotion_scores.json / long_term_memory.json / user_profiles.json   # {user_id: ...} 全局文件
+    analysis_reports/<user_id>_<日期>_<时间>.json
+
+- sessions.json 和全局文件按顶层键逐项增量解析，内存占用与文件大小无关；
+  单个会话的文件一次只读取一个会话
+- 以会话 / 用户为单位分批写入目标后端（import_sessions / import_users，保留原始时间戳和ID）
+- 每个单位写入后从目标读回，校验条数和校验和
+- 迁移状态（每个单位的源文件指纹和校验和）追加写入状态文件：中断后重新运行只迁移
+  尚未完成或源数据发生变化的单位；在线迁移时最后停写再运行一次即为追平（catch-up）
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from dao.bundle import SESSION_KINDS
+from dao.report_store import legacy_report_id
+from utils import json_codec
+
+# 按会话保存的文件：(数据种类, 目录, 文件名后缀)
+_SESSION_FILES = (
+    ("chat_history", "messages", ".json"),
+    ("moods", "messages", "_mood.json"),
+    ("events", "events", ".json"),
+    ("plan", "plans", ".json"),
+    ("inquiry", "inquiry_results", ".json"),
+    ("pattern", "patterns", ".json"),
+    ("inquiry_history", "inquiry_history", ".json"),
+)
+
+# 全局用户文件：(数据种类, 文件名)
+_USER_FILES = (
+    ("profile", "user_profiles.json"),
+    ("long_term_memory", "long_term_memory.json"),
+    ("emotions", "emotion_scores.json"),
+)
+
+_DOCUMENT_KINDS = ("plan", "inquiry", "pattern", "profile")
+
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = ",:]}"
+
+
+def iter_json_items(path, chunk_size=64 * 1024):
+    """增量解析顶层为对象或数组的 JSON 文件，逐项产出 (键或下标, 值)
+
+    一次只在内存中保留当前的一项（以及一个读取块），适合很大的 sessions.json
+    和按用户汇总的全局文件。
+
+    Raises:
+        ValueError: 文件不是合法的 JSON 对象 / 数组
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            # 每次至少读入与当前缓冲区等长的数据，单项很大时重试总成本仍是线性的
+            chunk = f.read(max(chunk_size, len(buffer) - pos))
+            if not chunk:
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                fill()
+
+        def decode():
+            # 值之后必须能看到分隔符（或文件结束），避免把被读取块截断的数字（如 "1." / "2e"）当成完整的值
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    rest = end
+                    while rest < len(buffer) and buffer[rest] in _WHITESPACE:
+                        rest += 1
+                    if (rest < len(buffer) and buffer[rest] in _DELIMITERS) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        def expect(chars):
+            nonlocal pos
+            skip_whitespace()
+            if pos >= len(buffer) or buffer[pos] not in chars:
+                raise ValueError(f"Malformed JSON in {path} near offset {f.tell()}")
+            pos += 1
+            return buffer[pos - 1]
+
+        opening = expect("{[")
+        closing = "}" if opening == "{" else "]"
+        skip_whitespace()
+        if pos < len(buffer) and buffer[pos] == closing:
+            return
+
+        index = 0
+        while True:
+            skip_whitespace()
+            if opening == "{":
+                key = decode()
+                expect(":")
+                skip_whitespace()
+            else:
+                key = index
+            yield key, decode()
+            index += 1
+            if expect("," + closing) == closing:
+                return
+
+
+def _canonical(data):
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def _normalize_numbers(value):
+    """整数值的浮点数统一为整数（SQLite 的 REAL 列把 5 读回为 5.0）"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {k: _normalize_numbers(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize_numbers(v) for v in value]
+    return value
+
+
+def _digest(kind, items):
+    """一种数据的校验和（文档类数据视为单元素列表，数值不区分 5 和 5.0）"""
+    sha = hashlib.sha256(kind.encode("utf-8"))
+    for item in items:
+        sha.update(_canonical(_normalize_numbers(item)).encode("utf-8"))
+        sha.update(b"\n")
+    return sha.hexdigest()
+
+
+def _as_items(kind, value):
+    if kind in _DOCUMENT_KINDS:
+        return [value] if value else []
+    return value or []
+
+
+def _project(source_items, target_items):
+    """把目标读回的记录裁剪为源记录中出现的字段（目标可以带有额外字段）"""
+    projected = []
+    for source, target in zip(source_items, target_items):
+        if isinstance(source, dict) and isinstance(target, dict):
+            projected.append({key: target.get(key) for key in source})
+        else:
+            projected.append(target)
+    return projected
+
+
+class LegacyMigrator:
+    """旧版 data/ 目录到任意存储后端的可恢复迁移"""
+
+    def __init__(
+        self,
+        source_dir,
+        target,
+        state_file,
+        batch_records=2000,
+        batch_units=200,
+        verify=True,
+        progress_interval=5.0,
+        log=print,
+    ):
+        """初始化迁移器
+
+        Args:
+            source_dir: 旧版数据目录（只读，不会被修改）
+            target: 目标存储后端（StorageBackend，需要支持 import_sessions / import_users）
+            state_file: 迁移状态文件
+            batch_records: 每批最多写入的记录数
+            batch_units: 每批最多写入的会话 / 用户数
+            verify: 是否在写入后读回校验
+            progress_interval: 输出进度的间隔（秒）
+            log: 日志输出函数
+        """
+        self.source_dir = source_dir
+        self.target = target
+        self.state_file = state_file
+        self.batch_records = batch_records
+        self.batch_units = batch_units
+        self.verify = verify
+        self.progress_interval = progress_interval
+        self.log = log
+        self.state = self._load_state()
+
+    # ---- 迁移状态 ----
+
+    def _load_state(self):
+        state = {}
+        if not os.path.exists(self.state_file):
+            return state
+        with open(self.state_file, "rb+") as f:
+            data = f.read()
+            # 截掉写到一半中断的最后一行，之后的追加才能从新的一行开始
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            try:
+                entry = json_codec.loads(line)
+            except ValueError:
+                continue
+            state[entry["unit"]] = entry
+        return state
+
+    def _save_state(self, entries):
+        if not entries:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        with open(self.state_file, "ab") as f:
+            f.write(b"".join(json_codec.dumps_bytes(e) + b"\n" for e in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        for entry in entries:
+            self.state[entry["unit"]] = entry
+
+    def _is_done(self, unit, fingerprint):
+        entry = self.state.get(unit)
+        return entry is not None and entry["fingerprint"] == fingerprint
+
+    # ---- 源数据 ----
+
+    def _session_path(self, session_id, dirname, suffix):
+        return os.path.join(self.source_dir, dirname, f"{session_id}{suffix}")
+
+    def _session_fingerprint(self, session_id, meta):
+        sha = hashlib.sha1(_canonical(meta).encode("utf-8"))
+        for _, dirname, suffix in _SESSION_FILES:
+            try:
+                st = os.stat(self._session_path(session_id, dirname, suffix))
+                sha.update(f"{dirname}{suffix}:{st.st_size}:{st.st_mtime_ns};".encode())
+            except FileNotFoundError:
+                sha.update(f"{dirname}{suffix}:-;".encode())
+        return sha.hexdigest()
+
+    def _read_session(self, session_id):
+        """读取一个会话的全部文件，返回 (data, 读取的字节数)"""
+        data = {}
+        size = 0
+        for kind, dirname, suffix in _SESSION_FILES:
+            path = self._session_path(session_id, dirname, suffix)
+            try:
+                with open(path, "rb") as f:
+                    payload = f.read()
+            except FileNotFoundError:
+                data[kind] = None if kind in _DOCUMENT_KINDS else []
+                continue
+            size += len(payload)
+            data[kind] = json_codec.loads(payload) if payload.strip() else None
+            if data[kind] is None and kind not in _DOCUMENT_KINDS:
+                data[kind] = []
+        return data, size
+
+    def _iter_reports(self):
+        """按用户分组的旧版报告文件：user_id -> [(时间戳, 路径), ...]"""
+        reports_dir = os.path.join(self.source_dir, "analysis_reports")
+        grouped = {}
+        if not os.path.isdir(reports_dir):
+            return grouped
+        for entry in os.scandir(reports_dir):
+            if not entry.is_file() or not entry.name.endswith(".json"):
+                continue
+            parts = entry.name[: -len(".json")].rsplit("_", 2)
+            if len(parts) != 3:
+                continue
+            user_id, date_part, time_part = parts
+            grouped.setdefault(user_id, []).append((f"{date_part}_{time_part}", entry.path))
+        return grouped
+
+    # ---- 迁移 ----
+
+    def run(self):
+        """执行一遍迁移（已完成且源数据未变化的单位会被跳过）
+
+        Returns:
+            dict: 本遍的统计信息
+        """
+        self.stats = {
+            "migrated": 0,
+            "skipped": 0,
+            "records": 0,
+            "bytes": 0,
+            "errors": [],
+            "mismatches": [],
+        }
+        self._started = time.monotonic()
+        self._last_progress = self._started
+
+        self._migrate_sessions()
+        self._migrate_users()
+        self._migrate_reports()
+
+        elapsed = time.monotonic() - self._started
+        self.stats["elapsed_s"] = round(elapsed, 3)
+        self.stats["records_per_s"] = round(self.stats["records"] / elapsed, 1) if elapsed else 0.0
+        self.stats["mb_per_s"] = (
+            round(self.stats["bytes"] / elapsed / 1024 / 1024, 2) if elapsed else 0.0
+        )
+        self._progress(final=True)
+        return self.stats
+
+    def follow(self, interval=10.0, max_passes=None):
+        """在线迁移：反复执行迁移，直到某一遍没有需要迁移的单位
+
+        Args:
+            interval: 两遍之间的等待时间（秒）
+            max_passes: 最多执行的遍数，None表示不限
+
+        Returns:
+            list: 每一遍的统计信息
+        """
+        passes = []
+        while True:
+            stats = self.run()
+            passes.append(stats)
+            if stats["migrated"] == 0 and not stats["errors"]:
+                return passes
+            if max_passes is not None and len(passes) >= max_passes:
+                return passes
+            time.sleep(interval)
+
+    def _migrate_sessions(self):
+        sessions_file = os.path.join(self.source_dir, "sessions.json")
+        if not os.path.exists(sessions_file):
+            return
+
+        batch = []
+        batch_records = 0
+        try:
+            for session_id, meta in iter_json_items(sessions_file):
+                unit = f"session:{session_id}"
+                # 先取指纹再读文件：读取期间发生的修改会在下一遍被重新迁移
+                fingerprint = self._session_fingerprint(session_id, meta)
+                if self._is_done(unit, fingerprint):
+                    self.stats["skipped"] += 1
+                    continue
+                try:
+                    data, size = self._read_session(session_id)
+                except (OSError, ValueError) as e:
+                    self.stats["errors"].append(f"{unit}: {str(e)}")
+                    continue
+
+                records = sum(len(_as_items(kind, data[kind])) for kind in data)
+                batch.append((unit, fingerprint, session_id, meta, data, records))
+                batch_records += records
+                self.stats["bytes"] += size
+                if len(batch) >= self.batch_units or batch_records >= self.batch_records:
+                    self._flush_sessions(batch)
+                    batch = []
+                    batch_records = 0
+        except (OSError, ValueError) as e:
+            # sessions.json 正在被改写时可能读到不完整的内容，下一遍重试
+            self.stats["errors"].append(f"sessions.json: {str(e)}")
+        self._flush_sessions(batch)
+
+    def _flush_sessions(self, batch):
+        if not batch:
+            return
+        try:
+            self.target.import_sessions(
+                [(session_id, meta, data) for _, _, session_id, meta, data, _ in batch]
+            )
+        except Exception as e:
+            self.stats["errors"].append(f"import_sessions: {str(e)}")
+            return
+
+        entries = []
+        for unit, fingerprint, session_id, meta, data, records in batch:
+            checksum = self._checksum(data)
+            if self.verify:
+                readback = self._read_target_session(session_id, data)
+                if not self._matches(unit, data, readback):
+                    continue
+            entries.append(self._state_entry(unit, fingerprint, records, checksum))
+            self.stats["migrated"] += 1
+            self.stats["records"] += records
+        self._save_state(entries)
+        self._progress()
+
+    def _migrate_users(self):
+        for kind, filename in _USER_FILES:
+            path = os.path.join(self.source_dir, filename)
+            if not os.path.exists(path):
+                continue
+
+            batch = []
+            batch_records = 0
+            try:
+                for user_id, value in iter_json_items(path):
+                    unit = f"{kind}:{user_id}"
+                    payload = json_codec.dumps_bytes(value)
+                    fingerprint = hashlib.sha1(payload).hexdigest()
+                    if self._is_done(unit, fingerprint):
+                        self.stats["skipped"] += 1
+                        continue
+                    records = len(_as_items(kind, value))
+                    batch.append((unit, fingerprint, user_id, {kind: value}, records))
+                    batch_records += records
+                    self.stats["bytes"] += len(payload)
+                    if len(batch) >= self.batch_units or batch_records >= self.batch_records:
+                        self._flush_users(batch)
+                        batch = []
+                        batch_records = 0
+            except (OSError, ValueError) as e:
+                self.stats["errors"].append(f"{filename}: {str(e)}")
+            self._flush_users(batch)
+
+    def _migrate_reports(self):
+        batch = []
+        for user_id, files in self._iter_reports().items():
+            unit = f"reports:{user_id}"
+            files.sort()
+            sha = hashlib.sha1()
+            for _, path in files:
+                st = os.stat(path)
+                sha.update(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns};".encode())
+            fingerprint = sha.hexdigest()
+            if self._is_done(unit, fingerprint):
+                self.stats["skipped"] += 1
+                continue
+
+            reports = []
+            try:
+                for stamp, path in files:
+                    with open(path, "rb") as f:
+                        payload = f.read()
+                    self.stats["bytes"] += len(payload)
+                    # 报告ID由文件名确定，重复迁移得到相同的ID
+                    report_id = legacy_report_id(stamp, os.path.basename(path))
+                    reports.append((report_id, json_codec.loads(payload)))
+            except (OSError, ValueError) as e:
+                self.stats["errors"].append(f"{unit}: {str(e)}")
+                continue
+
+            batch.append((unit, fingerprint, user_id, {"reports": reports}, len(reports)))
+            if len(batch) >= self.batch_units:
+                self._flush_users(batch)
+                batch = []
+        self._flush_users(batch)
+
+    def _flush_users(self, batch):
+        if not batch:
+            return
+        try:
+            self.target.import_users([(user_id, data) for _, _, user_id, data, _ in batch])
+        except Exception as e:
+            self.stats["errors"].append(f"import_users: {str(e)}")
+            return
+
+        entries = []
+        for unit, fingerprint, user_id, data, records in batch:
+            checksum = self._checksum(data)
+            if self.verify:
+                readback = self._read_target_user(user_id, data)
+                if not self._matches(unit, data, readback):
+                    continue
+            entries.append(self._state_entry(unit, fingerprint, records, checksum))
+            self.stats["migrated"] += 1
+            self.stats["records"] += records
+        self._save_state(entries)
+        self._progress()
+
+    # ---- 校验 ----
+
+    def _read_target_session(self, session_id, data):
+        readers = {
+            "chat_history": self.target.get_chat_history,
+            "events": self.target.get_events,
+            "moods": self.target.get_mood_analysis,
+            "inquiry_history": self.target.get_inquiry_history,
+            "plan": self.target.get_session_plan,
+            "inquiry": self.target.get_inquiry_result,
+            "pattern": self.target.get_pattern_analysis,
+        }
+        return {kind: readers[kind](session_id) for kind in data if kind in SESSION_KINDS}
+
+    def _read_target_user(self, user_id, data):
+        readback = {}
+        if "profile" in data:
+            readback["profile"] = self.target.get_user_profile(user_id)
+        if "long_term_memory" in data:
+            readback["long_term_memory"] = self.target.get_long_term_memory(user_id)
+        if "emotions" in data:
+            readback["emotions"] = self.target.get_emotion_history(user_id)
+        if "reports" in data:
+            readback["reports"] = [
+                (header["id"], self.target.get_analysis_report(user_id, header["id"]))
+                for header in reversed(self.target.get_analysis_reports_history(user_id))
+            ]
+        return readback
+
+    def _checksum(self, data):
+        sha = hashlib.sha256()
+        for kind in sorted(data):
+            sha.update(_digest(kind, _as_items(kind, data[kind])).encode())
+        return sha.hexdigest()
+
+    def _matches(self, unit, data, readback):
+        """比较源数据与目标读回的数据（条数 + 校验和），不一致时记录下来"""
+        for kind in sorted(data):
+            source = _as_items(kind, data[kind])
+            target = _as_items(kind, readback.get(kind))
+            if len(source) != len(target):
+                self.stats["mismatches"].append(
+                    f"{unit} {kind}: count {len(source)} != {len(target)}"
+                )
+                return False
+            if _digest(kind, source) != _digest(kind, _project(source, target)):
+                self.stats["mismatches"].append(f"{unit} {kind}: checksum mismatch")
+                return False
+        return True
+
+    @staticmethod
+    def _state_entry(unit, fingerprint, records, checksum):
+        return {
+            "unit": unit,
+            "fingerprint": fingerprint,
+            "records": records,
+            "checksum": checksum,
+            "migrated_at": time.time(),
+        }
+
+    def _progress(self, final=False):
+        now = time.monotonic()
+        if not final and now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        elapsed = max(now - self._started, 1e-9)
+        stats = self.stats
+        self.log(
+            f"[migrate] {'done' if final else 'progress'}: "
+            f"migrated {stats['migrated']} skipped {stats['skipped']} units, "
+            f"{stats['records']} records, {stats['bytes'] / 1024 / 1024:.1f} MB read "
+            f"({stats['records'] / elapsed:.0f} rec/s, {stats['bytes'] / elapsed / 1024 / 1024:.2f} MB/s), "
+            f"{len(stats['errors'])} errors, {len(stats['mismatches'])} mismatches"
+        )
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库锁工具
+
+- RWLock: 写优先的读写锁，多个读者可并发，写者独占
+- FileLock: 基于 fcntl.flock 的跨进程建议锁，多个工作进程共享同一数据目录时使用
+- StripedRWLock: 按 key（session_id / user_id 等）哈希到固定数量的读写锁上，
+  不同会话、不同用户的请求互不阻塞，同时记录等待时间与持有时间用于观测锁竞争
+"""
+
+import os
+import time
+import threading
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 等平台没有 fcntl，此时只使用进程内锁
+    fcntl = None
+
+
+class RWLock:
+    """写优先的读写锁"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class FileLock:
+    """基于 fcntl.flock 的跨进程建议锁
+
+    flock 以打开的文件描述符为单位，同一进程内的多个读线程共享一个描述符，
+    因此共享锁需要引用计数：第一个读者加锁，最后一个读者解锁。
+    进程内的互斥仍由线程锁负责，本类只解决进程之间的互斥。
+    """
+
+    def __init__(self, path):
+        """初始化文件锁
+
+        Args:
+            path: 锁文件路径（不存在时自动创建）
+        """
+        self.path = path
+        self._fd = None
+        self._shared = 0
+        self._mutex = threading.Lock()
+
+    def _fileno(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    def acquire_shared(self):
+        if fcntl is None:
+            return
+        with self._mutex:
+            if self._shared == 0:
+                fcntl.flock(self._fileno(), fcntl.LOCK_SH)
+            self._shared += 1
+
+    def release_shared(self):
+        if fcntl is None:
+            return
+        with self._mutex:
+            self._shared -= 1
+            if self._shared == 0:
+                fcntl.flock(self._fileno(), fcntl.LOCK_UN)
+
+    def acquire_exclusive(self):
+        if fcntl is None:
+            return
+        fcntl.flock(self._fileno(), fcntl.LOCK_EX)
+
+    def release_exclusive(self):
+        if fcntl is None:
+            return
+        fcntl.flock(self._fileno(), fcntl.LOCK_UN)
+
+    def try_acquire_exclusive(self):
+        """非阻塞地获取独占锁
+
+        Returns:
+            bool: 是否获取成功（锁被其他进程持有时为 False）
+        """
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self._fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def close(self):
+        """关闭锁文件描述符（同时释放持有的锁）"""
+        with self._mutex:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+                self._shared = 0
+
+    @contextmanager
+    def exclusive(self):
+        """以独占模式持有文件锁"""
+        self.acquire_exclusive()
+        try:
+            yield
+        finally:
+            self.release_exclusive()
+
+
+class LockStats:
+    """锁等待/持有时间统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._data = {
+                mode: {
+                    "acquisitions": 0,
+                    "contended": 0,
+                    "wait_total": 0.0,
+                    "wait_max": 0.0,
+                    "hold_total": 0.0,
+                    "hold_max": 0.0,
+                }
+                for mode in ("read", "write")
+            }
+
+    def record(self, mode, wait, hold):
+        with self._lock:
+            data = self._data[mode]
+            data["acquisitions"] += 1
+            if wait > 0.001:
+                data["contended"] += 1
+            data["wait_total"] += wait
+            data["hold_total"] += hold
+            data["wait_max"] = max(data["wait_max"], wait)
+            data["hold_max"] = max(data["hold_max"], hold)
+
+    def snapshot(self):
+        """返回统计快照（时间单位：秒）"""
+        with self._lock:
+            result = {}
+            for mode, data in self._data.items():
+                count = data["acquisitions"] or 1
+                result[mode] = dict(
+                    data,
+                    wait_avg=data["wait_total"] / count,
+                    hold_avg=data["hold_total"] / count,
+                )
+            return result
+
+
+class StripedRWLock:
+    """按 key 分片的读写锁"""
+
+    def __init__(self, stripes=64, lock_dir=None):
+        """初始化分片锁
+
+        Args:
+            stripes: 分片数量（同一数据目录下的所有进程必须一致）
+            lock_dir: 锁文件目录，提供时每个分片额外持有一个跨进程文件锁
+        """
+        self._locks = [RWLock() for _ in range(stripes)]
+        self._file_locks = None
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+            self._file_locks = [
+                FileLock(os.path.join(lock_dir, f"stripe-{i:03d}.lock"))
+                for i in range(stripes)
+            ]
+        self.stats = LockStats()
+
+    def _index(self, key):
+        return zlib.crc32(str(key).encode("utf-8")) % len(self._locks)
+
+    @contextmanager
+    def read(self, key):
+        """以读模式锁定 key"""
+        index = self._index(key)
+        lock = self._locks[index]
+        file_lock = self._file_locks[index] if self._file_locks else None
+        start = time.perf_counter()
+        lock.acquire_read()
+        if file_lock is not None:
+            file_lock.acquire_shared()
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            if file_lock is not None:
+                file_lock.release_shared()
+            lock.release_read()
+            self.stats.record("read", acquired - start, time.perf_counter() - acquired)
+
+    @contextmanager
+    def write(self, key):
+        """以写模式锁定 key"""
+        index = self._index(key)
+        lock = self._locks[index]
+        file_lock = self._file_locks[index] if self._file_locks else None
+        start = time.perf_counter()
+        lock.acquire_write()
+        if file_lock is not None:
+            file_lock.acquire_exclusive()
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            if file_lock is not None:
+                file_lock.release_exclusive()
+            lock.release_write()
+            self.stats.record("write", acquired - start, time.perf_counter() - acquired)
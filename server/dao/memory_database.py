@@ -0,0 +1,803 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+纯内存存储后端（DB_BACKEND=memory）
+
+数据只保存在进程内存中，进程退出即丢失，用于测试、基准测试和压测，
+避免磁盘 I/O 干扰测量结果。
+
+为了减少内存占用并保证调用方拿到的是副本：
+- 消息、长期记忆、情绪评分保存为元组，读取时再组装成 dict
+- 事件、情绪分析、画像、计划等任意结构的数据保存为紧凑的 JSON bytes
+"""
+
+import time
+import uuid
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+
+from dao.report_store import build_report_header, new_report_id
+from dao.retention import expired_positions, record_time
+from dao.storage import StorageBackend
+from dao.time_range import time_window, to_epoch
+from utils import json_codec
+
+
+def _encode(data):
+    return json_codec.dumps_bytes(data)
+
+
+def _decode(payload):
+    return json_codec.loads(payload)
+
+
+def _payload_size(value):
+    """估算保存的数据占用的字节数（字符串按 UTF-8 编码长度）"""
+    if value is None:
+        return 0
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(_payload_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_payload_size(item) for item in value)
+    return 8
+
+
+def _tail(items, limit):
+    if limit is not None and limit > 0:
+        return items[-limit:]
+    return items
+
+
+class MemoryDatabase(StorageBackend):
+    """基于内存的数据库实现，接口与 Database 一致"""
+
+    def __init__(self, data_dir=None):
+        """初始化数据库
+
+        Args:
+            data_dir: 不使用，仅为与其他后端保持相同的构造参数
+        """
+        self.data_dir = data_dir
+        self._lock = threading.RLock()
+
+        # session_id -> [user_id, created_at, updated_at]
+        self._sessions = {}
+        # user_id -> {session_id: None}（保持创建顺序）
+        self._by_user = {}
+        # session_id -> [(role, content, timestamp), ...]
+        self._messages = {}
+        # session_id -> {role: 消息数量}
+        self._message_counts = {}
+        # session_id -> OrderedDict(event_id -> JSON bytes)
+        self._events = {}
+        # session_id -> [JSON bytes, ...]
+        self._moods = {}
+        self._inquiry_history = {}
+        # session_id -> JSON bytes
+        self._plans = {}
+        self._inquiries = {}
+        self._patterns = {}
+        # user_id -> [(time, content), ...]
+        self._memories = {}
+        # user_id -> [(session_id, emotion_score, emotion_category, timestamp, epoch 秒), ...]
+        self._emotions = {}
+        # user_id -> JSON bytes
+        self._profiles = {}
+        # user_id -> [(报告头, 正文 JSON bytes), ...]
+        self._reports = {}
+
+    def session_exists(self, session_id):
+        """检查会话是否存在
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            bool: 会话是否存在
+        """
+        return session_id in self._sessions
+
+    def save_message(self, session_id, user_id, role, content, timestamp=None):
+        """保存消息
+
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            role: 消息发送者角色 ('user' 或 'agent')
+            content: 消息内容
+            timestamp: 时间戳，如果不提供则使用当前时间
+        """
+        try:
+            now = datetime.now().isoformat()
+            if timestamp is None:
+                timestamp = now
+
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if session is None:
+                    self._sessions[session_id] = [user_id, now, now]
+                    self._by_user.setdefault(user_id, {})[session_id] = None
+                else:
+                    session[2] = now
+
+                self._messages.setdefault(session_id, []).append(
+                    (role, content, timestamp)
+                )
+                counts = self._message_counts.setdefault(session_id, {})
+                counts[role] = counts.get(role, 0) + 1
+
+        except Exception as e:
+            print(f"Error saving message: {str(e)}")
+
+    def get_chat_history(self, session_id, limit=None):
+        """获取聊天历史记录
+
+        Args:
+            session_id: 会话ID
+            limit: 最大消息数量，None表示获取全部
+
+        Returns:
+            list: 消息列表
+        """
+        with self._lock:
+            messages = _tail(self._messages.get(session_id, []), limit)
+            return [
+                {"role": role, "content": content, "timestamp": timestamp}
+                for role, content, timestamp in messages
+            ]
+
+    def get_sessions(self, user_id=None):
+        """获取会话列表
+
+        Args:
+            user_id: 用户ID，None表示获取所有会话
+
+        Returns:
+            dict: 会话列表
+        """
+        with self._lock:
+            if user_id is None:
+                session_ids = list(self._sessions)
+            else:
+                session_ids = list(self._by_user.get(user_id, {}))
+            return {
+                session_id: dict(
+                    zip(("user_id", "created_at", "updated_at"), self._sessions[session_id])
+                )
+                for session_id in session_ids
+            }
+
+    def get_user_message_count(self, session_id):
+        """获取会话中用户消息的数量
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            int: 用户消息数量
+        """
+        return self._message_counts.get(session_id, {}).get("user", 0)
+
+    def get_message_counts(self, session_id):
+        """获取会话中各角色的消息数量
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 角色 -> 消息数量
+        """
+        with self._lock:
+            return dict(self._message_counts.get(session_id, {}))
+
+    def save_events(self, session_id, events):
+        """保存事件列表
+
+        Args:
+            session_id: 会话ID
+            events: 事件列表
+        """
+        try:
+            with self._lock:
+                if session_id not in self._sessions:
+                    print(f"Warning: Session {session_id} does not exist")
+                    return
+
+                stored = self._events.setdefault(session_id, OrderedDict())
+                for event in events:
+                    # 只有当事件没有ID时才生成新ID（保持EventService生成的ID）
+                    if "id" not in event or not event["id"]:
+                        event["id"] = (
+                            f"evt_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+                        )
+                    event["created_at"] = datetime.now().isoformat()
+                    stored.pop(event["id"], None)
+                    stored[event["id"]] = _encode(event)
+
+        except Exception as e:
+            print(f"Error saving events: {str(e)}")
+
+    def get_events(self, session_id, limit=None, since=None, types=None):
+        """获取事件列表
+
+        Args:
+            session_id: 会话ID
+            limit: 最大事件数量，None表示获取全部
+            since: 只返回该时间（datetime 或 ISO 字符串）之后创建的事件
+            types: 只返回 primaryType / subType 属于其中的事件
+
+        Returns:
+            list: 事件列表
+        """
+        if isinstance(since, datetime):
+            since = since.isoformat()
+        if isinstance(types, str):
+            types = {types}
+
+        with self._lock:
+            payloads = list(self._events.get(session_id, {}).values())
+
+        events = [_decode(payload) for payload in payloads]
+        if since is not None:
+            events = [e for e in events if (e.get("created_at") or "") >= since]
+        if types:
+            types = set(types)
+            events = [
+                e for e in events
+                if e.get("primaryType") in types or e.get("subType") in types
+            ]
+        return _tail(events, limit)
+
+    def update_event(self, session_id, event_id, update_data):
+        """更新事件
+
+        Args:
+            session_id: 会话ID
+            event_id: 事件ID
+            update_data: 更新数据字典
+
+        Returns:
+            bool: 更新是否成功
+        """
+        try:
+            with self._lock:
+                stored = self._events.get(session_id, {})
+                if event_id not in stored:
+                    return False
+                event = _decode(stored[event_id])
+                event.update(update_data)
+                event["updateTime"] = datetime.now().isoformat()
+                stored[event_id] = _encode(event)
+                return True
+
+        except Exception as e:
+            print(f"Error updating event: {str(e)}")
+            return False
+
+    def delete_event(self, session_id, event_id):
+        """删除事件
+
+        Args:
+            session_id: 会话ID
+            event_id: 事件ID
+        """
+        with self._lock:
+            self._events.get(session_id, {}).pop(event_id, None)
+
+    def get_event_count(self, session_id):
+        """获取会话的事件数量
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            int: 事件数量
+        """
+        return len(self._events.get(session_id, {}))
+
+    def save_mood_data(self, user_id, session_id, mood_data):
+        """保存情绪分析数据
+        Args:
+            session_id: 会话ID
+            mood_data: 情绪分析数据（dict 或 list）
+        """
+        try:
+            with self._lock:
+                if session_id not in self._sessions:
+                    print(f"Warning: Session {session_id} does not exist")
+                    return
+
+                # mood_data 可以是单个 dict 或 list
+                if isinstance(mood_data, dict):
+                    moods = [mood_data]
+                elif isinstance(mood_data, list):
+                    moods = mood_data
+                else:
+                    moods = []
+
+                stored = self._moods.setdefault(session_id, [])
+                for mood in moods:
+                    mood["created_at"] = datetime.now().isoformat()
+                    stored.append(_encode(mood))
+
+        except Exception as e:
+            print(f"Error saving mood analysis: {str(e)}")
+
+    def get_mood_analysis(self, session_id, limit=None, start=None, end=None):
+        """获取情绪分析数据
+        Args:
+            session_id: 会话ID
+            limit: 最大数量，None表示获取全部
+            start: 按 created_at 过滤的起始时间（datetime / ISO 字符串 / epoch 秒）
+            end: 结束时间（不含）
+        Returns:
+            list: 情绪分析数据列表
+        """
+        with self._lock:
+            if start is None and end is None:
+                payloads = _tail(self._moods.get(session_id, []), limit)
+            else:
+                payloads = list(self._moods.get(session_id, []))
+        if start is None and end is None:
+            return [_decode(payload) for payload in payloads]
+        moods = time_window([_decode(p) for p in payloads], "created_at", start, end)
+        return _tail(moods, limit)
+
+    def update_mood_analysis(self, session_id, mood_id, update_data):
+        """更新情绪分析数据
+        Args:
+            session_id: 会话ID
+            mood_id: 情绪分析数据ID
+            update_data: 更新数据字典
+        Returns:
+            bool: 更新是否成功
+        """
+        try:
+            with self._lock:
+                stored = self._moods.get(session_id, [])
+                for index, payload in enumerate(stored):
+                    mood = _decode(payload)
+                    if mood.get("id") == mood_id:
+                        mood.update(update_data)
+                        mood["updateTime"] = datetime.now().isoformat()
+                        stored[index] = _encode(mood)
+                        return True
+                return False
+
+        except Exception as e:
+            print(f"Error updating mood analysis: {str(e)}")
+            return False
+
+    def delete_mood_analysis(self, session_id, mood_id):
+        """删除情绪分析数据
+        Args:
+            session_id: 会话ID
+            mood_id: 情绪分析数据ID
+        """
+        with self._lock:
+            if session_id in self._moods:
+                self._moods[session_id] = [
+                    payload
+                    for payload in self._moods[session_id]
+                    if _decode(payload).get("id") != mood_id
+                ]
+
+    def save_long_term_memory(self, user_id, memory_content):
+        """保存长期记忆
+
+        Args:
+            user_id: 用户ID
+            memory_content: 记忆内容
+        """
+        entry = (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), memory_content)
+        with self._lock:
+            self._memories.setdefault(user_id, []).append(entry)
+
+    def get_long_term_memory(self, user_id, limit=None):
+        """获取长期记忆
+
+        Args:
+            user_id: 用户ID
+            limit: 获取的记忆数量限制
+
+        Returns:
+            list: 长期记忆列表
+        """
+        with self._lock:
+            memories = _tail(self._memories.get(user_id, []), limit)
+            return [{"time": t, "content": content} for t, content in memories]
+
+    def get_long_term_memory_count(self, user_id):
+        """获取用户长期记忆的数量
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            int: 长期记忆数量
+        """
+        with self._lock:
+            return len(self._memories.get(user_id, []))
+
+    def save_emotion_score(
+        self, user_id, session_id, emotion_score, emotion_category=None
+    ):
+        """保存情绪评分
+
+        Args:
+            user_id: 用户ID
+            session_id: 会话ID
+            emotion_score: 情绪评分
+            emotion_category: 情绪类别（可选）
+        """
+        with self._lock:
+            now = datetime.now()
+            entry = (session_id, emotion_score, emotion_category, now.isoformat(), now.timestamp())
+            self._emotions.setdefault(user_id, []).append(entry)
+
+    def get_emotion_count(self, user_id):
+        """获取用户情绪评分记录的数量
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            int: 情绪评分记录数量
+        """
+        return len(self._emotions.get(user_id, []))
+
+    def get_emotion_history(self, user_id, limit=None, start=None, end=None):
+        """获取用户情绪历史
+
+        Args:
+            user_id: 用户ID
+            limit: 获取的数量限制（范围内最近的 limit 条）
+            start: 起始时间（datetime / ISO 字符串 / epoch 秒），包含
+            end: 结束时间，不包含
+
+        Returns:
+            list: 情绪历史列表
+        """
+        fields = ("session_id", "emotion_score", "emotion_category", "timestamp")
+        start = to_epoch(start)
+        end = to_epoch(end)
+        with self._lock:
+            emotions = self._emotions.get(user_id, [])
+            # 记录在锁内按时间追加，epoch 列有序，直接二分查找
+            lo = bisect_left(emotions, start, key=lambda e: e[4]) if start is not None else 0
+            hi = bisect_left(emotions, end, key=lambda e: e[4]) if end is not None else len(emotions)
+            emotions = _tail(emotions[lo:hi], limit)
+            return [dict(zip(fields, entry)) for entry in emotions]
+
+    def save_user_profile(self, user_id, profile_data):
+        """保存用户画像数据
+
+        Args:
+            user_id: 用户ID
+            profile_data: 用户画像数据字典
+        """
+        try:
+            with self._lock:
+                profile = self.get_user_profile(user_id)
+                profile.update(profile_data)
+                profile["updated_at"] = datetime.now().isoformat()
+                self._profiles[user_id] = _encode(profile)
+
+        except Exception as e:
+            print(f"Error saving user profile: {str(e)}")
+
+    def get_user_profile(self, user_id):
+        """获取用户画像数据
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            dict: 用户画像数据
+        """
+        payload = self._profiles.get(user_id)
+        return _decode(payload) if payload is not None else {}
+
+    def _save_document(self, store, session_id, data, label):
+        try:
+            payload = _encode(data)
+            with self._lock:
+                store[session_id] = payload
+
+        except Exception as e:
+            print(f"Error saving {label}: {str(e)}")
+
+    @staticmethod
+    def _get_document(store, session_id):
+        payload = store.get(session_id)
+        return _decode(payload) if payload is not None else {}
+
+    def save_session_plan(self, session_id, plan_data):
+        """保存会话计划
+
+        Args:
+            session_id: 会话ID
+            plan_data: 计划数据
+        """
+        self._save_document(self._plans, session_id, plan_data, "session plan")
+
+    def get_session_plan(self, session_id):
+        """获取会话计划
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 会话计划数据
+        """
+        return self._get_document(self._plans, session_id)
+
+    def save_inquiry_result(self, session_id, inquiry_data):
+        """保存引导性询问结果
+
+        Args:
+            session_id: 会话ID
+            inquiry_data: 引导性询问结果数据
+        """
+        inquiry_data["saved_at"] = datetime.now().isoformat()
+        self._save_document(self._inquiries, session_id, inquiry_data, "inquiry result")
+
+    def get_inquiry_result(self, session_id):
+        """获取引导性询问结果
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 引导性询问结果数据
+        """
+        return self._get_document(self._inquiries, session_id)
+
+    def save_pattern_analysis(self, session_id, pattern_data):
+        """保存模式分析结果
+
+        Args:
+            session_id: 会话ID
+            pattern_data: 模式分析结果数据
+        """
+        pattern_data["saved_at"] = datetime.now().isoformat()
+        self._save_document(self._patterns, session_id, pattern_data, "pattern analysis")
+
+    def get_pattern_analysis(self, session_id):
+        """获取模式分析结果
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 模式分析结果数据
+        """
+        return self._get_document(self._patterns, session_id)
+
+    def save_inquiry_history(self, session_id, inquiry_data):
+        """保存引导性询问历史记录
+
+        Args:
+            session_id: 会话ID
+            inquiry_data: 引导性询问数据
+        """
+        try:
+            inquiry_data["timestamp"] = datetime.now().isoformat()
+            payload = _encode(inquiry_data)
+            with self._lock:
+                self._inquiry_history.setdefault(session_id, []).append(payload)
+
+        except Exception as e:
+            print(f"Error saving inquiry history: {str(e)}")
+
+    def get_inquiry_history(self, session_id, limit=None):
+        """获取引导性询问历史记录
+
+        Args:
+            session_id: 会话ID
+            limit: 获取的记录数量限制
+
+        Returns:
+            list: 引导性询问历史记录列表
+        """
+        with self._lock:
+            payloads = _tail(self._inquiry_history.get(session_id, []), limit)
+        return [_decode(payload) for payload in payloads]
+
+    def save_analysis_report(self, user_id, report_data):
+        """保存分析报告
+
+        Args:
+            user_id: 用户ID
+            report_data: 分析报告数据
+
+        Returns:
+            str: 报告ID
+        """
+        try:
+            report_data["saved_at"] = datetime.now().isoformat()
+            payload = _encode(report_data)
+            # 报告头由副本生成，不与调用方的数据共享引用
+            header = build_report_header(
+                new_report_id(), user_id, _decode(payload), len(payload)
+            )
+            with self._lock:
+                self._reports.setdefault(user_id, []).append((header, payload))
+            return header["id"]
+
+        except Exception as e:
+            print(f"Error saving analysis report: {str(e)}")
+
+    def get_latest_analysis_report(self, user_id):
+        """获取用户最新的分析报告
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            dict: 最新的分析报告数据
+        """
+        reports = self._reports.get(user_id)
+        return _decode(reports[-1][1]) if reports else {}
+
+    def get_analysis_reports_history(self, user_id, limit=None):
+        """获取用户的分析报告历史（只返回报告头）
+
+        Args:
+            user_id: 用户ID
+            limit: 获取的报告数量限制
+
+        Returns:
+            list: 报告头列表（最新的在前）
+        """
+        with self._lock:
+            reports = _tail(self._reports.get(user_id, []), limit)
+            return [dict(header) for header, _ in reversed(reports)]
+
+    def get_analysis_report(self, user_id, report_id):
+        """按报告ID获取完整的分析报告
+
+        Args:
+            user_id: 用户ID
+            report_id: 报告ID
+
+        Returns:
+            dict: 分析报告数据，不存在时为空字典
+        """
+        for header, payload in self._reports.get(user_id, []):
+            if header["id"] == report_id:
+                return _decode(payload)
+        return {}
+
+    def delete_user(self, user_id):
+        """删除用户的全部数据，每个会话单独加锁，返回值见 Database.delete_user"""
+        started = time.perf_counter()
+        result = {"sessions": 0, "bytes_reclaimed": 0}
+
+        with self._lock:
+            session_ids = list(self._by_user.pop(user_id, {}))
+        for session_id in session_ids:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+                self._message_counts.pop(session_id, None)
+                for store in (
+                    self._messages, self._events, self._moods, self._inquiry_history,
+                    self._plans, self._inquiries, self._patterns,
+                ):
+                    result["bytes_reclaimed"] += _payload_size(store.pop(session_id, None))
+            result["sessions"] += 1
+
+        with self._lock:
+            for store in (self._memories, self._emotions, self._profiles, self._reports):
+                result["bytes_reclaimed"] += _payload_size(store.pop(user_id, None))
+
+        result["elapsed_s"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def expire_records(self, entity, key, before=None, keep=None, match=None):
+        """按保留规则删除一个会话 / 用户的旧记录，参数和返回值见 Database.expire_records"""
+        result = {"expired": 0, "bytes_freed": 0, "oldest": None}
+        with self._lock:
+            if entity == "plan":
+                result["bytes_freed"] = _payload_size(self._plans.pop(key, None))
+                result["expired"] = 1 if result["bytes_freed"] else 0
+                return result
+
+            if entity == "inquiry_history":
+                store, to_record = self._inquiry_history, _decode
+            elif entity == "long_term_memory":
+                store = self._memories
+                to_record = lambda item: {"time": item[0], "content": item[1]}
+            elif entity == "reports":
+                store, to_record = self._reports, lambda item: item[0]
+            else:
+                raise ValueError(f"Unsupported retention entity: {entity}")
+
+            items = store.get(key, [])
+            expired, result["oldest"] = expired_positions(
+                [to_record(item) for item in items], record_time(entity), before, keep, match
+            )
+            if expired:
+                store[key] = [item for i, item in enumerate(items) if i not in expired]
+                result["expired"] = len(expired)
+                result["bytes_freed"] = sum(_payload_size(items[i]) for i in expired)
+        return result
+
+    def import_sessions(self, items):
+        """导入会话数据（数据迁移使用），参数和语义见 Database.import_sessions"""
+        with self._lock:
+            for session_id, meta, data in items:
+                user_id = meta.get("user_id")
+                self._sessions[session_id] = [
+                    user_id,
+                    meta.get("created_at"),
+                    meta.get("updated_at") or meta.get("created_at"),
+                ]
+                self._by_user.setdefault(user_id, {})[session_id] = None
+
+                if "chat_history" in data:
+                    self._messages[session_id] = [
+                        (m.get("role"), m.get("content"), m.get("timestamp"))
+                        for m in data["chat_history"]
+                    ]
+                    counts = {}
+                    for role, _, _ in self._messages[session_id]:
+                        counts[role] = counts.get(role, 0) + 1
+                    self._message_counts[session_id] = counts
+                if "events" in data:
+                    self._events[session_id] = OrderedDict(
+                        (event.get("id") or f"evt_{i}", _encode(event))
+                        for i, event in enumerate(data["events"])
+                    )
+                for kind, store in (("moods", self._moods), ("inquiry_history", self._inquiry_history)):
+                    if kind in data:
+                        store[session_id] = [_encode(item) for item in data[kind]]
+                for kind, store in (
+                    ("plan", self._plans),
+                    ("inquiry", self._inquiries),
+                    ("pattern", self._patterns),
+                ):
+                    if kind in data:
+                        if data[kind] is None:
+                            store.pop(session_id, None)
+                        else:
+                            store[session_id] = _encode(data[kind])
+
+    def import_users(self, items):
+        """导入用户数据（数据迁移使用），参数和语义见 Database.import_users"""
+        with self._lock:
+            for user_id, data in items:
+                if "profile" in data:
+                    if data["profile"] is None:
+                        self._profiles.pop(user_id, None)
+                    else:
+                        self._profiles[user_id] = _encode(data["profile"])
+                if "long_term_memory" in data:
+                    self._memories[user_id] = [
+                        (m.get("time"), m.get("content")) for m in data["long_term_memory"]
+                    ]
+                if "emotions" in data:
+                    self._emotions[user_id] = [
+                        (
+                            e.get("session_id"),
+                            e.get("emotion_score"),
+                            e.get("emotion_category"),
+                            e.get("timestamp"),
+                            to_epoch(e.get("timestamp")) or 0.0,
+                        )
+                        for e in data["emotions"]
+                    ]
+                if "reports" in data:
+                    reports = []
+                    for report_id, report_data in data["reports"]:
+                        payload = _encode(report_data)
+                        reports.append(
+                            (build_report_header(report_id, user_id, _decode(payload), len(payload)), payload)
+                        )
+                    self._reports[user_id] = reports
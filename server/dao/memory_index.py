@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+长期记忆的本地语义检索索引
+
+按用户在内存中维护长期记忆的向量索引，不依赖网络和模型：
+- 向量：字符 n-gram（中文片段的二元组、三元组，单个汉字保留单字；英文、数字按词）
+  哈希到 dim 个桶，词频取 1 + log(tf)，乘以 IDF 后做余弦相似度
+- 检索：只遍历查询命中的桶的倒排表；出现在超过一半记忆中的桶区分度很低，直接跳过
+- 增量更新：订阅变更流（dao.change_feed）记录有新记忆的用户，检索前只读取新增的记忆尾部，
+  并核对尾部之前的一条与索引中最后一条一致（不一致时整体重建）；没有变更流的后端每次检索前核对，
+  存储中的记忆数量少于索引时也整体重建；
+  记忆被删除（保留策略、删除用户）时丢弃该用户的索引
+- 文档范数在记忆数量翻倍时按最新的 IDF 重新计算，均摊后每条记忆 O(1)
+
+retrieve 返回与当前输入最相关的若干条记忆，总长度不超过给定的 token 预算，按时间正序排列。
+"""
+
+import math
+import heapq
+import threading
+from array import array
+from collections import Counter, OrderedDict
+
+from dao.search_index import is_cjk, segments
+
+# 每次核对时读取的最小尾部条数
+_TAIL_PROBE = 8
+
+# 出现在超过该比例的记忆中的桶在查询时跳过（记忆条数不少于 _MIN_DOCS_FOR_PRUNE 时）
+_MAX_DF_RATIO = 0.5
+_MIN_DOCS_FOR_PRUNE = 20
+
+# 截断的记忆至少保留多少 token，剩余预算更少时不再加入
+_MIN_SNIPPET_TOKENS = 32
+
+
+def estimate_tokens(text):
+    """粗略估计文本的 token 数：汉字按 1 个，其余字符按 4 个 1 个"""
+    text = text or ""
+    cjk = sum(len(segment) for segment in segments(text) if is_cjk(segment))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate(text, tokens):
+    """截取不超过 tokens 的前缀"""
+    used = 0
+    for position, char in enumerate(text):
+        used += 1 if is_cjk(char) else 0.25
+        if used > tokens:
+            return text[:position] + "…"
+    return text
+
+
+def features(text, dim):
+    """文本的哈希 n-gram 词频 {桶: 1 + log(tf)}"""
+    grams = []
+    for segment in segments(text):
+        if is_cjk(segment):
+            if len(segment) == 1:
+                grams.append(segment)
+            grams.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+            grams.extend(segment[i:i + 3] for i in range(len(segment) - 2))
+        else:
+            grams.append(segment)
+
+    counts = Counter(hash(gram) & (dim - 1) for gram in grams)
+    return {bucket: 1.0 + math.log(tf) for bucket, tf in counts.items()}
+
+
+class _UserMemories:
+    """单个用户的记忆向量索引"""
+
+    __slots__ = ("lock", "memories", "postings", "norms", "normed_at", "built")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空索引（保留锁）"""
+        self.memories = []
+        # 桶 -> (文档ID数组, 权重数组)
+        self.postings = {}
+        # 文档范数（按计算时的 IDF）
+        self.norms = array("d")
+        # 上次全部重新计算范数时的记忆条数
+        self.normed_at = 0
+        self.built = False
+
+    def idf(self, bucket):
+        entry = self.postings.get(bucket)
+        df = len(entry[0]) if entry is not None else 0
+        return math.log((len(self.memories) + 1) / (df + 1)) + 1.0
+
+    def add(self, memory, dim):
+        doc_id = len(self.memories)
+        self.memories.append(memory)
+        vector = features(memory.get("content"), dim)
+        for bucket, weight in vector.items():
+            entry = self.postings.get(bucket)
+            if entry is None:
+                entry = self.postings[bucket] = (array("I"), array("f"))
+            entry[0].append(doc_id)
+            entry[1].append(weight)
+
+        if len(self.memories) >= 2 * max(self.normed_at, 1):
+            self._renorm()
+        else:
+            self.norms.append(self._norm(vector))
+
+    def _norm(self, vector):
+        return math.sqrt(
+            sum((weight * self.idf(bucket)) ** 2 for bucket, weight in vector.items())
+        ) or 1.0
+
+    def _renorm(self):
+        """按当前的 IDF 重新计算全部文档范数"""
+        squares = [0.0] * len(self.memories)
+        for bucket, (doc_ids, weights) in self.postings.items():
+            idf = self.idf(bucket)
+            for doc_id, weight in zip(doc_ids, weights):
+                squares[doc_id] += (weight * idf) ** 2
+        self.norms = array("d", (math.sqrt(s) or 1.0 for s in squares))
+        self.normed_at = len(self.memories)
+
+
+class MemoryIndex:
+    """按用户的长期记忆相似度检索"""
+
+    def __init__(self, database, dim=1 << 20, max_users=256):
+        """初始化记忆索引
+
+        Args:
+            database: 存储后端（StorageBackend）
+            dim: 哈希桶数（2 的幂）
+            max_users: 内存中最多保留多少个用户的索引
+        """
+        if dim & (dim - 1):
+            raise ValueError("dim must be a power of two")
+        self.db = database
+        self.dim = dim
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        # 有新记忆待索引的用户
+        self._dirty = set()
+        self.stats = {"builds": 0, "indexed": 0, "queries": 0}
+
+        self.changes = getattr(database, "changes", None)
+        if self.changes is not None:
+            self.changes.subscribe(self._on_change, "long_term_memory")
+
+    def _on_change(self, change):
+        # 变更回调（可能在写操作的锁内执行），只记录用户ID
+        with self._lock:
+            user_id = change.get("user_id")
+            if user_id not in self._users:
+                return
+            if change.get("op") == "insert":
+                self._dirty.add(user_id)
+            else:
+                # 记忆被删除（保留策略、删除用户），下次检索时重建
+                self._users.pop(user_id, None)
+                self._dirty.discard(user_id)
+
+    def retrieve(self, user_id, query, k=5, token_budget=600, min_score=0.05):
+        """检索与 query 最相关的记忆
+
+        Args:
+            user_id: 用户ID
+            query: 当前的用户输入
+            k: 最多返回多少条记忆
+            token_budget: 返回的记忆内容总共不超过多少 token（超出的记忆截断或舍弃）
+            min_score: 最低余弦相似度
+
+        Returns:
+            list: [{"time", "content", "score"}, ...]，按时间正序排列
+        """
+        try:
+            index = self._user_index(user_id)
+            with index.lock:
+                self._refresh(user_id, index)
+                self.stats["queries"] += 1
+                ranked = self._rank(index, query, k, min_score)
+
+                selected = []
+                remaining = token_budget
+                for score, doc_id in ranked:
+                    memory = index.memories[doc_id]
+                    content = memory.get("content") or ""
+                    tokens = estimate_tokens(content)
+                    if tokens > remaining:
+                        if remaining < _MIN_SNIPPET_TOKENS:
+                            break
+                        content = _truncate(content, remaining)
+                        tokens = remaining
+                    remaining -= tokens
+                    selected.append(
+                        (doc_id, dict(memory, content=content, score=round(score, 4)))
+                    )
+
+            selected.sort(key=lambda item: item[0])
+            return [memory for _, memory in selected]
+
+        except Exception as e:
+            print(f"Error retrieving long term memory: {str(e)}")
+            return []
+
+    def invalidate(self, user_id=None):
+        """丢弃用户（None 表示全部用户）的索引，下次检索时重建"""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+                self._dirty.clear()
+            else:
+                self._users.pop(user_id, None)
+                self._dirty.discard(user_id)
+
+    # ---- 索引维护 ----
+
+    def _user_index(self, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+                return index
+            index = self._users[user_id] = _UserMemories()
+            while len(self._users) > self.max_users:
+                evicted, _ = self._users.popitem(last=False)
+                self._dirty.discard(evicted)
+            return index
+
+    def _refresh(self, user_id, index):
+        """把存储中新增的记忆加入索引，调用方需持有 index.lock"""
+        if self.changes is not None:
+            self.changes.poll()
+            with self._lock:
+                dirty = user_id in self._dirty
+                self._dirty.discard(user_id)
+            if index.built and not dirty:
+                return
+
+        if index.built:
+            # 没有变更流时靠记忆数量发现旧记忆被删除（先于尾部读取，并发追加只会让尾部更多）
+            count = self.db.get_long_term_memory_count(user_id) if self.changes is None else None
+            # 读取尾部，找到索引中最后一条记忆的位置，之后的即为新增的记忆
+            size = _TAIL_PROBE
+            last = index.memories[-1] if index.memories else None
+            while True:
+                tail = self.db.get_long_term_memory(user_id, size)
+                if last is None:
+                    start = 0 if len(tail) < size else None
+                else:
+                    start = next(
+                        (i + 1 for i in range(len(tail) - 1, -1, -1) if tail[i] == last),
+                        None,
+                    )
+                if start is not None and count is not None and (
+                    len(index.memories) + len(tail) - start > count
+                ):
+                    break
+                if start is not None:
+                    for memory in tail[start:]:
+                        index.add(memory, self.dim)
+                    self.stats["indexed"] += len(tail) - start
+                    return
+                if len(tail) < size:
+                    break
+                size *= 2
+
+        # 首次建立索引，或存储中的记忆与索引对不上（被清理、重写）时整体重建
+        memories = self.db.get_long_term_memory(user_id)
+        index.reset()
+        for memory in memories:
+            index.add(memory, self.dim)
+        index.built = True
+        self.stats["builds"] += 1
+        self.stats["indexed"] += len(memories)
+
+    # ---- 检索 ----
+
+    def _rank(self, index, query, k, min_score):
+        """返回 [(相似度, 文档ID), ...]，相似度从高到低"""
+        doc_count = len(index.memories)
+        if not doc_count or k <= 0:
+            return []
+
+        vector = features(query, self.dim)
+        max_df = doc_count * _MAX_DF_RATIO if doc_count >= _MIN_DOCS_FOR_PRUNE else doc_count
+
+        scores = {}
+        query_norm = 0.0
+        for bucket, weight in vector.items():
+            idf = index.idf(bucket)
+            query_norm += (weight * idf) ** 2
+            entry = index.postings.get(bucket)
+            if entry is None or len(entry[0]) > max_df:
+                continue
+            factor = weight * idf * idf
+            for doc_id, doc_weight in zip(*entry):
+                scores[doc_id] = scores.get(doc_id, 0.0) + factor * doc_weight
+        if not scores:
+            return []
+
+        query_norm = math.sqrt(query_norm) or 1.0
+        norms = index.norms
+        ranked = heapq.nlargest(
+            k, ((score / (query_norm * norms[doc_id]), doc_id) for doc_id, score in scores.items())
+        )
+        return [(score, doc_id) for score, doc_id in ranked if score >= min_score]
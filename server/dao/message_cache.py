@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+最近消息的内存环形缓存
+
+每个会话在内存中保留最近 capacity 条消息（紧凑的 __slots__ 记录），
+get_chat_history(limit) 在缓存覆盖所需范围时不读取消息日志：
+
+- 写入：save_message 追加消息后把消息放入缓存（超出 capacity 时丢弃最旧的一条）
+- 读取：缓存记录了会话的消息总数，与消息日志的条数（偏移索引的大小，一次 stat）一致时
+  直接返回；不一致（其他进程写入、数据被替换）时读取日志并重新填充
+- 内存上限：按字符串实际占用估算每条消息的字节数，总量超过 max_bytes 时按会话
+  LRU 淘汰；capacity 或 max_bytes 为 0 时关闭缓存
+"""
+
+import sys
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+
+# 单条缓存记录（对象本身和 deque 槽位）的固定开销
+_RECORD_OVERHEAD = 96
+# 单个会话缓存（对象、deque、LRU 条目）的固定开销
+_RING_OVERHEAD = 1024
+
+_FIELDS = ("role", "content", "timestamp")
+
+
+class _CachedMessage:
+    """一条缓存的消息"""
+
+    __slots__ = ("role", "content", "timestamp", "extra", "size")
+
+    def __init__(self, message):
+        self.role = message.get("role")
+        self.content = message.get("content")
+        self.timestamp = message.get("timestamp")
+        # 三个常规字段以外的字段（迁移或导入的旧数据）
+        extra = {k: v for k, v in message.items() if k not in _FIELDS}
+        self.extra = extra or None
+        self.size = _RECORD_OVERHEAD + sum(
+            sys.getsizeof(value) for value in (self.content, self.timestamp)
+            if isinstance(value, str)
+        ) + (sys.getsizeof(extra) if extra else 0)
+
+    def to_dict(self):
+        message = {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+        if self.extra:
+            message.update(self.extra)
+        return message
+
+
+class _SessionRing:
+    """单个会话最近的消息"""
+
+    __slots__ = ("messages", "total", "size")
+
+    def __init__(self):
+        self.messages = deque()
+        # 会话的消息总数（缓存中的是其中最后的 len(messages) 条）
+        self.total = 0
+        self.size = _RING_OVERHEAD
+
+
+class RecentMessageCache:
+    """按会话的最近消息缓存"""
+
+    def __init__(self, capacity=64, max_bytes=64 * 1024 * 1024):
+        """初始化缓存
+
+        Args:
+            capacity: 每个会话最多缓存多少条消息
+            max_bytes: 所有会话的缓存总共最多占用多少字节（估算）
+        """
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.enabled = capacity > 0 and max_bytes > 0
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def append(self, session_id, messages, total):
+        """消息写入日志后放入缓存
+
+        Args:
+            session_id: 会话ID
+            messages: 新追加的消息
+            total: 追加后会话的消息总数
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            ring = self._rings.get(session_id)
+            if ring is None or ring.total + len(messages) != total:
+                # 缓存落后于日志（其他进程写入过），只保留这次的消息
+                self._drop_locked(session_id)
+                ring = self._new_ring_locked(session_id)
+            else:
+                self._rings.move_to_end(session_id)
+            self._extend_locked(ring, messages)
+            ring.total = total
+            self._evict_locked()
+
+    def get(self, session_id, limit, total):
+        """从缓存读取最近 limit 条消息
+
+        Args:
+            session_id: 会话ID
+            limit: 最多返回最近的多少条，None表示全部
+            total: 日志中的消息总数
+
+        Returns:
+            list: 消息列表；缓存不能覆盖所需范围时返回 None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            ring = self._rings.get(session_id)
+            if ring is not None and ring.total == total:
+                cached = len(ring.messages)
+                if limit is not None and 0 < limit <= cached:
+                    self._rings.move_to_end(session_id)
+                    self.stats["hits"] += 1
+                    return [m.to_dict() for m in islice(ring.messages, cached - limit, None)]
+                if cached == total:
+                    self._rings.move_to_end(session_id)
+                    self.stats["hits"] += 1
+                    return [m.to_dict() for m in ring.messages]
+            self.stats["misses"] += 1
+            return None
+
+    def fill(self, session_id, messages, total):
+        """用从日志读取的最近消息填充缓存
+
+        Args:
+            session_id: 会话ID
+            messages: 日志中最后的若干条消息
+            total: 读取时日志中的消息总数
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._drop_locked(session_id)
+            ring = self._new_ring_locked(session_id)
+            self._extend_locked(ring, messages[-self.capacity:])
+            ring.total = total
+            self._evict_locked()
+
+    def discard(self, session_id):
+        """丢弃会话的缓存（消息被替换或删除时）"""
+        with self._lock:
+            self._drop_locked(session_id)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._rings.clear()
+            self.bytes = 0
+
+    def _new_ring_locked(self, session_id):
+        ring = self._rings[session_id] = _SessionRing()
+        self.bytes += ring.size
+        return ring
+
+    def _extend_locked(self, ring, messages):
+        for message in messages:
+            record = _CachedMessage(message)
+            ring.messages.append(record)
+            ring.size += record.size
+            self.bytes += record.size
+            if len(ring.messages) > self.capacity:
+                oldest = ring.messages.popleft()
+                ring.size -= oldest.size
+                self.bytes -= oldest.size
+
+    def _drop_locked(self, session_id):
+        ring = self._rings.pop(session_id, None)
+        if ring is not None:
+            self.bytes -= ring.size
+
+    def _evict_locked(self):
+        while self.bytes > self.max_bytes and self._rings:
+            _, ring = self._rings.popitem(last=False)
+            self.bytes -= ring.size
+            self.stats["evictions"] += 1
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按用户索引的分析报告存储
+
+目录结构：
+    analysis_reports/
+    ├── index/<user_id>.jsonl     # 报告头索引（追加写，每份报告一行）
+    ├── index/<user_id>.idx
+    └── <user_id>/<report_id>.json.gz   # gzip 压缩的报告正文
+
+报告头包含 id、生成时间、大小、分析周期和核心指标（报告的 metadata），
+因此“最新报告”只需读取索引最后一行，历史列表只返回报告头，正文按需加载。
+旧版 analysis_reports/<user_id>_<时间戳>.json 文件在启动时迁移到新结构。
+"""
+
+import os
+import gzip
+import uuid
+import hashlib
+from datetime import datetime
+
+from dao.append_log import AppendLog
+from dao.atomic_file import BACKUP_SUFFIX, AtomicFileWriter, remove_tree
+from utils import json_codec
+
+
+def new_report_id():
+    """生成报告ID（按时间递增）"""
+    return f"rpt_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+
+def legacy_report_id(stamp, filename):
+    """旧版报告文件的报告ID（由文件名确定，重复迁移得到相同的ID）
+
+    Args:
+        stamp: 文件名中的时间戳（YYYYmmdd_HHMMSS）
+        filename: 旧版报告的文件名
+    """
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    return f"rpt_{stamp}_{digest[:8]}"
+
+
+def build_report_header(report_id, user_id, report_data, size, stored_size=None):
+    """根据报告正文生成报告头
+
+    Args:
+        report_id: 报告ID
+        user_id: 用户ID
+        report_data: 报告正文
+        size: 正文JSON的字节数
+        stored_size: 压缩后实际占用的字节数
+
+    Returns:
+        dict: 报告头
+    """
+    return {
+        "id": report_id,
+        "user_id": user_id,
+        "report_type": report_data.get("report_type"),
+        "generated_at": report_data.get("generated_at"),
+        "saved_at": report_data.get("saved_at"),
+        "period": report_data.get("analysis_period"),
+        "metrics": report_data.get("metadata", {}),
+        "size": size,
+        "stored_size": stored_size if stored_size is not None else size,
+    }
+
+
+class ReportStore:
+    """分析报告存储：报告头索引 + 压缩正文"""
+
+    def __init__(self, reports_dir, writer=None, compresslevel=6):
+        """初始化报告存储
+
+        Args:
+            reports_dir: 报告目录
+            writer: 正文文件写入器（AtomicFileWriter）
+            compresslevel: gzip 压缩级别
+        """
+        self.reports_dir = reports_dir
+        self.writer = writer or AtomicFileWriter()
+        self.compresslevel = compresslevel
+        self.index = AppendLog(os.path.join(reports_dir, "index"))
+        os.makedirs(self.index.log_dir, exist_ok=True)
+
+    def body_path(self, user_id, report_id):
+        """获取报告正文文件路径"""
+        return os.path.join(self.reports_dir, user_id, f"{report_id}.json.gz")
+
+    def save(self, user_id, report_data, report_id=None):
+        """保存报告正文并追加报告头
+
+        Args:
+            user_id: 用户ID
+            report_data: 报告正文
+            report_id: 报告ID，默认自动生成
+
+        Returns:
+            dict: 报告头
+        """
+        report_id = report_id or new_report_id()
+        payload = json_codec.dumps_bytes(report_data)
+        compressed = gzip.compress(payload, compresslevel=self.compresslevel)
+
+        body_file = self.body_path(user_id, report_id)
+        os.makedirs(os.path.dirname(body_file), exist_ok=True)
+        # 先写正文再写索引，索引中出现的报告一定可以读取
+        self.writer.write_bytes(body_file, compressed)
+
+        header = build_report_header(
+            report_id, user_id, report_data, len(payload), len(compressed)
+        )
+        self.index.append(user_id, header)
+        return header
+
+    def replace(self, user_id, reports):
+        """用给定的报告替换用户的全部报告（数据迁移时使用，可重复执行）
+
+        Args:
+            user_id: 用户ID
+            reports: [(报告ID, 报告正文), ...]，按时间正序排列
+        """
+        headers = []
+        for report_id, report_data in reports:
+            payload = json_codec.dumps_bytes(report_data)
+            compressed = gzip.compress(payload, compresslevel=self.compresslevel)
+            body_file = self.body_path(user_id, report_id)
+            os.makedirs(os.path.dirname(body_file), exist_ok=True)
+            self.writer.write_bytes(body_file, compressed)
+            headers.append(
+                build_report_header(
+                    report_id, user_id, report_data, len(payload), len(compressed)
+                )
+            )
+        if headers:
+            self.index.write_all(user_id, headers)
+        else:
+            self.index.remove(user_id)
+
+    def remove_reports(self, user_id, report_ids):
+        """删除用户的部分报告（重写报告头索引并删除正文），返回删除的字节数"""
+        report_ids = set(report_ids)
+        headers = self.index.read(user_id)
+        remaining = [h for h in headers if h["id"] not in report_ids]
+        if remaining:
+            size = os.path.getsize(self.index.log_path(user_id))
+            self.index.write_all(user_id, remaining)
+            removed = size - os.path.getsize(self.index.log_path(user_id))
+        else:
+            removed = self.index.remove(user_id)
+
+        for report_id in report_ids:
+            path = self.body_path(user_id, report_id)
+            for stale in (path, path + BACKUP_SUFFIX):
+                try:
+                    removed += os.path.getsize(stale)
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def remove_user(self, user_id):
+        """删除用户的全部报告（报告头索引和正文），返回删除的字节数"""
+        return self.index.remove(user_id) + remove_tree(os.path.join(self.reports_dir, user_id))
+
+    def headers(self, user_id, limit=None):
+        """获取报告头列表（最新的在前）
+
+        Args:
+            user_id: 用户ID
+            limit: 数量限制
+
+        Returns:
+            list: 报告头列表
+        """
+        headers = self.index.read(user_id, limit)
+        headers.reverse()
+        return headers
+
+    def latest(self, user_id):
+        """获取最新一份报告的报告头，没有报告时返回 None"""
+        headers = self.index.read(user_id, 1)
+        return headers[0] if headers else None
+
+    def load(self, user_id, report_id):
+        """加载报告正文，不存在时返回 None"""
+        try:
+            with open(self.body_path(user_id, report_id), "rb") as f:
+                return json_codec.loads(gzip.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+
+    def migrate_legacy(self):
+        """把旧版 <user_id>_<时间戳>.json 报告迁移到新结构（按时间顺序），完成后删除旧文件
+
+        报告ID由文件名确定；迁移中途崩溃后重新迁移时，报告头索引中已有的报告不再重复保存。
+
+        Returns:
+            int: 迁移的报告数量
+        """
+        legacy = []
+        for entry in os.scandir(self.reports_dir):
+            if not entry.is_file() or not entry.name.endswith(".json"):
+                continue
+            parts = entry.name[: -len(".json")].rsplit("_", 2)
+            if len(parts) != 3:
+                continue
+            user_id, date_part, time_part = parts
+            legacy.append((user_id, f"{date_part}_{time_part}", entry.path))
+
+        existing = {}
+        for user_id, stamp, path in sorted(legacy, key=lambda item: (item[0], item[1])):
+            if user_id not in existing:
+                existing[user_id] = {header["id"] for header in self.headers(user_id)}
+            report_id = legacy_report_id(stamp, os.path.basename(path))
+            if report_id not in existing[user_id]:
+                report_data = self.writer.read_json(path)
+                if report_data is not None:
+                    self.save(user_id, report_data, report_id)
+            os.remove(path)
+            if os.path.exists(path + BACKUP_SUFFIX):
+                os.remove(path + BACKUP_SUFFIX)
+
+        if legacy:
+            print(f"Migrated {len(legacy)} analysis reports into per-user index")
+        return len(legacy)
+
+    def has_legacy(self):
+        """目录顶层是否还有旧版报告文件"""
+        try:
+            return any(
+                entry.is_file() and entry.name.endswith(".json")
+                for entry in os.scandir(self.reports_dir)
+            )
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据保留策略与后台清理（janitor）
+
+按数据种类声明保留规则（最长保留时间、每个会话 / 用户最多保留的条数），由低优先级的
+后台线程按限速逐个会话 / 用户执行，存储和扫描的开销随活跃窗口而不是全部历史增长：
+
+    RETENTION_RULES='{"inquiry_history": {"max_age_days": 90, "max_count": 50},
+                      "plan": {"max_age_days": 180},
+                      "reports": {"max_count": 12},
+                      "crisis_memory": {"max_age_days": 365}}'
+
+- inquiry_history：每个会话的引导性询问历史（max_count 为每个会话的条数）
+- plan：会话计划，会话超过 max_age_days 没有更新时删除
+- reports：每个用户的分析报告（max_count 为每个用户的份数）
+- crisis_memory：长期记忆中的危机记录（[CRISIS-...] 开头，max_count 为每个用户的条数）
+
+已归档的会话不处理。清理按键限速（RETENTION_MAX_KEYS_PER_S），两遍之间间隔
+RETENTION_INTERVAL_S 秒；支持变更流的后端上，订阅变更记录有新写入的会话 / 用户，
+没有新写入且还没到下一条记录过期时间的直接跳过。
+"""
+
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from dao.locks import FileLock
+from dao.time_range import to_epoch
+from utils import json_codec
+
+_DAY = 86400.0
+
+CRISIS_PREFIX = "[CRISIS-"
+
+
+def is_crisis_memory(memory):
+    """长期记忆是否为危机记录"""
+    return (memory.get("content") or "").startswith(CRISIS_PREFIX)
+
+
+# 数据种类 -> (作用范围, 存储中的数据种类, 记录过滤条件)
+ENTITIES = {
+    "inquiry_history": ("session", "inquiry_history", None),
+    "plan": ("session", "plan", None),
+    "reports": ("user", "reports", None),
+    "crisis_memory": ("user", "long_term_memory", is_crisis_memory),
+}
+
+
+@dataclass
+class RetentionRule:
+    """一种数据的保留规则"""
+
+    entity: str
+    max_age_days: Optional[float] = None
+    max_count: Optional[int] = None
+
+    @property
+    def scope(self):
+        return ENTITIES[self.entity][0]
+
+    @property
+    def storage_entity(self):
+        return ENTITIES[self.entity][1]
+
+    @property
+    def match(self):
+        return ENTITIES[self.entity][2]
+
+    def cutoff(self, now):
+        """早于该时间（epoch 秒）的记录过期，没有时间限制时为 None"""
+        if self.max_age_days is None:
+            return None
+        return now - self.max_age_days * _DAY
+
+
+def parse_rules(config):
+    """解析保留规则
+
+    Args:
+        config: {数据种类: {"max_age_days", "max_count"}} 或其 JSON 字符串
+
+    Returns:
+        list: RetentionRule 列表
+
+    Raises:
+        ValueError: 未知的数据种类或参数
+    """
+    if isinstance(config, str):
+        config = json_codec.loads(config) if config.strip() else {}
+    rules = []
+    for entity, options in (config or {}).items():
+        if entity not in ENTITIES:
+            raise ValueError(f"Unknown retention entity: {entity} (available: {', '.join(ENTITIES)})")
+        unknown = set(options) - {"max_age_days", "max_count"}
+        if unknown:
+            raise ValueError(f"Unknown retention options for {entity}: {sorted(unknown)}")
+        rule = RetentionRule(entity, options.get("max_age_days"), options.get("max_count"))
+        if rule.max_age_days is None and rule.max_count is None:
+            continue
+        if rule.entity == "plan" and rule.max_count is not None:
+            raise ValueError("plan only supports max_age_days")
+        rules.append(rule)
+    return rules
+
+
+def expired_positions(records, time_of, before=None, keep=None, match=None):
+    """按保留规则选出过期的记录
+
+    Args:
+        records: 按时间正序排列的记录
+        time_of: 记录 -> epoch 秒（无法确定时为 None，这样的记录不按时间过期）
+        before: 早于该时间的记录过期
+        keep: 只保留最近的 keep 条
+        match: 只考虑满足条件的记录，None表示全部
+
+    Returns:
+        (过期记录的下标集合, 保留的记录中最早的时间)
+    """
+    candidates = [i for i, record in enumerate(records) if match is None or match(record)]
+    expired = set()
+    if keep is not None and len(candidates) > keep:
+        expired.update(candidates[: len(candidates) - keep])
+    oldest = None
+    for i in candidates:
+        if i in expired:
+            continue
+        value = time_of(records[i])
+        if value is None:
+            continue
+        if before is not None and value < before:
+            expired.add(i)
+        elif oldest is None or value < oldest:
+            oldest = value
+    return expired, oldest
+
+
+def record_time(storage_entity):
+    """存储中各数据种类记录的时间"""
+    field = {
+        "inquiry_history": "timestamp",
+        "long_term_memory": "time",
+    }.get(storage_entity)
+    if field is not None:
+        return lambda record: to_epoch(record.get(field))
+    # 报告头
+    return lambda header: to_epoch(header.get("saved_at") or header.get("generated_at"))
+
+
+class RetentionJanitor:
+    """按保留规则清理过期数据的后台任务"""
+
+    def __init__(self, database, rules, interval=3600.0, max_keys_per_s=20.0, on_expired=None):
+        """初始化
+
+        Args:
+            database: 存储后端（StorageBackend），需要支持 expire_records
+            rules: RetentionRule 列表
+            interval: 两遍清理之间的间隔（秒）
+            max_keys_per_s: 每秒最多处理多少个会话 / 用户
+            on_expired: 有记录过期时的回调 on_expired(数据种类, 用户ID)，
+                        用于失效没有订阅变更流的进程内缓存
+        """
+        self.db = database
+        self.rules = list(rules)
+        self.interval = interval
+        self.max_keys_per_s = max_keys_per_s
+        self.on_expired = on_expired
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # (数据种类, 会话ID/用户ID) -> 下一条记录的过期时间
+        self._checked = {}
+        # 上次处理之后有新写入的 (存储中的数据种类, 会话ID/用户ID)
+        self._dirty = set()
+        self.stats = {
+            "passes": 0,
+            "keys_checked": 0,
+            "keys_skipped": 0,
+            "expired": {rule.entity: 0 for rule in self.rules},
+            "bytes_freed": {rule.entity: 0 for rule in self.rules},
+            "errors": 0,
+            "last_pass": None,
+        }
+
+        lock_dir = getattr(database, "lock_dir", None)
+        self._pass_lock = (
+            FileLock(os.path.join(lock_dir, "retention.lock")) if lock_dir else None
+        )
+
+        self.changes = getattr(database, "changes", None)
+        if self.changes is not None:
+            self.changes.subscribe(
+                self._on_change, {rule.storage_entity for rule in self.rules}
+            )
+
+    def _on_change(self, change):
+        # 变更回调（可能在写操作的锁内执行），只记录键；删除（包括清理本身）不会产生新的过期记录
+        if change.get("op") != "delete":
+            with self._lock:
+                self._dirty.add((change["entity"], change["key"]))
+
+    def run_once(self):
+        """执行一遍清理
+
+        Returns:
+            dict: 本遍的统计 {"keys_checked", "keys_skipped", "expired", "bytes_freed", "elapsed_s"}
+        """
+        if self._pass_lock is None:
+            return self._run_pass()
+        # 多个工作进程共享数据目录时同一时间只有一个在清理
+        with self._pass_lock.exclusive():
+            return self._run_pass()
+
+    def _run_pass(self):
+        started = time.perf_counter()
+        result = {"keys_checked": 0, "keys_skipped": 0, "expired": 0, "bytes_freed": 0}
+        if self.changes is not None:
+            # 读入其他进程写入的变更
+            self.changes.poll()
+        sessions = self.db.get_sessions()
+        users = sorted({meta.get("user_id") for meta in sessions.values()} - {None})
+
+        for rule in self.rules:
+            if rule.scope == "session":
+                keys = [
+                    (session_id, meta.get("user_id"), meta)
+                    for session_id, meta in sessions.items()
+                    if not meta.get("archived_at")
+                ]
+            else:
+                keys = [(user_id, user_id, None) for user_id in users]
+
+            for key, user_id, meta in keys:
+                if self._stop.is_set():
+                    break
+                now = time.time()
+                if self.changes is not None:
+                    with self._lock:
+                        dirty = (rule.storage_entity, key) in self._dirty
+                        self._dirty.discard((rule.storage_entity, key))
+                    next_expiry = self._checked.get((rule.entity, key))
+                    if not dirty and next_expiry is not None and now < next_expiry:
+                        result["keys_skipped"] += 1
+                        continue
+
+                try:
+                    stats = self._apply(rule, key, meta, now)
+                except Exception as e:
+                    print(f"Error applying retention rule {rule.entity} to {key}: {str(e)}")
+                    self.stats["errors"] += 1
+                    continue
+
+                result["keys_checked"] += 1
+                result["expired"] += stats["expired"]
+                result["bytes_freed"] += stats["bytes_freed"]
+                self.stats["expired"][rule.entity] += stats["expired"]
+                self.stats["bytes_freed"][rule.entity] += stats["bytes_freed"]
+                if stats["expired"] and self.on_expired is not None:
+                    self.on_expired(rule.entity, user_id)
+                self._checked[(rule.entity, key)] = stats["next_expiry"]
+                self._throttle()
+
+        # 已经不存在的会话 / 用户
+        live = set(sessions) | set(users)
+        for checked_key in [k for k in self._checked if k[1] not in live]:
+            del self._checked[checked_key]
+
+        result["elapsed_s"] = round(time.perf_counter() - started, 3)
+        self.stats["passes"] += 1
+        self.stats["keys_checked"] += result["keys_checked"]
+        self.stats["keys_skipped"] += result["keys_skipped"]
+        self.stats["last_pass"] = result
+        if result["expired"]:
+            print(f"Retention janitor expired {result['expired']} records: {result}")
+        return result
+
+    def _apply(self, rule, key, meta, now):
+        """对一个会话 / 用户执行规则，返回 {"expired", "bytes_freed", "next_expiry"}"""
+        cutoff = rule.cutoff(now)
+        if rule.entity == "plan":
+            # 计划只有一份，会话长时间没有更新时整体删除
+            updated = to_epoch((meta or {}).get("updated_at"))
+            if updated is None or updated >= cutoff:
+                next_expiry = (updated or now) + rule.max_age_days * _DAY
+                return {"expired": 0, "bytes_freed": 0, "next_expiry": next_expiry}
+            stats = self.db.expire_records("plan", key)
+            return dict(stats, next_expiry=float("inf"))
+
+        stats = self.db.expire_records(
+            rule.storage_entity, key, before=cutoff, keep=rule.max_count, match=rule.match
+        )
+        oldest = stats.get("oldest")
+        if rule.max_age_days is None or oldest is None:
+            next_expiry = float("inf")
+        else:
+            next_expiry = oldest + rule.max_age_days * _DAY
+        return {
+            "expired": stats["expired"],
+            "bytes_freed": stats["bytes_freed"],
+            "next_expiry": next_expiry,
+        }
+
+    def _throttle(self):
+        if self.max_keys_per_s > 0:
+            self._stop.wait(1.0 / self.max_keys_per_s)
+
+    def start(self):
+        """启动后台线程"""
+        if self._thread is not None or not self.rules:
+            return
+        self._thread = threading.Thread(target=self._run, name="retention-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程（当前处理的会话 / 用户完成后退出）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.changes is not None:
+            self.changes.unsubscribe(self._on_change)
+
+    def _run(self):
+        try:
+            # Linux 上线程有独立的 nice 值，降低清理线程的调度优先级
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error running retention janitor: {str(e)}")
+
+
+def start_janitor(database, on_expired=None):
+    """按环境变量（RETENTION_RULES 等）启动后台清理，没有配置规则时返回 None"""
+    rules = parse_rules(os.environ.get("RETENTION_RULES", ""))
+    if not rules:
+        return None
+    janitor = RetentionJanitor(
+        database,
+        rules,
+        interval=float(os.environ.get("RETENTION_INTERVAL_S", "3600")),
+        max_keys_per_s=float(os.environ.get("RETENTION_MAX_KEYS_PER_S", "20")),
+        on_expired=on_expired,
+    )
+    janitor.start()
+    return janitor
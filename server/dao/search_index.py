@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+用户对话的全文检索索引
+
+按用户在内存中维护消息内容的倒排索引：
+- 中文按字切成二元组（bigram），只有一个汉字的片段保留单字；英文、数字按词切分并转小写
+- 检索时所有词项都必须命中，再按原文逐段校验（保证多字查询是连续出现的），
+  用 BM25 打分，分数相同时较新的消息在前
+- 首次检索某个用户时从存储读入其全部会话建立索引，之后增量更新：
+  订阅变更流（dao.change_feed）记录有新消息的会话，检索前只读取这些会话新增的消息；
+  没有变更流的后端在检索前比较各会话的消息数量
+- 最近检索的 max_users 个用户的索引保留在内存中（LRU）
+
+只追加新消息，不修改已有的消息；会话的消息数量减少（清理、删除）时重建该会话的索引。
+"""
+
+import re
+import math
+import heapq
+import threading
+from array import array
+from collections import Counter, OrderedDict
+
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_SEGMENT = re.compile(f"[{_CJK}]+|[^\\W_{_CJK}]+")
+_CJK_SEGMENT = re.compile(f"[{_CJK}]+")
+
+# BM25 参数
+_K1 = 1.2
+_B = 0.75
+
+# 追加新消息时读取的尾部与消息数量不一致（读取期间又有写入）时的重试次数
+_CATCH_UP_RETRIES = 3
+
+
+def segments(text):
+    """把文本切成连续的中文片段和英文/数字词（小写）"""
+    return _SEGMENT.findall((text or "").lower())
+
+
+def is_cjk(text):
+    """文本是否全部由汉字组成"""
+    return bool(_CJK_SEGMENT.fullmatch(text))
+
+
+def tokenize(text):
+    """把文本切成检索词项：中文片段切成二元组，单个汉字保留单字，其余按词"""
+    terms = []
+    for segment in segments(text):
+        if len(segment) > 1 and _CJK_SEGMENT.fullmatch(segment):
+            terms.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            terms.append(segment)
+    return terms
+
+
+class _UserIndex:
+    """单个用户的倒排索引"""
+
+    __slots__ = (
+        "lock", "docs", "lengths", "total_length", "live",
+        "postings", "chars", "sessions", "built",
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # 文档ID（按加入顺序递增）-> (会话ID, 会话内序号, 消息)，已删除的为 None
+        self.docs = []
+        self.lengths = array("I")
+        self.total_length = 0
+        self.live = 0
+        # 词项 -> (文档ID数组, 词频数组)，文档ID递增
+        self.postings = {}
+        # 汉字 -> 包含该字的二元组，检索单个汉字时直接查找
+        self.chars = {}
+        # 会话ID -> 已索引的消息数量
+        self.sessions = {}
+        # 是否已从存储建立过索引
+        self.built = False
+
+    def add(self, session_id, position, message):
+        doc_id = len(self.docs)
+        counts = Counter(tokenize(message.get("content")))
+        self.docs.append((session_id, position, message))
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.total_length += length
+        self.live += 1
+        for term, tf in counts.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("I"), array("I"))
+                if len(term) == 2 and _CJK_SEGMENT.fullmatch(term):
+                    for char in set(term):
+                        self.chars.setdefault(char, []).append(term)
+            entry[0].append(doc_id)
+            entry[1].append(tf)
+
+    def drop_session(self, session_id):
+        """删除会话的全部文档（倒排表中的条目在检索时跳过，过多时整体重建）"""
+        for doc_id, doc in enumerate(self.docs):
+            if doc is not None and doc[0] == session_id:
+                self.docs[doc_id] = None
+                self.total_length -= self.lengths[doc_id]
+                self.live -= 1
+        self.sessions.pop(session_id, None)
+        if self.live * 2 < len(self.docs):
+            self._rebuild()
+
+    def _rebuild(self):
+        docs = [doc for doc in self.docs if doc is not None]
+        self.docs, self.lengths, self.total_length, self.live = [], array("I"), 0, 0
+        self.postings, self.chars = {}, {}
+        for session_id, position, message in docs:
+            self.add(session_id, position, message)
+
+
+class SearchIndex:
+    """按用户的消息全文检索"""
+
+    def __init__(self, database, max_users=128):
+        """初始化检索索引
+
+        Args:
+            database: 存储后端（StorageBackend）
+            max_users: 内存中最多保留多少个用户的索引
+        """
+        self.db = database
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        # user_id -> 有新消息待索引的会话ID集合（由变更流回调填写）
+        self._dirty = {}
+        self.stats = {"builds": 0, "indexed": 0, "queries": 0}
+
+        self.changes = getattr(database, "changes", None)
+        if self.changes is not None:
+            self.changes.subscribe(self._on_change, ("chat_history", "sessions"))
+
+    def _on_change(self, change):
+        # 变更回调（可能在写操作的锁内执行），只记录会话ID
+        user_id = change.get("user_id")
+        with self._lock:
+            if user_id in self._users:
+                self._dirty.setdefault(user_id, set()).add(change["key"])
+
+    def search(self, user_id, query, offset=0, limit=20, session_id=None):
+        """检索用户的消息
+
+        Args:
+            user_id: 用户ID
+            query: 检索词，多个词之间用空格分隔（全部命中）
+            offset: 跳过前多少条结果
+            limit: 最多返回多少条结果
+            session_id: 只检索该会话
+
+        Returns:
+            dict: {"total": 命中总数, "hits": [{"session_id", "index", "role", "content",
+                  "timestamp", "snippet", "score"}, ...]}
+        """
+        terms = set(tokenize(query))
+        phrases = segments(query)
+        if not terms:
+            return {"total": 0, "hits": []}
+
+        index = self._user_index(user_id)
+        with index.lock:
+            self._refresh(user_id, index)
+            self.stats["queries"] += 1
+            scored = self._score(index, terms, phrases, session_id)
+            # 分数相同时文档ID大（较新）的在前
+            top = heapq.nlargest(offset + limit, scored)
+
+            hits = []
+            for score, doc_id in top[offset:]:
+                doc_session, position, message = index.docs[doc_id]
+                hits.append({
+                    "session_id": doc_session,
+                    "index": position,
+                    "role": message.get("role"),
+                    "content": message.get("content"),
+                    "timestamp": message.get("timestamp"),
+                    "snippet": _snippet(message.get("content") or "", phrases),
+                    "score": round(score, 4),
+                })
+            return {"total": len(scored), "hits": hits}
+
+    def invalidate(self, user_id=None):
+        """丢弃用户（None 表示全部用户）的索引，下次检索时重建"""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+                self._dirty.clear()
+            else:
+                self._users.pop(user_id, None)
+                self._dirty.pop(user_id, None)
+
+    # ---- 索引维护 ----
+
+    def _user_index(self, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+                return index
+            index = self._users[user_id] = _UserIndex()
+            self._dirty.pop(user_id, None)
+            while len(self._users) > self.max_users:
+                evicted, _ = self._users.popitem(last=False)
+                self._dirty.pop(evicted, None)
+            return index
+
+    def _refresh(self, user_id, index):
+        """把存储中新增的消息加入索引，调用方需持有 index.lock"""
+        if self.changes is not None and index.built:
+            # 读入其他进程写入的变更，只检查有变更的会话
+            self.changes.poll()
+            with self._lock:
+                dirty = self._dirty.pop(user_id, set())
+            if not dirty:
+                return
+            sessions = self.db.get_sessions(user_id)
+            for session_id in dirty:
+                if session_id in sessions:
+                    if not self._catch_up(index, session_id):
+                        with self._lock:
+                            self._dirty.setdefault(user_id, set()).add(session_id)
+                elif session_id in index.sessions:
+                    index.drop_session(session_id)
+            return
+
+        # 首次建立索引，或没有变更流时逐个会话比较消息数量
+        if not index.built:
+            self.stats["builds"] += 1
+            index.built = True
+        if self.changes is not None:
+            self.changes.poll()
+            with self._lock:
+                self._dirty.pop(user_id, None)
+        sessions = self.db.get_sessions(user_id)
+        for session_id in list(index.sessions):
+            if session_id not in sessions:
+                index.drop_session(session_id)
+        for session_id in sessions:
+            self._catch_up(index, session_id)
+
+    def _catch_up(self, index, session_id):
+        """索引会话中新增的消息，返回是否已追平"""
+        for _ in range(_CATCH_UP_RETRIES):
+            total = sum(self.db.get_message_counts(session_id).values())
+            indexed = index.sessions.get(session_id, 0)
+            if total == indexed:
+                return True
+            if total < indexed:
+                index.drop_session(session_id)
+                indexed = 0
+
+            messages = self.db.get_chat_history(session_id, limit=total - indexed)
+            # 读取期间又有新消息时尾部已经移动，重新读取
+            if sum(self.db.get_message_counts(session_id).values()) != total:
+                continue
+            for offset, message in enumerate(messages):
+                index.add(session_id, indexed + offset, message)
+            index.sessions[session_id] = indexed + len(messages)
+            self.stats["indexed"] += len(messages)
+            return True
+        return False
+
+    # ---- 检索 ----
+
+    def _score(self, index, terms, phrases, session_id):
+        """返回 [(分数, 文档ID), ...]"""
+        doc_count = max(index.live, 1)
+        avg_length = index.total_length / doc_count or 1.0
+
+        # 每个词项命中的 {文档ID: 词频}，从最短的倒排表开始求交集
+        matches = []
+        for term in terms:
+            postings = self._term_postings(index, term)
+            if not postings:
+                return []
+            matches.append(postings)
+        matches.sort(key=len)
+
+        candidates = set(matches[0])
+        for postings in matches[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return []
+
+        weights = [
+            (postings, (_K1 + 1) * math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5)))
+            for postings in matches
+        ]
+        # 二元组全部命中不代表三个字以上的中文片段连续出现，只有这种片段需要对照原文
+        phrases = [p for p in phrases if len(p) > 2 and _CJK_SEGMENT.fullmatch(p)]
+        docs, lengths = index.docs, index.lengths
+        norm_base, norm_scale = _K1 * (1 - _B), _K1 * _B / avg_length
+
+        scored = []
+        for doc_id in candidates:
+            doc = docs[doc_id]
+            if doc is None or (session_id is not None and doc[0] != session_id):
+                continue
+            if phrases:
+                content = (doc[2].get("content") or "").lower()
+                if not all(phrase in content for phrase in phrases):
+                    continue
+            norm = norm_base + norm_scale * lengths[doc_id]
+            score = 0.0
+            for postings, weight in weights:
+                tf = postings[doc_id]
+                score += weight * tf / (tf + norm)
+            scored.append((score, doc_id))
+        return scored
+
+    @staticmethod
+    def _term_postings(index, term):
+        """词项的 {文档ID: 词频}；单个汉字还要合并包含该字的二元组
+
+        字在词中间时同时出现在前后两个二元组里，因此每个文档取这些二元组词频的最大值
+        作为该字在多字片段中的出现次数，而不是相加。
+        """
+        result = {}
+        entry = index.postings.get(term)
+        if entry is not None:
+            result.update(zip(entry[0], entry[1]))
+        if len(term) == 1 and _CJK_SEGMENT.fullmatch(term):
+            in_bigrams = {}
+            for bigram in index.chars.get(term, ()):
+                doc_ids, tfs = index.postings[bigram]
+                for doc_id, tf in zip(doc_ids, tfs):
+                    if tf > in_bigrams.get(doc_id, 0):
+                        in_bigrams[doc_id] = tf
+            for doc_id, tf in in_bigrams.items():
+                result[doc_id] = result.get(doc_id, 0) + tf
+        return result
+
+
+def _snippet(content, phrases, width=40):
+    """截取第一个命中位置附近的文本"""
+    lowered = content.lower()
+    positions = [lowered.find(phrase) for phrase in phrases]
+    positions = [p for p in positions if p >= 0]
+    if not positions:
+        return content[:width * 2]
+    start = max(min(positions) - width, 0)
+    end = min(start + width * 2, len(content))
+    return ("…" if start > 0 else "") + content[start:end] + ("…" if end < len(content) else "")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+冷会话归档
+
+长时间没有活动的会话会把其全部数据（消息、事件、情绪分析、计划、询问结果、
+模式分析、询问历史）打包成一条压缩记录，追加到该用户的段文件中，随后删除原来的
+零散文件。
+
+目录结构：
+    archive/
+    ├── index/<user_id>.jsonl       # 归档索引（追加写）：会话所在的段文件、偏移、大小
+    ├── index/<user_id>.idx
+    └── <user_id>/000001.seg        # 段文件：若干条独立压缩的会话记录首尾相接
+
+- 每条会话记录单独压缩，按索引中的偏移直接 seek 读取，不需要解压整个段
+- 段文件超过 segment_max_bytes 后写入新的段文件
+- 会话被恢复（重新有写入）时追加一条 restored 记录，段内不再有存活会话时删除段文件
+- 压缩格式优先使用 zstd（需要安装 zstandard），否则使用 gzip，可用 ARCHIVE_CODEC 指定
+"""
+
+import os
+import gzip
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from dao.append_log import AppendLog
+from dao.atomic_file import fsync_dir, remove_tree
+from utils import json_codec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ("zstd", "gzip")
+
+_RESTORED = "restored"
+
+
+def _choose_codec():
+    preferred = os.environ.get("ARCHIVE_CODEC", "").lower()
+    if preferred == "gzip" or zstandard is None:
+        return "gzip"
+    return "zstd"
+
+
+def compress(payload, codec):
+    """按指定格式压缩"""
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(payload)
+    return gzip.compress(payload, compresslevel=6)
+
+
+def decompress(payload, codec):
+    """按指定格式解压"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd archive segments")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return gzip.decompress(payload)
+
+
+class SessionArchive:
+    """按用户分段的压缩会话归档"""
+
+    def __init__(self, archive_dir, codec=None, segment_max_bytes=64 * 1024 * 1024, cache_size=16):
+        """初始化会话归档
+
+        Args:
+            archive_dir: 归档目录
+            codec: 压缩格式（zstd / gzip），默认自动选择
+            segment_max_bytes: 单个段文件的最大字节数
+            cache_size: 缓存多少个最近读取的会话（解压后的 JSON）
+        """
+        self.archive_dir = archive_dir
+        self.codec = codec or _choose_codec()
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown archive codec: {self.codec}")
+        self.segment_max_bytes = segment_max_bytes
+        self.cache_size = cache_size
+
+        self.index = AppendLog(os.path.join(archive_dir, "index"))
+        os.makedirs(self.index.log_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        # user_id -> (索引记录数, {session_id: 索引项})
+        self._entries = {}
+        # (user_id, session_id, 段号, 偏移) -> 解压后的会话 JSON
+        self._cache = OrderedDict()
+
+    def segment_path(self, user_id, segment):
+        """获取段文件路径"""
+        return os.path.join(self.archive_dir, user_id, f"{segment:06d}.seg")
+
+    def _live_entries(self, user_id):
+        """用户当前归档中的会话（读取其他进程新追加的索引记录）"""
+        count = self.index.count(user_id)
+        cached = self._entries.get(user_id)
+        if cached is not None and cached[0] == count:
+            return cached[1]
+
+        entries = {}
+        for record in self.index.read(user_id):
+            if record.get("_op") == _RESTORED:
+                entries.pop(record.get("session_id"), None)
+            else:
+                entries[record["session_id"]] = record
+        self._entries[user_id] = (count, entries)
+        return entries
+
+    def _current_segment(self, user_id):
+        """获取可以继续追加的段号"""
+        user_dir = os.path.join(self.archive_dir, user_id)
+        segments = sorted(
+            int(name[:-4]) for name in os.listdir(user_dir) if name.endswith(".seg")
+        ) if os.path.isdir(user_dir) else []
+        if not segments:
+            return 1
+        last = segments[-1]
+        if os.path.getsize(self.segment_path(user_id, last)) >= self.segment_max_bytes:
+            return last + 1
+        return last
+
+    def put(self, user_id, session_id, data):
+        """归档一个会话的数据（段文件和索引都 fsync 后才返回）
+
+        Args:
+            user_id: 用户ID
+            session_id: 会话ID
+            data: 会话数据
+
+        Returns:
+            dict: 索引项
+        """
+        payload = json_codec.dumps_bytes(data)
+        compressed = compress(payload, self.codec)
+
+        with self._lock:
+            segment = self._current_segment(user_id)
+            segment_file = self.segment_path(user_id, segment)
+            os.makedirs(os.path.dirname(segment_file), exist_ok=True)
+            with open(segment_file, "ab") as f:
+                offset = f.tell()
+                f.write(compressed)
+                f.flush()
+                os.fsync(f.fileno())
+            fsync_dir(os.path.dirname(segment_file))
+
+            entry = {
+                "session_id": session_id,
+                "segment": segment,
+                "offset": offset,
+                "size": len(compressed),
+                "raw_size": len(payload),
+                "codec": self.codec,
+                "archived_at": datetime.now().isoformat(),
+            }
+            self.index.append(user_id, entry, fsync=True)
+            return entry
+
+    def locate(self, user_id, session_id):
+        """获取会话的归档索引项，未归档时返回 None"""
+        with self._lock:
+            return self._live_entries(user_id).get(session_id)
+
+    def load(self, user_id, session_id):
+        """读取归档的会话数据，未归档时返回 None"""
+        with self._lock:
+            entry = self._live_entries(user_id).get(session_id)
+            if entry is None:
+                return None
+
+            key = (user_id, session_id, entry["segment"], entry["offset"])
+            payload = self._cache.get(key)
+            if payload is not None:
+                self._cache.move_to_end(key)
+            else:
+                with open(self.segment_path(user_id, entry["segment"]), "rb") as f:
+                    f.seek(entry["offset"])
+                    compressed = f.read(entry["size"])
+                payload = decompress(compressed, entry["codec"])
+                self._cache[key] = payload
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        # 缓存解压后的 JSON，每次解析出新的副本，调用方可以随意修改
+        return json_codec.loads(payload)
+
+    def drop(self, user_id, session_id):
+        """把会话移出归档（会话已恢复为常规文件），段内不再有存活会话时删除段文件"""
+        with self._lock:
+            entry = self._live_entries(user_id).get(session_id)
+            if entry is None:
+                return
+            self.index.append(
+                user_id, {"_op": _RESTORED, "session_id": session_id}, fsync=True
+            )
+
+            segment = entry["segment"]
+            live = self._live_entries(user_id)
+            if segment != self._current_segment(user_id) and not any(
+                e["segment"] == segment for e in live.values()
+            ):
+                os.remove(self.segment_path(user_id, segment))
+
+            for key in [k for k in self._cache if k[:2] == (user_id, session_id)]:
+                del self._cache[key]
+
+    def remove_user(self, user_id):
+        """删除用户的全部归档（段文件和索引），返回删除的字节数"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            for key in [k for k in self._cache if k[0] == user_id]:
+                del self._cache[key]
+            return self.index.remove(user_id) + remove_tree(os.path.join(self.archive_dir, user_id))
+
+    def stats(self, user_id):
+        """用户归档的统计信息
+
+        Returns:
+            dict: 会话数、压缩前后字节数、段文件数
+        """
+        with self._lock:
+            entries = self._live_entries(user_id)
+            user_dir = os.path.join(self.archive_dir, user_id)
+            return {
+                "sessions": len(entries),
+                "raw_bytes": sum(e["raw_size"] for e in entries.values()),
+                "stored_bytes": sum(e["size"] for e in entries.values()),
+                "segments": len(
+                    [n for n in os.listdir(user_dir) if n.endswith(".seg")]
+                ) if os.path.isdir(user_dir) else 0,
+            }
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+常驻内存的会话索引
+
+启动时从 sessions.json（快照）和 sessions.journal（增量日志）加载一次，
+之后所有查询都在内存中完成：
+- session_id -> 会话元数据
+- user_id -> session_id 列表（按创建顺序）
+- 每个会话的计数器（各角色消息数、事件数），随会话元数据一起持久化
+
+持久化采用“快照 + 增量日志”的方式：
+- 新建会话立即追加一行到增量日志
+- 仅更新 updated_at 的会话只打脏标记，超过 flush_interval 秒后批量追加
+- 增量日志超过 compact_threshold 行时重写快照并清空日志
+
+多个工作进程共享同一数据目录时，写日志和合并快照都在跨进程文件锁内进行；
+查询未命中时会先读取其他进程新追加的日志行（只需一次 stat）。
+"""
+
+import os
+import time
+import atexit
+import threading
+
+from dao.atomic_file import AtomicFileWriter
+from dao.locks import FileLock
+from utils import json_codec
+
+
+class SessionIndex:
+    """会话索引"""
+
+    def __init__(
+        self,
+        sessions_file,
+        flush_interval=5.0,
+        compact_threshold=1000,
+        lock_file=None,
+        writer=None,
+    ):
+        """初始化会话索引
+
+        Args:
+            sessions_file: 会话快照文件路径（sessions.json）
+            flush_interval: 脏数据最长延迟写入时间（秒）
+            compact_threshold: 增量日志达到多少行后合并到快照
+            lock_file: 跨进程文件锁路径，默认与快照文件同目录
+            writer: 快照文件写入器（AtomicFileWriter），决定 fsync 策略
+        """
+        self.sessions_file = sessions_file
+        self.journal_file = os.path.splitext(sessions_file)[0] + ".journal"
+        self.flush_interval = flush_interval
+        self.compact_threshold = compact_threshold
+        self.writer = writer or AtomicFileWriter()
+
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(lock_file or sessions_file + ".lock")
+        self._sessions = {}
+        self._by_user = {}
+        self._dirty = set()
+        self._journal_lines = 0
+        self._journal_pos = 0
+        self._snapshot_stat = None
+        self._last_flush = time.monotonic()
+
+        with self._file_lock.exclusive():
+            self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _stat_key(path):
+        try:
+            st = os.stat(path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        """加载快照并回放增量日志"""
+        self._sessions = {}
+        self._by_user = {}
+        self._journal_lines = 0
+        self._journal_pos = 0
+
+        # 快照损坏时自动从上一代备份恢复，增量日志随后回放
+        sessions = self.writer.read_json(self.sessions_file)
+        if sessions is None:
+            sessions = {}
+            self.writer.write_json(self.sessions_file, sessions)
+        self._snapshot_stat = self._stat_key(self.sessions_file)
+
+        for session_id, data in sessions.items():
+            self._add(session_id, data)
+        self._read_journal()
+
+    def _read_journal(self):
+        """从上次读到的位置继续回放增量日志"""
+        try:
+            with open(self.journal_file, "rb") as f:
+                f.seek(self._journal_pos)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # 只处理完整的行，写了一半的行留到下次
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                record = json_codec.loads(line)
+            except ValueError:
+                # 崩溃时可能残留损坏的行
+                continue
+            self._apply(record)
+            self._journal_lines += 1
+        self._journal_pos += end
+
+    def _apply(self, record):
+        session_id = record.pop("session_id")
+        current = self._sessions.get(session_id)
+        if current is not None and session_id in self._dirty:
+            # 本进程尚未落盘的 updated_at 更新，保留较新的时间
+            record["updated_at"] = max(
+                record.get("updated_at") or "", current.get("updated_at") or ""
+            )
+            # 计数器同样以本进程尚未落盘的值为准
+            if "counts" in current:
+                record["counts"] = current["counts"]
+        self._add(session_id, record)
+
+    def _add(self, session_id, data):
+        self._sessions[session_id] = data
+        self._by_user.setdefault(data.get("user_id"), {})[session_id] = None
+
+    def _sync_locked(self):
+        """读取其他进程的变更：快照被重写时全量重载，否则增量读取日志"""
+        if self._stat_key(self.sessions_file) != self._snapshot_stat:
+            dirty = {sid: self._sessions[sid] for sid in self._dirty if sid in self._sessions}
+            self._load()
+            for session_id, data in dirty.items():
+                if session_id in self._sessions:
+                    self._sessions[session_id]["updated_at"] = data.get("updated_at")
+                    if "counts" in data:
+                        self._sessions[session_id]["counts"] = data["counts"]
+                else:
+                    self._add(session_id, data)
+            return
+
+        try:
+            journal_size = os.path.getsize(self.journal_file)
+        except FileNotFoundError:
+            journal_size = 0
+        if journal_size > self._journal_pos:
+            self._read_journal()
+
+    @staticmethod
+    def _public(data):
+        """对外返回的会话元数据副本（不含内部计数器）"""
+        return {key: value for key, value in data.items() if key != "counts"}
+
+    def exists(self, session_id):
+        """会话是否存在（命中时为 O(1) 字典查找）"""
+        if session_id in self._sessions:
+            return True
+        with self._lock:
+            self._sync_locked()
+            return session_id in self._sessions
+
+    def get(self, session_id):
+        """获取单个会话的元数据副本"""
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sync_locked()
+            data = self._sessions.get(session_id)
+            return self._public(data) if data is not None else None
+
+    def get_sessions(self, user_id=None):
+        """获取会话列表
+
+        Args:
+            user_id: 用户ID，None表示获取所有会话
+
+        Returns:
+            dict: session_id -> 会话元数据（副本）
+        """
+        with self._lock:
+            self._sync_locked()
+            if user_id is None:
+                return {sid: self._public(data) for sid, data in self._sessions.items()}
+            return {
+                sid: self._public(self._sessions[sid])
+                for sid in self._by_user.get(user_id, {})
+            }
+
+    def session_ids(self, user_id):
+        """获取用户的会话ID列表"""
+        with self._lock:
+            self._sync_locked()
+            return list(self._by_user.get(user_id, {}))
+
+    def touch(self, session_id, user_id, now=None, counts=None):
+        """创建会话或更新其 updated_at
+
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID（仅在新建会话时使用）
+            now: 当前时间的ISO字符串
+            counts: 需要累加的计数器增量，如 {"messages.user": 1}
+        """
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sync_locked()
+
+            if session_id not in self._sessions:
+                self._add(
+                    session_id,
+                    {"user_id": user_id, "created_at": now, "updated_at": now},
+                )
+                self._add_counts_locked(session_id, counts)
+                # 新会话立即落盘，保证其他接口和其他进程能看到它
+                self._dirty.add(session_id)
+                self._flush_locked()
+                return
+
+            self._sessions[session_id]["updated_at"] = now
+            self._add_counts_locked(session_id, counts)
+            self._dirty.add(session_id)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _add_counts_locked(self, session_id, deltas):
+        if not deltas:
+            return
+        counts = self._sessions[session_id].setdefault("counts", {})
+        for name, delta in deltas.items():
+            counts[name] = counts.get(name, 0) + delta
+
+    def get_counts(self, session_id):
+        """获取会话的计数器（O(1)）
+
+        Returns:
+            dict: 计数器名 -> 数值，会话不存在时为空字典
+        """
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sync_locked()
+            data = self._sessions.get(session_id)
+            return dict(data.get("counts", {})) if data is not None else {}
+
+    def add_counts(self, session_id, deltas):
+        """累加会话计数器，随下一次刷新写入增量日志
+
+        Args:
+            session_id: 会话ID
+            deltas: 计数器增量，如 {"events": 2}
+        """
+        with self._lock:
+            if session_id not in self._sessions:
+                return
+            self._add_counts_locked(session_id, deltas)
+            self._dirty.add(session_id)
+
+    def set_counts(self, session_id, values):
+        """直接设置会话计数器的值（用于重新统计后的校正）
+
+        Args:
+            session_id: 会话ID
+            values: 计数器名 -> 数值
+        """
+        with self._lock:
+            if session_id not in self._sessions:
+                return
+            self._sessions[session_id].setdefault("counts", {}).update(values)
+            self._dirty.add(session_id)
+
+    def field(self, session_id, name, sync=True):
+        """读取会话元数据中的单个字段，不存在时返回 None
+
+        Args:
+            session_id: 会话ID
+            name: 字段名
+            sync: 是否先读取其他进程的变更
+        """
+        with self._lock:
+            if sync:
+                self._sync_locked()
+            data = self._sessions.get(session_id)
+            return data.get(name) if data is not None else None
+
+    def set_fields(self, session_id, fields):
+        """设置会话元数据字段并立即写入增量日志（值为 None 表示删除该字段）
+
+        Args:
+            session_id: 会话ID
+            fields: 字段名 -> 值
+        """
+        with self._lock, self._file_lock.exclusive():
+            self._sync_locked()
+            data = self._sessions.get(session_id)
+            if data is None:
+                return
+            for name, value in fields.items():
+                if value is None:
+                    data.pop(name, None)
+                else:
+                    data[name] = value
+            self._dirty.discard(session_id)
+            self._append_journal_locked([session_id])
+
+    def remove(self, session_id):
+        """从索引中删除会话，并立即合并快照"""
+        self.remove_many([session_id])
+
+    def remove_many(self, session_ids):
+        """从索引中删除多个会话，只合并一次快照
+
+        Returns:
+            int: 实际删除的会话数
+        """
+        with self._lock, self._file_lock.exclusive():
+            self._sync_locked()
+            removed = 0
+            for session_id in session_ids:
+                data = self._sessions.pop(session_id, None)
+                if data is None:
+                    continue
+                user_sessions = self._by_user.get(data.get("user_id"), {})
+                user_sessions.pop(session_id, None)
+                if not user_sessions:
+                    self._by_user.pop(data.get("user_id"), None)
+                self._dirty.discard(session_id)
+                removed += 1
+            if removed:
+                self._compact_locked()
+            return removed
+
+    def flush(self):
+        """将脏数据写入增量日志"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._dirty:
+            return
+
+        with self._file_lock.exclusive():
+            # 先追上其他进程写入的内容，保证日志位置连续
+            self._sync_locked()
+
+            dirty = list(self._dirty)
+            self._dirty.clear()
+            self._append_journal_locked(dirty)
+
+    def _append_journal_locked(self, session_ids):
+        """把会话的当前元数据追加到增量日志（调用方需持有文件锁并已同步）"""
+        lines = []
+        for session_id in session_ids:
+            if session_id not in self._sessions:
+                continue
+            record = dict(self._sessions[session_id])
+            record["session_id"] = session_id
+            lines.append(json_codec.dumps_bytes(record) + b"\n")
+
+        data = b"".join(lines)
+        with open(self.journal_file, "ab") as f:
+            f.write(data)
+            if self.writer.fsync_policy == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        self._journal_pos += len(data)
+        self._journal_lines += len(lines)
+
+        if self._journal_lines >= self.compact_threshold:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        """重写快照文件并清空增量日志（调用方需持有文件锁）"""
+        # 快照必须在删除增量日志之前落盘，否则崩溃会同时丢失两者
+        self.writer.write_json(self.sessions_file, self._sessions, fsync=True)
+
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._snapshot_stat = self._stat_key(self.sessions_file)
+        self._journal_lines = 0
+        self._journal_pos = 0
+        self._dirty.clear()
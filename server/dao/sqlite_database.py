@@ -0,0 +1,1714 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+基于SQLite（WAL模式）的数据库实现
+
+与 dao.database.Database 保持相同的方法签名，可直接替换：
+- 每张表都有按 session_id / user_id 建立的索引，单次写入成本与数据总量无关
+- WAL 模式下读操作不会阻塞写操作
+- 每个线程持有独立连接，写事务由 SQLite 自身串行化
+"""
+
+import os
+import gzip
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+
+from dao.bundle import SessionBundle, UserDataBundle, normalize_kinds
+from dao.report_store import build_report_header, new_report_id
+from dao.retention import expired_positions, record_time
+from dao.storage import StorageBackend
+from dao.time_range import time_window, to_epoch
+from utils import json_codec
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT,
+    content TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_session_role ON messages(session_id, role);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    event_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_session ON events(session_id, id);
+CREATE INDEX IF NOT EXISTS idx_events_event_id ON events(session_id, event_id);
+
+CREATE TABLE IF NOT EXISTS moods (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    mood_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_moods_session ON moods(session_id, id);
+
+CREATE TABLE IF NOT EXISTS emotions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    emotion_score REAL,
+    emotion_category TEXT,
+    timestamp TEXT,
+    ts REAL
+);
+CREATE INDEX IF NOT EXISTS idx_emotions_user ON emotions(user_id, id);
+
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    time TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_memories_user ON memories(user_id, id);
+
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS plans (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS inquiry_results (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS inquiry_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_inquiry_history_session ON inquiry_history(session_id, id);
+
+CREATE TABLE IF NOT EXISTS patterns (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS analysis_reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    saved_at TEXT,
+    data TEXT NOT NULL,
+    report_id TEXT,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reports_user ON analysis_reports(user_id, id);
+
+CREATE TABLE IF NOT EXISTS counters (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, key, name)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_count AFTER INSERT ON messages BEGIN
+    INSERT INTO counters (scope, key, name, value)
+    VALUES ('session', NEW.session_id, 'messages.' || COALESCE(NEW.role, ''), 1)
+    ON CONFLICT (scope, key, name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_insert_count AFTER INSERT ON events BEGIN
+    INSERT INTO counters (scope, key, name, value)
+    VALUES ('session', NEW.session_id, 'events', 1)
+    ON CONFLICT (scope, key, name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_delete_count AFTER DELETE ON events BEGIN
+    UPDATE counters SET value = value - 1
+    WHERE scope = 'session' AND key = OLD.session_id AND name = 'events';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_emotions_count AFTER INSERT ON emotions BEGIN
+    INSERT INTO counters (scope, key, name, value)
+    VALUES ('user', NEW.user_id, 'emotions', 1)
+    ON CONFLICT (scope, key, name) DO UPDATE SET value = value + 1;
+END;
+"""
+
+# 计数器表创建之前已有的数据，在首次启动时统计一次
+_BACKFILL_COUNTERS = """
+INSERT OR IGNORE INTO counters (scope, key, name, value)
+SELECT 'session', session_id, 'messages.' || COALESCE(role, ''), COUNT(*)
+FROM messages GROUP BY session_id, role;
+INSERT OR IGNORE INTO counters (scope, key, name, value)
+SELECT 'session', session_id, 'events', COUNT(*) FROM events GROUP BY session_id;
+INSERT OR IGNORE INTO counters (scope, key, name, value)
+SELECT 'user', user_id, 'emotions', COUNT(*) FROM emotions GROUP BY user_id;
+"""
+
+# bulk_load 单条查询最多包含的会话数（SQLite 变量数上限）
+_BULK_CHUNK = 500
+
+# delete_user 每个写事务删除的会话数，写锁每次只持有很短的时间
+_PURGE_CHUNK = 50
+
+# delete_user 删除的表：(表名, 键列, 统计数据字节数的列)
+_SESSION_TABLES = (
+    ("messages", "session_id", ("role", "content", "timestamp")),
+    ("events", "session_id", ("data",)),
+    ("moods", "session_id", ("data",)),
+    ("inquiry_history", "session_id", ("data",)),
+    ("plans", "session_id", ("data",)),
+    ("inquiry_results", "session_id", ("data",)),
+    ("patterns", "session_id", ("data",)),
+    ("sessions", "session_id", ("user_id", "created_at", "updated_at")),
+)
+_USER_TABLES = (
+    ("emotions", "user_id", ("session_id", "emotion_category", "timestamp")),
+    ("memories", "user_id", ("time", "content")),
+    ("user_profiles", "user_id", ("data",)),
+    ("analysis_reports", "user_id", ("data", "header")),
+)
+
+
+# expire_records 处理的表：数据种类 -> (表名, 键列, 读取的列, 统计字节数的列, 行 -> 记录)
+_RETENTION_TABLES = {
+    "inquiry_history": (
+        "inquiry_history", "session_id", ("data",), ("data",),
+        lambda row: json_codec.loads(row["data"]),
+    ),
+    "long_term_memory": (
+        "memories", "user_id", ("time", "content"), ("time", "content"),
+        lambda row: {"time": row["time"], "content": row["content"]},
+    ),
+    "reports": (
+        "analysis_reports", "user_id", ("saved_at",), ("saved_at", "data", "header", "report_id"),
+        lambda row: {"saved_at": row["saved_at"]},
+    ),
+}
+
+
+def _size_expression(columns):
+    return " + ".join(f"COALESCE(LENGTH(CAST({c} AS BLOB)), 0)" for c in columns)
+
+
+def _purge_statements(tables, where, params):
+    """统计字节数并删除的语句：每张表一条 SELECT SUM(...) 和一条 DELETE"""
+    statements = []
+    for table, column, columns in tables:
+        size = _size_expression(columns)
+        condition = f"FROM {table} WHERE {column} {where}"
+        statements.append((f"SELECT COALESCE(SUM({size}), 0) {condition}", params))
+        statements.append((f"DELETE {condition}", params))
+    return statements
+
+
+def _dumps(data):
+    return json_codec.dumps(data)
+
+
+def _chronological(rows):
+    """按 id 倒序取出的行恢复为时间正序"""
+    rows = list(rows)
+    rows.reverse()
+    return rows
+
+
+class SQLiteDatabase(StorageBackend):
+    """基于SQLite的数据库实现，接口与 Database 一致"""
+
+    def __init__(self, data_dir="data", db_file=None):
+        """初始化数据库
+
+        Args:
+            data_dir: 数据存储目录
+            db_file: SQLite数据库文件路径，默认为 data_dir/introspection.db
+        """
+        self.data_dir = data_dir
+        self.db_file = db_file or os.path.join(data_dir, "introspection.db")
+        self._local = threading.local()
+
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        conn = self._get_conn()
+        has_counters = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'counters'"
+        ).fetchone()
+        if has_counters:
+            conn.executescript(_SCHEMA)
+        else:
+            conn.executescript(
+                "BEGIN IMMEDIATE;" + _SCHEMA + _BACKFILL_COUNTERS + "COMMIT;"
+            )
+        self._upgrade_schema(conn)
+
+    @staticmethod
+    def _upgrade_schema(conn):
+        """为旧数据库补充后来新增的列和索引"""
+        columns = {
+            row["name"] for row in conn.execute("PRAGMA table_info(analysis_reports)")
+        }
+        for column in ("report_id", "header"):
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE analysis_reports ADD COLUMN {column} TEXT")
+                except sqlite3.OperationalError:
+                    # 其他进程已经添加过该列
+                    pass
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_reports_report_id "
+            "ON analysis_reports(user_id, report_id)"
+        )
+
+        # 情绪评分的 epoch 时间列，按时间范围查询走 (user_id, ts) 索引
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(emotions)")}
+        if "ts" not in columns:
+            try:
+                conn.execute("ALTER TABLE emotions ADD COLUMN ts REAL")
+            except sqlite3.OperationalError:
+                pass
+        # timestamp 是不带时区的本地时间，'utc' 修饰符先换算为 UTC 再计算 epoch
+        conn.execute(
+            "UPDATE emotions SET ts = (julianday(timestamp, 'utc') - 2440587.5) * 86400.0 "
+            "WHERE ts IS NULL AND timestamp IS NOT NULL"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_emotions_ts ON emotions(user_id, ts)")
+
+    def _get_conn(self):
+        """获取当前线程的数据库连接（每个线程一个连接）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA foreign_keys=OFF")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, statements):
+        """在一个写事务中执行多条语句
+
+        Args:
+            statements: [(sql, params), ...]
+        """
+        conn = self._get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = None
+            for sql, params in statements:
+                cursor = conn.execute(sql, params)
+            conn.execute("COMMIT")
+            return cursor
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _query(self, sql, params=()):
+        return self._get_conn().execute(sql, params).fetchall()
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def session_exists(self, session_id):
+        """检查会话是否存在
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            bool: 会话是否存在
+        """
+        try:
+            rows = self._query(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            )
+            return bool(rows)
+        except Exception as e:
+            print(f"Error checking session existence: {str(e)}")
+            return False
+
+    def save_message(self, session_id, user_id, role, content, timestamp=None):
+        """保存消息
+
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            role: 消息发送者角色 ('user' 或 'agent')
+            content: 消息内容
+            timestamp: 时间戳，如果不提供则使用当前时间
+        """
+        try:
+            if timestamp is None:
+                timestamp = datetime.now().isoformat()
+            now = datetime.now().isoformat()
+
+            self._write(
+                [
+                    (
+                        "INSERT INTO sessions (session_id, user_id, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                        (session_id, user_id, now, now),
+                    ),
+                    (
+                        "INSERT INTO messages (session_id, role, content, timestamp) "
+                        "VALUES (?, ?, ?, ?)",
+                        (session_id, role, content, timestamp),
+                    ),
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error saving message: {str(e)}")
+
+    def get_chat_history(self, session_id, limit=None):
+        """获取聊天历史记录
+
+        Args:
+            session_id: 会话ID
+            limit: 最大消息数量，None表示获取全部
+
+        Returns:
+            list: 消息列表
+        """
+        try:
+            if limit is not None and limit > 0:
+                rows = _chronological(
+                    self._query(
+                        "SELECT role, content, timestamp FROM messages "
+                        "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                        (session_id, limit),
+                    ),
+                )
+            else:
+                rows = self._query(
+                    "SELECT role, content, timestamp FROM messages "
+                    "WHERE session_id = ? ORDER BY id",
+                    (session_id,),
+                )
+
+            return [
+                {"role": r["role"], "content": r["content"], "timestamp": r["timestamp"]}
+                for r in rows
+            ]
+
+        except Exception as e:
+            print(f"Error getting chat history: {str(e)}")
+            return []
+
+    def get_sessions(self, user_id=None):
+        """获取会话列表
+
+        Args:
+            user_id: 用户ID，None表示获取所有会话
+
+        Returns:
+            dict: 会话列表
+        """
+        try:
+            if user_id is not None:
+                rows = self._query(
+                    "SELECT * FROM sessions WHERE user_id = ? ORDER BY rowid",
+                    (user_id,),
+                )
+            else:
+                rows = self._query("SELECT * FROM sessions ORDER BY rowid")
+
+            return {
+                r["session_id"]: {
+                    "user_id": r["user_id"],
+                    "created_at": r["created_at"],
+                    "updated_at": r["updated_at"],
+                }
+                for r in rows
+            }
+
+        except Exception as e:
+            print(f"Error getting sessions: {str(e)}")
+            return {}
+
+    def save_events(self, session_id, events):
+        """保存事件列表
+
+        Args:
+            session_id: 会话ID
+            events: 事件列表
+        """
+        try:
+            if not self.session_exists(session_id):
+                print(f"Warning: Session {session_id} does not exist")
+                return
+
+            statements = []
+            for event in events:
+                # 只有当事件没有ID时才生成新ID（保持EventService生成的ID）
+                if "id" not in event or not event["id"]:
+                    event["id"] = f"evt_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+                event["created_at"] = datetime.now().isoformat()
+                statements.append(
+                    (
+                        "INSERT INTO events (session_id, event_id, data) VALUES (?, ?, ?)",
+                        (session_id, event["id"], _dumps(event)),
+                    )
+                )
+
+            if statements:
+                self._write(statements)
+
+        except Exception as e:
+            print(f"Error saving events: {str(e)}")
+
+    def get_events(self, session_id, limit=None, since=None, types=None):
+        """获取事件列表
+
+        Args:
+            session_id: 会话ID
+            limit: 最大事件数量，None表示获取全部
+            since: 只返回该时间（datetime 或 ISO 字符串）之后创建的事件
+            types: 只返回 primaryType / subType 属于其中的事件
+
+        Returns:
+            list: 事件列表
+        """
+        try:
+            where = "session_id = ?"
+            params = [session_id]
+            if since is not None:
+                if isinstance(since, datetime):
+                    since = since.isoformat()
+                where += " AND json_extract(data, '$.created_at') >= ?"
+                params.append(since)
+            if types:
+                types = [types] if isinstance(types, str) else list(types)
+                marks = ", ".join("?" * len(types))
+                where += (
+                    f" AND (json_extract(data, '$.primaryType') IN ({marks})"
+                    f" OR json_extract(data, '$.subType') IN ({marks}))"
+                )
+                params.extend(types + types)
+
+            if limit is not None and limit > 0:
+                rows = _chronological(
+                    self._query(
+                        f"SELECT data FROM events WHERE {where} ORDER BY id DESC LIMIT ?",
+                        (*params, limit),
+                    ),
+                )
+            else:
+                rows = self._query(
+                    f"SELECT data FROM events WHERE {where} ORDER BY id", params
+                )
+            return [json_codec.loads(r["data"]) for r in rows]
+
+        except Exception as e:
+            print(f"Error getting events: {str(e)}")
+            return []
+
+    def update_event(self, session_id, event_id, update_data):
+        """更新事件
+
+        Args:
+            session_id: 会话ID
+            event_id: 事件ID
+            update_data: 更新数据字典
+
+        Returns:
+            bool: 更新是否成功
+        """
+        try:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, data FROM events WHERE session_id = ? AND event_id = ? "
+                    "ORDER BY id LIMIT 1",
+                    (session_id, event_id),
+                ).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return False
+
+                event = json_codec.loads(row["data"])
+                for key, value in update_data.items():
+                    event[key] = value
+                event["updateTime"] = datetime.now().isoformat()
+
+                conn.execute(
+                    "UPDATE events SET event_id = ?, data = ? WHERE id = ?",
+                    (event.get("id"), _dumps(event), row["id"]),
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        except Exception as e:
+            print(f"Error updating event: {str(e)}")
+            return False
+
+    def delete_event(self, session_id, event_id):
+        """删除事件
+
+        Args:
+            session_id: 会话ID
+            event_id: 事件ID
+        """
+        try:
+            self._write(
+                [
+                    (
+                        "DELETE FROM events WHERE session_id = ? AND event_id = ?",
+                        (session_id, event_id),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error deleting event: {str(e)}")
+
+    def get_user_message_count(self, session_id):
+        """获取会话中用户消息的数量
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            int: 用户消息数量
+        """
+        try:
+            return self.get_message_counts(session_id).get("user", 0)
+
+        except Exception as e:
+            print(f"Error getting user message count: {str(e)}")
+            return 0
+
+    def _get_counters(self, scope, key):
+        rows = self._query(
+            "SELECT name, value FROM counters WHERE scope = ? AND key = ?",
+            (scope, key),
+        )
+        return {row["name"]: row["value"] for row in rows}
+
+    def get_message_counts(self, session_id):
+        """获取会话中各角色的消息数量（由触发器维护的计数器）
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 角色 -> 消息数量
+        """
+        try:
+            return {
+                name[len("messages."):]: value
+                for name, value in self._get_counters("session", session_id).items()
+                if name.startswith("messages.")
+            }
+
+        except Exception as e:
+            print(f"Error getting message counts: {str(e)}")
+            return {}
+
+    def get_event_count(self, session_id):
+        """获取会话的事件数量
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            int: 事件数量
+        """
+        try:
+            return self._get_counters("session", session_id).get("events", 0)
+
+        except Exception as e:
+            print(f"Error getting event count: {str(e)}")
+            return 0
+
+    def get_emotion_count(self, user_id):
+        """获取用户情绪评分记录的数量
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            int: 情绪评分记录数量
+        """
+        try:
+            return self._get_counters("user", user_id).get("emotions", 0)
+
+        except Exception as e:
+            print(f"Error getting emotion count: {str(e)}")
+            return 0
+
+    def save_mood_data(self, user_id, session_id, mood_data):
+        """保存情绪分析数据
+        Args:
+            session_id: 会话ID
+            mood_data: 情绪分析数据（dict 或 list）
+        """
+        try:
+            if not self.session_exists(session_id):
+                print(f"Warning: Session {session_id} does not exist")
+                return
+
+            # mood_data 可以是单个 dict 或 list
+            if isinstance(mood_data, dict):
+                moods = [mood_data]
+            elif isinstance(mood_data, list):
+                moods = mood_data
+            else:
+                moods = []
+
+            statements = []
+            for mood in moods:
+                mood["created_at"] = datetime.now().isoformat()
+                statements.append(
+                    (
+                        "INSERT INTO moods (session_id, mood_id, data) VALUES (?, ?, ?)",
+                        (session_id, mood.get("id"), _dumps(mood)),
+                    )
+                )
+
+            if statements:
+                self._write(statements)
+
+        except Exception as e:
+            print(f"Error saving mood analysis: {str(e)}")
+
+    def get_mood_analysis(self, session_id, limit=None, start=None, end=None):
+        """获取情绪分析数据
+        Args:
+            session_id: 会话ID
+            limit: 最大数量，None表示获取全部
+            start: 按 created_at 过滤的起始时间（datetime / ISO 字符串 / epoch 秒）
+            end: 结束时间（不含）
+        Returns:
+            list: 情绪分析数据列表
+        """
+        try:
+            if start is not None or end is not None:
+                rows = self._query(
+                    "SELECT data FROM moods WHERE session_id = ? ORDER BY id",
+                    (session_id,),
+                )
+                moods = time_window(
+                    [json_codec.loads(r["data"]) for r in rows], "created_at", start, end
+                )
+                return moods[-limit:] if limit is not None and limit > 0 else moods
+
+            if limit is not None and limit > 0:
+                rows = _chronological(
+                    self._query(
+                        "SELECT data FROM moods WHERE session_id = ? "
+                        "ORDER BY id DESC LIMIT ?",
+                        (session_id, limit),
+                    ),
+                )
+            else:
+                rows = self._query(
+                    "SELECT data FROM moods WHERE session_id = ? ORDER BY id",
+                    (session_id,),
+                )
+            return [json_codec.loads(r["data"]) for r in rows]
+
+        except Exception as e:
+            print(f"Error getting mood analysis: {str(e)}")
+            return []
+
+    def update_mood_analysis(self, session_id, mood_id, update_data):
+        """更新情绪分析数据
+        Args:
+            session_id: 会话ID
+            mood_id: 情绪分析数据ID
+            update_data: 更新数据字典
+        Returns:
+            bool: 更新是否成功
+        """
+        try:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, data FROM moods WHERE session_id = ? AND mood_id = ? "
+                    "ORDER BY id LIMIT 1",
+                    (session_id, mood_id),
+                ).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return False
+
+                mood = json_codec.loads(row["data"])
+                for key, value in update_data.items():
+                    mood[key] = value
+                mood["updateTime"] = datetime.now().isoformat()
+
+                conn.execute(
+                    "UPDATE moods SET mood_id = ?, data = ? WHERE id = ?",
+                    (mood.get("id"), _dumps(mood), row["id"]),
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        except Exception as e:
+            print(f"Error updating mood analysis: {str(e)}")
+            return False
+
+    def delete_mood_analysis(self, session_id, mood_id):
+        """删除情绪分析数据
+        Args:
+            session_id: 会话ID
+            mood_id: 情绪分析数据ID
+        """
+        try:
+            self._write(
+                [
+                    (
+                        "DELETE FROM moods WHERE session_id = ? AND mood_id = ?",
+                        (session_id, mood_id),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error deleting mood analysis: {str(e)}")
+
+    def save_long_term_memory(self, user_id, memory_content):
+        """保存长期记忆
+
+        Args:
+            user_id: 用户ID
+            memory_content: 记忆内容
+        """
+        try:
+            self._write(
+                [
+                    (
+                        "INSERT INTO memories (user_id, time, content) VALUES (?, ?, ?)",
+                        (
+                            user_id,
+                            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            memory_content,
+                        ),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error saving long term memory: {str(e)}")
+
+    def get_long_term_memory(self, user_id, limit=None):
+        """获取长期记忆
+
+        Args:
+            user_id: 用户ID
+            limit: 获取的记忆数量限制
+
+        Returns:
+            list: 长期记忆列表
+        """
+        try:
+            if limit is not None and limit > 0:
+                rows = _chronological(
+                    self._query(
+                        "SELECT time, content FROM memories WHERE user_id = ? "
+                        "ORDER BY id DESC LIMIT ?",
+                        (user_id, limit),
+                    ),
+                )
+            else:
+                rows = self._query(
+                    "SELECT time, content FROM memories WHERE user_id = ? ORDER BY id",
+                    (user_id,),
+                )
+            return [{"time": r["time"], "content": r["content"]} for r in rows]
+
+        except Exception as e:
+            print(f"Error getting long term memory: {str(e)}")
+            return []
+
+    def get_long_term_memory_count(self, user_id):
+        """获取用户长期记忆的数量
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            int: 长期记忆数量
+        """
+        try:
+            return self._query(
+                "SELECT COUNT(*) FROM memories WHERE user_id = ?", (user_id,)
+            )[0][0]
+
+        except Exception as e:
+            print(f"Error getting long term memory count: {str(e)}")
+            return 0
+
+    def save_emotion_score(
+        self, user_id, session_id, emotion_score, emotion_category=None
+    ):
+        """保存情绪评分
+
+        Args:
+            user_id: 用户ID
+            session_id: 会话ID
+            emotion_score: 情绪评分
+            emotion_category: 情绪类别（可选）
+        """
+        try:
+            now = datetime.now()
+            self._write(
+                [
+                    (
+                        "INSERT INTO emotions "
+                        "(user_id, session_id, emotion_score, emotion_category, timestamp, ts) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            user_id,
+                            session_id,
+                            emotion_score,
+                            emotion_category,
+                            now.isoformat(),
+                            now.timestamp(),
+                        ),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error saving emotion score: {str(e)}")
+
+    def get_emotion_history(self, user_id, limit=None, start=None, end=None):
+        """获取用户情绪历史
+
+        Args:
+            user_id: 用户ID
+            limit: 获取的数量限制（范围内最近的 limit 条）
+            start: 起始时间（datetime / ISO 字符串 / epoch 秒），包含
+            end: 结束时间，不包含
+
+        Returns:
+            list: 情绪历史列表
+        """
+        try:
+            columns = "session_id, emotion_score, emotion_category, timestamp"
+            if start is not None or end is not None:
+                # 走 (user_id, ts) 索引的范围扫描
+                where = ["user_id = ?"]
+                params = [user_id]
+                if start is not None:
+                    where.append("ts >= ?")
+                    params.append(to_epoch(start))
+                if end is not None:
+                    where.append("ts < ?")
+                    params.append(to_epoch(end))
+                sql = f"SELECT {columns} FROM emotions WHERE {' AND '.join(where)} ORDER BY id DESC"
+                if limit is not None and limit > 0:
+                    sql += " LIMIT ?"
+                    params.append(limit)
+                return [dict(r) for r in _chronological(self._query(sql, params))]
+
+            if limit is not None and limit > 0:
+                rows = _chronological(
+                    self._query(
+                        f"SELECT {columns} FROM emotions WHERE user_id = ? "
+                        "ORDER BY id DESC LIMIT ?",
+                        (user_id, limit),
+                    ),
+                )
+            else:
+                rows = self._query(
+                    f"SELECT {columns} FROM emotions WHERE user_id = ? ORDER BY id",
+                    (user_id,),
+                )
+            return [dict(r) for r in rows]
+
+        except Exception as e:
+            print(f"Error getting emotion history: {str(e)}")
+            return []
+
+    def save_session_plan(self, session_id, plan_data):
+        """保存会话计划
+
+        Args:
+            session_id: 会话ID
+            plan_data: 计划数据
+        """
+        try:
+            self._write(
+                [
+                    (
+                        "INSERT OR REPLACE INTO plans (session_id, data) VALUES (?, ?)",
+                        (session_id, _dumps(plan_data)),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error saving session plan: {str(e)}")
+
+    def get_session_plan(self, session_id):
+        """获取会话计划
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 会话计划数据
+        """
+        try:
+            rows = self._query(
+                "SELECT data FROM plans WHERE session_id = ?", (session_id,)
+            )
+            return json_codec.loads(rows[0]["data"]) if rows else {}
+
+        except Exception as e:
+            print(f"Error getting session plan: {str(e)}")
+            return {}
+
+    def save_user_profile(self, user_id, profile_data):
+        """保存用户画像数据
+
+        Args:
+            user_id: 用户ID
+            profile_data: 用户画像数据字典
+        """
+        try:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT data FROM user_profiles WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                profile = json_codec.loads(row["data"]) if row else {}
+                profile.update(profile_data)
+                profile["updated_at"] = datetime.now().isoformat()
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO user_profiles (user_id, data) VALUES (?, ?)",
+                    (user_id, _dumps(profile)),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        except Exception as e:
+            print(f"Error saving user profile: {str(e)}")
+
+    def get_user_profile(self, user_id):
+        """获取用户画像数据
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            dict: 用户画像数据
+        """
+        try:
+            rows = self._query(
+                "SELECT data FROM user_profiles WHERE user_id = ?", (user_id,)
+            )
+            return json_codec.loads(rows[0]["data"]) if rows else {}
+
+        except Exception as e:
+            print(f"Error getting user profile: {str(e)}")
+            return {}
+
+    def save_inquiry_result(self, session_id, inquiry_data):
+        """保存引导性询问结果
+
+        Args:
+            session_id: 会话ID
+            inquiry_data: 引导性询问结果数据
+        """
+        try:
+            # 添加时间戳
+            inquiry_data["saved_at"] = datetime.now().isoformat()
+
+            self._write(
+                [
+                    (
+                        "INSERT OR REPLACE INTO inquiry_results (session_id, data) VALUES (?, ?)",
+                        (session_id, _dumps(inquiry_data)),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error saving inquiry result: {str(e)}")
+
+    def get_inquiry_result(self, session_id):
+        """获取引导性询问结果
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 引导性询问结果数据
+        """
+        try:
+            rows = self._query(
+                "SELECT data FROM inquiry_results WHERE session_id = ?", (session_id,)
+            )
+            return json_codec.loads(rows[0]["data"]) if rows else {}
+
+        except Exception as e:
+            print(f"Error getting inquiry result: {str(e)}")
+            return {}
+
+    def save_pattern_analysis(self, session_id, pattern_data):
+        """保存模式分析结果
+
+        Args:
+            session_id: 会话ID
+            pattern_data: 模式分析结果数据
+        """
+        try:
+            # 添加时间戳
+            pattern_data["saved_at"] = datetime.now().isoformat()
+
+            self._write(
+                [
+                    (
+                        "INSERT OR REPLACE INTO patterns (session_id, data) VALUES (?, ?)",
+                        (session_id, _dumps(pattern_data)),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error saving pattern analysis: {str(e)}")
+
+    def get_pattern_analysis(self, session_id):
+        """获取模式分析结果
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 模式分析结果数据
+        """
+        try:
+            rows = self._query(
+                "SELECT data FROM patterns WHERE session_id = ?", (session_id,)
+            )
+            return json_codec.loads(rows[0]["data"]) if rows else {}
+
+        except Exception as e:
+            print(f"Error getting pattern analysis: {str(e)}")
+            return {}
+
+    def save_inquiry_history(self, session_id, inquiry_data):
+        """保存引导性询问历史记录
+
+        Args:
+            session_id: 会话ID
+            inquiry_data: 引导性询问数据
+        """
+        try:
+            # 添加时间戳
+            inquiry_data["timestamp"] = datetime.now().isoformat()
+
+            self._write(
+                [
+                    (
+                        "INSERT INTO inquiry_history (session_id, data) VALUES (?, ?)",
+                        (session_id, _dumps(inquiry_data)),
+                    )
+                ]
+            )
+
+        except Exception as e:
+            print(f"Error saving inquiry history: {str(e)}")
+
+    def get_inquiry_history(self, session_id, limit=None):
+        """获取引导性询问历史记录
+
+        Args:
+            session_id: 会话ID
+            limit: 获取的记录数量限制
+
+        Returns:
+            list: 引导性询问历史记录列表
+        """
+        try:
+            if limit is not None and limit > 0:
+                rows = _chronological(
+                    self._query(
+                        "SELECT data FROM inquiry_history WHERE session_id = ? "
+                        "ORDER BY id DESC LIMIT ?",
+                        (session_id, limit),
+                    ),
+                )
+            else:
+                rows = self._query(
+                    "SELECT data FROM inquiry_history WHERE session_id = ? ORDER BY id",
+                    (session_id,),
+                )
+            return [json_codec.loads(r["data"]) for r in rows]
+
+        except Exception as e:
+            print(f"Error getting inquiry history: {str(e)}")
+            return []
+
+    def save_analysis_report(self, user_id, report_data):
+        """保存分析报告
+
+        Args:
+            user_id: 用户ID
+            report_data: 分析报告数据
+
+        Returns:
+            str: 报告ID
+        """
+        try:
+            # 添加保存时间戳
+            report_data["saved_at"] = datetime.now().isoformat()
+
+            # 正文压缩保存，报告头单独一列，列表查询不需要读取正文
+            report_id = new_report_id()
+            payload = _dumps(report_data).encode("utf-8")
+            compressed = gzip.compress(payload)
+            header = build_report_header(
+                report_id, user_id, report_data, len(payload), len(compressed)
+            )
+            self._write(
+                [
+                    (
+                        "INSERT INTO analysis_reports "
+                        "(user_id, saved_at, data, report_id, header) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (
+                            user_id,
+                            report_data["saved_at"],
+                            compressed,
+                            report_id,
+                            _dumps(header),
+                        ),
+                    )
+                ]
+            )
+            return report_id
+
+        except Exception as e:
+            print(f"Error saving analysis report: {str(e)}")
+
+    @staticmethod
+    def _load_report(data):
+        """解析报告正文（新数据为 gzip 压缩的 BLOB，旧数据为 JSON 文本）"""
+        if isinstance(data, bytes):
+            data = gzip.decompress(data)
+        return json_codec.loads(data)
+
+    def get_latest_analysis_report(self, user_id):
+        """获取用户最新的分析报告
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            dict: 最新的分析报告数据
+        """
+        try:
+            rows = self._query(
+                "SELECT data FROM analysis_reports WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (user_id,),
+            )
+            return self._load_report(rows[0]["data"]) if rows else {}
+
+        except Exception as e:
+            print(f"Error getting latest analysis report: {str(e)}")
+            return {}
+
+    def get_analysis_reports_history(self, user_id, limit=None):
+        """获取用户的分析报告历史（只返回报告头）
+
+        Args:
+            user_id: 用户ID
+            limit: 获取的报告数量限制
+
+        Returns:
+            list: 报告头列表（最新的在前）
+        """
+        try:
+            sql = (
+                "SELECT id, report_id, header FROM analysis_reports "
+                "WHERE user_id = ? ORDER BY id DESC"
+            )
+            params = (user_id,)
+            if limit is not None and limit > 0:
+                sql += " LIMIT ?"
+                params = (user_id, limit)
+
+            headers = []
+            for row in self._query(sql, params):
+                if row["header"] is not None:
+                    headers.append(json_codec.loads(row["header"]))
+                    continue
+
+                # 旧数据没有报告头，读取一次正文生成后保存
+                data = self._query(
+                    "SELECT data FROM analysis_reports WHERE id = ?", (row["id"],)
+                )[0]["data"]
+                raw = data if isinstance(data, bytes) else data.encode("utf-8")
+                report_id = row["report_id"] or f"rpt_legacy_{row['id']}"
+                header = build_report_header(
+                    report_id, user_id, self._load_report(data), len(raw)
+                )
+                self._write(
+                    [
+                        (
+                            "UPDATE analysis_reports SET report_id = ?, header = ? "
+                            "WHERE id = ?",
+                            (report_id, _dumps(header), row["id"]),
+                        )
+                    ]
+                )
+                headers.append(header)
+            return headers
+
+        except Exception as e:
+            print(f"Error getting analysis reports history: {str(e)}")
+            return []
+
+    def get_analysis_report(self, user_id, report_id):
+        """按报告ID获取完整的分析报告
+
+        Args:
+            user_id: 用户ID
+            report_id: 报告ID
+
+        Returns:
+            dict: 分析报告数据，不存在时为空字典
+        """
+        try:
+            rows = self._query(
+                "SELECT data FROM analysis_reports WHERE user_id = ? AND report_id = ?",
+                (user_id, report_id),
+            )
+            return self._load_report(rows[0]["data"]) if rows else {}
+
+        except Exception as e:
+            print(f"Error getting analysis report: {str(e)}")
+            return {}
+
+    def delete_user(self, user_id):
+        """删除用户的全部数据
+
+        会话数据按 _PURGE_CHUNK 个会话一个写事务删除（都走 session_id / user_id 索引），
+        事务之间其他连接的写入可以继续进行。
+
+        Returns:
+            dict: {"sessions": 删除的会话数, "bytes_reclaimed": 删除的数据字节数,
+                   "elapsed_s": 耗时（秒）}
+        """
+        started = time.perf_counter()
+        result = {"sessions": 0, "bytes_reclaimed": 0}
+
+        session_ids = [
+            row["session_id"]
+            for row in self._query("SELECT session_id FROM sessions WHERE user_id = ?", (user_id,))
+        ]
+        for start in range(0, len(session_ids), _PURGE_CHUNK):
+            chunk = session_ids[start:start + _PURGE_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            statements = _purge_statements(_SESSION_TABLES, f"IN ({placeholders})", chunk)
+            statements.append(
+                (f"DELETE FROM counters WHERE scope = 'session' AND key IN ({placeholders})", chunk)
+            )
+            result["bytes_reclaimed"] += self._purge(statements)
+            result["sessions"] += len(chunk)
+
+        statements = _purge_statements(_USER_TABLES, "= ?", (user_id,))
+        statements.append(("DELETE FROM counters WHERE scope = 'user' AND key = ?", (user_id,)))
+        result["bytes_reclaimed"] += self._purge(statements)
+
+        result["elapsed_s"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def expire_records(self, entity, key, before=None, keep=None, match=None):
+        """按保留规则删除一个会话 / 用户的旧记录，参数和返回值见 Database.expire_records"""
+        result = {"expired": 0, "bytes_freed": 0, "oldest": None}
+
+        if entity == "plan":
+            result["bytes_freed"] = self._purge(
+                _purge_statements((("plans", "session_id", ("data",)),), "= ?", (key,))
+            )
+            result["expired"] = 1 if result["bytes_freed"] else 0
+            return result
+
+        if entity not in _RETENTION_TABLES:
+            raise ValueError(f"Unsupported retention entity: {entity}")
+        table, key_column, columns, size_columns, to_record = _RETENTION_TABLES[entity]
+
+        rows = self._query(
+            f"SELECT id, {', '.join(columns)}, {_size_expression(size_columns)} AS size "
+            f"FROM {table} WHERE {key_column} = ? ORDER BY id",
+            (key,),
+        )
+        expired, result["oldest"] = expired_positions(
+            [to_record(row) for row in rows], record_time(entity), before, keep, match
+        )
+        if not expired:
+            return result
+
+        ids = [rows[i]["id"] for i in sorted(expired)]
+        statements = [
+            (
+                f"DELETE FROM {table} WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for chunk in (ids[i:i + _BULK_CHUNK] for i in range(0, len(ids), _BULK_CHUNK))
+        ]
+        self._write(statements)
+        result["expired"] = len(expired)
+        result["bytes_freed"] = sum(rows[i]["size"] for i in expired)
+        return result
+
+    def _purge(self, statements):
+        """在一个写事务中执行删除，返回其中 SELECT 统计的字节数之和"""
+        conn = self._get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = 0
+            for sql, params in statements:
+                cursor = conn.execute(sql, params)
+                if sql.startswith("SELECT"):
+                    removed += cursor.fetchone()[0] or 0
+            conn.execute("COMMIT")
+            return int(removed)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def import_sessions(self, items):
+        """导入会话数据（数据迁移使用），整批在一个写事务中完成
+
+        参数和语义见 Database.import_sessions。
+        """
+        conn = self._get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for session_id, meta, data in items:
+                conn.execute(
+                    "INSERT INTO sessions (session_id, user_id, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET user_id = excluded.user_id, "
+                    "created_at = excluded.created_at, updated_at = excluded.updated_at",
+                    (
+                        session_id,
+                        meta.get("user_id"),
+                        meta.get("created_at"),
+                        meta.get("updated_at") or meta.get("created_at"),
+                    ),
+                )
+                if "chat_history" in data:
+                    # 消息没有删除触发器，先清掉消息计数再由插入触发器重新累计
+                    conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                    conn.execute(
+                        "DELETE FROM counters WHERE scope = 'session' AND key = ? "
+                        "AND name LIKE 'messages.%'",
+                        (session_id,),
+                    )
+                    conn.executemany(
+                        "INSERT INTO messages (session_id, role, content, timestamp) "
+                        "VALUES (?, ?, ?, ?)",
+                        [
+                            (session_id, m.get("role"), m.get("content"), m.get("timestamp"))
+                            for m in data["chat_history"]
+                        ],
+                    )
+                for kind, table, id_column in (
+                    ("events", "events", "event_id"),
+                    ("moods", "moods", "mood_id"),
+                    ("inquiry_history", "inquiry_history", None),
+                ):
+                    if kind not in data:
+                        continue
+                    conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+                    if id_column:
+                        conn.executemany(
+                            f"INSERT INTO {table} (session_id, {id_column}, data) VALUES (?, ?, ?)",
+                            [(session_id, item.get("id"), _dumps(item)) for item in data[kind]],
+                        )
+                    else:
+                        conn.executemany(
+                            f"INSERT INTO {table} (session_id, data) VALUES (?, ?)",
+                            [(session_id, _dumps(item)) for item in data[kind]],
+                        )
+                for kind, table in (
+                    ("plan", "plans"),
+                    ("inquiry", "inquiry_results"),
+                    ("pattern", "patterns"),
+                ):
+                    if kind not in data:
+                        continue
+                    if data[kind] is None:
+                        conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+                    else:
+                        conn.execute(
+                            f"INSERT OR REPLACE INTO {table} (session_id, data) VALUES (?, ?)",
+                            (session_id, _dumps(data[kind])),
+                        )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def import_users(self, items):
+        """导入用户数据（数据迁移使用），整批在一个写事务中完成
+
+        参数和语义见 Database.import_users。
+        """
+        conn = self._get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id, data in items:
+                if "profile" in data:
+                    if data["profile"] is None:
+                        conn.execute("DELETE FROM user_profiles WHERE user_id = ?", (user_id,))
+                    else:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO user_profiles (user_id, data) VALUES (?, ?)",
+                            (user_id, _dumps(data["profile"])),
+                        )
+                if "long_term_memory" in data:
+                    conn.execute("DELETE FROM memories WHERE user_id = ?", (user_id,))
+                    conn.executemany(
+                        "INSERT INTO memories (user_id, time, content) VALUES (?, ?, ?)",
+                        [(user_id, m.get("time"), m.get("content")) for m in data["long_term_memory"]],
+                    )
+                if "emotions" in data:
+                    conn.execute("DELETE FROM emotions WHERE user_id = ?", (user_id,))
+                    conn.execute(
+                        "DELETE FROM counters WHERE scope = 'user' AND key = ? AND name = 'emotions'",
+                        (user_id,),
+                    )
+                    conn.executemany(
+                        "INSERT INTO emotions "
+                        "(user_id, session_id, emotion_score, emotion_category, timestamp, ts) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (
+                                user_id,
+                                e.get("session_id"),
+                                e.get("emotion_score"),
+                                e.get("emotion_category"),
+                                e.get("timestamp"),
+                                to_epoch(e.get("timestamp")),
+                            )
+                            for e in data["emotions"]
+                        ],
+                    )
+                if "reports" in data:
+                    conn.execute("DELETE FROM analysis_reports WHERE user_id = ?", (user_id,))
+                    for report_id, report_data in data["reports"]:
+                        payload = _dumps(report_data).encode("utf-8")
+                        compressed = gzip.compress(payload)
+                        header = build_report_header(
+                            report_id, user_id, report_data, len(payload), len(compressed)
+                        )
+                        conn.execute(
+                            "INSERT INTO analysis_reports "
+                            "(user_id, saved_at, data, report_id, header) VALUES (?, ?, ?, ?, ?)",
+                            (
+                                user_id,
+                                report_data.get("saved_at"),
+                                compressed,
+                                report_id,
+                                _dumps(header),
+                            ),
+                        )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def bulk_load(self, user_id, session_ids=None, kinds=None, since=None, limits=None):
+        """一次性批量读取用户在多个会话中的数据
+
+        每种数据对全部会话只执行一次查询（会话很多时分批），
+        每个会话的数量限制在 SQL 中按索引完成。
+
+        Args:
+            user_id: 用户ID
+            session_ids: 会话ID列表，None表示该用户的全部会话
+            kinds: 需要的数据种类（见 dao.bundle.KINDS），None表示全部
+            since: 只返回该时间之后创建的事件、情绪分析和情绪评分（datetime 或 ISO 字符串）
+            limits: 各数据种类的数量限制，如 {"chat_history": 100, "events": 50}
+
+        Returns:
+            UserDataBundle: 批量数据
+        """
+        kinds = normalize_kinds(kinds)
+        limits = limits or {}
+        if isinstance(since, datetime):
+            since = since.isoformat()
+
+        bundle = UserDataBundle(user_id=user_id)
+        try:
+            if session_ids is None:
+                session_ids = [
+                    r["session_id"]
+                    for r in self._query(
+                        "SELECT session_id FROM sessions WHERE user_id = ? ORDER BY rowid",
+                        (user_id,),
+                    )
+                ]
+            bundle.sessions = {
+                session_id: SessionBundle(session_id=session_id)
+                for session_id in session_ids
+            }
+
+            for start in range(0, len(session_ids), _BULK_CHUNK):
+                self._bulk_load_sessions(
+                    bundle.sessions,
+                    session_ids[start : start + _BULK_CHUNK],
+                    kinds,
+                    since,
+                    limits,
+                )
+
+            if "profile" in kinds:
+                bundle.profile = self.get_user_profile(user_id)
+            if "long_term_memory" in kinds:
+                bundle.long_term_memory = self.get_long_term_memory(
+                    user_id, limits.get("long_term_memory")
+                )
+            if "emotions" in kinds:
+                rows = self._per_key_rows(
+                    "emotions",
+                    "user_id",
+                    "session_id, emotion_score, emotion_category, timestamp",
+                    [user_id],
+                    limits.get("emotions"),
+                    "ts >= ?" if since is not None else None,
+                    (to_epoch(since),) if since is not None else (),
+                )
+                bundle.emotions = [
+                    {
+                        "session_id": r["session_id"],
+                        "emotion_score": r["emotion_score"],
+                        "emotion_category": r["emotion_category"],
+                        "timestamp": r["timestamp"],
+                    }
+                    for r in rows
+                ]
+
+        except Exception as e:
+            print(f"Error bulk loading data: {str(e)}")
+
+        return bundle
+
+    def _per_key_rows(self, table, key_column, columns, keys, limit, where=None, params=()):
+        """一次查询多个键的数据，每个键最多保留最近的 limit 行，按 id 正序返回
+
+        有数量限制时对每个键做一次 (key, id) 索引上的倒序查找，不扫描超出限制的行。
+        """
+        values = ", ".join(["(?)"] * len(keys))
+        condition = f"{key_column} = k.key"
+        if where:
+            condition += f" AND {where}"
+
+        if limit is not None and limit > 0:
+            sql = (
+                f"WITH k(key) AS (VALUES {values}) "
+                f"SELECT k.key AS _key, t.id AS _id, {columns} FROM k JOIN {table} t "
+                f"ON t.id IN (SELECT id FROM {table} WHERE {condition} "
+                f"ORDER BY id DESC LIMIT ?) ORDER BY t.id"
+            )
+            return self._query(sql, (*keys, *params, limit))
+
+        sql = (
+            f"WITH k(key) AS (VALUES {values}) "
+            f"SELECT k.key AS _key, id AS _id, {columns} FROM k JOIN {table} "
+            f"ON {condition} ORDER BY id"
+        )
+        return self._query(sql, (*keys, *params))
+
+    def _bulk_load_sessions(self, sessions, session_ids, kinds, since, limits):
+        """批量读取一组会话的数据，填入 sessions 中对应的 SessionBundle"""
+        if not session_ids:
+            return
+
+        if "chat_history" in kinds:
+            for r in self._per_key_rows(
+                "messages",
+                "session_id",
+                "role, content, timestamp",
+                session_ids,
+                limits.get("chat_history"),
+            ):
+                sessions[r["_key"]].chat_history.append(
+                    {"role": r["role"], "content": r["content"], "timestamp": r["timestamp"]}
+                )
+
+        if "message_count" in kinds:
+            marks = ", ".join("?" * len(session_ids))
+            for r in self._query(
+                f"SELECT key, value FROM counters WHERE scope = 'session' "
+                f"AND name = 'messages.user' AND key IN ({marks})",
+                session_ids,
+            ):
+                sessions[r["key"]].message_count = r["value"]
+
+        since_where = "json_extract(data, '$.created_at') >= ?" if since is not None else None
+        since_params = (since,) if since is not None else ()
+        for kind, table, use_since in (
+            ("events", "events", True),
+            ("moods", "moods", True),
+            ("inquiry_history", "inquiry_history", False),
+        ):
+            if kind not in kinds:
+                continue
+            for r in self._per_key_rows(
+                table,
+                "session_id",
+                "data",
+                session_ids,
+                limits.get(kind),
+                since_where if use_since else None,
+                since_params if use_since else (),
+            ):
+                getattr(sessions[r["_key"]], kind).append(json_codec.loads(r["data"]))
+
+        marks = ", ".join("?" * len(session_ids))
+        for kind, table in (
+            ("pattern", "patterns"),
+            ("inquiry", "inquiry_results"),
+            ("plan", "plans"),
+        ):
+            if kind not in kinds:
+                continue
+            for r in self._query(
+                f"SELECT session_id, data FROM {table} WHERE session_id IN ({marks})",
+                session_ids,
+            ):
+                setattr(sessions[r["session_id"]], kind, json_codec.loads(r["data"]))
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+存储后端接口
+
+StorageBackend 定义了 app.py、chat_langgraph_optimized.py 和 analysis_report_service.py
+使用的全部存储方法。各后端继承该接口：
+
+- file（Database）：基于 JSON / JSONL 文件的存储（默认）
+- sqlite（SQLiteDatabase）：SQLite（WAL）存储
+- memory（MemoryDatabase）：纯内存存储，用于测试和基准测试
+
+后端由环境变量 DB_BACKEND 选择（见 dao.database.create_database），
+新的后端通过 register_backend 注册后即可使用，无需修改服务代码。
+
+约定：
+- 读方法出错时返回空值（{} / [] / 0 / False），不向调用方抛出异常
+- 返回的数据是副本，调用方可以随意修改
+- 列表按时间正序排列，limit 表示取最近的 limit 条
+- 时间范围参数 start / end 表示 [start, end)，接受 datetime / ISO 字符串 / epoch 秒
+"""
+
+import abc
+import threading
+
+from dao.bundle import SessionBundle, UserDataBundle, normalize_kinds
+
+
+class StorageBackend(abc.ABC):
+    """存储后端接口"""
+
+    # ---- 会话与消息 ----
+
+    @abc.abstractmethod
+    def session_exists(self, session_id):
+        """会话是否存在"""
+
+    @abc.abstractmethod
+    def save_message(self, session_id, user_id, role, content, timestamp=None):
+        """保存消息，会话不存在时创建会话"""
+
+    @abc.abstractmethod
+    def get_chat_history(self, session_id, limit=None):
+        """获取聊天历史记录 [{"role", "content", "timestamp"}, ...]"""
+
+    @abc.abstractmethod
+    def get_sessions(self, user_id=None):
+        """获取会话列表 {session_id: {"user_id", "created_at", "updated_at"}}"""
+
+    @abc.abstractmethod
+    def get_user_message_count(self, session_id):
+        """会话中用户消息的数量"""
+
+    @abc.abstractmethod
+    def get_message_counts(self, session_id):
+        """会话中各角色的消息数量 {role: count}"""
+
+    # ---- 事件 ----
+
+    @abc.abstractmethod
+    def save_events(self, session_id, events):
+        """保存事件（补充 id 和 created_at），会话不存在时忽略"""
+
+    @abc.abstractmethod
+    def get_events(self, session_id, limit=None, since=None, types=None):
+        """获取事件，可按创建时间和 primaryType / subType 过滤"""
+
+    @abc.abstractmethod
+    def update_event(self, session_id, event_id, update_data):
+        """更新事件，返回事件是否存在"""
+
+    @abc.abstractmethod
+    def delete_event(self, session_id, event_id):
+        """删除事件"""
+
+    @abc.abstractmethod
+    def get_event_count(self, session_id):
+        """会话的事件数量"""
+
+    # ---- 情绪分析 ----
+
+    @abc.abstractmethod
+    def save_mood_data(self, user_id, session_id, mood_data):
+        """保存情绪分析数据（dict 或 list），会话不存在时忽略"""
+
+    @abc.abstractmethod
+    def get_mood_analysis(self, session_id, limit=None, start=None, end=None):
+        """获取情绪分析数据，可按 created_at 截取 [start, end) 时间范围"""
+
+    @abc.abstractmethod
+    def update_mood_analysis(self, session_id, mood_id, update_data):
+        """更新情绪分析数据，返回是否更新成功"""
+
+    @abc.abstractmethod
+    def delete_mood_analysis(self, session_id, mood_id):
+        """删除情绪分析数据"""
+
+    # ---- 用户数据 ----
+
+    @abc.abstractmethod
+    def save_long_term_memory(self, user_id, memory_content):
+        """保存长期记忆"""
+
+    @abc.abstractmethod
+    def get_long_term_memory(self, user_id, limit=None):
+        """获取长期记忆 [{"time", "content"}, ...]"""
+
+    @abc.abstractmethod
+    def save_emotion_score(self, user_id, session_id, emotion_score, emotion_category=None):
+        """保存情绪评分"""
+
+    @abc.abstractmethod
+    def get_emotion_count(self, user_id):
+        """用户情绪评分记录的数量"""
+
+    @abc.abstractmethod
+    def get_emotion_history(self, user_id, limit=None, start=None, end=None):
+        """获取情绪评分历史，可截取 [start, end) 时间范围（datetime / ISO 字符串 / epoch 秒）"""
+
+    @abc.abstractmethod
+    def save_user_profile(self, user_id, profile_data):
+        """合并更新用户画像"""
+
+    @abc.abstractmethod
+    def get_user_profile(self, user_id):
+        """获取用户画像"""
+
+    # ---- 会话分析结果 ----
+
+    @abc.abstractmethod
+    def save_session_plan(self, session_id, plan_data):
+        """保存会话计划"""
+
+    @abc.abstractmethod
+    def get_session_plan(self, session_id):
+        """获取会话计划"""
+
+    @abc.abstractmethod
+    def save_inquiry_result(self, session_id, inquiry_data):
+        """保存引导性询问结果"""
+
+    @abc.abstractmethod
+    def get_inquiry_result(self, session_id):
+        """获取引导性询问结果"""
+
+    @abc.abstractmethod
+    def save_pattern_analysis(self, session_id, pattern_data):
+        """保存模式分析结果"""
+
+    @abc.abstractmethod
+    def get_pattern_analysis(self, session_id):
+        """获取模式分析结果"""
+
+    @abc.abstractmethod
+    def save_inquiry_history(self, session_id, inquiry_data):
+        """追加引导性询问历史记录"""
+
+    @abc.abstractmethod
+    def get_inquiry_history(self, session_id, limit=None):
+        """获取引导性询问历史记录"""
+
+    # ---- 分析报告 ----
+
+    @abc.abstractmethod
+    def save_analysis_report(self, user_id, report_data):
+        """保存分析报告，返回报告ID"""
+
+    @abc.abstractmethod
+    def get_latest_analysis_report(self, user_id):
+        """获取最新的分析报告正文"""
+
+    @abc.abstractmethod
+    def get_analysis_reports_history(self, user_id, limit=None):
+        """获取报告头列表（最新的在前）"""
+
+    @abc.abstractmethod
+    def get_analysis_report(self, user_id, report_id):
+        """按报告ID获取报告正文"""
+
+    # ---- 可选能力（提供默认实现）----
+
+    # 数据变更流（dao.change_feed.ChangeFeed），不支持的后端为 None
+    changes = None
+
+    def flush(self):
+        """把尚未落盘的数据写入存储，默认无操作"""
+
+    def get_long_term_memory_count(self, user_id):
+        """用户长期记忆的数量（默认读取全部记忆计数）"""
+        return len(self.get_long_term_memory(user_id))
+
+    def data_version(self, user_id):
+        """用户数据的版本号，用户的任何数据变更后单调递增；不支持变更流时返回 None"""
+        if self.changes is None:
+            return None
+        return self.changes.data_version(user_id)
+
+    def import_sessions(self, items):
+        """导入会话数据，保留原始时间戳和ID（数据迁移使用）
+
+        参数和语义见 Database.import_sessions。
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support import")
+
+    def import_users(self, items):
+        """导入用户数据（数据迁移使用），参数和语义见 Database.import_users"""
+        raise NotImplementedError(f"{type(self).__name__} does not support import")
+
+    def delete_user(self, user_id):
+        """删除用户的全部数据（会话及其全部数据、情绪评分、长期记忆、画像、分析报告）
+
+        返回值见 Database.delete_user。
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support deleting users")
+
+    def expire_records(self, entity, key, before=None, keep=None, match=None):
+        """按保留规则删除一个会话 / 用户的旧记录（dao.retention 使用）
+
+        参数和返回值见 Database.expire_records。
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support retention")
+
+    def bulk_load(self, user_id, session_ids=None, kinds=None, since=None, limits=None):
+        """批量读取用户在多个会话中的数据（默认逐个调用单项读取方法）
+
+        参数和返回值见 Database.bulk_load。
+        """
+        kinds = normalize_kinds(kinds)
+        limits = limits or {}
+        if since is not None and not isinstance(since, str):
+            since = since.isoformat()
+
+        bundle = UserDataBundle(user_id=user_id)
+        if session_ids is None:
+            session_ids = list(self.get_sessions(user_id))
+
+        for session_id in session_ids:
+            session = SessionBundle(session_id=session_id)
+            if "chat_history" in kinds:
+                session.chat_history = self.get_chat_history(
+                    session_id, limits.get("chat_history")
+                )
+            if "message_count" in kinds:
+                session.message_count = self.get_user_message_count(session_id)
+            if "events" in kinds:
+                session.events = self.get_events(
+                    session_id, limits.get("events"), since
+                )
+            if "moods" in kinds:
+                session.moods = self.get_mood_analysis(
+                    session_id, limits.get("moods"), since
+                )
+            if "pattern" in kinds:
+                session.pattern = self.get_pattern_analysis(session_id)
+            if "inquiry" in kinds:
+                session.inquiry = self.get_inquiry_result(session_id)
+            if "inquiry_history" in kinds:
+                session.inquiry_history = self.get_inquiry_history(
+                    session_id, limits.get("inquiry_history")
+                )
+            if "plan" in kinds:
+                session.plan = self.get_session_plan(session_id)
+            bundle.sessions[session_id] = session
+
+        if "profile" in kinds:
+            bundle.profile = self.get_user_profile(user_id)
+        if "long_term_memory" in kinds:
+            bundle.long_term_memory = self.get_long_term_memory(
+                user_id, limits.get("long_term_memory")
+            )
+        if "emotions" in kinds:
+            bundle.emotions = self.get_emotion_history(
+                user_id, limits.get("emotions"), since
+            )
+        return bundle
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """注册存储后端
+
+    Args:
+        name: 后端名称（DB_BACKEND 的取值）
+        factory: 可调用对象，factory(data_dir) 返回 StorageBackend 实例
+    """
+    with _backends_lock:
+        _backends[name.lower()] = factory
+
+
+def get_backend_factory(name):
+    """获取已注册的存储后端工厂，未注册时返回 None"""
+    return _backends.get(name.lower())
+
+
+def backend_names():
+    """已注册的存储后端名称"""
+    return sorted(_backends)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+时间范围查询工具
+
+情绪评分、情绪分析等记录按写入时间正序存储，按时间范围查询时把边界统一转换为
+epoch 秒后二分查找起止位置，不需要逐条解析时间字符串。
+"""
+
+from bisect import bisect_left
+from datetime import datetime
+
+
+def to_epoch(value):
+    """把 datetime / ISO 字符串 / 数字转换为 epoch 秒，无法解析时返回 None
+
+    不带时区的时间按本地时间处理（与 datetime.now().isoformat() 生成的时间戳一致）。
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return None
+
+
+def time_window(items, field, start=None, end=None):
+    """截取时间字段在 [start, end) 内的记录
+
+    Args:
+        items: 按 field 时间正序排列的记录列表
+        field: 时间字段名
+        start: 起始时间（datetime / ISO 字符串 / epoch 秒），None表示不限
+        end: 结束时间（不含），None表示不限
+
+    Returns:
+        list: 范围内的记录（items 的切片）
+    """
+    start = to_epoch(start)
+    end = to_epoch(end)
+    if start is None and end is None:
+        return items
+
+    def key(item):
+        return to_epoch(item.get(field)) or 0.0
+
+    lo = bisect_left(items, start, key=key) if start is not None else 0
+    hi = bisect_left(items, end, key=key) if end is not None else len(items)
+    return items[lo:hi]
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+单个用户的全部数据导出（流式）
+
+按会话逐项读取用户的数据，边读边输出，内存中最多只有一个会话的一种数据：
+
+- ndjson：每行一条记录 {"type": 数据种类, "session_id": 会话ID, "data": 记录}，
+  数据种类与 bulk_load 的 kinds 一致，另有 user（导出信息）、session（会话元数据）、report（分析报告）
+- tar：gzip 压缩的 tar 包，每种数据一个文件：
+
+      <user_id>/user.json
+      <user_id>/sessions/<session_id>/session.json / chat_history.jsonl / events.jsonl / ...
+      <user_id>/profile.json / long_term_memory.jsonl / emotions.jsonl
+      <user_id>/reports/<report_id>.json
+
+只使用 StorageBackend 的读接口，适用于所有存储后端。
+"""
+
+import io
+import time
+import tarfile
+from datetime import datetime
+
+from utils import json_codec
+
+EXPORT_FORMATS = ("ndjson", "tar")
+
+# ndjson 每次输出的最小字节数
+_CHUNK_BYTES = 64 * 1024
+
+
+def _user_parts(database, user_id):
+    """按顺序生成用户数据的各个部分 (数据种类, 会话ID, 数据, 是否为记录列表)
+
+    每一部分在迭代到它时才读取。
+    """
+    sessions = database.get_sessions(user_id)
+    yield "user", None, {
+        "user_id": user_id,
+        "exported_at": datetime.now().isoformat(),
+        "sessions": len(sessions),
+    }, False
+
+    for session_id, meta in sessions.items():
+        yield "session", session_id, dict(meta, session_id=session_id), False
+        yield "chat_history", session_id, database.get_chat_history(session_id), True
+        yield "events", session_id, database.get_events(session_id), True
+        yield "moods", session_id, database.get_mood_analysis(session_id), True
+        yield "inquiry_history", session_id, database.get_inquiry_history(session_id), True
+        yield "plan", session_id, database.get_session_plan(session_id), False
+        yield "inquiry", session_id, database.get_inquiry_result(session_id), False
+        yield "pattern", session_id, database.get_pattern_analysis(session_id), False
+
+    yield "profile", None, database.get_user_profile(user_id), False
+    yield "long_term_memory", None, database.get_long_term_memory(user_id), True
+    yield "emotions", None, database.get_emotion_history(user_id), True
+    # 报告头列表是最新的在前，按时间正序导出
+    for header in reversed(database.get_analysis_reports_history(user_id)):
+        report = database.get_analysis_report(user_id, header["id"])
+        yield "report", None, {"header": header, "report": report}, False
+
+
+def has_user_data(database, user_id):
+    """用户是否有任何数据"""
+    return bool(
+        database.get_sessions(user_id)
+        or database.get_emotion_count(user_id)
+        or database.get_long_term_memory(user_id, 1)
+        or database.get_user_profile(user_id)
+        or database.get_analysis_reports_history(user_id, 1)
+    )
+
+
+def iter_user_records(database, user_id):
+    """逐条生成用户的全部数据记录 {"type", "session_id", "data"}"""
+    for kind, session_id, data, many in _user_parts(database, user_id):
+        if not data:
+            continue
+        for item in data if many else (data,):
+            record = {"type": kind}
+            if session_id is not None:
+                record["session_id"] = session_id
+            record["data"] = item
+            yield record
+
+
+def ndjson_stream(database, user_id):
+    """以 NDJSON 格式流式导出用户数据，生成 bytes 分块"""
+    buffer = []
+    size = 0
+    for record in iter_user_records(database, user_id):
+        line = json_codec.dumps_bytes(record) + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= _CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+class _ChunkWriter:
+    """tarfile 的输出对象：写入的数据暂存，由生成器取走"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _safe_name(name):
+    """会话ID / 用户ID 作为 tar 内的路径时去掉路径分隔符"""
+    name = str(name).replace("/", "_").replace("\\", "_")
+    return "_" + name if name.startswith(".") else name
+
+
+def tar_stream(database, user_id):
+    """以 tar.gz 格式流式导出用户数据，生成 bytes 分块"""
+    output = _ChunkWriter()
+    root = _safe_name(user_id)
+    mtime = time.time()
+
+    with tarfile.open(fileobj=output, mode="w|gz") as archive:
+        for kind, session_id, data, many in _user_parts(database, user_id):
+            if not data:
+                continue
+            if many:
+                payload = b"".join(json_codec.dumps_bytes(item) + b"\n" for item in data)
+                filename = f"{kind}.jsonl"
+            else:
+                payload = json_codec.dumps_bytes(data, pretty=True)
+                filename = f"{kind}.json"
+
+            if session_id is not None:
+                path = f"{root}/sessions/{_safe_name(session_id)}/{filename}"
+            elif kind == "report":
+                path = f"{root}/reports/{_safe_name(data['header']['id'])}.json"
+            else:
+                path = f"{root}/{filename}"
+
+            info = tarfile.TarInfo(path)
+            info.size = len(payload)
+            info.mtime = mtime
+            archive.addfile(info, io.BytesIO(payload))
+            chunk = output.drain()
+            if chunk:
+                yield chunk
+
+    chunk = output.drain()
+    if chunk:
+        yield chunk
@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+写后台化（write-behind）持久化队列
+
+请求线程只负责把写操作放入队列并立即返回；后台写线程把一个时间窗口内到达的
+所有写操作合并成一个批次，交给数据库的 apply_batch 按文件合并写入（group commit）。
+
+意图日志（WRITE_BEHIND_LOG，文件后端和 SQLite 后端默认开启）：
+- 提交的写操作先追加到本进程的意图日志并 fsync，submit 返回时写操作已经落盘，
+  进程崩溃不会丢失已确认的写入。同时提交的多个请求共用一次 fsync（group commit）：
+  正在 fsync 时到达的请求只写入日志，由下一次 fsync 一并落盘
+- 每个写操作有唯一的ID（日志名:序号:下标），随写操作交给数据库的 apply_batch
+- 批次写入完成后追加完成标记，没有未完成的操作时清空日志
+- 每个进程的日志在存活期间持有独占文件锁；启动时重放锁已释放（进程已退出）的日志中
+  未完成的操作。崩溃发生在写入完成和完成标记之间时，先通过数据库的
+  applied_operations 跳过已经写入的操作（文件后端的消息、情绪评分和长期记忆带有
+  写操作ID标记）；无法判断的操作（画像合并更新等幂等操作、SQLite 后端）再执行一次
+
+fsync 策略（WRITE_BEHIND_FSYNC）：
+- none: 不主动 fsync，由操作系统决定落盘时机（默认）
+- batch: 每个批次结束时对写入过的文件各 fsync 一次
+- write: 每个写操作单独写入并 fsync（不合并，最安全也最慢）
+"""
+
+import os
+import time
+import uuid
+import atexit
+import inspect
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from dao.locks import FileLock
+from utils import json_codec
+
+FSYNC_POLICIES = ("none", "batch", "write")
+
+# 写操作涉及的键（用于 wait_for 等待某个会话/用户的未完成写入）
+_KEY_PARAMS = ("session_id", "user_id")
+
+
+def op_ids(log_name, seq, count):
+    """一组写操作的ID（日志名:序号:下标）"""
+    return [f"{log_name}:{seq}:{i}" for i in range(count)]
+
+
+class IntentLog:
+    """本进程提交的写操作的意图日志"""
+
+    def __init__(self, directory):
+        """初始化意图日志
+
+        Args:
+            directory: 日志目录，每个进程一个日志文件
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(directory, f"{self.name}.jsonl")
+        # 进程存活期间一直持有，其他进程据此判断日志是否无主
+        self._owner = FileLock(self.path)
+        self._owner.acquire_exclusive()
+        self._file = open(self.path, "ab")
+        self._mutex = threading.Lock()
+        self._seq = 0
+        self._open = 0
+        # group commit：已经 fsync 到的序号、是否有线程正在 fsync
+        self._sync_cond = threading.Condition()
+        self._synced = 0
+        self._syncing = False
+
+    def append(self, operations):
+        """追加一组写操作，返回前该记录已经 fsync
+
+        Args:
+            operations: [(方法名, args, kwargs), ...]
+
+        Returns:
+            int: 序号，写入完成后传给 complete
+        """
+        with self._mutex:
+            self._seq += 1
+            seq = self._seq
+            record = {
+                "seq": seq,
+                "ops": [[name, list(args), kwargs] for name, args, kwargs in operations],
+            }
+            self._file.write(json_codec.dumps_bytes(record) + b"\n")
+            self._file.flush()
+            self._open += 1
+        self._sync(seq)
+        return seq
+
+    def _sync(self, seq):
+        """等待序号 seq 之前的记录落盘
+
+        没有线程在 fsync 时由当前线程 fsync，一次覆盖已经写入的全部记录；
+        否则等待正在进行的 fsync 完成后再检查。
+        """
+        with self._sync_cond:
+            while self._synced < seq:
+                if self._syncing:
+                    self._sync_cond.wait()
+                    continue
+                self._syncing = True
+                with self._mutex:
+                    target = self._seq
+                self._sync_cond.release()
+                try:
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                    self._sync_cond.notify_all()
+                self._synced = max(self._synced, target)
+
+    def complete(self, seqs):
+        """标记写操作已完成"""
+        if not seqs:
+            return
+        with self._mutex:
+            self._open -= len(seqs)
+            if self._open <= 0:
+                # 全部完成，日志不再需要（追加模式下截断后从头写入）
+                self._open = 0
+                self._file.truncate(0)
+            else:
+                self._file.write(json_codec.dumps_bytes({"done": list(seqs)}) + b"\n")
+                self._file.flush()
+
+    def close(self, remove=True):
+        """关闭日志（remove 为 True 时删除日志文件）"""
+        with self._mutex:
+            self._file.close()
+            if remove:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+            self._owner.close()
+
+    def orphans(self):
+        """逐个生成已退出进程留下的日志中未完成的写操作
+
+        Yields:
+            (日志路径, 锁, [(写操作ID列表, [(方法名, args, kwargs), ...]), ...])，
+            调用方重放后调用 release_orphan
+        """
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if path == self.path or not name.endswith(".jsonl"):
+                continue
+            lock = FileLock(path)
+            if not lock.try_acquire_exclusive():
+                # 所属进程仍在运行
+                lock.close()
+                continue
+            yield path, lock, [
+                (op_ids(name[: -len(".jsonl")], seq, len(ops)), ops)
+                for seq, ops in self._read_pending(path)
+            ]
+
+    @staticmethod
+    def release_orphan(path, lock):
+        """删除已重放的日志"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        lock.close()
+
+    @staticmethod
+    def _read_pending(path):
+        intents = {}
+        done = set()
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json_codec.loads(line)
+                except ValueError:
+                    # 写到一半的最后一行：fsync 没有完成，提交方没有得到确认
+                    continue
+                if "done" in record:
+                    done.update(record["done"])
+                else:
+                    intents[record["seq"]] = [
+                        (name, tuple(args), kwargs) for name, args, kwargs in record["ops"]
+                    ]
+        return [(seq, ops) for seq, ops in sorted(intents.items()) if seq not in done]
+
+
+class WriteBehindQueue:
+    """合并写入的后台持久化队列"""
+
+    def __init__(
+        self, database, window=0.02, fsync_policy="none", max_batch=1000, log_dir=None
+    ):
+        """初始化写队列
+
+        Args:
+            database: 数据库实例
+            window: 合并窗口（秒），窗口内到达的写操作合并为一个批次
+            fsync_policy: fsync 策略，none / batch / write
+            max_batch: 单个批次的最大操作数
+            log_dir: 意图日志目录，None表示不记录意图日志（崩溃时丢失未写入的操作）
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+
+        self.db = database
+        self.window = window
+        self.fsync_policy = fsync_policy
+        self.max_batch = max_batch
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._pending = {}
+        self._signatures = {}
+        self._stopped = False
+        self.stats = {
+            "batches": 0, "operations": 0, "max_batch": 0, "replayed": 0, "skipped": 0,
+        }
+
+        self._log = IntentLog(log_dir) if log_dir else None
+        if self._log is not None:
+            self._replay()
+
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, method, *args, **kwargs):
+        """提交单个写操作
+
+        Args:
+            method: 数据库写方法名，如 "save_message"
+            *args, **kwargs: 方法参数
+
+        Returns:
+            Future: 该操作提交到磁盘后完成
+        """
+        return self.submit_batch([(method, args, kwargs)])
+
+    def submit_batch(self, operations):
+        """提交一组写操作，它们保证在同一个批次中执行
+
+        Args:
+            operations: [(方法名, args, kwargs), ...]
+
+        Returns:
+            Future: 全部操作提交到磁盘后完成；任一操作失败时为该操作的异常
+        """
+        operations = list(operations)
+        future = Future()
+        keys = set()
+        for name, args, kwargs in operations:
+            keys.update(self._keys_of(name, args, kwargs))
+
+        with self._cond:
+            stopped = self._stopped
+        if stopped:
+            # 队列已停止时直接同步执行
+            self._execute([(operations, future, keys, None, None)])
+            return future
+
+        seq = ids = None
+        if self._log is not None:
+            try:
+                seq = self._log.append(operations)
+                ids = op_ids(self._log.name, seq, len(operations))
+            except Exception as e:
+                print(f"Error logging write-behind intent: {str(e)}")
+
+        with self._cond:
+            for key in keys:
+                self._pending[key] = self._pending.get(key, 0) + 1
+            self._queue.append((operations, future, keys, seq, ids))
+            self._cond.notify_all()
+        return future
+
+    def wait_for(self, key, timeout=None):
+        """等待与某个会话ID/用户ID相关的写操作全部完成（读己之写）
+
+        Args:
+            key: 会话ID或用户ID
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            bool: 是否已无未完成的写操作
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending.get(key):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def flush(self, timeout=None):
+        """等待队列中所有写操作完成
+
+        Returns:
+            bool: 队列是否已清空
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stop(self):
+        """停止后台线程，退出前写完队列中剩余的操作"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self._log is not None:
+            self._log.close()
+
+    def _keys_of(self, method, args, kwargs):
+        """按参数名取出写操作涉及的会话ID / 用户ID"""
+        signature = self._signatures.get(method)
+        try:
+            if signature is None:
+                signature = self._signatures[method] = inspect.signature(
+                    getattr(self.db, method)
+                )
+            params = signature.bind(*args, **kwargs).arguments
+        except (AttributeError, TypeError, ValueError):
+            # 参数不匹配的操作执行时会失败，这里只取关键字参数
+            params = kwargs
+        return [params[name] for name in _KEY_PARAMS if params.get(name) is not None]
+
+    def _replay(self):
+        """重放已退出进程的意图日志中未完成的写操作，跳过数据库中已经写入的操作"""
+        applied_operations = getattr(self.db, "applied_operations", None)
+        for path, lock, batches in self._log.orphans():
+            try:
+                for ids, operations in batches:
+                    applied = applied_operations(operations, ids) if applied_operations else ()
+                    pending = [
+                        (op_id, op) for op_id, op in zip(ids, operations)
+                        if op_id not in applied
+                    ]
+                    self.stats["skipped"] += len(operations) - len(pending)
+                    if pending:
+                        # 沿用原来的写操作ID，重放中途崩溃时同样可以跳过
+                        self._execute([(
+                            [op for _, op in pending], Future(), (), None,
+                            [op_id for op_id, _ in pending],
+                        )])
+                    self.stats["replayed"] += len(pending)
+                IntentLog.release_orphan(path, lock)
+            except Exception as e:
+                print(f"Error replaying write-behind log {path}: {str(e)}")
+                lock.close()
+        if self.stats["replayed"] or self.stats["skipped"]:
+            print(
+                f"Replayed {self.stats['replayed']} write-behind operations"
+                f" (skipped {self.stats['skipped']} already applied)"
+            )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if not self._queue and self._stopped:
+                    return
+
+            # 等待合并窗口，让并发请求的写操作进入同一批次
+            if self.window > 0 and not self._stopped:
+                time.sleep(self.window)
+
+            with self._cond:
+                batch = []
+                size = 0
+                while self._queue and size < self.max_batch:
+                    item = self._queue.popleft()
+                    batch.append(item)
+                    size += len(item[0])
+
+            self._execute(batch)
+
+    def _apply(self, operations, ids):
+        """执行写操作，返回与 operations 一一对应的异常（成功为 None）
+
+        Args:
+            operations: [(方法名, args, kwargs), ...]
+            ids: 与 operations 一一对应的写操作ID（没有意图日志时为 None）
+        """
+        batched = hasattr(self.db, "apply_batch")
+        if batched and self.fsync_policy != "write":
+            try:
+                return self.db.apply_batch(
+                    operations, fsync=self.fsync_policy == "batch", op_ids=ids
+                )
+            except Exception as e:
+                print(f"Error in write-behind batch: {str(e)}")
+                return [e] * len(operations)
+
+        errors = []
+        for i, (name, args, kwargs) in enumerate(operations):
+            try:
+                if batched:
+                    error = self.db.apply_batch(
+                        [(name, args, kwargs)], fsync=True, op_ids=[ids[i]]
+                    )[0]
+                else:
+                    getattr(self.db, name)(*args, **kwargs)
+                    error = None
+            except Exception as e:
+                print(f"Error in write-behind operation {name}: {str(e)}")
+                error = e
+            errors.append(error)
+        return errors
+
+    def _execute(self, batch):
+        operations = [op for ops, _, _, _, _ in batch for op in ops]
+        ids = [
+            op_id
+            for ops, _, _, _, item_ids in batch
+            for op_id in (item_ids or [None] * len(ops))
+        ]
+        errors = self._apply(operations, ids)
+
+        if self._log is not None:
+            try:
+                self._log.complete([seq for _, _, _, seq, _ in batch if seq is not None])
+            except Exception as e:
+                print(f"Error completing write-behind intents: {str(e)}")
+
+        with self._cond:
+            self.stats["batches"] += 1
+            self.stats["operations"] += len(operations)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(operations))
+            for _, _, keys, _, _ in batch:
+                for key in keys:
+                    count = self._pending.get(key, 0) - 1
+                    if count > 0:
+                        self._pending[key] = count
+                    else:
+                        self._pending.pop(key, None)
+            self._cond.notify_all()
+
+        offset = 0
+        for ops, future, _, _, _ in batch:
+            failed = [e for e in errors[offset:offset + len(ops)] if e is not None]
+            offset += len(ops)
+            if failed:
+                future.set_exception(failed[0])
+            else:
+                future.set_result(len(ops))
+
+
+_shared_queues = {}
+_shared_queues_lock = threading.Lock()
+
+
+def get_write_queue(database):
+    """获取数据库实例对应的共享写队列，参数来自环境变量
+
+    - WRITE_BEHIND_WINDOW_MS: 合并窗口（毫秒），默认 20
+    - WRITE_BEHIND_FSYNC: fsync 策略，默认 none
+    - WRITE_BEHIND_LOG: 是否记录意图日志（数据目录下的 write_queue/），默认 1
+    """
+    key = id(database)
+    queue = _shared_queues.get(key)
+    if queue is None:
+        with _shared_queues_lock:
+            queue = _shared_queues.get(key)
+            if queue is None:
+                data_dir = getattr(database, "data_dir", None)
+                log_dir = None
+                if data_dir and os.environ.get("WRITE_BEHIND_LOG", "1") != "0":
+                    log_dir = os.path.join(data_dir, "write_queue")
+                queue = WriteBehindQueue(
+                    database,
+                    window=float(os.environ.get("WRITE_BEHIND_WINDOW_MS", "20")) / 1000,
+                    fsync_policy=os.environ.get("WRITE_BEHIND_FSYNC", "none").lower(),
+                    log_dir=log_dir,
+                )
+                _shared_queues[key] = queue
+    return queue
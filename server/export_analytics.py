@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+列式分析数据导出工具
+
+把存储后端中的消息、事件、情绪评分、情绪分析和模式分析增量导出为
+按用户分区的 Parquet（需要 pyarrow）或 gzip CSV 文件：
+
+    python export_analytics.py --data-dir data --out analytics
+
+每次运行只导出上次之后变化的数据，可以放在定时任务中执行。
+"""
+
+import os
+import sys
+import argparse
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from dao.analytics_export import FORMATS, AnalyticsExporter
+from dao.database import backend_names, get_backend_factory
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="增量导出列式分析数据")
+    parser.add_argument("--data-dir", default="data", help="数据目录")
+    parser.add_argument(
+        "--backend",
+        default=os.environ.get("DB_BACKEND", "file"),
+        help=f"存储后端（{' / '.join(backend_names())}），默认为 DB_BACKEND",
+    )
+    parser.add_argument("--out", required=True, help="导出目录")
+    parser.add_argument(
+        "--format", choices=FORMATS, help="导出格式，默认安装了 pyarrow 时为 parquet，否则为 csv"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    factory = get_backend_factory(args.backend)
+    if factory is None:
+        print(f"❌ 未知的存储后端: {args.backend}（可用: {', '.join(backend_names())}）")
+        return 2
+
+    try:
+        exporter = AnalyticsExporter(factory(args.data_dir), args.out, args.format)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 2
+
+    stats = exporter.run()
+    print(
+        f"✅ 导出完成（{exporter.format}）: {stats['users']} 个用户有变化，"
+        f"写入 {stats['files_written']} 个文件 / {stats['rows']} 行 / "
+        f"{stats['bytes'] / 1024 / 1024:.2f} MB，删除 {stats['files_removed']} 个文件，"
+        f"用时 {stats['elapsed_s']}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
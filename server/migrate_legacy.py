@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+旧版 data/ 目录迁移工具
+
+把旧版 JSON 文件布局的数据流式迁移到指定的存储后端（file / sqlite / ...），可中断后继续：
+
+    python migrate_legacy.py --source data --target sqlite --target-dir data_sqlite
+
+在线迁移：服务照常运行时执行迁移（--follow 会反复迁移变化的数据），
+停止写入后再运行一次作为最后的追平，然后把 DB_BACKEND 切换到新后端。
+"""
+
+import os
+import sys
+import argparse
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from dao.database import backend_names, get_backend_factory
+from dao.legacy_migrator import LegacyMigrator
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="迁移旧版 data/ 目录到新的存储后端")
+    parser.add_argument("--source", default="data", help="旧版数据目录（只读）")
+    parser.add_argument(
+        "--target", default="sqlite", help=f"目标存储后端（{' / '.join(backend_names())}）"
+    )
+    parser.add_argument("--target-dir", required=True, help="目标数据目录")
+    parser.add_argument("--state", help="迁移状态文件，默认为 <target-dir>/.migration_state.jsonl")
+    parser.add_argument("--batch-size", type=int, default=2000, help="每批最多写入的记录数")
+    parser.add_argument("--batch-units", type=int, default=200, help="每批最多写入的会话 / 用户数")
+    parser.add_argument("--no-verify", action="store_true", help="写入后不读回校验")
+    parser.add_argument("--follow", action="store_true", help="反复迁移直到某一遍没有变化的数据")
+    parser.add_argument("--interval", type=float, default=10.0, help="--follow 两遍之间的间隔（秒）")
+    parser.add_argument("--max-passes", type=int, help="--follow 最多执行的遍数")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="输出进度的间隔（秒）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    factory = get_backend_factory(args.target)
+    if factory is None:
+        print(f"❌ 未知的存储后端: {args.target}（可用: {', '.join(backend_names())}）")
+        return 2
+    if os.path.realpath(args.source) == os.path.realpath(args.target_dir):
+        # 文件后端打开旧版目录时会就地转换文件，目标目录必须与源目录不同
+        print("❌ 目标目录不能与源目录相同")
+        return 2
+
+    target = factory(args.target_dir)
+    migrator = LegacyMigrator(
+        args.source,
+        target,
+        args.state or os.path.join(args.target_dir, ".migration_state.jsonl"),
+        batch_records=args.batch_size,
+        batch_units=args.batch_units,
+        verify=not args.no_verify,
+        progress_interval=args.progress_interval,
+    )
+
+    if args.follow:
+        passes = migrator.follow(args.interval, args.max_passes)
+    else:
+        passes = [migrator.run()]
+    target.flush()
+
+    failed = False
+    for number, stats in enumerate(passes, 1):
+        print(
+            f"第 {number} 遍: 迁移 {stats['migrated']} 个单位，跳过 {stats['skipped']} 个，"
+            f"{stats['records']} 条记录，用时 {stats['elapsed_s']}s "
+            f"（{stats['records_per_s']} 条/秒，{stats['mb_per_s']} MB/秒）"
+        )
+        for error in stats["errors"]:
+            print(f"  ⚠️ 读取失败: {error}")
+        for mismatch in stats["mismatches"]:
+            print(f"  ❌ 校验不一致: {mismatch}")
+    last = passes[-1]
+    failed = bool(last["errors"] or last["mismatches"])
+    print("❌ 迁移未完成，修复问题后重新运行即可继续" if failed else "✅ 迁移完成")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
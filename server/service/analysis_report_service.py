@@ -13,7 +13,9 @@ import numpy as np
 
 # 添加路径以便导入数据库模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from dao.database import Database
+from dao.bundle import KINDS
+from dao.database import get_database
+from utils import json_codec
 
 class AnalysisReportService:
     """全面的用户心理健康分析报告服务
@@ -29,8 +31,13 @@ class AnalysisReportService:
     - 风险评估和预测
     """
 
-    def __init__(self):
-        """初始化全面分析报告服务"""
+    def __init__(self, database=None):
+        """初始化全面分析报告服务
+
+        Args:
+            database: 数据库实例，默认使用进程内共享的实例
+        """
+        self.db = database or get_database()
         self.model = os.environ.get("CHAT_MODEL_NAME", "deepseek-chat")
         self.client = OpenAI(
             api_key=os.environ.get("CHAT_API_KEY"),
@@ -263,8 +270,7 @@ class AnalysisReportService:
     def _get_user_sessions(self, user_id: str) -> List[str]:
         """获取用户的所有会话ID"""
         try:
-            db = Database()
-            sessions = db.get_sessions(user_id)
+            sessions = self.db.get_sessions(user_id)
             return list(sessions.keys())
         except Exception as e:
             print(f"Error getting user sessions: {str(e)}")
@@ -272,7 +278,6 @@ class AnalysisReportService:
 
     def _collect_comprehensive_data(self, user_id: str, session_ids: List[str], time_period: int) -> Dict[str, Any]:
         """收集用户的全面数据"""
-        db = Database()
         cutoff_date = datetime.now() - timedelta(days=time_period)
         
         comprehensive_data = {
@@ -288,95 +293,50 @@ class AnalysisReportService:
         }
         
         try:
-            # 收集对话历史
-            for session_id in session_ids:
-                try:
-                    chat_history = db.get_chat_history(session_id, limit=100)
-                    message_count = db.get_user_message_count(session_id)
-                    
-                    session_data = {
-                        "session_id": session_id,
-                        "chat_history": chat_history,
-                        "message_count": message_count,
-                        "collected_at": datetime.now().isoformat()
-                    }
-                    comprehensive_data["conversations"].append(session_data)
-                except Exception as e:
-                    print(f"Error collecting conversation data for session {session_id}: {e}")
-                    continue
-            
-            # 收集事件数据
-            for session_id in session_ids:
-                try:
-                    events = db.get_events(session_id, limit=50)
-                    filtered_events = self._filter_by_time_period(events, cutoff_date, "time")
-                    comprehensive_data["events"].extend(filtered_events)
-                except Exception as e:
-                    print(f"Error collecting events for session {session_id}: {e}")
-                    continue
-            
-            # 收集情绪数据
-            try:
-                emotions = db.get_emotion_history(user_id, limit=100)
-                filtered_emotions = self._filter_by_time_period(emotions, cutoff_date, "timestamp")
-                comprehensive_data["emotions"] = filtered_emotions
-            except Exception as e:
-                print(f"Error collecting emotions: {e}")
-            
-            # 收集行为模式数据
-            for session_id in session_ids:
-                try:
-                    pattern = db.get_pattern_analysis(session_id)
-                    if pattern:
-                        comprehensive_data["patterns"].append(pattern)
-                except Exception as e:
-                    print(f"Error collecting pattern for session {session_id}: {e}")
-                    continue
-            
-            # 收集心情分析数据
-            for session_id in session_ids:
-                try:
-                    moods = db.get_mood_analysis(session_id, limit=20)
-                    filtered_moods = self._filter_by_time_period(moods, cutoff_date, "timestamp")
-                    comprehensive_data["moods"].extend(filtered_moods)
-                except Exception as e:
-                    print(f"Error collecting moods for session {session_id}: {e}")
-                    continue
-            
-            # 收集引导性询问数据
-            for session_id in session_ids:
-                try:
-                    inquiry = db.get_inquiry_result(session_id)
-                    if inquiry:
-                        comprehensive_data["inquiries"].append(inquiry)
-                    
-                    inquiry_history = db.get_inquiry_history(session_id, limit=10)
-                    comprehensive_data["inquiries"].extend(inquiry_history)
-                except Exception as e:
-                    print(f"Error collecting inquiry data for session {session_id}: {e}")
-                    continue
-            
-            # 收集用户画像
-            try:
-                comprehensive_data["user_profile"] = db.get_user_profile(user_id)
-            except Exception as e:
-                print(f"Error collecting user profile: {e}")
+            # 一次批量读取所有会话的数据（各会话并行读取）；事件、心情分析和情绪评分
+            # 都按时间范围（created_at / timestamp）从存储层读取，不再逐条解析时间
+            bundle = self.db.bulk_load(
+                user_id,
+                session_ids,
+                kinds=[kind for kind in KINDS if kind != "emotions"],
+                since=cutoff_date,
+                limits={
+                    "chat_history": 100,
+                    "events": 50,
+                    "moods": 20,
+                    "inquiry_history": 10,
+                    "long_term_memory": 50,
+                },
+            )
+            collected_at = datetime.now().isoformat()
             
-            # 收集长期记忆
-            try:
-                comprehensive_data["long_term_memory"] = db.get_long_term_memory(user_id, limit=50)
-            except Exception as e:
-                print(f"Error collecting long term memory: {e}")
+            for session in bundle.iter_sessions():
+                # 对话历史
+                comprehensive_data["conversations"].append({
+                    "session_id": session.session_id,
+                    "chat_history": session.chat_history,
+                    "message_count": session.message_count,
+                    "collected_at": collected_at
+                })
+                
+                # 事件、心情分析（已按时间范围过滤）
+                comprehensive_data["events"].extend(session.events)
+                comprehensive_data["moods"].extend(session.moods)
+                
+                # 行为模式、引导性询问、会话计划
+                if session.pattern:
+                    comprehensive_data["patterns"].append(session.pattern)
+                if session.inquiry:
+                    comprehensive_data["inquiries"].append(session.inquiry)
+                comprehensive_data["inquiries"].extend(session.inquiry_history)
+                if session.plan:
+                    comprehensive_data["session_plans"].append(session.plan)
             
-            # 收集会话计划
-            for session_id in session_ids:
-                try:
-                    plan = db.get_session_plan(session_id)
-                    if plan:
-                        comprehensive_data["session_plans"].append(plan)
-                except Exception as e:
-                    print(f"Error collecting session plan for {session_id}: {e}")
-                    continue
+            comprehensive_data["emotions"] = self.db.get_emotion_history(
+                user_id, limit=100, start=cutoff_date
+            )
+            comprehensive_data["user_profile"] = bundle.profile
+            comprehensive_data["long_term_memory"] = bundle.long_term_memory
             
             return comprehensive_data
             
@@ -384,29 +344,6 @@ class AnalysisReportService:
             print(f"Error in comprehensive data collection: {e}")
             return comprehensive_data
 
-    def _filter_by_time_period(self, items: List[Dict], cutoff_date: datetime, time_field: str) -> List[Dict]:
-        """根据时间段过滤数据"""
-        filtered_items = []
-        for item in items:
-            try:
-                time_str = item.get(time_field, "")
-                if time_str:
-                    # 处理不同的时间格式
-                    if not time_str.endswith('Z') and '+' not in time_str:
-                        if 'T' not in time_str:
-                            time_str += 'T00:00:00'
-                    item_time = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
-                    if item_time >= cutoff_date:
-                        filtered_items.append(item)
-                else:
-                    # 如果没有时间信息，仍然包含该项
-                    filtered_items.append(item)
-            except Exception as e:
-                print(f"Error parsing time for filtering: {e}")
-                # 解析失败时仍然包含该项
-                filtered_items.append(item)
-        return filtered_items
-
     def _generate_comprehensive_statistics(self, comprehensive_data: Dict[str, Any]) -> Dict[str, Any]:
         """生成全面的统计分析"""
         try:
@@ -980,7 +917,7 @@ class AnalysisReportService:
             {self.analysis_prompt}
             
             用户全面心理健康数据分析：
-            {json.dumps(analysis_input, ensure_ascii=False, indent=2)}
+            {json_codec.dumps(analysis_input)}
             
             请基于以上全面的数据生成深度专业的心理健康分析报告。
             """
@@ -1339,7 +1276,7 @@ class AnalysisReportService:
     def export_comprehensive_report(self, report: Dict[str, Any], format_type: str = "json") -> str:
         """导出全面报告"""
         if format_type == "json":
-            return json.dumps(report, ensure_ascii=False, indent=2)
+            return json_codec.dumps(report, pretty=True)
         elif format_type == "markdown":
             return self._format_comprehensive_report_as_markdown(report)
         elif format_type == "text":
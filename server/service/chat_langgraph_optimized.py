@@ -21,11 +21,9 @@
 """
 
 import os
-import json
 import sys
 from pathlib import Path
 import asyncio
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Tuple, Any, Optional
 
 sys.path.append(str(Path(__file__).parent.parent))
@@ -41,7 +39,11 @@ from pydantic import BaseModel, Field
 from snownlp import SnowNLP
 
 from utils.extract_json import extract_json
-from dao.database import Database
+from utils import json_codec
+from dao.async_database import get_async_database
+from dao.database import Database, get_database
+from dao.memory_index import MemoryIndex
+from dao.write_queue import get_write_queue
 from service.analysis_report_service import AnalysisReportService
 
 import warnings
@@ -242,11 +244,16 @@ class OptimizedChatService:
         self.guided_inquiry_prompt = self._load_guided_inquiry_prompt()
         self.pattern_analysis_prompt = self._load_pattern_analysis_prompt()
 
-        # 创建线程池用于并行处理
-        self.executor = ThreadPoolExecutor(max_workers=3)
+        # 异步数据库接口：并发读取存储，调用在有界的存储线程池中排队而不是超时
+        self.async_db = get_async_database(database)
+
+        # 长期记忆按与当前输入的相关度检索，只把最相关的几条放入提示词
+        self.memory_index = MemoryIndex(database)
+        self.memory_top_k = int(os.environ.get("MEMORY_TOP_K", "5"))
+        self.memory_token_budget = int(os.environ.get("MEMORY_TOKEN_BUDGET", "600"))
         
         # 初始化分析报告服务
-        self.analysis_service = AnalysisReportService()
+        self.analysis_service = AnalysisReportService(database)
 
     def _load_prompt_template(self) -> str:
         """加载咨询师提示词模板"""
@@ -323,52 +330,53 @@ class OptimizedChatService:
         with open(prompt_file, "r", encoding="utf-8") as f:
             return f.read()
 
-    def batch_get_user_data(self, user_id: str) -> Dict[str, Any]:
-        """批量获取用户数据"""
-        try:
-            # 并行获取用户数据
-            futures = {
-                "profile": self.executor.submit(self.db.get_user_profile, user_id),
-                "memory": self.executor.submit(
-                    self.db.get_long_term_memory, user_id, 5
-                ),
-                "emotion_history": self.executor.submit(
-                    self.db.get_emotion_history, user_id
-                ),
-            }
+    async def abatch_get_user_data(
+        self, user_id: str, query: str | None = None
+    ) -> Dict[str, Any]:
+        """批量获取用户数据（异步）
 
-            results = {}
-            for key, future in futures.items():
-                try:
-                    results[key] = future.result(timeout=2)
-                except Exception as e:
-                    print(f"Error getting {key}: {e}")
-                    results[key] = {} if key == "profile" else []
+        给出 query 时长期记忆取与其最相关的若干条（不超过 token 预算），否则取最近 5 条。
+        """
+        if query:
+            memory = (
+                self.memory_index.retrieve,
+                user_id,
+                query,
+                self.memory_top_k,
+                self.memory_token_budget,
+            )
+        else:
+            memory = ("get_long_term_memory", user_id, 5)
+        return await self.async_db.gather(
+            defaults={"profile": {}, "memory": [], "emotion_history": []},
+            profile=("get_user_profile", user_id),
+            memory=memory,
+            emotion_history=("get_emotion_history", user_id),
+        )
 
-            return results
+    def batch_get_user_data(
+        self, user_id: str, query: str | None = None
+    ) -> Dict[str, Any]:
+        """批量获取用户数据"""
+        try:
+            return self.async_db.run(self.abatch_get_user_data(user_id, query))
         except Exception as e:
             print(f"Error in batch_get_user_data: {e}")
             return {"profile": {}, "memory": [], "emotion_history": []}
 
+    async def aget_session_analysis_data(self, session_id: str) -> Dict[str, Any]:
+        """获取会话分析数据（异步）"""
+        return await self.async_db.gather(
+            defaults={"inquiry_result": {}, "pattern_analysis": {}, "inquiry_history": []},
+            inquiry_result=("get_inquiry_result", session_id),
+            pattern_analysis=("get_pattern_analysis", session_id),
+            inquiry_history=("get_inquiry_history", session_id, 5),
+        )
+
     def get_session_analysis_data(self, session_id: str) -> Dict[str, Any]:
         """获取会话分析数据（引导性询问和模式分析结果）"""
         try:
-            # 并行获取会话分析数据
-            futures = {
-                "inquiry_result": self.executor.submit(self.db.get_inquiry_result, session_id),
-                "pattern_analysis": self.executor.submit(self.db.get_pattern_analysis, session_id),
-                "inquiry_history": self.executor.submit(self.db.get_inquiry_history, session_id, 5),
-            }
-
-            results = {}
-            for key, future in futures.items():
-                try:
-                    results[key] = future.result(timeout=2)
-                except Exception as e:
-                    print(f"Error getting {key}: {e}")
-                    results[key] = {} if key != "inquiry_history" else []
-
-            return results
+            return self.async_db.run(self.aget_session_analysis_data(session_id))
         except Exception as e:
             print(f"Error in get_session_analysis_data: {e}")
             return {"inquiry_result": {}, "pattern_analysis": {}, "inquiry_history": []}
@@ -513,7 +521,7 @@ class OptimizedChatService:
                 {"role": "system", "content": self.guided_inquiry_prompt},
                 {
                     "role": "user",
-                    "content": f"请评估以下对话的信息完整性并决定是否需要引导性询问：\n\n{json.dumps(conversation_context, ensure_ascii=False)}"
+                    "content": f"请评估以下对话的信息完整性并决定是否需要引导性询问：\n\n{json_codec.dumps(conversation_context)}"
                 }
             ]
 
@@ -556,7 +564,7 @@ class OptimizedChatService:
                 {"role": "system", "content": self.pattern_analysis_prompt},
                 {
                     "role": "user",
-                    "content": f"请基于以下收集到的信息分析客户的行为模式：\n\n{json.dumps(collected_info, ensure_ascii=False)}"
+                    "content": f"请基于以下收集到的信息分析客户的行为模式：\n\n{json_codec.dumps(collected_info)}"
                 }
             ]
 
@@ -584,7 +592,8 @@ class OptimizedChatService:
 
 
 # 初始化服务
-db = Database()
+db = get_database()
+write_queue = get_write_queue(db)
 crisis_detector = OptimizedCrisisDetector()
 search_service = OptimizedSearchService()
 chat_service = OptimizedChatService(db)
@@ -657,16 +666,21 @@ def build_context(state: OptimizedSessionState) -> OptimizedSessionState:
     """上下文构建节点"""
     start_time = datetime.now().timestamp()
 
-    # 批量获取用户数据
-    user_data = chat_service.batch_get_user_data(state.user_id)
+    # 并发获取用户数据和会话分析数据（引导性询问和模式分析结果）
+    async def load_context():
+        return await asyncio.gather(
+            chat_service.abatch_get_user_data(state.user_id, state.user_input),
+            chat_service.aget_session_analysis_data(state.session_id),
+        )
+
+    # 单个查询失败时 gather 已按键返回默认值；事件循环本身出错时直接抛出，
+    # 不以空画像和空记忆继续生成回复
+    user_data, analysis_data = chat_service.async_db.run(load_context())
 
     state.user_profile = user_data.get("profile", {})
     state.memory_context = chat_service.format_memory_context(
         user_data.get("memory", [])
     )
-
-    # 获取会话分析数据（引导性询问和模式分析结果）
-    analysis_data = chat_service.get_session_analysis_data(state.session_id)
     
     # 如果存在之前的分析结果，加载到状态中
     if analysis_data.get("inquiry_result"):
@@ -740,9 +754,9 @@ def update_plan(state: OptimizedSessionState) -> OptimizedSessionState:
             {"role": "system", "content": chat_service.planning_prompt},
             {
                 "role": "user",
-                "content": f"Current plan: {json.dumps(plan, ensure_ascii=False)}\n\n"
+                "content": f"Current plan: {json_codec.dumps(plan)}\n\n"
                 f"Current message: {state.user_input}\n\n"
-                f"History: {json.dumps(state.history, ensure_ascii=False)}",
+                f"History: {json_codec.dumps(state.history)}",
             },
         ]
 
@@ -803,7 +817,7 @@ def generate_response(state: OptimizedSessionState) -> OptimizedSessionState:
 
         if state.plan:
             additional_context += (
-                f"\n\n当前对话计划：{json.dumps(state.plan, ensure_ascii=False)}"
+                f"\n\n当前对话计划：{json_codec.dumps(state.plan)}"
             )
 
         if state.search_results:
@@ -814,7 +828,7 @@ def generate_response(state: OptimizedSessionState) -> OptimizedSessionState:
 
         # 添加引导性询问上下文
         if state.inquiry_result:
-            additional_context += f"\n\n引导性询问评估：{json.dumps(state.inquiry_result, ensure_ascii=False)}"
+            additional_context += f"\n\n引导性询问评估：{json_codec.dumps(state.inquiry_result)}"
             
             # 如果需要引导性询问，修改系统提示
             if state.inquiry_result.get("need_inquiry", False):
@@ -1470,59 +1484,45 @@ def postprocess_and_save(state: OptimizedSessionState) -> OptimizedSessionState:
         # 计算情绪评分
         emotion_score = SnowNLP(state.user_input).sentiments * 2 - 1
 
-        # 批量保存数据
-        save_futures = []
-
-        # 保存情绪评分
-        save_futures.append(
-            chat_service.executor.submit(
-                chat_service.db.save_emotion_score,
-                state.user_id,
-                state.session_id,
-                emotion_score,
-                state.emotion,
-            )
-        )
+        profile_update = {
+            "last_interaction": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "recent_emotion_score": emotion_score,
+            "recent_emotion": state.emotion,
+        }
 
-        # 更新用户画像
-        save_futures.append(
-            chat_service.executor.submit(
-                chat_service.db.save_user_profile,
-                state.user_id,
-                {
-                    "last_interaction": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "recent_emotion_score": emotion_score,
-                    "recent_emotion": state.emotion,
-                },
-            )
-        )
+        # 批量保存数据：情绪评分、用户画像
+        save_operations = [
+            (
+                "save_emotion_score",
+                (state.user_id, state.session_id, emotion_score, state.emotion),
+                {},
+            ),
+            ("save_user_profile", (state.user_id, profile_update), {}),
+        ]
 
         # 保存记忆（每3次对话保存一次到长期记忆）
-        emotion_history = chat_service.db.get_emotion_history(state.user_id)
-        is_long_term = (len(emotion_history) + 1) % 3 == 0
+        write_queue.wait_for(state.user_id, timeout=2)
+        emotion_count = chat_service.db.get_emotion_count(state.user_id)
+        is_long_term = (emotion_count + 1) % 3 == 0
 
         if is_long_term:
-            save_futures.append(
-                chat_service.executor.submit(
-                    chat_service.db.save_long_term_memory,
-                    state.user_id,
-                    f"用户: {state.user_input}\n咨询师: {state.response}",
+            save_operations.append(
+                (
+                    "save_long_term_memory",
+                    (state.user_id, f"用户: {state.user_input}\n咨询师: {state.response}"),
+                    {},
                 )
             )
 
-        # 等待所有保存操作完成
-        for future in as_completed(save_futures, timeout=3):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"Save operation failed: {e}")
+        # 交给写后台化队列合并写入，不阻塞响应
+        write_queue.submit_batch(save_operations)
 
         # 更新历史记录
         state.history.append({"role": "user", "content": state.user_input})
         state.history.append({"role": "agent", "content": state.response})
 
-        # 获取更新后的用户画像
-        state.user_profile = chat_service.db.get_user_profile(state.user_id)
+        # 在内存中合并画像更新，无需等待写入后再读回
+        state.user_profile = {**state.user_profile, **profile_update}
 
     except Exception as e:
         print(f"Error in postprocess_and_save: {e}")
@@ -9,13 +9,13 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from service.chat_langgraph_optimized import optimized_chat
-from dao.database import Database
+from dao.database import get_database
 from datetime import datetime
 import json
 
 def create_sample_data():
     """创建一些示例数据来测试报告生成"""
-    db = Database()
+    db = get_database()
     user_id = "keyword_test_user"
     session_id = "keyword_test_session"
     
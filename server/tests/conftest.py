@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pytest 公共配置：把 server 目录加入导入路径，提供按存储后端参数化的 db fixture
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dao.database import get_backend_factory
+
+BACKENDS = ("file", "sqlite", "memory")
+
+
+@pytest.fixture(params=BACKENDS)
+def db(request, tmp_path, monkeypatch):
+    """每种存储后端各一个空的实例（不落盘变更流）"""
+    monkeypatch.delenv("CHANGE_FEED_PERSIST", raising=False)
+    return get_backend_factory(request.param)(str(tmp_path / request.param))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+列式分析数据导出（CSV 格式，不依赖 pyarrow）：首次导出、增量追加、修改后重写
+"""
+
+import csv
+import glob
+import gzip
+import os
+
+import pytest
+
+from dao.analytics_export import AnalyticsExporter
+from dao.database import get_backend_factory
+
+
+def _rows(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def _seed(db):
+    for i in range(10):
+        db.save_message("s1", "u1", "user", f'你好,"x"\n{i}')
+    db.save_message("s2", "u2", "user", "hi")
+    db.save_events("s1", [{"id": "e1", "primaryType": "work", "title": "t", "status": "open"}])
+    db.save_emotion_score("u1", "s1", 7.5, "happy")
+    db.save_pattern_analysis("s1", {"pattern_summary": {"k": 1}})
+    return db
+
+
+@pytest.fixture
+def seeded(db):
+    return _seed(db)
+
+
+@pytest.fixture
+def feed_db(tmp_path, monkeypatch):
+    """持久化变更流的文件后端"""
+    monkeypatch.setenv("CHANGE_FEED_PERSIST", "1")
+    return _seed(get_backend_factory("file")(str(tmp_path / "feed")))
+
+
+def _export(db, out):
+    return AnalyticsExporter(db, str(out), "csv", log=lambda *args: None).run()
+
+
+def _check_full_export(db, out):
+    stats = _export(db, out)
+    assert stats["files_written"] >= 5
+
+    messages = _rows(glob.glob(f"{out}/messages/user_id=u1/s1.*.csv.gz")[0])
+    assert len(messages) == 10
+    assert messages[3]["content"] == '你好,"x"\n3' and messages[3]["seq"] == "3"
+    assert _rows(f"{out}/events/user_id=u1/s1.csv.gz")[0]["primary_type"] == "work"
+    assert os.path.exists(f"{out}/events/_schema.json")
+    assert glob.glob(f"{out}/messages/user_id=u2/*.csv.gz")
+
+    # 没有变化时不写任何文件
+    assert _export(db, out)["files_written"] == 0
+
+
+def _check_incremental_export(db, out):
+    _export(db, out)
+
+    db.save_message("s1", "u1", "agent", "new")
+    db.save_emotion_score("u1", "s1", 3, "sad")
+    assert _export(db, out)["files_written"] == 2
+
+    parts = sorted(glob.glob(f"{out}/messages/user_id=u1/*.csv.gz"))
+    assert len(parts) == 2 and _rows(parts[1])[0]["seq"] == "10"
+    emotions = sorted(glob.glob(f"{out}/emotions/user_id=u1/*.csv.gz"))
+    assert [r["emotion_category"] for p in emotions for r in _rows(p)] == ["happy", "sad"]
+
+    # 事件被修改时重写该会话的事件文件
+    db.update_event("s1", "e1", {"status": "closed"})
+    assert _export(db, out)["files_written"] == 1
+    assert _rows(f"{out}/events/user_id=u1/s1.csv.gz")[0]["status"] == "closed"
+
+
+def test_full_export(seeded, tmp_path):
+    _check_full_export(seeded, tmp_path / "out")
+
+
+def test_incremental_export(seeded, tmp_path):
+    _check_incremental_export(seeded, tmp_path / "out")
+
+
+def test_export_from_persisted_feed(feed_db, tmp_path):
+    _check_full_export(feed_db, tmp_path / "full")
+    _check_incremental_export(feed_db, tmp_path / "incremental")
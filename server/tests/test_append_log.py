@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+追加写日志：尾部读取、崩溃残留的半行、索引重建、时间范围读取、旧版文件转换、整体替换中途崩溃
+"""
+
+import json
+import os
+
+import pytest
+
+from dao.append_log import AppendLog
+
+
+def _records(n, start=0):
+    return [{"i": i, "timestamp": f"2024-03-01T00:{i:02d}:00"} for i in range(start, start + n)]
+
+
+def test_append_and_tail(tmp_path):
+    log = AppendLog(str(tmp_path))
+    log.append_many("s1", _records(5))
+    log.append("s1", {"i": 5})
+
+    assert log.count("s1") == 6
+    assert [r["i"] for r in log.read("s1")] == list(range(6))
+    assert [r["i"] for r in log.read("s1", limit=2)] == [4, 5]
+    assert log.read("missing") == [] and log.count("missing") == 0
+
+
+def test_torn_last_line_is_truncated(tmp_path):
+    log = AppendLog(str(tmp_path))
+    log.append_many("s1", _records(3))
+    # 模拟崩溃：日志写了半行，索引没有写
+    with open(log.log_path("s1"), "ab") as f:
+        f.write(b'{"i": 3, "timest')
+
+    reopened = AppendLog(str(tmp_path))
+    assert [r["i"] for r in reopened.read("s1")] == [0, 1, 2]
+    assert reopened.count("s1") == 3
+    reopened.append("s1", {"i": 3})
+    assert [r["i"] for r in reopened.read("s1", limit=1)] == [3]
+    with open(log.log_path("s1"), "rb") as f:
+        assert f.read().count(b"\n") == 4
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    log = AppendLog(str(tmp_path))
+    log.append_many("s1", _records(4))
+    # 模拟崩溃：日志已写入，索引缺少最后一条
+    with open(log.index_path("s1"), "r+b") as f:
+        f.truncate(os.path.getsize(log.index_path("s1")) - 8)
+
+    reopened = AppendLog(str(tmp_path))
+    assert reopened.count("s1") == 4
+    assert [r["i"] for r in reopened.read("s1", limit=2)] == [2, 3]
+
+
+def test_read_range(tmp_path):
+    log = AppendLog(str(tmp_path), time_field="timestamp")
+    log.append_many("u1", _records(10))
+    # 晚到的旧记录：时间索引按前一条计，读取时按自身时间过滤
+    log.append("u1", {"i": 99, "timestamp": "2024-03-01T00:00:30"})
+
+    got = log.read_range("u1", "2024-03-01T00:03:00", "2024-03-01T00:06:00")
+    assert [r["i"] for r in got] == [3, 4, 5]
+    assert [r["i"] for r in log.read_range("u1", "2024-03-01T00:08:00")] == [8, 9]
+    assert [r["i"] for r in log.read_range("u1", limit=2)] == [9, 99]
+    assert log.read_range("u1", "2024-03-02") == []
+
+
+def test_time_index_rebuilt_when_missing(tmp_path):
+    log = AppendLog(str(tmp_path), time_field="timestamp")
+    log.append_many("u1", _records(5))
+    os.remove(log.time_index_path("u1"))
+
+    reopened = AppendLog(str(tmp_path), time_field="timestamp")
+    assert [r["i"] for r in reopened.read_range("u1", "2024-03-01T00:02:00")] == [2, 3, 4]
+
+
+def test_legacy_json_is_converted(tmp_path):
+    with open(tmp_path / "s1.json", "w", encoding="utf-8") as f:
+        json.dump(_records(3), f)
+
+    log = AppendLog(str(tmp_path))
+    assert [r["i"] for r in log.read("s1")] == [0, 1, 2]
+    assert not os.path.exists(tmp_path / "s1.json")
+    assert os.path.exists(log.index_path("s1"))
+
+
+def test_write_all_and_remove(tmp_path):
+    log = AppendLog(str(tmp_path), time_field="timestamp")
+    log.append_many("s1", _records(5))
+    log.write_all("s1", _records(2, start=7))
+    assert [r["i"] for r in log.read("s1")] == [7, 8]
+    assert [r["i"] for r in log.read_range("s1", "2024-03-01T00:08:00")] == [8]
+
+    assert log.remove("s1") > 0
+    assert not log.exists("s1")
+
+
+@pytest.mark.parametrize("crash_at", range(5))
+def test_write_all_crash_between_replaces(tmp_path, monkeypatch, crash_at):
+    log = AppendLog(str(tmp_path), time_field="timestamp")
+    # 新旧记录条数和行长度相同：索引与日志错配时偏移校验无法发现
+    log.append_many("s1", _records(2))
+
+    steps = []
+
+    def crashing(func):
+        def wrapper(*args, **kwargs):
+            if len(steps) == crash_at:
+                raise SystemExit("crash")
+            steps.append(args[0])
+            return func(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(os, "remove", crashing(os.remove))
+    monkeypatch.setattr(os, "replace", crashing(os.replace))
+    with pytest.raises(SystemExit):
+        log.write_all("s1", _records(2, start=7))
+    monkeypatch.undo()
+
+    # 重新打开（相当于重启后的进程）：日志、偏移索引和时间索引保持一致
+    reopened = AppendLog(str(tmp_path), time_field="timestamp")
+    records = reopened.read("s1")
+    assert [r["i"] for r in records] in ([0, 1], [7, 8])
+    assert reopened.count("s1") == 2
+    assert reopened.read_range("s1", "2024-03-01T00:08:00") == [
+        r for r in records if r["timestamp"] >= "2024-03-01T00:08:00"
+    ]
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.async_database：有界并发、gather 的按键默认值、close
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dao.async_database import AsyncDatabase, get_async_database
+
+
+class _SlowDatabase:
+    """记录同时执行的调用数的阻塞存储"""
+
+    name = "slow"
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.completed = 0
+
+    def get_value(self, value):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+            self.completed += 1
+        return value
+
+    def fail(self):
+        raise RuntimeError("boom")
+
+
+def test_bounded_concurrency():
+    database = _SlowDatabase()
+    adb = AsyncDatabase(database, max_concurrency=2)
+
+    async def main():
+        return await asyncio.gather(*(adb.get_value(i) for i in range(6)))
+
+    try:
+        assert asyncio.run(main()) == list(range(6))
+        # 超出上限的调用排队等待，不会失败
+        assert database.peak == 2 and database.completed == 6
+    finally:
+        adb.close()
+
+
+def test_gather_defaults_per_key():
+    adb = AsyncDatabase(_SlowDatabase(delay=0), max_concurrency=4)
+    try:
+        result = asyncio.run(adb.gather(
+            defaults={"profile": {}},
+            value=("get_value", 1),
+            profile=("fail",),
+            memory=("fail",),
+        ))
+        assert result == {"value": 1, "profile": {}, "memory": None}
+    finally:
+        adb.close()
+
+
+def test_close_waits_for_running_calls():
+    database = _SlowDatabase(delay=0.2)
+    adb = AsyncDatabase(database, max_concurrency=1)
+
+    async def main():
+        task = asyncio.ensure_future(adb.get_value("x"))
+        await asyncio.sleep(0.05)
+        adb.close()
+        assert database.completed == 1
+        assert await task == "x"
+        with pytest.raises(RuntimeError):
+            await adb.get_value("y")
+
+    asyncio.run(main())
+
+
+def test_attributes_and_shared_instance():
+    database = _SlowDatabase(delay=0)
+    adb = get_async_database(database)
+    assert get_async_database(database) is adb
+    assert adb.name == "slow"
+    with pytest.raises(AttributeError):
+        adb._private
+    assert get_async_database(_SlowDatabase()) is not adb
+
+
+def test_run_uses_one_loop_thread():
+    database = _SlowDatabase(delay=0)
+    adb = AsyncDatabase(database, max_concurrency=2)
+
+    async def loop_thread():
+        await adb.get_value(1)
+        return threading.current_thread()
+
+    try:
+        first = adb.run(loop_thread())
+        assert adb.run(loop_thread()) is first and first is not threading.current_thread()
+
+        # 调用线程已有运行中的事件循环时同样可用
+        async def inside_running_loop():
+            return adb.run(adb.gather(value=("get_value", 2)))
+
+        assert asyncio.run(inside_running_loop()) == {"value": 2}
+
+        # 在事件循环线程内部调用 run 会死锁，直接报错
+        async def nested():
+            adb.run(adb.get_value(3))
+
+        with pytest.raises(RuntimeError):
+            adb.run(nested())
+    finally:
+        adb.close()
+    assert not first.is_alive()
+    with pytest.raises(RuntimeError):
+        adb.run(adb.get_value(4))
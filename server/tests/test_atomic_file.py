@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.atomic_file：原子替换、从上一代备份恢复、启动检查
+"""
+
+import os
+import time
+
+from dao.atomic_file import AtomicFileWriter, remove_tree
+from dao.database import Database
+
+
+def _corrupt(path):
+    with open(path, "wb") as f:
+        f.write(b'{"truncated": ')
+
+
+def test_read_recovers_from_backup(tmp_path):
+    writer = AtomicFileWriter()
+    path = str(tmp_path / "plan.json")
+    writer.write_json(path, {"v": 1})
+    writer.write_json(path, {"v": 2})
+    assert os.path.exists(path + ".bak")
+
+    _corrupt(path)
+    assert writer.read_json(path) == {"v": 1}
+    assert writer.stats["recovered"] == 1
+    # 恢复后的文件本身也是完好的
+    assert writer.read_json(path) == {"v": 1}
+
+
+def test_corrupt_file_without_backup_is_quarantined(tmp_path):
+    writer = AtomicFileWriter(keep_backup=False)
+    path = str(tmp_path / "profile.json")
+    writer.write_json(path, {"v": 1})
+    _corrupt(path)
+
+    assert writer.read_json(path, default={}) == {}
+    assert not os.path.exists(path)
+    assert [name for name in os.listdir(tmp_path) if ".corrupt-" in name]
+
+
+def test_verify_tree_quick_and_full(tmp_path):
+    writer = AtomicFileWriter()
+    nested = str(tmp_path / "messages" / "s1_plan.json")
+    top = str(tmp_path / "sessions.json")
+    for path in (nested, top):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        writer.write_json(path, {"v": 1})
+        writer.write_json(path, {"v": 2})
+        _corrupt(path)
+    stale = str(tmp_path / "messages" / "x.json.123.456.tmp")
+    with open(stale, "wb") as f:
+        f.write(b"partial")
+    old = time.time() - 3600
+    os.utime(stale, (old, old))
+
+    quick = writer.verify_tree(str(tmp_path), recursive=False)
+    assert quick["checked"] == 1 and quick["recovered"] == 1
+    assert os.path.exists(stale)
+
+    full = writer.verify_tree(str(tmp_path))
+    assert full["recovered"] == 1 and full["tmp_removed"] == 1
+    assert writer.read_json(nested) == {"v": 1}
+
+
+def test_startup_verify_is_quick_by_default(tmp_path, monkeypatch):
+    data_dir = str(tmp_path / "data")
+    Database(data_dir)
+    calls = []
+    original = AtomicFileWriter.verify_tree
+
+    def spy(self, root, stale_tmp_age=60.0, recursive=True):
+        calls.append(recursive)
+        return original(self, root, stale_tmp_age, recursive)
+
+    monkeypatch.setattr(AtomicFileWriter, "verify_tree", spy)
+    monkeypatch.delenv("DB_VERIFY_ON_START", raising=False)
+    Database(data_dir)
+    monkeypatch.setenv("DB_VERIFY_ON_START", "full")
+    Database(data_dir)
+    monkeypatch.setenv("DB_VERIFY_ON_START", "0")
+    Database(data_dir)
+    assert calls == [False, True]
+
+
+def test_remove_tree_returns_bytes(tmp_path):
+    directory = tmp_path / "archive"
+    (directory / "u1").mkdir(parents=True)
+    (directory / "u1" / "a.seg").write_bytes(b"x" * 10)
+    (directory / "b.seg").write_bytes(b"y" * 5)
+    assert remove_tree(str(directory)) == 15
+    assert not directory.exists()
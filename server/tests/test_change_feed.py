@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.change_feed：版本号顺序、订阅、落盘后的多进程共享
+"""
+
+import os
+import sys
+import time
+import subprocess
+import textwrap
+import threading
+
+from dao.change_feed import ChangeFeed
+from dao.locks import FileLock
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_in_process_versions_and_subscribers():
+    feed = ChangeFeed()
+    seen = []
+    feed.subscribe(seen.append, "events")
+    feed.publish("events", "insert", "s1", "u1", count=2)
+    feed.publish("chat_history", "insert", "s1", "u1")
+    feed.publish("events", "delete", "s2", "u2", record_id="e1")
+
+    assert [c["version"] for c in seen] == [1, 3]
+    assert seen[1]["id"] == "e1"
+    assert feed.data_version("u1") == 2
+    assert feed.data_version("u2") == 3
+    assert feed.data_version("nobody") == 0
+    assert [c["entity"] for c in feed.changes_since(1)] == ["chat_history", "events"]
+
+
+def test_concurrent_publishers_get_ordered_versions():
+    feed = ChangeFeed()
+    seen = []
+    feed.subscribe(seen.append)
+
+    def writer(n):
+        for _ in range(200):
+            feed.publish("chat_history", "insert", f"s{n}", f"u{n}")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [c["version"] for c in seen] == list(range(1, 1601))
+
+
+def test_persisted_feed_shared_between_instances(tmp_path):
+    # 两个实例相当于共享数据目录的两个进程
+    first = ChangeFeed(str(tmp_path))
+    second = ChangeFeed(str(tmp_path))
+    received = []
+    second.subscribe(received.append)
+
+    first.publish("events", "insert", "s1", "u1")
+    second.publish("moods", "insert", "s2", "u2")
+    first.publish("events", "update", "s1", "u1", record_id="e1")
+    first.flush()
+
+    # second 写入自己的变更时已读入 first 的第一条
+    assert second.poll() == 1
+    assert [c["version"] for c in received] == [1, 2, 3]
+    assert second.data_version("u1") == 3
+    assert [c["version"] for c in ChangeFeed(str(tmp_path)).changes_since(0)] == [1, 2, 3]
+
+
+def test_publish_does_not_wait_for_cross_process_lock(tmp_path):
+    feed = ChangeFeed(str(tmp_path))
+    other_process = FileLock(os.path.join(str(tmp_path), "feed.lock"))
+    other_process.acquire_exclusive()
+    try:
+        started = time.monotonic()
+        for i in range(50):
+            feed.publish("chat_history", "insert", f"s{i}", "u1")
+        assert time.monotonic() - started < 1.0
+    finally:
+        other_process.release_exclusive()
+        other_process.close()
+    # 锁释放后由后台线程写入；读取时也会先写入本进程排队的变更
+    assert feed.data_version("u1") == 50
+    assert [c["version"] for c in feed.changes_since(0)] == list(range(1, 51))
+
+
+def test_versions_contiguous_across_processes(tmp_path):
+    feed_dir = str(tmp_path)
+    script = textwrap.dedent(
+        f"""
+        import sys
+        from dao.change_feed import ChangeFeed
+        feed = ChangeFeed({feed_dir!r})
+        for i in range(200):
+            feed.publish("chat_history", "insert", "s" + sys.argv[1], "u" + sys.argv[1])
+        feed.flush()
+        """
+    )
+    processes = [
+        subprocess.Popen([sys.executable, "-c", script, str(n)], cwd=SERVER_DIR) for n in range(4)
+    ]
+    for process in processes:
+        assert process.wait() == 0
+
+    changes = ChangeFeed(feed_dir).changes_since(0)
+    assert [c["version"] for c in changes] == list(range(1, 801))
+    assert {c["user_id"] for c in changes} == {"u0", "u1", "u2", "u3"}
+
+
+def test_compaction_keeps_recent_versions(tmp_path):
+    feed = ChangeFeed(str(tmp_path), max_records=100)
+    for i in range(250):
+        feed.publish("emotions", "insert", "u1", "u1")
+        feed.flush()
+    assert feed.log.count("feed") <= 100
+    assert feed.version == 250
+    assert [c["version"] for c in feed.changes_since(240)] == list(range(241, 251))
+    assert ChangeFeed(str(tmp_path)).version == 250
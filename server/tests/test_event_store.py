@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.event_store：追加写事件日志的查询、更新 / 删除、压缩与并发
+"""
+
+import threading
+
+from dao.event_store import EventStore
+
+
+def _event(i, kind="work"):
+    return {"id": f"e{i}", "primaryType": kind, "created_at": f"2024-01-01T00:00:{i:02d}"}
+
+
+def test_update_delete_and_compaction(tmp_path):
+    store = EventStore(str(tmp_path), compact_min=2)
+    store.append("s1", [_event(i) for i in range(4)])
+    assert store.update("s1", "e1", {"primaryType": "family"})
+    assert store.delete("s1", "e2")
+    assert not store.delete("s1", "missing")
+
+    size_before = store.log_size("s1")
+    assert store.delete("s1", "e3")
+    # 废弃记录达到阈值后压缩
+    assert store.log_size("s1") < size_before
+
+    events = store.query("s1")
+    assert [e["id"] for e in events] == ["e0", "e1"]
+    assert events[1]["primaryType"] == "family"
+    assert [e["id"] for e in store.query("s1", types={"family"})] == ["e1"]
+    assert [e["id"] for e in store.query("s1", since="2024-01-01T00:00:01")] == ["e1"]
+    assert store.count("s1") == 2
+
+
+def test_sees_writes_from_another_instance(tmp_path):
+    # 两个实例相当于共享数据目录的两个进程
+    first = EventStore(str(tmp_path), compact_min=1)
+    second = EventStore(str(tmp_path), compact_min=1)
+    first.append("s1", [_event(0), _event(1)])
+    assert second.count("s1") == 2
+
+    second.delete("s1", "e0")  # 触发压缩，日志被重写
+    assert [e["id"] for e in first.query("s1")] == ["e1"]
+    first.append("s1", [_event(2)])
+    assert second.count("s1") == 2
+
+
+def test_sessions_do_not_block_each_other(tmp_path):
+    store = EventStore(str(tmp_path))
+    store.append("slow", [_event(0)])
+    store.append("fast", [_event(1)])
+
+    release = threading.Event()
+    reading = threading.Event()
+    read_at = store.log.read_at
+
+    def blocking_read_at(session_id, offsets):
+        if session_id == "slow":
+            reading.set()
+            release.wait(5)
+        return read_at(session_id, offsets)
+
+    store.log.read_at = blocking_read_at
+    worker = threading.Thread(target=store.query, args=("slow",))
+    worker.start()
+    try:
+        assert reading.wait(5)
+        # "slow" 的磁盘读取进行中，其他会话照常读写
+        store.append("fast", [_event(2)])
+        assert [e["id"] for e in store.query("fast")] == ["e1", "e2"]
+        assert worker.is_alive()
+    finally:
+        release.set()
+        worker.join()
+
+
+def test_concurrent_appends(tmp_path):
+    store = EventStore(str(tmp_path))
+
+    def writer(session_id, start):
+        for i in range(start, start + 50):
+            store.append(session_id, [_event(i)])
+
+    threads = [
+        threading.Thread(target=writer, args=(f"s{n % 2}", n * 100)) for n in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.count("s0") == 100
+    assert store.count("s1") == 100
+    assert len({e["id"] for e in store.query("s0")}) == 100
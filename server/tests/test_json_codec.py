@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+utils.json_codec 各后端的序列化 / 解析
+"""
+
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from utils import json_codec
+
+BACKENDS = [
+    pytest.param("orjson", marks=pytest.mark.skipif(json_codec.orjson is None, reason="orjson not installed")),
+    pytest.param("msgspec", marks=pytest.mark.skipif(json_codec.msgspec is None, reason="msgspec not installed")),
+    "json",
+]
+
+SAMPLE = {"b": 1, "a": [1, 2.5, None, True], "中文": "情绪", "nested": {"z": "x", "y": {}}}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(json_codec, "BACKEND", request.param)
+    return request.param
+
+
+def test_round_trip(backend):
+    data = json_codec.dumps_bytes(SAMPLE)
+    assert isinstance(data, bytes)
+    assert json_codec.loads(data) == SAMPLE
+    assert json_codec.loads(json_codec.dumps(SAMPLE)) == SAMPLE
+
+
+def test_compact_utf8_output(backend):
+    text = json_codec.dumps({"中文": [1, 2]})
+    assert text == '{"中文":[1,2]}'
+
+
+def test_sort_keys_and_pretty(backend):
+    # jsonify 总是传 sort_keys 和 default
+    text = json_codec.dumps(SAMPLE, sort_keys=True, default=str)
+    assert list(json.loads(text)) == sorted(SAMPLE)
+    pretty = json_codec.dumps_bytes(SAMPLE, pretty=True, sort_keys=True)
+    assert b"\n  " in pretty
+    assert json_codec.loads(pretty) == SAMPLE
+
+
+def test_datetime_and_custom_default(backend):
+    moment = datetime(2024, 1, 2, 3, 4, 5)
+    assert json_codec.loads(json_codec.dumps({"t": moment})) == {"t": moment.isoformat()}
+
+    class Custom:
+        pass
+
+    assert json_codec.loads(json_codec.dumps([Custom()], default=lambda o: "custom")) == ["custom"]
+    with pytest.raises(TypeError):
+        json_codec.dumps([Custom()])
+
+    # 传入 default 时时间也交给它处理（jsonify 传入的是 Flask 的 http_date）
+    def http_date(o):
+        return format_datetime(o, usegmt=True)
+
+    aware = moment.replace(tzinfo=timezone.utc)
+    text = json_codec.dumps({"t": aware}, sort_keys=True, default=http_date)
+    assert json_codec.loads(text) == {"t": "Tue, 02 Jan 2024 03:04:05 GMT"}
+
+
+def test_invalid_json_raises_value_error(backend):
+    with pytest.raises(ValueError):
+        json_codec.loads(b"{not json")
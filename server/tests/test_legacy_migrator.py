@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+旧版 data/ 目录迁移：完整迁移与无变化重跑、中断后从状态文件继续、
+读回校验不一致、迁移后新写入的追平（所有目标后端）
+"""
+
+import json
+import os
+
+import pytest
+
+from dao.legacy_migrator import LegacyMigrator, iter_json_items
+
+# 会话 s1、s2 + 用户 u1 的三个全局文件 + u1 的报告
+UNITS = 6
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _message(i):
+    return {"role": "user" if i % 2 == 0 else "agent", "content": f"消息{i}", "timestamp": f"2024-03-01T00:00:{i:02d}"}
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "legacy"
+    sessions = {}
+    for s in ("s1", "s2"):
+        sessions[s] = {"user_id": "u1", "created_at": "2024-03-01T00:00:00", "updated_at": "2024-03-01T01:00:00"}
+        _write(root / "messages" / f"{s}.json", [_message(i) for i in range(5)])
+        _write(root / "events" / f"{s}.json", [{"id": f"{s}-e1", "primaryType": "work", "created_at": "2024-03-01T00:00:00"}])
+        _write(root / "plans" / f"{s}.json", {"goal": s})
+    _write(root / "messages" / "s1_mood.json", [{"id": "m1", "moodCategory": "calm"}])
+    _write(root / "sessions.json", sessions)
+    _write(root / "user_profiles.json", {"u1": {"name": "小明"}})
+    _write(root / "long_term_memory.json", {"u1": [{"time": "2024-03-01 00:00:00", "content": "记得"}]})
+    # 整数评分在 SQLite 中读回为浮点数，校验时不算不一致
+    _write(root / "emotion_scores.json", {"u1": [
+        {"emotion_score": 5.5, "timestamp": "2024-03-01T00:00:00"},
+        {"emotion_score": 7, "timestamp": "2024-03-01T00:01:00"},
+    ]})
+    _write(root / "analysis_reports" / "u1_20240301_120000.json", {"report_type": "weekly", "n": 1})
+    return root
+
+
+def _migrator(source, target, tmp_path, **kwargs):
+    kwargs.setdefault("log", lambda *args: None)
+    return LegacyMigrator(str(source), target, str(tmp_path / "state.jsonl"), **kwargs)
+
+
+class _Target:
+    """包装目标后端，按需注入故障"""
+
+    def __init__(self, db, fail_after=None, corrupt=False):
+        self.db = db
+        self.fail_after = fail_after
+        self.corrupt = corrupt
+        self.imports = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def import_sessions(self, items):
+        self.imports += 1
+        if self.fail_after is not None and self.imports > self.fail_after:
+            raise OSError("disk full")
+        return self.db.import_sessions(items)
+
+    def get_chat_history(self, session_id, limit=None):
+        history = self.db.get_chat_history(session_id, limit)
+        if self.corrupt and history:
+            history[0] = dict(history[0], content="被改写")
+        return history
+
+
+def test_migrate_and_noop_rerun(source, db, tmp_path):
+    stats = _migrator(source, db, tmp_path).run()
+    assert stats["errors"] == [] and stats["mismatches"] == []
+    assert stats["migrated"] == UNITS
+
+    assert [m["content"] for m in db.get_chat_history("s1")] == [f"消息{i}" for i in range(5)]
+    assert db.get_session_plan("s2") == {"goal": "s2"}
+    assert db.get_user_profile("u1")["name"] == "小明"
+    assert len(db.get_analysis_reports_history("u1")) == 1
+
+    # 源数据没有变化，重跑不写入任何数据
+    rerun = _migrator(source, db, tmp_path).run()
+    assert rerun["migrated"] == 0 and rerun["skipped"] == UNITS
+    assert len(db.get_chat_history("s1")) == 5
+    assert len(db.get_analysis_reports_history("u1")) == 1
+
+
+def test_resume_after_partial_run(source, db, tmp_path):
+    # 每批一个会话，第二批写入失败（模拟中途崩溃）
+    partial = _migrator(source, _Target(db, fail_after=1), tmp_path, batch_units=1).run()
+    assert partial["errors"] and partial["migrated"] == UNITS - 1
+    # 状态文件末尾残留写了一半的一行
+    with open(tmp_path / "state.jsonl", "ab") as f:
+        f.write(b'{"unit": "session:s')
+
+    resumed = _migrator(source, db, tmp_path, batch_units=1).run()
+    assert resumed["errors"] == [] and resumed["migrated"] == 1
+    assert resumed["skipped"] == UNITS - 1
+    assert len(db.get_chat_history("s2")) == 5
+
+
+def test_checksum_mismatch_is_not_recorded(source, db, tmp_path):
+    stats = _migrator(source, _Target(db, corrupt=True), tmp_path).run()
+    assert any("chat_history: checksum mismatch" in m for m in stats["mismatches"])
+    assert stats["migrated"] == UNITS - 2
+
+    # 不一致的会话没有记入状态，下一遍重新迁移
+    rerun = _migrator(source, db, tmp_path).run()
+    assert rerun["mismatches"] == [] and rerun["migrated"] == 2
+
+
+def test_catch_up_after_new_writes(source, db, tmp_path):
+    _migrator(source, db, tmp_path).run()
+
+    # 迁移之后旧服务又写入了消息和长期记忆
+    _write(source / "messages" / "s1.json", [_message(i) for i in range(6)])
+    _write(source / "long_term_memory.json", {"u1": [
+        {"time": "2024-03-01 00:00:00", "content": "记得"},
+        {"time": "2024-03-02 00:00:00", "content": "新的记忆"},
+    ]})
+
+    passes = _migrator(source, db, tmp_path).follow(interval=0, max_passes=3)
+    assert passes[0]["migrated"] == 2 and passes[-1]["migrated"] == 0
+    assert len(db.get_chat_history("s1")) == 6
+    assert len(db.get_chat_history("s2")) == 5
+    assert [m["content"] for m in db.get_long_term_memory("u1")] == ["记得", "新的记忆"]
+
+
+def test_iter_json_items_small_chunks(tmp_path):
+    data = {"a": [1.5, 2e3, {"b": "中文"}], "c": -12, "d": "x" * 100}
+    path = tmp_path / "data.json"
+    _write(path, data)
+    assert dict(iter_json_items(str(path), chunk_size=3)) == data
+    _write(path, [1, 22, 333])
+    assert list(iter_json_items(str(path), chunk_size=2)) == [(0, 1), (1, 22), (2, 333)]
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.locks：读写锁的互斥与写优先、分片互不阻塞、跨进程文件锁
+"""
+
+import os
+import sys
+import subprocess
+import textwrap
+import threading
+import time
+
+from dao.locks import FileLock, RWLock, StripedRWLock
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _start(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share_writer_excludes():
+    lock = RWLock()
+    lock.acquire_read()
+    lock.acquire_read()  # 多个读者可以同时持有
+
+    entered = threading.Event()
+
+    def writer():
+        lock.acquire_write()
+        entered.set()
+        lock.release_write()
+
+    thread = _start(writer)
+    assert not entered.wait(0.1)
+    lock.release_read()
+    assert not entered.wait(0.1)
+    lock.release_read()
+    assert entered.wait(2)
+    thread.join(2)
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    lock.acquire_read()
+    order = []
+
+    def writer():
+        lock.acquire_write()
+        order.append("writer")
+        lock.release_write()
+
+    def reader():
+        lock.acquire_read()
+        order.append("reader")
+        lock.release_read()
+
+    threads = [_start(writer)]
+    time.sleep(0.05)
+    threads.append(_start(reader))
+    time.sleep(0.05)
+    assert order == []
+    lock.release_read()
+    for thread in threads:
+        thread.join(2)
+    assert order == ["writer", "reader"]
+
+
+def test_stripes_do_not_block_each_other():
+    locks = StripedRWLock(stripes=16)
+    key_a = "s1"
+    key_b = next(k for k in (f"s{i}" for i in range(2, 100)) if locks._index(k) != locks._index(key_a))
+    done = threading.Event()
+
+    def other():
+        with locks.write(key_b):
+            done.set()
+
+    with locks.write(key_a):
+        _start(other)
+        assert done.wait(2)
+
+    with locks.read(key_a):
+        pass
+    snapshot = locks.stats.snapshot()
+    assert snapshot["write"]["acquisitions"] == 2
+    assert snapshot["read"]["acquisitions"] == 1
+
+
+def test_file_lock_across_processes(tmp_path):
+    path = str(tmp_path / "x.lock")
+    ready = tmp_path / "ready"
+    script = textwrap.dedent(f"""
+        import time
+        from dao.locks import FileLock
+        lock = FileLock({path!r})
+        lock.acquire_exclusive()
+        open({str(ready)!r}, "w").close()
+        time.sleep(0.5)
+        lock.release_exclusive()
+    """)
+    child = subprocess.Popen([sys.executable, "-c", script], cwd=SERVER_DIR)
+    try:
+        deadline = time.time() + 10
+        while not ready.exists() and time.time() < deadline:
+            time.sleep(0.01)
+
+        lock = FileLock(path)
+        assert not lock.try_acquire_exclusive()
+        start = time.perf_counter()
+        lock.acquire_exclusive()  # 等待子进程释放
+        assert time.perf_counter() - start > 0.1
+        lock.release_exclusive()
+        lock.close()
+    finally:
+        child.wait(10)
+
+
+def test_striped_lock_serializes_writers_across_processes(tmp_path):
+    lock_dir = str(tmp_path / "locks")
+    counter = tmp_path / "counter"
+    counter.write_text("0")
+    script = textwrap.dedent(f"""
+        from dao.locks import StripedRWLock
+        locks = StripedRWLock(stripes=8, lock_dir={lock_dir!r})
+        for _ in range(50):
+            with locks.write("u1"):
+                with open({str(counter)!r}) as f:
+                    value = int(f.read())
+                with open({str(counter)!r}, "w") as f:
+                    f.write(str(value + 1))
+    """)
+    children = [
+        subprocess.Popen([sys.executable, "-c", script], cwd=SERVER_DIR) for _ in range(4)
+    ]
+    for child in children:
+        assert child.wait(30) == 0
+    assert counter.read_text() == "200"
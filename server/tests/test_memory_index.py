@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+长期记忆检索：相关性排序、token 预算、增量更新、记忆被清理后重建（所有存储后端）
+"""
+
+import pytest
+
+from dao.memory_index import MemoryIndex, estimate_tokens
+
+TOPICS = [
+    "最近总是失眠，晚上睡不着觉，凌晨三点还醒着",
+    "工作压力很大，老板总是要求加班",
+    "和妈妈吵架了，她总是不理解我的选择",
+    "下个月要考研了，复习进度很慢",
+]
+FILLER = ["今天天气还行", "吃了午饭", "聊了一会儿", "嗯嗯好的"]
+
+
+@pytest.fixture
+def populated(db):
+    for i in range(40):
+        content = TOPICS[i // 10] if i % 10 == 0 else FILLER[i % len(FILLER)]
+        db.save_long_term_memory("u1", f"用户: {content}{i}")
+    return db
+
+
+def test_retrieve_relevant(populated):
+    db = populated
+    index = MemoryIndex(db)
+    result = index.retrieve("u1", "我又失眠了，睡不着", k=3)
+    assert result and "失眠" in result[0]["content"]
+    assert all(memory["score"] >= 0.05 for memory in result)
+    # 按时间正序排列
+    times = [memory["time"] for memory in result]
+    assert times == sorted(times)
+
+    assert index.retrieve("u1", "妈妈不理解我", k=1)[0]["content"].startswith("用户: 和妈妈吵架了")
+    assert index.retrieve("nobody", "失眠") == []
+
+
+def test_token_budget(populated):
+    db = populated
+    index = MemoryIndex(db)
+    result = index.retrieve("u1", "失眠 加班 妈妈 考研", k=10, token_budget=40)
+    assert result
+    assert sum(estimate_tokens(memory["content"]) for memory in result) <= 40
+
+
+def test_incremental_update(populated):
+    db = populated
+    index = MemoryIndex(db)
+    assert not any("钢琴" in m["content"] for m in index.retrieve("u1", "弹钢琴"))
+
+    db.save_long_term_memory("u1", "用户: 我开始学习弹钢琴了")
+    result = index.retrieve("u1", "弹钢琴", k=1)
+    assert "钢琴" in result[0]["content"]
+    assert index.stats["builds"] == 1
+
+
+def test_rebuild_after_expire(populated):
+    db = populated
+    index = MemoryIndex(db)
+    assert "失眠" in index.retrieve("u1", "失眠睡不着", k=1)[0]["content"]
+
+    # 只保留最近 5 条，失眠那条被清理
+    db.expire_records("long_term_memory", "u1", keep=5)
+    result = index.retrieve("u1", "失眠睡不着", k=1)
+    assert not any("失眠" in memory["content"] for memory in result)
+    assert index.stats["builds"] == 2
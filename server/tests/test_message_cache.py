@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+最近消息缓存：命中与未命中、容量、按 HISTORY_CACHE_MB 淘汰、其他进程写入后失效
+"""
+
+from dao.database import Database
+from dao.message_cache import RecentMessageCache
+
+
+def _messages(n, start=0):
+    return [
+        {"role": "user", "content": f"消息{i}", "timestamp": f"2024-03-01T00:00:{i % 60:02d}"}
+        for i in range(start, start + n)
+    ]
+
+
+def test_hit_and_miss():
+    cache = RecentMessageCache(capacity=4)
+    assert cache.get("s1", 2, 0) is None
+
+    cache.fill("s1", _messages(10), 10)
+    assert [m["content"] for m in cache.get("s1", 2, 10)] == ["消息8", "消息9"]
+    assert len(cache.get("s1", 4, 10)) == 4
+    # 超出缓存范围、全部读取（缓存只有最后 4 条）、条数不一致时都未命中
+    assert cache.get("s1", 5, 10) is None
+    assert cache.get("s1", None, 10) is None
+    assert cache.get("s1", 2, 11) is None
+    assert cache.stats["hits"] == 2 and cache.stats["misses"] == 4
+
+    cache.fill("s2", _messages(3), 3)
+    assert len(cache.get("s2", None, 3)) == 3
+
+
+def test_append_keeps_ring_and_extra_fields():
+    cache = RecentMessageCache(capacity=3)
+    cache.append("s1", _messages(2), 2)
+    cache.append("s1", [{"role": "agent", "content": "hi", "timestamp": None, "id": "x"}], 3)
+    assert cache.get("s1", None, 3)[-1] == {"role": "agent", "content": "hi", "timestamp": None, "id": "x"}
+
+    cache.append("s1", _messages(2, start=5), 5)
+    assert [m["content"] for m in cache.get("s1", 3, 5)] == ["hi", "消息5", "消息6"]
+
+    # 缓存落后于日志（其他进程追加过）时只保留这次的消息
+    cache.append("s1", _messages(1, start=9), 9)
+    assert [m["content"] for m in cache.get("s1", 1, 9)] == ["消息9"]
+    assert cache.get("s1", 2, 9) is None
+
+
+def test_lru_eviction_by_bytes():
+    cache = RecentMessageCache(capacity=8, max_bytes=12 * 1024)
+    for s in range(20):
+        cache.fill(f"s{s}", _messages(8), 8)
+        assert cache.bytes <= cache.max_bytes
+    assert cache.stats["evictions"] > 0
+    assert cache.get("s19", 1, 8) is not None
+    assert cache.get("s0", 1, 8) is None
+
+    # 最近读取过的会话不会先被淘汰
+    cache.get("s18", 1, 8)
+    cache.fill("s20", _messages(8), 8)
+    cache.fill("s21", _messages(8), 8)
+    assert cache.get("s18", 1, 8) is not None
+
+
+def test_disabled():
+    cache = RecentMessageCache(capacity=0)
+    cache.fill("s1", _messages(2), 2)
+    assert cache.get("s1", 1, 2) is None and cache.bytes == 0
+
+
+def test_database_cache_limit(tmp_path, monkeypatch):
+    monkeypatch.setenv("HISTORY_CACHE_MESSAGES", "16")
+    monkeypatch.setenv("HISTORY_CACHE_MB", "0.02")
+    db = Database(str(tmp_path / "data"))
+    for s in range(20):
+        for message in _messages(5):
+            db.save_message(f"s{s}", "u1", message["role"], message["content"])
+    assert db.recent.bytes <= 0.02 * 1024 * 1024
+    assert db.recent.stats["evictions"] > 0
+    # 被淘汰的会话从日志读取
+    assert len(db.get_chat_history("s0")) == 5
+
+
+def test_write_from_another_process_invalidates(tmp_path):
+    data_dir = str(tmp_path / "data")
+    first = Database(data_dir)
+    for message in _messages(3):
+        first.save_message("s1", "u1", message["role"], message["content"])
+    assert len(first.get_chat_history("s1", 2)) == 2
+    hits = first.recent.stats["hits"]
+
+    # 另一个进程（独立的 Database 实例）追加了一条消息
+    Database(data_dir).save_message("s1", "u1", "agent", "来自另一个进程")
+    history = first.get_chat_history("s1")
+    assert [m["content"] for m in history][-1] == "来自另一个进程"
+    assert len(history) == 4
+    assert first.recent.stats["hits"] == hits
+    # 重新填充后再次命中
+    assert first.get_chat_history("s1", 1)[0]["content"] == "来自另一个进程"
+    assert first.recent.stats["hits"] == hits + 1
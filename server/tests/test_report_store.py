@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.report_store：报告头索引、压缩正文、删除、旧版报告迁移
+"""
+
+import json
+import os
+
+from dao.report_store import ReportStore, legacy_report_id
+
+
+def _report(n):
+    return {
+        "report_type": "weekly",
+        "generated_at": f"2024-03-0{n}T00:00:00",
+        "analysis_period": "7d",
+        "metadata": {"events": n},
+        "content": "内容" * 200,
+    }
+
+
+def test_save_headers_and_load(tmp_path):
+    store = ReportStore(str(tmp_path))
+    ids = [store.save("u1", _report(n))["id"] for n in range(1, 4)]
+
+    latest = store.latest("u1")
+    assert latest["id"] == ids[-1] and latest["metrics"] == {"events": 3}
+    assert latest["stored_size"] < latest["size"]
+    assert [h["id"] for h in store.headers("u1")] == ids[::-1]
+    assert [h["id"] for h in store.headers("u1", limit=2)] == ids[:0:-1]
+    assert store.load("u1", ids[0]) == _report(1)
+    assert store.load("u1", "rpt_missing") is None
+    assert store.latest("u2") is None
+
+
+def test_replace(tmp_path):
+    store = ReportStore(str(tmp_path))
+    store.save("u1", _report(1))
+    store.replace("u1", [("rpt_a", _report(2)), ("rpt_b", _report(3))])
+    assert [h["id"] for h in store.headers("u1")] == ["rpt_b", "rpt_a"]
+
+    store.replace("u1", [])
+    assert store.headers("u1") == []
+
+
+def test_migrate_legacy(tmp_path):
+    for stamp, n in (("20240302_000000", 2), ("20240301_000000", 1)):
+        with open(tmp_path / f"u1_{stamp}.json", "w", encoding="utf-8") as f:
+            json.dump(_report(n), f)
+
+    store = ReportStore(str(tmp_path))
+    assert store.has_legacy()
+    assert store.migrate_legacy() == 2
+    assert not store.has_legacy()
+
+    headers = store.headers("u1")
+    assert [h["metrics"]["events"] for h in headers] == [2, 1]
+    assert headers[0]["id"].startswith("rpt_20240302_000000_")
+    assert store.load("u1", headers[1]["id"]) == _report(1)
+
+
+def test_remove_user(tmp_path):
+    store = ReportStore(str(tmp_path))
+    store.save("u1", _report(1))
+    store.save("u2", _report(2))
+
+    assert store.remove_user("u1") > 0
+    assert store.headers("u1") == []
+    assert not os.path.exists(tmp_path / "u1")
+    assert len(store.headers("u2")) == 1
+
+
+def test_remove_reports(tmp_path):
+    store = ReportStore(str(tmp_path))
+    ids = [store.save("u1", _report(n))["id"] for n in range(1, 4)]
+
+    assert store.remove_reports("u1", ids[:2]) > 0
+    assert [h["id"] for h in store.headers("u1")] == ids[2:]
+    assert store.load("u1", ids[0]) is None
+    assert store.remove_reports("u1", ids[2:]) > 0
+    assert store.headers("u1") == []
+
+
+def test_migrate_legacy_after_crash(tmp_path):
+    def write_legacy():
+        for stamp, n in (("20240302_000000", 2), ("20240301_000000", 1)):
+            with open(tmp_path / f"u1_{stamp}.json", "w", encoding="utf-8") as f:
+                json.dump(_report(n), f)
+
+    write_legacy()
+    store = ReportStore(str(tmp_path))
+    store.migrate_legacy()
+    ids = [h["id"] for h in store.headers("u1")]
+    assert ids[0] == legacy_report_id("20240302_000000", "u1_20240302_000000.json")
+
+    # 崩溃发生在保存报告之后、删除旧文件之前：重新迁移不产生重复的报告
+    write_legacy()
+    assert store.migrate_legacy() == 2
+    assert not store.has_legacy()
+    assert [h["id"] for h in store.headers("u1")] == ids
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据保留策略：规则解析、各类数据的清理、已归档会话跳过、变更流上的跳过（所有存储后端）
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from dao.database import Database
+from dao.retention import RetentionJanitor, expired_positions, parse_rules
+
+RULES = (
+    '{"inquiry_history": {"max_count": 4}, "plan": {"max_age_days": 180},'
+    ' "reports": {"max_count": 2}, "crisis_memory": {"max_age_days": 365, "max_count": 1}}'
+)
+
+
+def _ago(days):
+    return datetime.now() - timedelta(days=days)
+
+
+@pytest.fixture
+def seeded(db):
+    sessions = []
+    for s, age in enumerate((1, 1, 400)):
+        updated = _ago(age).isoformat()
+        sessions.append((
+            f"s{s}",
+            {"user_id": "u1", "created_at": updated, "updated_at": updated},
+            {
+                "chat_history": [{"role": "user", "content": "hi", "timestamp": updated}],
+                "inquiry_history": [{"i": i, "timestamp": updated} for i in range(10)],
+                "plan": {"goal": s},
+            },
+        ))
+    db.import_sessions(sessions)
+    db.import_users([(
+        "u1",
+        {
+            "long_term_memory": [
+                {"time": _ago(400).strftime("%Y-%m-%d %H:%M:%S"), "content": "[CRISIS-HIGH] a"},
+                {"time": _ago(2).strftime("%Y-%m-%d %H:%M:%S"), "content": "normal memory"},
+                {"time": _ago(1).strftime("%Y-%m-%d %H:%M:%S"), "content": "[CRISIS-LOW] b"},
+            ],
+            "reports": [
+                (f"rpt_{n}", {"report_type": "weekly", "n": n, "generated_at": _ago(10 - n).isoformat()})
+                for n in range(5)
+            ],
+        },
+    )])
+    return db
+
+
+def test_parse_rules():
+    rules = {rule.entity: rule for rule in parse_rules(RULES)}
+    assert rules["reports"].max_count == 2 and rules["reports"].scope == "user"
+    assert rules["plan"].max_age_days == 180 and rules["plan"].scope == "session"
+    with pytest.raises(ValueError):
+        parse_rules('{"search_results": {"max_count": 1}}')
+
+
+def test_expired_positions():
+    records = [{"t": t} for t in (1, 2, 3, 4, 5)]
+    assert expired_positions(records, lambda r: r["t"], before=3) == ({0, 1}, 3)
+    assert expired_positions(records, lambda r: r["t"], keep=2) == ({0, 1, 2}, 4)
+    odd = expired_positions(records, lambda r: r["t"], keep=1, match=lambda r: r["t"] % 2)
+    assert odd == ({0, 2}, 5)
+
+
+def test_run_once(seeded):
+    db = seeded
+    expired_users = []
+    janitor = RetentionJanitor(
+        db, parse_rules(RULES), max_keys_per_s=0,
+        on_expired=lambda entity, user_id: expired_users.append((entity, user_id)),
+    )
+    result = janitor.run_once()
+    assert result["expired"] > 0 and result["bytes_freed"] > 0
+
+    assert [r["i"] for r in db.get_inquiry_history("s0")] == [6, 7, 8, 9]
+    assert janitor.stats["expired"]["inquiry_history"] == 18
+    assert db.get_session_plan("s2") in ({}, None)
+    assert db.get_session_plan("s0") == {"goal": 0}
+    assert [h["id"] for h in db.get_analysis_reports_history("u1")] == ["rpt_4", "rpt_3"]
+    assert not db.get_analysis_report("u1", "rpt_0")
+    assert [m["content"] for m in db.get_long_term_memory("u1")] == [
+        "normal memory", "[CRISIS-LOW] b",
+    ]
+    assert ("crisis_memory", "u1") in expired_users
+
+    assert janitor.run_once()["expired"] == 0
+
+
+def test_archived_sessions_are_skipped(seeded):
+    db = seeded
+    if not isinstance(db, Database):
+        pytest.skip("only the file backend archives sessions")
+    db.archive_session("s1")
+    RetentionJanitor(db, parse_rules(RULES), max_keys_per_s=0).run_once()
+    assert len(db.get_inquiry_history("s1")) == 10
+    assert db.sessions.field("s1", "archived_at")
+
+
+def test_unchanged_keys_are_skipped(seeded):
+    db = seeded
+    if getattr(db, "changes", None) is None:
+        pytest.skip("backend has no change feed")
+    janitor = RetentionJanitor(db, parse_rules(RULES), max_keys_per_s=0)
+    janitor.run_once()
+
+    second = janitor.run_once()
+    assert second["keys_checked"] == 0 and second["keys_skipped"] > 0
+
+    db.save_inquiry_history("s0", {"i": 10})
+    third = janitor.run_once()
+    assert third["keys_checked"] == 1 and third["expired"] == 1
+    assert [r["i"] for r in db.get_inquiry_history("s0")] == [7, 8, 9, 10]
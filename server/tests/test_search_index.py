@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+全文检索索引：分词、单字检索、增量更新、删除会话后的重建
+"""
+
+from dao.search_index import SearchIndex, _UserIndex, tokenize
+
+
+def _keys(result):
+    return {(hit["session_id"], hit["index"]) for hit in result["hits"]}
+
+
+def test_tokenize():
+    assert tokenize("我很焦虑, Hello 2024 好") == ["我很", "很焦", "焦虑", "hello", "2024", "好"]
+
+
+def test_char_map_tracks_bigrams():
+    index = _UserIndex()
+    index.add("s1", 0, {"content": "焦虑失眠"})
+    index.add("s1", 1, {"content": "焦急"})
+    assert sorted(index.chars["焦"]) == ["焦急", "焦虑"]
+    assert index.chars["眠"] == ["失眠"]
+
+    # 重建后映射与倒排表保持一致
+    index.drop_session("s1")
+    assert index.chars == {} and index.postings == {}
+
+
+def test_single_char_and_phrase(db):
+    db.save_message("s1", "u1", "user", "最近工作压力很大")
+    db.save_message("s1", "u1", "agent", "压力大的时候可以试试深呼吸")
+    db.save_message("s2", "u1", "user", "今天很开心")
+    db.save_message("s3", "u2", "user", "压力")
+    index = SearchIndex(db)
+
+    assert _keys(index.search("u1", "压")) == {("s1", 0), ("s1", 1)}
+    assert _keys(index.search("u1", "开")) == {("s2", 0)}
+    assert _keys(index.search("u1", "工作压力")) == {("s1", 0)}
+    # 二元组都命中但不连续出现
+    assert index.search("u1", "作压很")["total"] == 0
+    assert _keys(index.search("u1", "压", session_id="s1")) == {("s1", 0), ("s1", 1)}
+
+
+def test_incremental_update(db):
+    db.save_message("s1", "u1", "user", "睡不着")
+    index = SearchIndex(db)
+    assert index.search("u1", "眠")["total"] == 0
+
+    db.save_message("s1", "u1", "user", "失眠好几天了")
+    db.save_message("s2", "u1", "user", "还是失眠")
+    assert _keys(index.search("u1", "眠")) == {("s1", 1), ("s2", 0)}
+    assert _keys(index.search("u1", "失眠")) == {("s1", 1), ("s2", 0)}
+    assert index.stats["builds"] == 1
+
+
+def test_drop_session_rebuilds_char_map():
+    index = _UserIndex()
+    for i in range(3):
+        index.add("s1", i, {"content": f"焦虑{i}"})
+    index.add("s2", 0, {"content": "不焦虑了"})
+    assert len(SearchIndex._term_postings(index, "虑")) == 4
+
+    # 超过一半的文档被删除时整体重建，单字检索只剩未删除的文档
+    index.drop_session("s1")
+    # 字在词中间时出现在两个二元组里，只计一次
+    assert SearchIndex._term_postings(index, "虑") == {0: 1}
+    assert sorted(index.chars["虑"]) == ["焦虑", "虑了"]
+    assert index.docs[0][0] == "s2"
+
+    index.add("s3", 0, {"content": "焦虑焦虑"})
+    assert SearchIndex._term_postings(index, "虑")[1] == 2
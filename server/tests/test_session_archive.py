@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+冷会话归档：段文件读写、恢复后删除段文件、Database 归档/读取/恢复的往返
+"""
+
+import os
+
+import pytest
+
+from dao.database import Database
+from dao.session_archive import SessionArchive
+
+
+@pytest.mark.parametrize("codec", ["gzip", None])
+def test_put_load_drop(tmp_path, codec):
+    archive = SessionArchive(str(tmp_path), codec=codec, segment_max_bytes=1)
+    archive.put("u1", "s1", {"messages": ["a"] * 100})
+    archive.put("u1", "s2", {"messages": ["b"]})
+
+    # segment_max_bytes=1：每个会话写入新的段文件
+    assert archive.locate("u1", "s1")["segment"] == 1
+    assert archive.locate("u1", "s2")["segment"] == 2
+    assert archive.load("u1", "s1") == {"messages": ["a"] * 100}
+    assert archive.stats("u1")["segments"] == 2
+
+    loaded = archive.load("u1", "s2")
+    loaded["messages"].append("changed")
+    assert archive.load("u1", "s2") == {"messages": ["b"]}
+
+    archive.drop("u1", "s1")
+    assert archive.load("u1", "s1") is None
+    assert not os.path.exists(archive.segment_path("u1", 1))
+
+    # 其他进程（新实例）读取同一索引
+    reopened = SessionArchive(str(tmp_path))
+    assert reopened.locate("u1", "s1") is None
+    assert reopened.load("u1", "s2") == {"messages": ["b"]}
+
+    assert archive.remove_user("u1") > 0
+    assert archive.stats("u1") == {"sessions": 0, "raw_bytes": 0, "stored_bytes": 0, "segments": 0}
+
+
+def test_database_archive_round_trip(tmp_path):
+    data_dir = str(tmp_path / "data")
+    db = Database(data_dir)
+    db.save_message("s1", "u1", "user", "你好")
+    db.save_message("s1", "u1", "agent", "你好，有什么可以帮你？")
+    db.save_events("s1", [{"id": "e1", "primaryType": "work"}])
+    db.save_mood_data("u1", "s1", {"id": "m1", "mood": "calm"})
+    db.save_session_plan("s1", {"goal": "sleep"})
+    history = db.get_chat_history("s1")
+    events = db.get_events("s1")
+    moods = db.get_mood_analysis("s1")
+
+    stats = db.archive_session("s1")
+    assert stats is not None and stats["files_removed"] > 0
+    assert not os.path.exists(db.message_log.log_path("s1"))
+    assert db.archive_session("s1") is None
+
+    # 读取直接从归档中取，不恢复为常规文件
+    reopened = Database(data_dir)
+    assert reopened.get_chat_history("s1") == history
+    assert reopened.get_events("s1") == events
+    assert reopened.get_mood_analysis("s1") == moods
+    assert reopened.get_session_plan("s1") == {"goal": "sleep"}
+    assert reopened.get_event_count("s1") == 1
+    assert not os.path.exists(reopened.message_log.log_path("s1"))
+
+    # 写入时恢复为常规文件并移出归档
+    reopened.save_message("s1", "u1", "user", "我回来了")
+    assert [m["content"] for m in reopened.get_chat_history("s1")] == [
+        "你好", "你好，有什么可以帮你？", "我回来了",
+    ]
+    assert reopened.get_events("s1") == events
+    assert reopened.sessions.field("s1", "archived_at") is None
+    assert reopened.archive.locate("u1", "s1") is None
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.session_index：快照 + 增量日志的持久化、崩溃恢复和计数器
+"""
+
+import os
+import sys
+import subprocess
+import textwrap
+
+from dao.database import Database
+from dao.session_index import SessionIndex
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_new_sessions_survive_reload(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    index = SessionIndex(path)
+    index.touch("s1", "u1", "2024-01-01T00:00:00")
+    index.touch("s2", "u1", "2024-01-01T00:01:00")
+
+    reloaded = SessionIndex(path)
+    assert reloaded.session_ids("u1") == ["s1", "s2"]
+    assert reloaded.get("s1")["created_at"] == "2024-01-01T00:00:00"
+
+
+def test_torn_journal_line_is_ignored(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    index = SessionIndex(path)
+    index.touch("s1", "u1", "2024-01-01T00:00:00")
+    with open(index.journal_file, "ab") as f:
+        f.write(b'{"session_id": "s2", "user_')
+
+    reloaded = SessionIndex(path)
+    assert reloaded.exists("s1")
+    assert not reloaded.exists("s2")
+
+
+def test_compaction_keeps_sessions_and_counts(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    index = SessionIndex(path, compact_threshold=3)
+    for i in range(5):
+        index.touch(f"s{i}", "u1", "2024-01-01T00:00:00", counts={"messages.user": 1})
+    index.add_counts("s0", {"messages.user": 2})
+    index.flush()
+
+    reloaded = SessionIndex(path)
+    assert len(reloaded.session_ids("u1")) == 5
+    assert reloaded.get_counts("s0") == {"messages.user": 3}
+    # 对外返回的元数据不含计数器
+    assert "counts" not in reloaded.get("s0")
+
+
+def test_counters_corrected_after_crash(tmp_path):
+    data_dir = str(tmp_path / "data")
+    # 子进程的计数器刷新之后又写入了消息和事件，随后崩溃，计数器没有落盘
+    script = textwrap.dedent(
+        f"""
+        import os
+        from dao.database import Database
+        db = Database({data_dir!r})
+        db.save_message("s1", "u1", "user", "first")
+        db.save_events("s1", [{{"primaryType": "work"}}])
+        db.sessions.flush()
+        db.save_message("s1", "u1", "user", "second")
+        db.save_events("s1", [{{"primaryType": "family"}}, {{"primaryType": "sleep"}}])
+        os._exit(0)
+        """
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=SERVER_DIR, check=True)
+
+    db = Database(data_dir)
+    assert db.sessions.get_counts("s1")["events"] == 1
+    assert db.get_event_count("s1") == 3
+    assert db.get_user_message_count("s1") == 2
+
+
+def test_event_count_follows_updates_and_deletes(tmp_path):
+    db = Database(str(tmp_path / "data"))
+    db.save_message("s1", "u1", "user", "hi")
+    db.save_events("s1", [{"primaryType": "work"}, {"primaryType": "sleep"}])
+    first = db.get_events("s1")[0]["id"]
+    db.update_event("s1", first, {"subType": "deadline"})
+    db.delete_event("s1", first)
+    assert db.get_event_count("s1") == 1
+    # 计数器与日志一致，直接返回计数器
+    assert db.sessions.get_counts("s1")["events.log_size"] == db.events.log_size("s1")
+
+
+def test_stale_counters_repaired_under_write_lock(tmp_path, monkeypatch):
+    db = Database(str(tmp_path / "data"))
+    db.save_message("s1", "u1", "user", "hi")
+    db.save_message("s1", "u1", "agent", "hello")
+    db.save_events("s1", [{"primaryType": "work"}])
+    # 模拟其他进程写入后未刷新的计数器
+    db.sessions.set_counts("s1", {"messages.user": 5, "events": 7, "events.log_size": 1})
+
+    held = []
+    write = db.locks.write
+
+    class _Tracked:
+        def __init__(self, key):
+            self.lock = write(key)
+
+        def __enter__(self):
+            held.append(True)
+            return self.lock.__enter__()
+
+        def __exit__(self, *exc):
+            held.pop()
+            return self.lock.__exit__(*exc)
+
+    set_counts = db.sessions.set_counts
+
+    def checked_set_counts(session_id, counts):
+        assert held, "counters must be repaired under the write lock"
+        set_counts(session_id, counts)
+
+    monkeypatch.setattr(db.locks, "write", _Tracked)
+    monkeypatch.setattr(db.sessions, "set_counts", checked_set_counts)
+
+    # 批量读取只持有读锁：返回重新统计的值，不写回
+    bundle = db.bulk_load("u1", ["s1"], kinds=["message_count"])
+    assert bundle.sessions["s1"].message_count == 1
+    assert db.sessions.get_counts("s1")["messages.user"] == 5
+
+    assert db.get_message_counts("s1") == {"user": 1, "agent": 1}
+    assert db.get_event_count("s1") == 1
+    counts = db.sessions.get_counts("s1")
+    assert counts["messages.user"] == 1 and counts["events"] == 1
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按时间范围读取：情绪评分 start/end、bulk_load 的 since（所有存储后端）
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+BASE = datetime(2024, 3, 1)
+
+
+def _at(days):
+    return (BASE + timedelta(days=days)).isoformat()
+
+
+@pytest.fixture
+def seeded(db):
+    db.import_sessions(
+        [
+            (
+                "s1",
+                {"user_id": "u1", "created_at": _at(0), "updated_at": _at(9)},
+                {
+                    "events": [
+                        {"id": f"e{d}", "primaryType": "work", "created_at": _at(d)}
+                        for d in range(10)
+                    ],
+                    "moods": [{"id": f"m{d}", "created_at": _at(d)} for d in range(10)],
+                },
+            )
+        ]
+    )
+    db.import_users(
+        [
+            (
+                "u1",
+                {
+                    "emotions": [
+                        {
+                            "session_id": "s1",
+                            "emotion_score": d,
+                            "emotion_category": "neutral",
+                            "timestamp": _at(d),
+                        }
+                        for d in range(10)
+                    ]
+                },
+            )
+        ]
+    )
+    return db
+
+
+def test_emotion_history_window(seeded):
+    window = seeded.get_emotion_history("u1", start=_at(3), end=_at(6))
+    assert [row["emotion_score"] for row in window] == [3, 4, 5]
+    # start 可以是 datetime / ISO 字符串 / epoch 秒
+    start = BASE + timedelta(days=7)
+    for value in (start, start.isoformat(), start.timestamp()):
+        assert [r["emotion_score"] for r in seeded.get_emotion_history("u1", start=value)] == [7, 8, 9]
+    assert [r["emotion_score"] for r in seeded.get_emotion_history("u1", limit=2, start=_at(2))] == [8, 9]
+
+
+def test_mood_analysis_window(seeded):
+    moods = seeded.get_mood_analysis("s1", start=_at(8))
+    assert [m["id"] for m in moods] == ["m8", "m9"]
+
+
+def test_bulk_load_since_filters_events_and_moods(seeded):
+    bundle = seeded.bulk_load(
+        "u1", ["s1"], kinds=["events", "moods"], since=_at(5), limits={"events": 3}
+    )
+    session = bundle.sessions["s1"]
+    # limit 作用在时间范围之内：取范围内最近的 3 条
+    assert [e["id"] for e in session.events] == ["e7", "e8", "e9"]
+    assert [m["id"] for m in session.moods] == ["m5", "m6", "m7", "m8", "m9"]
+
+    bundle = seeded.bulk_load("u1", ["s1"], kinds=["events"], since=BASE + timedelta(days=20))
+    assert bundle.sessions["s1"].events == []
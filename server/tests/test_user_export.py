@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+用户数据导出（ndjson / tar 流）与删除用户（所有存储后端）
+"""
+
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from dao.database import Database
+from dao.user_export import has_user_data, iter_user_records, ndjson_stream, tar_stream
+
+
+def _populate(db, user_id, sessions):
+    for s in range(sessions):
+        session_id = f"{user_id}-s{s}"
+        for i in range(4):
+            db.save_message(session_id, user_id, "user" if i % 2 == 0 else "agent", f"消息 {s} {i}")
+        db.save_events(session_id, [{"primaryType": "work", "title": "t"}])
+        db.save_mood_data(user_id, session_id, {"moodCategory": "calm", "moodIntensity": 3})
+        db.save_session_plan(session_id, {"goal": s})
+        db.save_inquiry_history(session_id, {"question": s})
+    db.save_emotion_score(user_id, f"{user_id}-s0", 5, "calm")
+    db.save_long_term_memory(user_id, "记得")
+    db.save_user_profile(user_id, {"name": user_id})
+    db.save_analysis_report(user_id, {"report_type": "weekly", "generated_at": "2024-03-01"})
+
+
+@pytest.fixture
+def populated(db):
+    _populate(db, "u1", 3)
+    _populate(db, "u2", 2)
+    if isinstance(db, Database):
+        # 已归档的会话同样导出
+        db.archive_session("u1-s2")
+    return db
+
+
+def test_export_streams(populated):
+    db = populated
+    records = list(iter_user_records(db, "u1"))
+    counts = {}
+    for record in records:
+        counts[record["type"]] = counts.get(record["type"], 0) + 1
+    assert counts["session"] == 3 and counts["chat_history"] == 12
+    assert counts["events"] == 3 and counts["report"] == 1 and counts["emotions"] == 1
+
+    lines = b"".join(ndjson_stream(db, "u1")).splitlines()
+    assert len(lines) == len(records)
+    assert json.loads(lines[0])["type"] == "user"
+
+    archive = b"".join(tar_stream(db, "u1"))
+    with tarfile.open(fileobj=io.BytesIO(archive), mode="r:gz") as tar:
+        names = tar.getnames()
+        messages = tar.extractfile("u1/sessions/u1-s2/chat_history.jsonl").read().splitlines()
+    assert len(messages) == 4
+    assert "u1/profile.json" in names
+    assert any(name.startswith("u1/reports/") for name in names)
+
+
+def test_delete_user(populated):
+    db = populated
+    result = db.delete_user("u1")
+    assert result["sessions"] == 3 and result["bytes_reclaimed"] > 0
+
+    assert not has_user_data(db, "u1")
+    assert db.get_chat_history("u1-s0") == [] and db.get_events("u1-s0") == []
+    assert db.get_long_term_memory("u1") == [] and db.get_emotion_history("u1") == []
+    assert db.get_analysis_reports_history("u1") == []
+
+    # 其他用户的数据不受影响
+    assert has_user_data(db, "u2") and len(db.get_sessions("u2")) == 2
+    assert len(db.get_chat_history("u2-s1")) == 4
+
+    if isinstance(db, Database):
+        data_dir = db.data_dir
+        left = [
+            os.path.join(root, name)
+            for root, _, files in os.walk(data_dir)
+            for name in files
+            if "u1" in name or "u1" in root
+        ]
+        assert not left
+        assert not Database(data_dir).get_sessions("u1")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+dao.write_queue：按参数名的排序键、逐个操作的错误、意图日志的 group commit 和崩溃重放
+"""
+
+import os
+import sys
+import subprocess
+import textwrap
+import threading
+import time
+
+import pytest
+
+from dao.database import Database
+from dao.write_queue import IntentLog, WriteBehindQueue
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Database(str(tmp_path / "data"))
+
+
+def test_keys_bound_by_parameter_name(db):
+    queue = WriteBehindQueue(db, window=0)
+    try:
+        # save_emotion_score 的第一个参数是 user_id
+        keys = queue._keys_of("save_emotion_score", ("u1", "s1", 0.5, "neutral"), {})
+        assert sorted(keys) == ["s1", "u1"]
+        keys = queue._keys_of("save_message", ("s1",), {"user_id": "u1", "role": "user", "content": "hi"})
+        assert sorted(keys) == ["s1", "u1"]
+    finally:
+        queue.stop()
+
+
+def test_failed_operation_only_fails_its_own_future(db):
+    queue = WriteBehindQueue(db, window=0.2)
+    try:
+        good = queue.submit("save_message", "s1", "u1", "user", "hello")
+        bad = queue.submit("save_message", "s1")  # 缺少参数
+        assert good.result(timeout=5) == 1
+        with pytest.raises(TypeError):
+            bad.result(timeout=5)
+        assert queue.stats["batches"] == 1
+    finally:
+        queue.stop()
+    assert [m["content"] for m in db.get_chat_history("s1")] == ["hello"]
+
+
+def test_apply_batch_reports_errors_per_operation(db, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(db, "save_session_plan", broken)
+    errors = db.apply_batch(
+        [
+            ("save_message", ("s1", "u1", "user", "a"), {}),
+            ("save_session_plan", ("s1", {}), {}),
+            ("save_emotion_score", ("u1", "s1", 0.1, "sad"), {}),
+        ]
+    )
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], RuntimeError)
+    assert len(db.get_chat_history("s1")) == 1
+    assert len(db.get_emotion_history("u1")) == 1
+
+
+def test_intent_log_replayed_after_crash(tmp_path):
+    data_dir = str(tmp_path / "data")
+    log_dir = os.path.join(data_dir, "write_queue")
+    # 子进程提交写操作后在合并窗口内直接退出，模拟崩溃
+    script = textwrap.dedent(
+        f"""
+        import os
+        from dao.database import Database
+        from dao.write_queue import WriteBehindQueue
+        queue = WriteBehindQueue(Database({data_dir!r}), window=60, log_dir={log_dir!r})
+        queue.submit_batch([
+            ("save_message", ("s1", "u1", "user", "before crash"), {{}}),
+            ("save_emotion_score", ("u1", "s1", 0.3, "anxious"), {{}}),
+        ])
+        os._exit(0)
+        """
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=SERVER_DIR, check=True)
+
+    db = Database(data_dir)
+    assert db.get_chat_history("s1") == []
+
+    queue = WriteBehindQueue(db, window=0, log_dir=log_dir)
+    try:
+        assert queue.stats["replayed"] == 2
+        assert [m["content"] for m in db.get_chat_history("s1")] == ["before crash"]
+        assert len(db.get_emotion_history("u1")) == 1
+        # 已重放的日志被删除，只剩本进程自己的日志
+        assert os.listdir(log_dir) == [os.path.basename(queue._log.path)]
+    finally:
+        queue.stop()
+    assert os.listdir(log_dir) == []
+
+
+def test_completed_and_live_logs_are_not_replayed(tmp_path, db):
+    log_dir = str(tmp_path / "log")
+    live = IntentLog(log_dir)
+    live.append([("save_message", ("s2", "u2", "user", "in flight"), {})])
+
+    queue = WriteBehindQueue(db, window=0, log_dir=log_dir)
+    try:
+        queue.submit("save_message", "s1", "u1", "user", "done").result(timeout=5)
+        # 完成后日志被清空
+        assert os.path.getsize(queue._log.path) == 0
+        # 仍在运行的进程（持有锁）的日志不重放
+        assert queue.stats["replayed"] == 0
+        assert db.get_chat_history("s2") == []
+    finally:
+        queue.stop()
+        live.close()
+
+
+def test_intent_fsync_is_shared_by_concurrent_submitters(tmp_path, monkeypatch):
+    calls = []
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        calls.append(fd)
+        time.sleep(0.01)
+        real_fsync(fd)
+
+    log = IntentLog(str(tmp_path / "log"))
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    try:
+        def submit(n):
+            for i in range(5):
+                seq = log.append([("save_message", (f"s{n}", "u1", "user", str(i)), {})])
+                # 返回时该记录已经落盘
+                assert log._synced >= seq
+
+        threads = [threading.Thread(target=submit, args=(n,)) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        monkeypatch.undo()
+        log.close()
+    assert log._seq == 80
+    assert len(calls) < 40
+
+
+def test_replay_skips_applied_operations(tmp_path):
+    data_dir = str(tmp_path / "data")
+    log_dir = os.path.join(data_dir, "write_queue")
+    # 子进程写入完成后、完成标记写入前退出
+    script = textwrap.dedent(
+        f"""
+        import os
+        from dao.database import Database
+        from dao.write_queue import WriteBehindQueue
+        queue = WriteBehindQueue(Database({data_dir!r}), window=0, log_dir={log_dir!r})
+        queue._log.complete = lambda seqs: None
+        queue.submit_batch([
+            ("save_message", ("s1", "u1", "user", "applied"), {{}}),
+            ("save_emotion_score", ("u1", "s1", 0.3, "anxious"), {{}}),
+            ("save_user_profile", ("u1", {{"name": "x"}}), {{}}),
+        ]).result(timeout=10)
+        os._exit(0)
+        """
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=SERVER_DIR, check=True)
+
+    db = Database(data_dir)
+    queue = WriteBehindQueue(db, window=0, log_dir=log_dir)
+    try:
+        # 消息和情绪评分带有写操作ID，画像合并更新无法判断，重放一次
+        assert queue.stats["skipped"] == 2 and queue.stats["replayed"] == 1
+        history = db.get_chat_history("s1")
+        assert [m["content"] for m in history] == ["applied"]
+        # 读取时去掉写操作ID标记
+        assert sorted(history[0]) == ["content", "role", "timestamp"]
+        assert len(db.get_emotion_history("u1")) == 1
+        assert db.get_user_profile("u1")["name"] == "x"
+    finally:
+        queue.stop()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码模块
+
+存储、HTTP 响应和 LLM 提示词统一通过本模块序列化。按以下顺序选择实现：
+orjson -> msgspec -> 标准库 json，也可以用环境变量 JSON_CODEC 指定。
+
+- 默认输出紧凑格式（无缩进、无多余空格），中文直接以 UTF-8 输出
+- datetime / date 默认序列化为 ISO 字符串；传入 default 时交给 default 处理
+  （各后端一致，HTTP 响应据此保持 Flask 的 HTTP-date 格式）
+- 解析失败统一抛出 ValueError
+"""
+
+import os
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj):
+    """标准库 / msgspec 不支持的类型的兜底处理"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _choose_backend():
+    preferred = os.environ.get("JSON_CODEC", "").lower()
+    available = {"orjson": orjson, "msgspec": msgspec, "json": json}
+    if preferred in available and available[preferred] is not None:
+        return preferred
+    if orjson is not None:
+        return "orjson"
+    if msgspec is not None:
+        return "msgspec"
+    return "json"
+
+
+BACKEND = _choose_backend()
+
+if msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder(enc_hook=_default)
+    _msgspec_decoder = msgspec.json.Decoder()
+
+
+def dumps_bytes(obj, pretty=False, sort_keys=False, default=None):
+    """序列化为 UTF-8 编码的 bytes
+
+    Args:
+        obj: 要序列化的对象
+        pretty: 是否使用两个空格缩进
+        sort_keys: 是否按键排序
+        default: 不支持的类型（以及 datetime / date）的转换函数
+
+    Returns:
+        bytes: JSON 数据
+    """
+    if BACKEND == "orjson":
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if default is not None:
+            # orjson 原生输出 ISO 时间，与标准库后端一样让自定义 default 处理时间
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=default or _default, option=option)
+
+    if BACKEND == "msgspec" and not sort_keys and default is None:
+        data = _msgspec_encoder.encode(obj)
+        return msgspec.json.format(data, indent=2) if pretty else data
+
+    # msgspec 不支持排序和自定义 default，与标准库后端一样用 json 序列化
+    return _json_dumps(obj, pretty, sort_keys, default).encode("utf-8")
+
+
+def dumps(obj, pretty=False, sort_keys=False, default=None):
+    """序列化为 str，参数同 dumps_bytes"""
+    if BACKEND == "json":
+        return _json_dumps(obj, pretty, sort_keys, default)
+    return dumps_bytes(obj, pretty, sort_keys, default).decode("utf-8")
+
+
+def _json_dumps(obj, pretty, sort_keys, default):
+    return json.dumps(
+        obj,
+        ensure_ascii=False,
+        indent=2 if pretty else None,
+        separators=None if pretty else (",", ":"),
+        sort_keys=sort_keys,
+        default=default or _default,
+    )
+
+
+def loads(data):
+    """解析 JSON（str 或 bytes）
+
+    Raises:
+        ValueError: 数据不是合法的 JSON
+    """
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if BACKEND == "msgspec":
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return json.loads(data)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文件后端数据检查工具
+
+检查数据目录中的所有 JSON 文件：损坏的从上一代备份（.bak）恢复，备份也不可用时
+隔离为 *.corrupt-<时间戳>，并清理崩溃残留的临时文件：
+
+    python verify_data.py --data-dir data
+
+服务启动时只检查全局文件，全量检查在维护窗口或定时任务中执行。
+"""
+
+import os
+import sys
+import argparse
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from dao.database import Database
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="检查并修复文件后端的数据文件")
+    parser.add_argument("--data-dir", default="data", help="数据目录")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.isdir(args.data_dir):
+        print(f"❌ 数据目录不存在: {args.data_dir}")
+        return 2
+
+    # 打开数据库时不再做启动检查，下面执行全量检查
+    os.environ["DB_VERIFY_ON_START"] = "0"
+    result = Database(args.data_dir).verify_files(full=True)
+    print(
+        f"✅ 检查了 {result['checked']} 个文件：恢复 {result['recovered']} 个，"
+        f"隔离 {result['quarantined']} 个，清理临时文件 {result['tmp_removed']} 个"
+    )
+    return 1 if result["quarantined"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())